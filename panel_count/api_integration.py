@@ -7,16 +7,64 @@ Integration module for roof detection segmentation system
 import cv2
 import base64
 import numpy as np
+import heapq
 import json
 import logging
-from flask import Flask, request, jsonify
-from roof_io import visualize_result, create_roof_mask
-from geometry import pixels_from_meters, erode_with_margin, calculate_panel_layout_fast, estimate_by_area
-import tempfile
+from flask import Flask, Response, abort, request, jsonify, stream_with_context
+from roof_io import (render_result, image_data_uri, create_roof_mask, panels_to_svg, panels_to_geojson,
+                     VISUALIZATION_FORMATS, VECTOR_FORMATS)
+from geometry import (pixels_from_meters, estimate_by_area, engine_pixels, placement_context, SETBACK_METRICS,
+                      LAYOUT_MODES, PLACEMENT_ENGINES, PlacementContext, panels_to_polygons)
+from mask_codec import decode_mask
+from result_cache import ResultCache, make_cache_key
 import os
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 app = Flask(__name__)
 
+# リクエストボディの上限（超えると 413 を返す。0 で無制限）
+MAX_REQUEST_MB = float(os.environ.get('PANEL_MAX_REQUEST_MB', '32'))
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_REQUEST_MB * 2**20) or None
+
+# 批量结果的流式返回格式（1 行 1 屋根）
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# 批量处理的并行进程数（1 = 串行, 0 = CPU 核数）
+BATCH_WORKERS = int(os.environ.get('PANEL_BATCH_WORKERS', '0')) or (os.cpu_count() or 1)
+
+# 批量结果（含面板矩形）的 Parquet 数据集目录（未设置则不输出，需要 pyarrow）
+PARQUET_DIR = os.environ.get('PANEL_PARQUET_DIR') or None
+
+_batch_pool = None
+
+# 計算結果のキャッシュ（件数 0 で無効、PANEL_CACHE_DIR を指定するとディスクにも保存）
+RESULT_CACHE = ResultCache(
+    max_entries=int(os.environ.get('PANEL_CACHE_SIZE', '256')),
+    ttl_s=float(os.environ.get('PANEL_CACHE_TTL_S', '3600')),
+    disk_dir=os.environ.get('PANEL_CACHE_DIR') or None
+)
+
+def get_batch_pool(workers=None):
+    """屋根ごとの計算を分散するプロセスプール（初回使用時に生成し、以降は再利用）"""
+    global _batch_pool
+    workers = workers or BATCH_WORKERS
+    if _batch_pool is None or _batch_pool._broken or _batch_pool._max_workers != workers:
+        if _batch_pool is not None:
+            _batch_pool.shutdown(wait=False)
+        # Flask のスレッドから fork しないよう spawn を使う
+        _batch_pool = ProcessPoolExecutor(max_workers=workers,
+                                          mp_context=multiprocessing.get_context("spawn"))
+    return _batch_pool
+
+@atexit.register
+def shutdown_batch_pool():
+    global _batch_pool
+    if _batch_pool is not None:
+        _batch_pool.shutdown(wait=False, cancel_futures=True)
+        _batch_pool = None
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -42,6 +90,70 @@ def b64_to_cv2(b64str, flags=cv2.IMREAD_UNCHANGED):
         logger.error(f"Base64デコードエラー: {e}")
         return None
 
+def decode_roof_mask(payload):
+    """
+    屋根マスクの転送形式をデコード
+    Decode a roof mask payload: PNG data URI string, or an RLE / packbits / polygon
+    object as produced by the roof service (see mask_codec.py)
+
+    Returns:
+        0/255 の uint8 マスク。デコードできない場合は None
+    """
+    if isinstance(payload, str):
+        return b64_to_cv2(payload, cv2.IMREAD_GRAYSCALE)
+    try:
+        return decode_mask(payload)
+    except Exception as e:
+        logger.error(f"マスクデコードエラー: {e}")
+        return None
+
+# 単体リクエストの可視化の既定値（批量は include_visualization=true の場合のみ生成）
+DEFAULT_VISUALIZATION = {"format": "png", "quality": None}
+
+def parse_visualization_options(data, default_include):
+    """
+    リクエストの include_visualization / visualization_format / visualization_quality を解釈する
+    Parse the visualization options of a request
+
+    Returns:
+        None（可視化なし）または {"format": ..., "quality": ...}
+
+    Raises:
+        ValueError: 形式・品質が不正な場合
+    """
+    if not data.get('include_visualization', default_include):
+        return None
+    fmt = str(data.get('visualization_format', 'png')).lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in VISUALIZATION_FORMATS and fmt not in VECTOR_FORMATS:
+        valid = list(VISUALIZATION_FORMATS) + list(VECTOR_FORMATS)
+        raise ValueError(f"visualization_format は {valid} のいずれかです: {fmt}")
+    quality = data.get('visualization_quality')
+    if quality is not None:
+        if isinstance(quality, bool) or not isinstance(quality, (int, float)) or not 0 <= quality <= 100:
+            raise ValueError(f"visualization_quality は 0〜100 の数値です: {quality}")
+        quality = int(quality)
+    return {"format": fmt, "quality": quality}
+
+def render_visualization(mask_bin, panels, polygons, visualization, renderer):
+    """
+    可視化を指定形式で生成し、結果に追加するフィールドを返す
+    Render the layout in the requested format and return the result fields
+
+    ラスター形式（png/jpeg/webp）は renderer(mask_bin, panels, polygons) で描画して
+    visualization_b64（data URI）に、svg は同じく data URI に、geojson は
+    visualization_geojson（オブジェクト）にする。ベクター形式はラスター描画を行わない。
+    """
+    fmt, quality = visualization["format"], visualization["quality"]
+    if fmt == "geojson":
+        return {"visualization_geojson": panels_to_geojson(mask_bin, panels, polygons)}
+    if fmt == "svg":
+        svg = panels_to_svg(mask_bin, panels, polygons)
+        return {"visualization_b64": f"data:{VECTOR_FORMATS['svg']};base64,"
+                                     f"{base64.b64encode(svg.encode('utf-8')).decode('utf-8')}"}
+    return {"visualization_b64": image_data_uri(renderer(mask_bin, panels, polygons), fmt, quality)}
+
 def process_segmented_roof(mask_image, centers, map_scale, spacing_interval, panel_options=None):
     """
     分割された屋根画像を処理して太陽能板配置を計算
@@ -73,20 +185,14 @@ def process_segmented_roof(mask_image, centers, map_scale, spacing_interval, pan
             "message": "マスクが空または無効です"
         }
     
-    # マスクを二値化 (0/255)
-    mask_bin = (mask_image > 127).astype(np.uint8) * 255
-    
-    # 有効エリアの計算（腐食処理）
+    # 二値化・腐食（屋根の外接矩形の切り出しで計算）
     offset_px = pixels_from_meters(spacing_interval, map_scale)
-    usable_area_mask = erode_with_margin(mask_bin, offset_px)
+    ctx = PlacementContext(mask_image, offset_px, "greedy")
     
     # 面積計算
     pixel_area = map_scale ** 2
-    effective_pixels = np.sum(usable_area_mask) / 255
-    effective_area_sqm = effective_pixels * pixel_area
-    
-    roof_pixels = np.sum(mask_bin) / 255
-    roof_area_sqm = roof_pixels * pixel_area
+    effective_area_sqm = ctx.effective_pixels * pixel_area
+    roof_area_sqm = ctx.roof_pixels * pixel_area
     
     logger.info(f"屋根面積: {roof_area_sqm:.2f} m^2")
     logger.info(f"有効面積: {effective_area_sqm:.2f} m^2")
@@ -123,9 +229,9 @@ def process_segmented_roof(mask_image, centers, map_scale, spacing_interval, pan
         panel_l_px = pixels_from_meters(panel_l_with_spacing, map_scale)
         panel_w_px = pixels_from_meters(panel_w_with_spacing, map_scale)
         
-        # 縦置きと横置きの両方を試す
-        count_v, panels_v = calculate_panel_layout_fast(usable_area_mask.copy(), panel_w_px, panel_l_px)
-        count_h, panels_h = calculate_panel_layout_fast(usable_area_mask.copy(), panel_l_px, panel_w_px)
+        # 縦置きと横置きの両方を試す（calculate_panel_layout_sat と同じ貪欲法、元画像座標）
+        count_v, panels_v = ctx.layout(panel_w_px, panel_l_px)
+        count_h, panels_h = ctx.layout(panel_l_px, panel_w_px)
         
         # 最適な配置方向を選択
         if count_v >= count_h:
@@ -158,17 +264,16 @@ def process_segmented_roof(mask_image, centers, map_scale, spacing_interval, pan
             results["best_panel"] = panel_name
             results["max_count"] = int(count_placement)
     
-    # 可視化画像を生成
+    # 可視化画像を生成（メモリ上でエンコード）
     if best_panel_for_vis:
         panels, panel_name = best_panel_for_vis
-        # 一時ファイルに保存
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-            visualize_result(mask_bin, panels, filename=tmp_file.name)
-            results["visualization_file"] = tmp_file.name
+        results["visualization_b64"] = image_data_uri(render_result(ctx.full_frame(ctx.mask_bin), panels))
     
     return results
 
-def calculate_single_roof(roof_mask, gsd, panel_options, offset_m=1.0, panel_spacing_m=0.02):
+def calculate_single_roof(roof_mask, gsd, panel_options, offset_m=1.0, panel_spacing_m=0.02, layout_mode="greedy",
+                          align_to_roof=False, visualization=DEFAULT_VISUALIZATION, engine="raster",
+                          setback_metric="square"):
     """
     单个屋顶的太阳能板配置计算
     Calculate solar panel layout for a single roof
@@ -179,6 +284,15 @@ def calculate_single_roof(roof_mask, gsd, panel_options, offset_m=1.0, panel_spa
         panel_options: Dictionary of panel options {name: (length, width)}
         offset_m: Safety margin in meters
         panel_spacing_m: Panel spacing in meters
+        layout_mode: Placement mode, "greedy" or "grid" (see geometry.LAYOUT_MODES)
+        align_to_roof: Also try a placement grid rotated to the dominant roof
+            orientation; panels are then returned as polygons in image coordinates
+        visualization: {"format": "png" | "jpeg" | "webp", "quality": 0-100 or None} to
+            return the best layout as the data URI "visualization_b64", or None to skip it
+        engine: Placement engine, "raster" (pixel mask) or "polygon" (roof contour polygon,
+            exact metric sizes; panel coordinates may be fractional), see geometry.PLACEMENT_ENGINES
+        setback_metric: "square" (square-kernel erosion) or "euclidean" (true distance from
+            the roof edge, rounded at corners), see geometry.SETBACK_METRICS
 
     Returns:
         Dictionary with calculation results
@@ -192,20 +306,18 @@ def calculate_single_roof(roof_mask, gsd, panel_options, offset_m=1.0, panel_spa
             "message": "マスクが空または無効です"
         }
 
-    # マスクを二値化 (0/255)
-    mask_bin = (roof_mask > 127).astype(np.uint8) * 255
-
-    # 有効エリアの計算（腐食処理）
-    offset_px = pixels_from_meters(offset_m, gsd)
-    usable_area_mask = erode_with_margin(mask_bin, offset_px)
+    # 二値化・腐食・積分画像（align_to_roof の場合は回転も）を屋根ごとに 1 回だけ、屋根の
+    # 外接矩形の切り出しで計算し、全パネル種類・縦横で共有する（パネル位置は元画像座標）
+    # polygon エンジンでは代わりに輪郭ポリゴンとセットバックのバッファを 1 回だけ計算する
+    offset_px = engine_pixels(offset_m, gsd, engine)
+    ctx = placement_context(roof_mask, offset_px, layout_mode, align_to_roof, engine, setback_metric)
+    # polygon エンジンのパネル位置は小数
+    to_number = int if engine == "raster" else (lambda v: round(float(v), 3))
 
     # 面積計算
     pixel_area = gsd ** 2
-    effective_pixels = np.sum(usable_area_mask) / 255
-    effective_area_sqm = effective_pixels * pixel_area
-
-    roof_pixels = np.sum(mask_bin) / 255
-    roof_area_sqm = roof_pixels * pixel_area
+    effective_area_sqm = ctx.effective_pixels * pixel_area
+    roof_area_sqm = ctx.roof_pixels * pixel_area
 
     logger.info(f"屋根面積: {roof_area_sqm:.2f} m^2")
     logger.info(f"有効面積: {effective_area_sqm:.2f} m^2")
@@ -217,6 +329,10 @@ def calculate_single_roof(roof_mask, gsd, panel_options, offset_m=1.0, panel_spa
         "gsd": float(gsd),
         "offset_m": float(offset_m),
         "panel_spacing_m": float(panel_spacing_m),
+        "layout_mode": layout_mode,
+        "align_to_roof": bool(align_to_roof),
+        "engine": engine,
+        "setback_metric": setback_metric,
         "panels": {},
         "best_panel": None,
         "max_count": -1
@@ -237,25 +353,20 @@ def calculate_single_roof(roof_mask, gsd, panel_options, offset_m=1.0, panel_spa
         panel_l_with_spacing = panel_length + panel_spacing_m
         panel_w_with_spacing = panel_width + panel_spacing_m
 
-        # ピクセルへの変換
-        panel_l_px = pixels_from_meters(panel_l_with_spacing, gsd)
-        panel_w_px = pixels_from_meters(panel_w_with_spacing, gsd)
-
-        # 縦置きと横置きの両方を試す
-        count_v, panels_v = calculate_panel_layout_fast(usable_area_mask.copy(), panel_w_px, panel_l_px)
-        count_h, panels_h = calculate_panel_layout_fast(usable_area_mask.copy(), panel_l_px, panel_w_px)
+        # ピクセルへの変換（raster は切り上げ）
+        panel_l_px = engine_pixels(panel_l_with_spacing, gsd, engine)
+        panel_w_px = engine_pixels(panel_w_with_spacing, gsd, engine)
 
-        # 最適な配置方向を選択
-        if count_v >= count_h:
-            count_placement = count_v
-            best_panels_for_panel_type = panels_v
-            orientation = "vertical"
-        else:
-            count_placement = count_h
-            best_panels_for_panel_type = panels_h
-            orientation = "horizontal"
+        # 縦置きと横置きの両方を試す（align_to_roof の場合は回転した座標系でも）
+        # ピクセル寸法が同じパネル種類はキャッシュ済みの結果を使う
+        best = ctx.best_layout(panel_w_px, panel_l_px)
+        count_placement = best["count"]
+        best_panels_for_panel_type = best["panels"]
+        orientation = best["orientation"]
+        frame = best["frame"]
 
-        logger.info(f"配置結果: {count_placement} 枚 (縦:{count_v}, 横:{count_h})")
+        logger.info(f"配置結果: {count_placement} 枚 (縦:{best['count_v']}, 横:{best['count_h']}, "
+                    f"回転:{frame.rotation_deg:.1f}°)")
 
         # 結果を記録 (numpy型をPython標準型に変換)
         panel_result = {
@@ -264,123 +375,514 @@ def calculate_single_roof(roof_mask, gsd, panel_options, offset_m=1.0, panel_spa
             "count_area": int(count_area),
             "count_sim": int(count_placement),
             "orientation": orientation,
-            "panels": [[int(p[0]), int(p[1]), int(p[2]), int(p[3])] for p in best_panels_for_panel_type]
+            "panels": [[to_number(v) for v in p] for p in best_panels_for_panel_type],
+            "rotation_deg": round(frame.rotation_deg, 2)
         }
+        if align_to_roof:
+            # panels は配置座標系の矩形。元画像座標の四角形は panel_polygons
+            panel_result["panel_polygons"] = panels_to_polygons(best_panels_for_panel_type, frame.back_matrix)
 
         results["panels"][panel_name] = panel_result
 
         # 最適なパネルを記録
         if count_placement > max_panels_for_vis:
             max_panels_for_vis = count_placement
-            best_panel_for_vis = (best_panels_for_panel_type, panel_name)
+            best_panel_for_vis = (panel_result.get("panel_polygons", best_panels_for_panel_type), panel_name)
             results["best_panel"] = panel_name
             results["max_count"] = int(count_placement)
 
-    # 可視化画像を生成
-    if best_panel_for_vis:
+    # 可視化画像を生成（一時ファイルを使わずメモリ上で 1 回だけエンコード）
+    if best_panel_for_vis and visualization:
         panels, panel_name = best_panel_for_vis
-        # 一時ファイルに保存
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-            visualize_result(mask_bin, panels, filename=tmp_file.name)
-            results["visualization_file"] = tmp_file.name
+        mask_bin = ctx.full_frame(ctx.mask_bin)
+        if align_to_roof:
+            results.update(render_visualization(mask_bin, [], panels, visualization, render_result))
+        else:
+            results.update(render_visualization(mask_bin, panels, None, visualization, render_result))
 
     return results
 
-def visualize_panels_on_mask(roof_mask, panels):
+def roof_cache_key(kind, roof_mask, gsd, panel_options, offset_m, panel_spacing_m, layout_mode, align_to_roof,
+                   visualization=None, engine="raster", setback_metric="square"):
+    """屋根マスクと計算パラメータから RESULT_CACHE のキーを作る"""
+    params = {
+        "visualization": visualization,
+        "gsd": float(gsd),
+        "offset_m": float(offset_m),
+        "panel_spacing_m": float(panel_spacing_m),
+        "panel_options": {name: [float(v) for v in size] for name, size in panel_options.items()},
+        "layout_mode": layout_mode,
+        "align_to_roof": bool(align_to_roof),
+        "engine": engine,
+        "setback_metric": setback_metric
+    }
+    return make_cache_key(kind, roof_mask, params)
+
+def calculate_single_roof_cached(roof_mask, gsd, panel_options, offset_m=1.0, panel_spacing_m=0.02,
+                                 layout_mode="greedy", align_to_roof=False, visualization=DEFAULT_VISUALIZATION,
+                                 engine="raster", setback_metric="square"):
+    """
+    calculate_single_roof の結果をキャッシュ付きで返す
+    calculate_single_roof served from RESULT_CACHE
+
+    同じマスク（形式を問わない）と同じパラメータの再送信では、腐食・配置・可視化を
+    再計算しません。失敗した結果はキャッシュしません。
+    """
+    key = roof_cache_key("single", roof_mask, gsd, panel_options, offset_m, panel_spacing_m, layout_mode,
+                         align_to_roof, visualization, engine, setback_metric)
+    cached = RESULT_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    result = calculate_single_roof(
+        roof_mask=roof_mask,
+        gsd=gsd,
+        panel_options=panel_options,
+        offset_m=offset_m,
+        panel_spacing_m=panel_spacing_m,
+        layout_mode=layout_mode,
+        align_to_roof=align_to_roof,
+        visualization=visualization,
+        engine=engine,
+        setback_metric=setback_metric
+    )
+    if not result.get('success'):
+        return result
+
+    RESULT_CACHE.put(key, result)
+    return result
+
+# カタログで出力が指定されていない場合の 1 枚あたり出力（/calculate_panels と同じ仮定）
+DEFAULT_PANEL_POWER_W = 400.0
+
+# /rank_panels の並べ替えキー
+RANK_KEYS = ("kw", "count", "effective_area_ratio")
+
+def parse_panel_catalog(catalog):
+    """
+    パネルカタログを [(name, length_m, width_m, power_w), ...] に正規化する
+    Normalize a panel catalog into [(name, length_m, width_m, power_w), ...]
+
+    Accepts either the panel_options form {name: [length, width(, power_w)]} or a
+    list of {"name", "length", "width", "power_w"} objects.
+
+    Raises:
+        ValueError: 形式が不正な場合 / If the catalog is malformed
+    """
+    if isinstance(catalog, dict):
+        entries = [(name, *values) for name, values in catalog.items()]
+    elif isinstance(catalog, list):
+        try:
+            entries = [(item["name"], item["length"], item["width"], item.get("power_w", DEFAULT_PANEL_POWER_W))
+                       for item in catalog]
+        except (TypeError, KeyError) as e:
+            raise ValueError(f"Catalog entries need name, length and width: {e}")
+    else:
+        raise ValueError("Catalog must be a dict or a list")
+
+    if not entries:
+        raise ValueError("Catalog is empty")
+
+    skus = []
+    for entry in entries:
+        if len(entry) == 3:
+            entry = (*entry, DEFAULT_PANEL_POWER_W)
+        if len(entry) != 4:
+            raise ValueError(f"Invalid catalog entry: {entry}")
+        name, length, width, power = entry
+        try:
+            length, width, power = float(length), float(width), float(power)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid catalog entry: {entry}")
+        if length <= 0 or width <= 0 or power < 0:
+            raise ValueError(f"Invalid panel dimensions or power: {entry}")
+        skus.append((str(name), length, width, power))
+    return skus
+
+def rank_panel_catalog(roof_mask, gsd, catalog, offset_m=1.0, panel_spacing_m=0.02, top_k=5, rank_by="kw",
+                       layout_mode="greedy", align_to_roof=False, engine="raster", setback_metric="square",
+                       exact_counts=False):
+    """
+    パネルカタログ全体を 1 つの屋根で評価して順位付けする
+    Evaluate a whole panel catalog on one roof and rank the SKUs
+
+    屋根の前処理（配置コンテキスト）は 1 回だけ行い、全 SKU で共有します。raster
+    エンジンの greedy では、まず全 SKU を格子配置の枚数（lattice_layout、位置の
+    リストを作らない）で数え、その目安の高い順に貪欲配置（best_layout）を行います。
+    目安（これまでの配置と格子の枚数の比で補正）が上位 top_k 件の最低スコアを
+    下回る SKU と、行・列の連続区間による上限（count_bound）が届かない SKU は
+    配置しません。上位 top_k 件は常に配置結果（count_method "placement"）で、
+    それ以下は "lattice" の目安を含みます。配置しなかった SKU の上限がすべて
+    上位に届かない場合のみ top_k_exact が True です（効率がほぼ同じ SKU が多いと
+    False になり、exact_counts=True の順位と異なる場合があります）。
+    layout_mode="grid" では格子配置の枚数がそのまま配置結果です。exact_counts=True と
+    polygon エンジンでは全 SKU を配置します。結果はピクセル寸法単位でキャッシュされます。
+    1000×1000 px・寸法がばらばらの 500 SKU（112 寸法）で約 0.9 秒、全 SKU の配置では
+    約 2.4 秒です（scripts/bench_panel_catalog.py）。
+
+    Mask preprocessing (the placement context) runs once and is shared by
+    every SKU. For the raster greedy layout every SKU is first counted with a
+    counts-only lattice placement on the shared valid-position map
+    (lattice_layout), and greedy placements (best_layout) run in decreasing
+    estimate order. SKUs whose estimate (scaled by the greedy/lattice ratio
+    seen so far) falls below the k-th best placed score, or whose row/column
+    run bound (count_bound) cannot reach it, are not placed. The top_k
+    entries are therefore always placement counts (count_method
+    "placement"); entries below them may be "lattice" estimates. top_k_exact
+    is True only when no unplaced SKU's bound reaches the top_k; catalogs
+    with many near-equal SKUs can rank differently from exact_counts=True.
+    With layout_mode="grid" the lattice count is the placement count.
+    exact_counts=True, or the polygon engine, places every SKU. Results are
+    cached by pixel size. 500 arbitrary sizes (112 distinct) on a 1000x1000
+    px roof take ~0.9 s versus ~2.4 s when placing every SKU
+    (scripts/bench_panel_catalog.py).
+
+    Args:
+        roof_mask: Binary roof mask (numpy array)
+        gsd: Ground Sample Distance (m/pixel)
+        catalog: Panel catalog, see parse_panel_catalog
+        offset_m: Safety margin in meters
+        panel_spacing_m: Panel spacing in meters
+        top_k: Number of top entries that carry panel rectangles
+        rank_by: Sort key, one of RANK_KEYS
+        layout_mode: Placement mode, "greedy" or "grid"
+        align_to_roof: Also try the roof-aligned placement frame
+        engine: Placement engine, "raster" or "polygon" (PLACEMENT_ENGINES)
+        setback_metric: Setback metric, "square" or "euclidean" (SETBACK_METRICS)
+        exact_counts: Run the full placement for every SKU
+
+    Returns:
+        Dictionary with the ranking
+    """
+    if rank_by not in RANK_KEYS:
+        raise ValueError(f"Unknown rank key: {rank_by}. Valid keys: {list(RANK_KEYS)}")
+    skus = parse_panel_catalog(catalog)
+
+    if roof_mask is None or np.sum(roof_mask) == 0:
+        logger.warning("空のマスクまたは無効なマスクです")
+        return {
+            "success": False,
+            "error": "empty_or_invalid_mask",
+            "message": "マスクが空または無効です"
+        }
+
+    ctx = placement_context(roof_mask, engine_pixels(offset_m, gsd, engine), layout_mode, align_to_roof, engine,
+                            setback_metric)
+    pixel_area = gsd ** 2
+    effective_area_sqm = ctx.effective_pixels * pixel_area
+    to_number = int if engine == "raster" else (lambda v: round(float(v), 3))
+
+    def entry_for(name, length, width, power, count):
+        return {
+            "panel_name": name,
+            "panel_size": [length, width],
+            "power_w": power,
+            "count": int(count),
+            "kw": round(count * power / 1000.0, 3),
+            "effective_area_ratio": round(count * length * width / effective_area_sqm, 4)
+            if effective_area_sqm > 0 else 0.0
+        }
+
+    sizes = [(engine_pixels(width + panel_spacing_m, gsd, engine), engine_pixels(length + panel_spacing_m, gsd, engine))
+             for _, length, width, _ in skus]
+    exact = [None] * len(skus)
+    top_k_exact = True
+    if exact_counts or engine != "raster":
+        exact = [ctx.best_layout(*px) for px in sizes]
+    elif layout_mode == "grid":
+        # 格子配置の枚数は配置結果と同じ（パネル位置は上位 top_k 件のみ作る）
+        exact = [ctx.lattice_layout(*px) for px in sizes]
+    else:
+        # 格子配置の目安が高い順に配置する。目安（配置 / 格子の枚数比の最大値で補正）が上位 top_k 件の
+        # 最低スコアを下回る SKU と、上限（count_bound）が届かない SKU は配置しない
+        # （目安は補正前でも最低スコア未満のため、上位 top_k 件は配置結果だけになる）
+        keep = max(top_k, 1)
+        lattice = [ctx.lattice_layout(*px)["count"] for px in sizes]
+        estimates = [entry_for(*sku, count)[rank_by] for sku, count in zip(skus, lattice)]
+        bounds = [entry_for(*sku, ctx.count_bound(*px))[rank_by] for sku, px in zip(skus, sizes)]
+        top_scores, ratio = [], 1.0
+        for i in sorted(range(len(skus)), key=lambda i: estimates[i], reverse=True):
+            if len(top_scores) >= keep and (estimates[i] * ratio < top_scores[0] or bounds[i] < top_scores[0]):
+                continue
+            exact[i] = ctx.best_layout(*sizes[i])
+            if lattice[i]:
+                ratio = max(ratio, exact[i]["count"] / lattice[i])
+            heapq.heappush(top_scores, entry_for(*skus[i], exact[i]["count"])[rank_by])
+            if len(top_scores) > keep:
+                heapq.heappop(top_scores)
+        # 配置しなかった SKU の上限が上位 top_k 件に届きうる場合、上位 top_k 件は保証されない
+        top_k_exact = all(bounds[i] < top_scores[0] for i, best in enumerate(exact) if best is None)
+
+    ranking = []
+    for sku, px, best in zip(skus, sizes, exact):
+        estimate = best is None
+        if estimate:
+            best = ctx.lattice_layout(*px)
+        entry = entry_for(*sku, best["count"])
+        entry["orientation"] = best["orientation"]
+        entry["count_method"] = "lattice" if estimate and layout_mode != "grid" else "placement"
+        entry["_px"] = px
+        ranking.append(entry)
+
+    unique_sizes = len(set(sizes))
+    placed_sizes = len({px for px, best in zip(sizes, exact) if best is not None})
+    # 安定ソートなので同点はカタログ順
+    ranking.sort(key=lambda r: r[rank_by], reverse=True)
+    for rank, entry in enumerate(ranking, 1):
+        entry["rank"] = rank
+        px = entry.pop("_px")
+        if rank <= top_k:
+            best = ctx.best_layout(*px)
+            entry["panels"] = [[to_number(v) for v in p] for p in best["panels"]]
+            entry["rotation_deg"] = round(best["frame"].rotation_deg, 2)
+            if align_to_roof:
+                entry["panel_polygons"] = panels_to_polygons(best["panels"], best["frame"].back_matrix)
+
+    logger.info(f"カタログ評価: {len(skus)} SKU, ピクセル寸法 {unique_sizes} 種類 (配置 {placed_sizes} 種類)")
+
+    return {
+        "success": True,
+        "roof_area": float(ctx.roof_pixels * pixel_area),
+        "effective_area": float(effective_area_sqm),
+        "gsd": float(gsd),
+        "offset_m": float(offset_m),
+        "panel_spacing_m": float(panel_spacing_m),
+        "layout_mode": layout_mode,
+        "align_to_roof": bool(align_to_roof),
+        "engine": engine,
+        "setback_metric": setback_metric,
+        "rank_by": rank_by,
+        "top_k": int(top_k),
+        "catalog_size": len(skus),
+        "unique_panel_sizes": unique_sizes,
+        "placed_panel_sizes": placed_sizes,
+        "top_k_exact": bool(top_k_exact),
+        "best_panel": ranking[0]["panel_name"],
+        "ranking": ranking
+    }
+
+def visualize_panels_on_mask(roof_mask, panels, polygons=None):
     """
     在屋顶掩码上可视化太阳能板
     Visualize solar panels on roof mask
+
+    polygons が指定された場合（align_to_roof）は回転した四角形として描画する。
+    全パネルを 1 枚のオーバーレイに塗ってから 1 回だけ合成するため、
+    パネル数によらず全画面の処理は 1 回（O(H×W + パネル数)）。
     """
     # 创建彩色图像
     vis_img = cv2.cvtColor(roof_mask, cv2.COLOR_GRAY2BGR)
+    if polygons:
+        pts = [np.round(np.asarray(p)).astype(np.int32) for p in polygons]
+    else:
+        pts = [np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], dtype=np.int32) for x, y, w, h in panels]
+    if not pts:
+        return vis_img
+
+    # 填充半透明 (绿色)：全パネルを塗ってから 1 回だけ合成
+    overlay = vis_img.copy()
+    cv2.fillPoly(overlay, pts, (0, 255, 0))
+    cv2.addWeighted(overlay, 0.3, vis_img, 0.7, 0, vis_img)
+    # 绘制矩形框 (蓝色)
+    cv2.polylines(vis_img, pts, True, (255, 0, 0), 2)
+    return vis_img
 
-    # 绘制太阳能板
-    for panel in panels:
-        x, y, w, h = panel
-        # 绘制矩形框 (蓝色)
-        cv2.rectangle(vis_img, (x, y), (x + w, y + h), (255, 0, 0), 2)
-        # 填充半透明 (绿色)
-        overlay = vis_img.copy()
-        cv2.rectangle(overlay, (x, y), (x + w, y + h), (0, 255, 0), -1)
-        cv2.addWeighted(overlay, 0.3, vis_img, 0.7, 0, vis_img)
+def decode_error_result(roof_id):
+    return {
+        "roof_id": roof_id,
+        "success": False,
+        "error": "decode_error",
+        "message": f"屋根{roof_id+1}のマスクデコードに失敗"
+    }
 
-    return vis_img
+def process_roof_payload(roof_id, roof_mask_payload, gsd, offset_m, panel_spacing_m, panel_options, layout_mode="greedy",
+                         align_to_roof=False, visualization=None, engine="raster", setback_metric="square"):
+    """
+    1 屋根分の処理（デコード → 配置計算 → 可視化）。エラーは結果として返す
+    Process one roof of a batch; errors are isolated into the returned dict
+    """
+    # PNG(Base64) / RLE / packbits / polygon をデコード
+    roof_mask = decode_roof_mask(roof_mask_payload)
+
+    if roof_mask is None:
+        return decode_error_result(roof_id)
+
+    return process_roof_mask(roof_id, roof_mask, gsd, offset_m, panel_spacing_m, panel_options, layout_mode,
+                             align_to_roof, visualization, engine, setback_metric)
 
-def process_multiple_roof_masks(roof_masks_b64, gsd, offset_m, panel_spacing_m, panel_options):
+def process_roof_mask(roof_id, roof_mask, gsd, offset_m, panel_spacing_m, panel_options, layout_mode="greedy",
+                      align_to_roof=False, visualization=None, engine="raster", setback_metric="square"):
     """
-    批量处理多个屋顶掩码
-    Process multiple roof masks in batch
+    デコード済みの 1 屋根分の処理（配置計算 → 可視化）
+    Process one decoded roof mask of a batch; errors are isolated into the returned dict
+
+    可視化は visualization（parse_visualization_options の結果）が指定された場合のみ生成する
     """
     try:
-        results = {
-            "success": True,
-            "total_roofs": len(roof_masks_b64),
-            "roofs": [],
-            "summary": {
-                "total_panels": 0,
-                "total_capacity_kw": 0.0,
-                "total_roof_area": 0.0,
-                "total_effective_area": 0.0
-            }
+        # Use single-roof calculation helper for consistency
+        roof_result = calculate_single_roof(
+            roof_mask=roof_mask,
+            gsd=gsd,
+            panel_options=panel_options,
+            offset_m=offset_m,
+            panel_spacing_m=panel_spacing_m,
+            layout_mode=layout_mode,
+            align_to_roof=align_to_roof,
+            visualization=None,
+            engine=engine,
+            setback_metric=setback_metric,
+        )
+
+        # 結果を追加
+        roof_result["roof_id"] = roof_id
+        roof_result["success"] = True
+
+        # 可視化を生成（要求された場合のみ、メモリ上で 1 回だけエンコード）
+        if visualization and roof_result.get("panels"):
+            best_panel = roof_result["best_panel"]
+            panels = roof_result["panels"][best_panel]["panels"]
+            polygons = roof_result["panels"][best_panel].get("panel_polygons")
+
+            roof_result.update(render_visualization(roof_mask, panels, polygons, visualization,
+                                                    visualize_panels_on_mask))
+
+        return roof_result
+
+    except Exception as e:
+        logger.error(f"屋根{roof_id+1}の処理エラー: {str(e)}")
+        return {
+            "roof_id": roof_id,
+            "success": False,
+            "error": "calculation_error",
+            "message": f"屋根{roof_id+1}の計算エラー: {str(e)}"
         }
 
-        for i, roof_mask_b64 in enumerate(roof_masks_b64):
-            logger.info(f"処理中の屋根 {i+1}/{len(roof_masks_b64)}")
+def new_batch_summary():
+    return {
+        "total_panels": 0,
+        "total_capacity_kw": 0.0,
+        "total_roof_area": 0.0,
+        "total_effective_area": 0.0
+    }
 
-            # Base64をデコード
-            roof_mask = b64_to_cv2(roof_mask_b64, cv2.IMREAD_GRAYSCALE)
+def add_to_batch_summary(summary, roof_result):
+    """成功した屋根の結果をサマリーに加算"""
+    if not roof_result.get("success"):
+        return
+    summary["total_panels"] += roof_result.get("max_count", 0)
+    summary["total_capacity_kw"] += roof_result.get("total_capacity_kw", 0.0)
+    summary["total_roof_area"] += roof_result.get("roof_area", 0.0)
+    summary["total_effective_area"] += roof_result.get("effective_area", 0.0)
+
+def iter_roof_results(roof_masks_b64, gsd, offset_m, panel_spacing_m, panel_options, workers=None, layout_mode="greedy",
+                      align_to_roof=False, visualization=None, engine="raster", setback_metric="square"):
+    """
+    屋根ごとの結果を roof_id 順に 1 件ずつ返すジェネレータ
+    Yield per-roof results in roof_id order as soon as each one is computed
 
-            if roof_mask is None:
-                results["roofs"].append({
-                    "roof_id": i,
-                    "success": False,
-                    "error": "decode_error",
-                    "message": f"屋根{i+1}のマスクデコードに失敗"
-                })
+    workers > 1 の場合はプロセスプールで並列計算する（既定は PANEL_BATCH_WORKERS）。
+    デコードと RESULT_CACHE の参照は親プロセスで行い、キャッシュにない屋根だけを計算する。
+    """
+    params = (gsd, offset_m, panel_spacing_m, panel_options, layout_mode, align_to_roof, visualization, engine,
+              setback_metric)
+
+    def lookup(roof_id, payload):
+        # (結果, None, None) またはキャッシュ未登録なら (None, マスク, キー)
+        roof_mask = decode_roof_mask(payload)
+        if roof_mask is None:
+            return decode_error_result(roof_id), None, None
+        key = roof_cache_key("batch", roof_mask, gsd, panel_options, offset_m, panel_spacing_m, layout_mode,
+                             align_to_roof, visualization, engine, setback_metric)
+        cached = RESULT_CACHE.get(key)
+        if cached is not None:
+            cached["roof_id"] = roof_id
+            return cached, None, None
+        return None, roof_mask, key
+
+    def remember(key, roof_result):
+        if roof_result.get("success"):
+            RESULT_CACHE.put(key, roof_result)
+        return roof_result
+
+    workers = workers or BATCH_WORKERS
+    if workers <= 1 or len(roof_masks_b64) <= 1:
+        for i, roof_mask_b64 in enumerate(roof_masks_b64):
+            logger.info(f"処理中の屋根 {i+1}/{len(roof_masks_b64)}")
+            roof_result, roof_mask, key = lookup(i, roof_mask_b64)
+            if roof_result is None:
+                roof_result = remember(key, process_roof_mask(i, roof_mask, *params))
+            yield roof_result
+        return
+
+    logger.info(f"{len(roof_masks_b64)}個の屋根を{workers}プロセスで並列処理")
+    pool = get_batch_pool(workers)
+    jobs = []
+    for i, roof_mask_b64 in enumerate(roof_masks_b64):
+        roof_result, roof_mask, key = lookup(i, roof_mask_b64)
+        if roof_result is None:
+            jobs.append((key, pool.submit(process_roof_mask, i, roof_mask, *params)))
+        else:
+            jobs.append((None, roof_result))
+    try:
+        # 完了順ではなく roof_id 順に返す
+        for i, (key, job) in enumerate(jobs):
+            if key is None:
+                yield job
                 continue
-
-            # 個別の屋根を処理
             try:
-                # Use single-roof calculation helper for consistency
-                roof_result = calculate_single_roof(
-                    roof_mask=roof_mask,
-                    gsd=gsd,
-                    panel_options=panel_options,
-                    offset_m=offset_m,
-                    panel_spacing_m=panel_spacing_m,
-                )
-
-                # 結果を追加
-                roof_result["roof_id"] = i
-                roof_result["success"] = True
-
-                # 可視化を生成
-                if roof_result.get("panels"):
-                    best_panel = roof_result["best_panel"]
-                    panels = roof_result["panels"][best_panel]["panels"]
-
-                    # 可視化画像をBase64で生成
-                    vis_img = visualize_panels_on_mask(roof_mask, panels)
-                    _, buffer = cv2.imencode('.png', vis_img)
-                    vis_b64 = base64.b64encode(buffer).decode('utf-8')
-                    roof_result["visualization_b64"] = f"data:image/png;base64,{vis_b64}"
-
-                results["roofs"].append(roof_result)
-
-                # サマリーを更新
-                results["summary"]["total_panels"] += roof_result.get("max_count", 0)
-                results["summary"]["total_capacity_kw"] += roof_result.get("total_capacity_kw", 0.0)
-                results["summary"]["total_roof_area"] += roof_result.get("roof_area", 0.0)
-                results["summary"]["total_effective_area"] += roof_result.get("effective_area", 0.0)
-
+                yield remember(key, job.result())
             except Exception as e:
+                # ワーカープロセス自体の異常もその屋根のエラーとして扱う
                 logger.error(f"屋根{i+1}の処理エラー: {str(e)}")
-                results["roofs"].append({
+                yield {
                     "roof_id": i,
                     "success": False,
                     "error": "calculation_error",
                     "message": f"屋根{i+1}の計算エラー: {str(e)}"
-                })
+                }
+    finally:
+        # ストリーミングが途中で切断された場合は残りを取り消す
+        for key, job in jobs:
+            if key is not None:
+                job.cancel()
+
+def open_parquet_writer():
+    """
+    PANEL_PARQUET_DIR が設定されていれば批量リクエスト 1 件分の Parquet ライター（run_id はリクエストごと）
+    Parquet writer for one batch request when PANEL_PARQUET_DIR is set, else None
+    """
+    if not PARQUET_DIR:
+        return None
+    from parquet_results import ParquetResultWriter
+    return ParquetResultWriter(PARQUET_DIR)
+
+def process_multiple_roof_masks(roof_masks_b64, gsd, offset_m, panel_spacing_m, panel_options, layout_mode="greedy",
+                                align_to_roof=False, visualization=None, engine="raster", setback_metric="square"):
+    """
+    批量处理多个屋顶掩码
+    Process multiple roof masks in batch
+    """
+    try:
+        results = {
+            "success": True,
+            "total_roofs": len(roof_masks_b64),
+            "roofs": [],
+            "summary": new_batch_summary()
+        }
+
+        parquet = open_parquet_writer()
+        for roof_result in iter_roof_results(roof_masks_b64, gsd, offset_m, panel_spacing_m, panel_options,
+                                             layout_mode=layout_mode, align_to_roof=align_to_roof,
+                                             visualization=visualization, engine=engine,
+                                             setback_metric=setback_metric):
+            results["roofs"].append(roof_result)
+            # サマリーを更新
+            add_to_batch_summary(results["summary"], roof_result)
+            if parquet:
+                parquet.write(roof_result)
+        if parquet:
+            parquet.close()
+            results["run_id"] = parquet.run_id
 
         return jsonify(results)
 
@@ -392,6 +894,58 @@ def process_multiple_roof_masks(roof_masks_b64, gsd, offset_m, panel_spacing_m,
             "message": f"批量処理エラー: {str(e)}"
         }), 500
 
+def stream_multiple_roof_masks(roof_masks_b64, gsd, offset_m, panel_spacing_m, panel_options, layout_mode="greedy",
+                               align_to_roof=False, visualization=None, engine="raster", setback_metric="square"):
+    """
+    批量处理结果以 NDJSON 流式返回
+    Stream batch results as NDJSON: one {"type": "roof", ...} line per roof,
+    then a final {"type": "summary", ...} line
+    """
+    def generate():
+        summary = new_batch_summary()
+        parquet = None
+        try:
+            parquet = open_parquet_writer()
+            for roof_result in iter_roof_results(roof_masks_b64, gsd, offset_m, panel_spacing_m, panel_options,
+                                                 layout_mode=layout_mode, align_to_roof=align_to_roof,
+                                                 visualization=visualization, engine=engine,
+                                                 setback_metric=setback_metric):
+                add_to_batch_summary(summary, roof_result)
+                if parquet:
+                    parquet.write(roof_result)
+                yield json.dumps({"type": "roof", **roof_result}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            # ヘッダー送信後のためステータスは変えられない。エラー行で通知する
+            logger.error(f"批量処理エラー: {str(e)}")
+            yield json.dumps({
+                "type": "error",
+                "success": False,
+                "error": "batch_processing_error",
+                "message": f"批量処理エラー: {str(e)}"
+            }, ensure_ascii=False) + "\n"
+            return
+        finally:
+            # 切断・エラーの場合も計算済みの屋根は書き出す
+            if parquet:
+                parquet.close()
+        summary_line = {
+            "type": "summary",
+            "success": True,
+            "total_roofs": len(roof_masks_b64),
+            "summary": summary
+        }
+        if parquet:
+            summary_line["run_id"] = parquet.run_id
+        yield json.dumps(summary_line, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+def wants_stream(data):
+    """リクエストボディの stream または Accept: application/x-ndjson でストリーミングを選択"""
+    if data.get('stream'):
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
 @app.route('/calculate_panels', methods=['POST'])
 def calculate_panels():
     """
@@ -403,6 +957,43 @@ def calculate_panels():
     2. roof_mask: Single Base64 encoded binary roof mask
     3. roof_shape_name: Predefined roof shape for testing
 
+    Each mask may be a PNG data URI string or a compact object returned by
+    /segment_masks?format=rle|packbits|polygon, e.g.
+    {"format": "rle", "size": [h, w], "counts": [...]}
+
+    With roof_masks, "stream": true (or Accept: application/x-ndjson) returns
+    NDJSON: one {"type": "roof", "roof_id": i, ...} line per roof as soon as it
+    is computed, followed by {"type": "summary", "total_roofs": n, "summary": {...}}.
+
+    "layout_mode": "greedy" (default, pixel-wise greedy) or "grid" (panels on an
+    aligned row/column lattice with the best phase offset).
+
+    "align_to_roof": true also tries a placement grid rotated to the roof's
+    dominant edge orientation (minAreaRect). Each panel result then carries
+    "rotation_deg" and "panel_polygons" (4 corner points in image coordinates);
+    "panels" stays in the placement frame.
+
+    "engine": "raster" (default, placement on the pixel mask) or "polygon"
+    (placement on the simplified roof contour with a buffered setback and
+    exact panel sizes in metres; cost no longer grows with the pixel count,
+    and "panels" coordinates may be fractional).
+
+    "setback_metric": "square" (default, square-kernel erosion of offset_m) or
+    "euclidean" (every usable point is at least offset_m from the roof edge,
+    so the setback is rounded at corners like a circular clearance).
+
+    With PANEL_PARQUET_DIR set, every roof_masks request is also written to a
+    Parquet dataset under <PANEL_PARQUET_DIR>/run_id=<run_id>/date=<UTC date>/
+    (roof stats plus panel rectangles, see parquet_results.py); "run_id" is
+    returned with the batch response or the NDJSON summary line.
+
+    "include_visualization" (default true for a single roof, false for
+    roof_masks) adds the best layout as the data URI "visualization_b64",
+    encoded in memory as "visualization_format" png (default) | jpeg | webp
+    with optional "visualization_quality" 0-100. "svg" returns the roof
+    outline and panels as an SVG data URI, and "geojson" returns them as
+    "visualization_geojson" (pixel coordinates) for client-side rendering.
+
     Example for batch processing:
     {
         "roof_masks": [
@@ -437,22 +1028,67 @@ def calculate_panels():
         if isinstance(panel_options, dict):
             panel_options = {k: tuple(v) if isinstance(v, list) else v for k, v in panel_options.items()}
 
-        logger.info(f"リクエスト受信: gsd={gsd}, offset_m={offset_m}")
+        layout_mode = data.get('layout_mode', 'greedy')
+        if layout_mode not in LAYOUT_MODES:
+            return jsonify({
+                "success": False,
+                "error": "invalid_layout_mode",
+                "message": f"layout_mode は {list(LAYOUT_MODES)} のいずれかです: {layout_mode}"
+            }), 400
+
+        align_to_roof = bool(data.get('align_to_roof', False))
+
+        engine = data.get('engine', 'raster')
+        if engine not in PLACEMENT_ENGINES:
+            return jsonify({
+                "success": False,
+                "error": "invalid_engine",
+                "message": f"engine は {list(PLACEMENT_ENGINES)} のいずれかです: {engine}"
+            }), 400
+
+        setback_metric = data.get('setback_metric', 'square')
+        if setback_metric not in SETBACK_METRICS:
+            return jsonify({
+                "success": False,
+                "error": "invalid_setback_metric",
+                "message": f"setback_metric は {list(SETBACK_METRICS)} のいずれかです: {setback_metric}"
+            }), 400
+
+        logger.info(f"リクエスト受信: gsd={gsd}, offset_m={offset_m}, layout_mode={layout_mode}, "
+                    f"align_to_roof={align_to_roof}, engine={engine}, setback_metric={setback_metric}")
 
         # 入力方法を判定
         roof_mask_b64 = data.get('roof_mask')
         roof_masks_b64 = data.get('roof_masks')  # 新增：批量处理
         roof_shape_name = data.get('roof_shape_name')
 
+        # 可視化は単体では既定で PNG、批量では include_visualization=true の場合のみ
+        try:
+            visualization = parse_visualization_options(data, default_include=not roof_masks_b64)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": "invalid_visualization_options",
+                "message": str(e)
+            }), 400
+
         if roof_masks_b64:
             # Method 1a: Multiple Base64 encoded roof masks (NEW)
             logger.info(f"批量Base64屋根マスクを使用: {len(roof_masks_b64)}個")
-            return process_multiple_roof_masks(roof_masks_b64, gsd, offset_m, panel_spacing_m, panel_options)
+            if wants_stream(data):
+                return stream_multiple_roof_masks(roof_masks_b64, gsd, offset_m, panel_spacing_m, panel_options,
+                                                  layout_mode=layout_mode, align_to_roof=align_to_roof,
+                                                  visualization=visualization, engine=engine,
+                                                  setback_metric=setback_metric)
+            return process_multiple_roof_masks(roof_masks_b64, gsd, offset_m, panel_spacing_m, panel_options,
+                                               layout_mode=layout_mode, align_to_roof=align_to_roof,
+                                               visualization=visualization, engine=engine,
+                                               setback_metric=setback_metric)
 
         elif roof_mask_b64:
             # Method 1: Base64 encoded roof mask
             logger.info("Base64屋根マスクを使用")
-            roof_mask = b64_to_cv2(roof_mask_b64, cv2.IMREAD_GRAYSCALE)
+            roof_mask = decode_roof_mask(roof_mask_b64)
 
             if roof_mask is None:
                 return jsonify({
@@ -488,30 +1124,23 @@ def calculate_panels():
                 "message": "roof_mask または roof_shape_name のいずれかが必要です"
             }), 400
 
-        # 太陽光パネル配置を計算
-        result = calculate_single_roof(
+        # 太陽光パネル配置を計算（同じマスク・パラメータならキャッシュから返す）
+        result = calculate_single_roof_cached(
             roof_mask=roof_mask,
             gsd=gsd,
             panel_options=panel_options,
             offset_m=offset_m,
-            panel_spacing_m=panel_spacing_m
+            panel_spacing_m=panel_spacing_m,
+            layout_mode=layout_mode,
+            align_to_roof=align_to_roof,
+            visualization=visualization,
+            engine=engine,
+            setback_metric=setback_metric
         )
 
         if not result.get('success'):
             return jsonify(result), 400
 
-        # 可視化ファイルがある場合はBase64エンコードして返す
-        if "visualization_file" in result:
-            try:
-                with open(result["visualization_file"], 'rb') as img_file:
-                    img_b64 = base64.b64encode(img_file.read()).decode('utf-8')
-                    result["visualization_b64"] = f"data:image/png;base64,{img_b64}"
-                # 一時ファイルを削除
-                os.unlink(result["visualization_file"])
-                del result["visualization_file"]
-            except Exception as e:
-                logger.warning(f"可視化画像の処理エラー: {e}")
-
         # 追加情報を含める
         if roof_shape_name:
             result["roof_type"] = roof_shape_name
@@ -530,6 +1159,120 @@ def calculate_panels():
             "message": str(e)
         }), 500
 
+@app.route('/rank_panels', methods=['POST'])
+def rank_panels():
+    """
+    パネルカタログを 1 つの屋根で評価して順位付けするAPI
+    Rank a whole panel catalog on one roof
+
+    The roof is given as "roof_mask" (PNG data URI or compact mask object) or
+    "roof_shape_name" (+ "dimensions"), as in /calculate_panels. "catalog" is
+    either {name: [length, width, power_w]} or a list of
+    {"name", "length", "width", "power_w"} objects (power_w defaults to 400).
+
+    Every SKU gets count, kW and effective-area ratio; only the first "top_k"
+    entries (default 5) of "ranking" carry panel rectangles. "rank_by" is
+    "kw" (default), "count" or "effective_area_ratio".
+
+    The top_k entries are always counted with the full placement. Entries
+    below them may be counts-only lattice estimates ("count_method":
+    "lattice"); "exact_counts": true places every SKU (slower). "layout_mode",
+    "align_to_roof", "engine" and "setback_metric" are accepted as in
+    /calculate_panels, so the ranking matches the later layout.
+
+    Example:
+    {
+        "roof_shape_name": "original_sample",
+        "dimensions": [1000, 1000],
+        "gsd": 0.05,
+        "catalog": {"M60": [1.65, 0.99, 330], "M72": [1.96, 0.99, 400]},
+        "top_k": 3
+    }
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({
+                "success": False,
+                "error": "no_data",
+                "message": "リクエストデータがありません"
+            }), 400
+
+        layout_mode = data.get('layout_mode', 'greedy')
+        if layout_mode not in LAYOUT_MODES:
+            return jsonify({
+                "success": False,
+                "error": "invalid_layout_mode",
+                "message": f"layout_mode は {list(LAYOUT_MODES)} のいずれかです: {layout_mode}"
+            }), 400
+
+        engine = data.get('engine', 'raster')
+        if engine not in PLACEMENT_ENGINES:
+            return jsonify({
+                "success": False,
+                "error": "invalid_engine",
+                "message": f"engine は {list(PLACEMENT_ENGINES)} のいずれかです: {engine}"
+            }), 400
+
+        setback_metric = data.get('setback_metric', 'square')
+        if setback_metric not in SETBACK_METRICS:
+            return jsonify({
+                "success": False,
+                "error": "invalid_setback_metric",
+                "message": f"setback_metric は {list(SETBACK_METRICS)} のいずれかです: {setback_metric}"
+            }), 400
+
+        if data.get('roof_mask'):
+            roof_mask = decode_roof_mask(data['roof_mask'])
+            if roof_mask is None:
+                return jsonify({
+                    "success": False,
+                    "error": "decode_error",
+                    "message": "屋根マスクのデコードに失敗しました"
+                }), 400
+        elif data.get('roof_shape_name'):
+            roof_mask = create_roof_mask(data['roof_shape_name'], tuple(data.get('dimensions', [400, 500])))
+        else:
+            return jsonify({
+                "success": False,
+                "error": "missing_input",
+                "message": "roof_mask または roof_shape_name のいずれかが必要です"
+            }), 400
+
+        try:
+            result = rank_panel_catalog(
+                roof_mask=roof_mask,
+                gsd=data.get('gsd', 0.05),
+                catalog=data.get('catalog'),
+                offset_m=data.get('offset_m', 1.0),
+                panel_spacing_m=data.get('panel_spacing_m', 0.02),
+                top_k=int(data.get('top_k', 5)),
+                rank_by=data.get('rank_by', 'kw'),
+                layout_mode=layout_mode,
+                align_to_roof=bool(data.get('align_to_roof', False)),
+                engine=engine,
+                setback_metric=setback_metric,
+                exact_counts=bool(data.get('exact_counts', False))
+            )
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": "invalid_parameters",
+                "message": str(e)
+            }), 400
+
+        if not result.get('success'):
+            return jsonify(result), 400
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error(f"カタログ評価エラー: {e}")
+        return jsonify({
+            "success": False,
+            "error": "processing_error",
+            "message": str(e)
+        }), 500
+
 # REMOVED: Deprecated endpoint - see ARCHITECTURE_REFACTOR_PLAN.md
 def process_roof_segments_deprecated():
     """
@@ -627,16 +1370,43 @@ def health_check():
         "version": "2.0.0",
         "api_endpoints": {
             "primary": "/calculate_panels",
+            "rank": "/rank_panels",
             "deprecated": ["/process_roof_segments", "/segment_click"],
             "health": "/health"
         },
+        "result_cache": RESULT_CACHE.stats(),
         "supported_input_methods": [
             "roof_mask (base64 encoded binary image)",
+            "roof_mask / roof_masks (compact mask object: rle, packbits, polygon)",
             "roof_shape_name (predefined shapes for testing)"
         ]
     })
 
+@app.before_request
+def reject_oversized_request():
+    """
+    Content-Length で上限超過を本文の読み込み前に判定する
+    Reject oversized bodies from Content-Length before reading them
+    （各ルートの except Exception で 500 に変わらないように、ルートに入る前に 413 を返す）
+    """
+    limit = app.config.get('MAX_CONTENT_LENGTH')
+    if limit and request.content_length is not None and request.content_length > limit:
+        abort(413)
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """
+    リクエストボディが PANEL_MAX_REQUEST_MB を超えた場合
+    Request body exceeds PANEL_MAX_REQUEST_MB
+    """
+    return jsonify({
+        "success": False,
+        "error": "request_too_large",
+        "message": f"リクエストサイズが上限 {MAX_REQUEST_MB:g} MB を超えています"
+    }), 413
+
 if __name__ == '__main__':
     # 開発用サーバーを起動 (ポート8001で起動、屋根検出システムは8000)
+    # 本番は gunicorn -c gunicorn.conf.py api_integration:app（複数ワーカー・グレースフル停止）
     port = int(os.environ.get('FLASK_RUN_PORT', 8001))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG') == '1')
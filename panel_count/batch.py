@@ -0,0 +1,234 @@
+"""
+大量の屋根マスクのバッチ計算
+Batch runner for panel layouts over many roof masks
+
+このモジュールは以下の機能を提供します：
+- 入力の展開（ディレクトリ・glob パターン・ファイル・事前定義の屋根形状）
+- プロセスプールによる屋根ごとの並列計算（planner.process_roof）
+- 屋根ごとの結果の CSV への逐次追記（完了した順に書き込み、途中で止まっても結果が残る）
+- Parquet のデータセットへの出力（任意、parquet_results.py、pyarrow が必要）
+- 出力 CSV に記録済みの入力のスキップ（再開）
+- 進捗・スループットのログとサマリー
+
+This module provides the following functionality:
+- Input expansion (directories, glob patterns, files, predefined roof shapes)
+- Per-roof parallel computation in a process pool (planner.process_roof)
+- Streaming CSV output: rows are appended as each roof completes, so an
+  interrupted run keeps everything finished so far
+- Optional Parquet dataset output (parquet_results.py, requires pyarrow)
+- Resume: inputs already recorded in the output CSV are skipped
+- Progress / throughput logging and a final summary
+
+Author: Panel Count Module Team
+"""
+
+import csv
+import glob
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import ExitStack
+
+from cli import CSV_FIELDNAMES, result_csv_rows
+from planner import process_roof
+
+# create_roof_mask が画像として読み込む拡張子
+# Extensions create_roof_mask loads as images
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+
+# 進捗ログの間隔（屋根数） / Log progress every this many roofs
+PROGRESS_EVERY = 50
+
+# ワーカーあたりの未完了ジョブ数の上限（入力が多くても投入済みのジョブを抑える）
+# In-flight jobs per worker, so huge inputs are not all submitted at once
+JOBS_PER_WORKER = 4
+
+def expand_inputs(patterns):
+    """
+    入力の指定を屋根ごとの入力のリストに展開する
+    Expand input specs into a list of per-roof inputs
+
+    - ディレクトリ: 直下の画像ファイル（IMAGE_EXTENSIONS、名前順）
+    - glob パターン（*, ?, [ を含む、** は再帰）: 一致する画像ファイル（名前順）
+    - それ以外: そのまま（画像ファイルまたは事前定義の屋根形状名）
+
+    Directories yield their image files, glob patterns (** is recursive)
+    their matching image files, both sorted; anything else is passed through
+    as a file or predefined roof shape name. Duplicates are dropped, keeping
+    the first occurrence.
+
+    Args:
+        patterns (list): ディレクトリ・glob パターン・ファイル・屋根形状名 / Input specs
+
+    Returns:
+        list: 入力のリスト（重複なし） / Inputs without duplicates
+    """
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            names = sorted(os.listdir(pattern))
+            matches = [os.path.join(pattern, name) for name in names
+                       if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(pattern, name))]
+        elif glob.has_magic(pattern):
+            matches = [path for path in sorted(glob.glob(pattern, recursive=True))
+                       if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path)]
+            if not matches:
+                logging.warning(f"'{pattern}' に一致する画像ファイルがありません")
+        else:
+            matches = [pattern]
+        inputs.extend(matches)
+    return list(dict.fromkeys(inputs))
+
+def completed_inputs(output_csv):
+    """
+    出力 CSV に記録済みの入力（roof_type 列）の集合
+    Inputs already recorded in the output CSV (its roof_type column)
+
+    失敗した屋根は CSV に書かれないため、再開時には再計算されます。
+    Failed roofs are never written, so a resumed run retries them.
+    """
+    if not os.path.isfile(output_csv):
+        return set()
+    with open(output_csv, newline='') as csvfile:
+        return {row['roof_type'] for row in csv.DictReader(csvfile) if row.get('roof_type')}
+
+class CsvResultWriter:
+    """
+    屋根ごとの結果を CSV に追記するライター（save_results_to_csv と同じ列）
+    Appends per-roof results to a CSV with the save_results_to_csv columns
+
+    1 屋根分の行を書くたびにフラッシュするため、中断しても完了した屋根の結果は残ります。
+    Flushes after every roof, so an interrupted run keeps every finished roof.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        file_exists = os.path.isfile(filename) and os.path.getsize(filename) > 0
+        self._file = open(filename, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=CSV_FIELDNAMES)
+        if not file_exists:
+            self._writer.writeheader()
+
+    def write(self, result):
+        """1 屋根分の結果を書き込む（失敗した屋根は書かない） / Write one roof; failed roofs are skipped"""
+        self._writer.writerows(result_csv_rows(result))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def process_input(roof_type, process_options):
+    """
+    1 屋根分の計算（ワーカープロセスで実行）。例外は失敗の結果として返す
+    Compute one roof (runs in a worker); exceptions become a failed result
+    """
+    try:
+        return process_roof(roof_type, **process_options)
+    except Exception as e:
+        logging.error(f"'{roof_type}' の計算エラー: {e}")
+        return {"roof_type": roof_type, "success": False, "error": "calculation_error", "message": str(e)}
+
+def iter_batch_results(inputs, process_options, workers=1):
+    """
+    屋根ごとの結果を完了した順に返すジェネレータ
+    Yield per-roof results in completion order
+
+    workers > 1 の場合はプロセスプールで計算し、未完了のジョブを workers × JOBS_PER_WORKER 件に
+    抑えながら次の入力を投入します。ワーカープロセス自体の異常はその屋根の失敗として返します。
+
+    With workers > 1 the roofs run in a process pool with at most
+    workers × JOBS_PER_WORKER jobs in flight. A crashed worker is reported as
+    a failed result for its roof.
+    """
+    if workers <= 1 or len(inputs) <= 1:
+        for roof_type in inputs:
+            yield process_input(roof_type, process_options)
+        return
+
+    remaining = iter(inputs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        def submit(count):
+            for roof_type in remaining:
+                pending[pool.submit(process_input, roof_type, process_options)] = roof_type
+                count -= 1
+                if count <= 0:
+                    return
+
+        submit(workers * JOBS_PER_WORKER)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for job in done:
+                roof_type = pending.pop(job)
+                try:
+                    yield job.result()
+                except Exception as e:
+                    logging.error(f"'{roof_type}' の計算エラー: {e}")
+                    yield {"roof_type": roof_type, "success": False, "error": "calculation_error",
+                           "message": str(e)}
+            submit(len(done))
+
+def run_batch(inputs, output_csv, process_options, workers=1, resume=False, progress_every=PROGRESS_EVERY,
+              parquet_dir=None, run_id=None):
+    """
+    屋根ごとに計算して結果を CSV に逐次追記する
+    Compute every input roof and stream the results into the CSV
+
+    Args:
+        inputs (list): 入力（expand_inputs の結果） / Inputs from expand_inputs
+        output_csv (str): 追記する CSV ファイル / CSV file to append to
+        process_options (dict): planner.process_roof のキーワード引数（roof_shape_name 以外）
+            / Keyword arguments for planner.process_roof (all but roof_shape_name)
+        workers (int): 並列プロセス数（0 は CPU コア数） / Worker processes (0 = CPU count)
+        resume (bool): 出力 CSV に記録済みの入力をスキップする / Skip inputs already in the CSV
+        progress_every (int): 進捗ログの間隔（屋根数） / Log progress every N roofs
+        parquet_dir (str): Parquet のデータセットのルート（None は出力しない） / Parquet dataset root, or None
+        run_id (str): Parquet のパーティションの run_id（None は自動） / Parquet run_id partition
+
+    Returns:
+        dict: total, skipped, processed, succeeded, failed, total_panels, elapsed_s, roofs_per_s
+            （Parquet を出力した場合は run_id も / plus run_id with Parquet output）
+    """
+    workers = workers or os.cpu_count() or 1
+    done_before = completed_inputs(output_csv) if resume else set()
+    todo = [roof_type for roof_type in inputs if roof_type not in done_before]
+    summary = {"total": len(inputs), "skipped": len(inputs) - len(todo), "processed": 0, "succeeded": 0,
+               "failed": 0, "total_panels": 0, "elapsed_s": 0.0, "roofs_per_s": 0.0}
+    logging.info(f"バッチ計算: {len(todo)} 屋根（スキップ {summary['skipped']}）, {workers} プロセス → '{output_csv}'")
+
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        writers = [stack.enter_context(CsvResultWriter(output_csv))]
+        if parquet_dir:
+            from parquet_results import ParquetResultWriter
+            writers.append(stack.enter_context(ParquetResultWriter(parquet_dir, run_id)))
+            summary["run_id"] = writers[-1].run_id
+        for result in iter_batch_results(todo, process_options, workers):
+            for writer in writers:
+                writer.write(result)
+            summary["processed"] += 1
+            if result.get("success"):
+                summary["succeeded"] += 1
+                summary["total_panels"] += max(result.get("max_count", 0), 0)
+            else:
+                summary["failed"] += 1
+                logging.warning(f"'{result.get('roof_type')}' は失敗: {result.get('error')}")
+            done = summary["processed"]
+            if done % progress_every == 0 or done == len(todo):
+                elapsed = time.perf_counter() - start
+                logging.info(f"進捗: {done}/{len(todo)} 屋根, {elapsed:.1f} 秒, {done / max(elapsed, 1e-9):.1f} 屋根/秒")
+
+    summary["elapsed_s"] = round(time.perf_counter() - start, 3)
+    summary["roofs_per_s"] = round(summary["processed"] / max(summary["elapsed_s"], 1e-9), 2)
+    logging.info(f"バッチ計算完了: 成功 {summary['succeeded']}, 失敗 {summary['failed']}, "
+                 f"スキップ {summary['skipped']}, パネル合計 {summary['total_panels']} 枚, "
+                 f"{summary['elapsed_s']:.1f} 秒 ({summary['roofs_per_s']:.1f} 屋根/秒)")
+    return summary
@@ -35,11 +35,12 @@ def run_calculation(image_files, output_csv="all_samples_results.csv"):
     for img in image_files:
         print(f"  - {img}")
     
-    # 构建命令
+    # 构建命令（批处理模式：按 CPU 核数并行，每个屋顶完成后立即追加到 CSV）
     cmd = [
         sys.executable, "main.py",
-        "--roof-types"] + image_files + [
+        "--input"] + image_files + [
         "--fast",
+        "--workers", "0",
         "--output-csv", output_csv,
         "--log-level", "INFO"
     ]
@@ -29,6 +29,13 @@ def validate_args(args):
     if args.spacing < 0:
         raise ValueError(f'Panel spacing must be non-negative, got: {args.spacing}')
 
+    if args.workers < 0:
+        raise ValueError(f'Workers must be non-negative, got: {args.workers}')
+
+    # バッチモードでは入力（ディレクトリ・glob）を batch.expand_inputs で展開する
+    if args.input:
+        return
+
     # 有効な屋根タイプのリスト（画像ファイルも許可）
     valid_roof_types = ["original_sample", "kiritsuma_side", "yosemune_main", "katanagare", "rikuyane"]
     valid_image_extensions = ['.png', '.jpg', '.jpeg', '.bmp', '.tiff']
@@ -60,6 +67,20 @@ def parse_args():
     parser.add_argument('--fast', action='store_true',
                         help='高速アルゴリズムを使用する')
 
+    parser.add_argument('--layout-mode', type=str, default='greedy', choices=['greedy', 'grid'],
+                        help='配置モード: greedy（貪欲法）または grid（行・列を揃えた格子配置）, デフォルト: greedy')
+
+    parser.add_argument('--align-to-roof', action='store_true',
+                        help='屋根の主方向に回転した配置も試す（傾いた屋根向け）')
+
+    parser.add_argument('--engine', type=str, default='raster', choices=['raster', 'polygon'],
+                        help='配置エンジン: raster（マスク上で配置）または polygon（屋根の輪郭ポリゴン上で配置、'
+                             '解像度に依存しない）, デフォルト: raster')
+
+    parser.add_argument('--setback-metric', type=str, default='square', choices=['square', 'euclidean'],
+                        help='セットバックの距離: square（正方形カーネル）または euclidean（屋根端からの実距離、'
+                             '角は円弧）, デフォルト: square')
+
     parser.add_argument('--roof-types', nargs='+',
                         default=["original_sample", "kiritsuma_side", "yosemune_main", "katanagare", "rikuyane"],
                         help='計算する屋根タイプのリスト')
@@ -67,6 +88,29 @@ def parse_args():
     parser.add_argument('--output-csv', type=str, default='result_summary.csv',
                         help='結果を保存するCSVファイル名')
 
+    parser.add_argument('--input', nargs='+',
+                        help='バッチモード: 屋根マスク画像のディレクトリ・glob パターン（例: "masks/**/*.png"）・'
+                             'ファイル。指定すると --roof-types の代わりに使い、屋根ごとに CSV へ追記する')
+
+    parser.add_argument('--workers', type=int, default=1,
+                        help='バッチモードの並列プロセス数（0 は CPU コア数）, デフォルト: 1')
+
+    parser.add_argument('--resume', action='store_true',
+                        help='バッチモード: 出力 CSV に記録済みの入力をスキップする')
+
+    parser.add_argument('--output-dir', type=str, default='.',
+                        help='可視化画像（result_*.png）の保存先ディレクトリ, デフォルト: カレントディレクトリ')
+
+    parser.add_argument('--no-visualization', action='store_true',
+                        help='可視化画像を保存しない')
+
+    parser.add_argument('--output-parquet', type=str,
+                        help='パネル矩形を含む結果を Parquet のデータセット（run_id=.../date=.../）として'
+                             'このディレクトリに書き出す（pyarrow が必要）')
+
+    parser.add_argument('--run-id', type=str,
+                        help='Parquet のパーティションの run_id, デフォルト: 実行時刻 + 乱数')
+
     parser.add_argument('--log-level', type=str, default='INFO',
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help='ログレベル')
@@ -75,6 +119,32 @@ def parse_args():
     validate_args(args)
     return args
 
+CSV_FIELDNAMES = [
+    'roof_type', 'panel_name', 'count_area', 'count_sim',
+    'orientation', 'roof_area', 'effective_area',
+    'gsd', 'offset', 'panel_spacing'
+]
+
+def result_csv_rows(result):
+    """1 屋根分の結果をパネル種類ごとの CSV の行に変換する（失敗した屋根は行なし）"""
+    if not result.get('success', False):
+        return []
+    return [
+        {
+            'roof_type': result['roof_type'],
+            'panel_name': panel_name,
+            'count_area': panel_data['count_area'],
+            'count_sim': panel_data['count_sim'],
+            'orientation': panel_data['orientation'],
+            'roof_area': result['roof_area'],
+            'effective_area': result['effective_area'],
+            'gsd': result['gsd'],
+            'offset': result['offset'],
+            'panel_spacing': result['panel_spacing']
+        }
+        for panel_name, panel_data in result['panels'].items()
+    ]
+
 def save_results_to_csv(results, filename):
     """結果をCSVファイルに保存する"""
     import csv
@@ -83,33 +153,12 @@ def save_results_to_csv(results, filename):
     file_exists = os.path.isfile(filename)
     
     with open(filename, 'a', newline='') as csvfile:
-        fieldnames = [
-            'roof_type', 'panel_name', 'count_area', 'count_sim', 
-            'orientation', 'roof_area', 'effective_area', 
-            'gsd', 'offset', 'panel_spacing'
-        ]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer = csv.DictWriter(csvfile, fieldnames=CSV_FIELDNAMES)
         
         if not file_exists:
             writer.writeheader()
         
         for result in results:
-            if not result.get('success', False):
-                continue
-                
-            for panel_name, panel_data in result['panels'].items():
-                row = {
-                    'roof_type': result['roof_type'],
-                    'panel_name': panel_name,
-                    'count_area': panel_data['count_area'],
-                    'count_sim': panel_data['count_sim'],
-                    'orientation': panel_data['orientation'],
-                    'roof_area': result['roof_area'],
-                    'effective_area': result['effective_area'],
-                    'gsd': result['gsd'],
-                    'offset': result['offset'],
-                    'panel_spacing': result['panel_spacing']
-                }
-                writer.writerow(row)
+            writer.writerows(result_csv_rows(result))
     
     logging.info(f"結果を '{filename}' に保存しました。")
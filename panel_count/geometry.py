@@ -4,15 +4,22 @@ Geometric calculation module for solar panel layout computation
 
 このモジュールは以下の機能を提供します：
 - 単位変換（メートル ↔ ピクセル）
-- 画像腐食処理（安全マージンの適用）
-- 高速パネル配置アルゴリズム（畳み込みベース）
+- 画像腐食処理（安全マージンの適用、正方形 / ユークリッド距離、大きなマージンは距離変換）
+- 高速パネル配置アルゴリズム（畳み込みベース / 積分画像ベース）
+- 格子配置アルゴリズム（行・列を揃えた配置）
+- 屋根方向への配置座標系の回転
+- 配置エンジンの選択（ラスター / 輪郭ポリゴン, polygon_layout.py）
 - 従来パネル配置アルゴリズム（ピクセルスキャンベース）
 - 面積ベース配置数推定
 
 This module provides the following functionality:
 - Unit conversion (meters ↔ pixels)
-- Image erosion processing (safety margin application)
-- Fast panel placement algorithm (convolution-based)
+- Image erosion processing (safety margin application, square / Euclidean
+  metric, distance transform for large margins)
+- Fast panel placement algorithm (convolution-based / summed-area table)
+- Grid-aligned placement algorithm (panels in aligned rows and columns)
+- Rotating the placement frame to the dominant roof orientation
+- Placement engine selection (raster / roof contour polygon, polygon_layout.py)
 - Traditional panel placement algorithm (pixel scan-based)
 - Area-based placement count estimation
 
@@ -22,6 +29,8 @@ Last Updated: 2025-07-02
 """
 
 import math
+from collections import deque, namedtuple
+
 import cv2
 import numpy as np
 from scipy.signal import convolve2d
@@ -59,7 +68,47 @@ def pixels_from_meters(value_m, gsd):
         raise ValueError(f"GSD must be positive, got: {gsd}")
     return math.ceil(value_m / gsd)
 
-def erode_with_margin(mask_bin, margin_px):
+# セットバックの距離の測り方: square（正方形カーネル, チェビシェフ距離）/ euclidean（円, ユークリッド距離）
+# Setback metrics: square (square kernel, chessboard distance) / euclidean (disk, true distance)
+SETBACK_METRICS = ("square", "euclidean")
+
+# これ以上のマージンの square の腐食は距離変換で行う。cv2.erode の矩形カーネルは分離可能で
+# 小さなマージンでは速いが、時間はマージンに比例し、このあたりで距離変換（マージンに依存しない）と並ぶ
+# Square erosion switches to the distance transform from this margin on: the separable
+# rectangular cv2.erode is faster for small margins but grows linearly with them
+DISTANCE_EROSION_MIN_PX = 160
+
+def erode_by_distance(mask_bin, margin_px, metric="square"):
+    """
+    距離変換によるマスクの腐食（計算量は O(H×W) でマージンに依存しない）
+    Erode a mask with a distance transform in O(H·W), independent of the margin
+
+    屋根の各画素から最も近い非屋根画素までの距離が margin_px より大きい画素を残します。
+    square はチェビシェフ距離（cv2.DIST_C）で、(2m+1)² の正方形カーネルの cv2.erode と
+    同じ結果になります。euclidean は厳密なユークリッド距離（cv2.DIST_MASK_PRECISE）で、
+    半径 margin_px の円のカーネルに相当します。画像の外側は腐食と同じく屋根として扱います。
+
+    Keeps the pixels whose distance to the nearest non-roof pixel exceeds
+    margin_px. "square" uses the chessboard distance and matches cv2.erode
+    with the (2m+1)² square kernel exactly; "euclidean" uses the exact
+    Euclidean distance, i.e. a disk of radius margin_px. As with cv2.erode,
+    pixels outside the image count as roof.
+
+    Args:
+        mask_bin (numpy.ndarray): 二値化されたマスク (0/255, uint8) / Binary mask (0/255, uint8)
+        margin_px (float): マージン（ピクセル、euclidean では小数可） / Margin in pixels (may be fractional for euclidean)
+        metric (str): "square" または "euclidean"（SETBACK_METRICS） / Distance metric
+
+    Returns:
+        numpy.ndarray: 腐食されたマスク (0/255, uint8) / Eroded mask (0/255, uint8)
+    """
+    if metric == "square":
+        dist = cv2.distanceTransform(mask_bin, cv2.DIST_C, 3)
+    else:
+        dist = cv2.distanceTransform(mask_bin, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    return cv2.compare(dist, float(margin_px), cv2.CMP_GT)
+
+def erode_with_margin(mask_bin, margin_px, metric="square"):
     """
     一度に指定されたマージンでマスクを腐食する
     Apply erosion to mask with specified margin in a single operation
@@ -79,6 +128,9 @@ def erode_with_margin(mask_bin, margin_px):
         margin_px (int): 腐食するピクセル数 / Number of pixels to erode
             - 正の値: 腐食を実行 / Positive value: perform erosion
             - 0以下: 元のマスクを返す / Zero or negative: return original mask
+        metric (str): セットバックの距離 / Setback metric (SETBACK_METRICS)
+            - "square": 正方形カーネル（従来どおり） / Square kernel (default, unchanged)
+            - "euclidean": 円（辺・角からの実距離） / Disk: true distance from edges and corners
 
     Returns:
         numpy.ndarray: 腐食されたマスク / Eroded mask
@@ -95,14 +147,20 @@ def erode_with_margin(mask_bin, margin_px):
         1. カーネルサイズ = 2 * margin_px + 1
         2. 正方形の構造要素を作成
         3. OpenCVの腐食処理を1回実行
+        - euclidean、または margin_px >= DISTANCE_EROSION_MIN_PX の場合は
+          erode_by_distance（距離変換、結果は同じ）
 
     Note:
         - margin_px <= 0 の場合、元のマスクのコピーを返します
         - 大きなマージンは小さな屋根を完全に消去する可能性があります
-        - 処理時間はマージンサイズに比例します
+        - カーネルの処理時間はマージンサイズに比例するため、大きなマージンは距離変換で処理します
     """
+    if metric not in SETBACK_METRICS:
+        raise ValueError(f"Unknown setback metric: {metric}. Valid metrics: {list(SETBACK_METRICS)}")
     if margin_px <= 0:
         return mask_bin.copy()
+    if metric == "euclidean" or margin_px >= DISTANCE_EROSION_MIN_PX:
+        return erode_by_distance(mask_bin, margin_px, metric)
 
     # カーネルサイズの計算（奇数サイズを保証）
     k = 2 * margin_px + 1
@@ -281,6 +339,720 @@ def calculate_panel_layout_fast(usable_mask, panel_w_px, panel_h_px):
 
     return len(panels), panels
 
+def summed_area_table(usable_mask):
+    """
+    有効エリアの積分画像（Summed-Area Table）を作る
+    Build the (H+1, W+1) summed-area table of the valid pixels (255) of a mask
+
+    int32 のため H×W < 2^31 画素まで扱えます / int32 handles masks up to 2^31 pixels
+    """
+    return cv2.integral((usable_mask == 255).view(np.uint8), sdepth=cv2.CV_32S)
+
+def valid_placement_map(usable_mask, panel_w_px, panel_h_px, sat=None):
+    """
+    積分画像（Summed-Area Table）でパネルを置ける左上位置を一括判定する
+    Find every top-left position whose panel window is fully inside the mask
+
+    積分画像を使うと任意の矩形内の画素数を4回の参照で求められるため、
+    パネルサイズによらず O(H×W) で全位置を判定できます。
+
+    A summed-area table gives the pixel count of any rectangle with four
+    lookups, so all windows are checked in O(H×W) regardless of panel size.
+
+    Args:
+        usable_mask (numpy.ndarray): 有効エリアのマスク (255=有効) / Valid area mask (255=valid)
+        panel_w_px (int): パネル幅（ピクセル） / Panel width in pixels
+        panel_h_px (int): パネル高さ（ピクセル） / Panel height in pixels
+        sat (numpy.ndarray): 計算済みの積分画像（省略時は作成） / Precomputed summed-area table (optional)
+
+    Returns:
+        numpy.ndarray: (H-Ph+1, W-Pw+1) の bool 配列 / Boolean map of valid top-left positions
+            - パネルがマスクより大きい場合は空配列 / Empty if the panel does not fit
+    """
+    h, w = usable_mask.shape[:2]
+    if h < panel_h_px or w < panel_w_px:
+        return np.zeros((0, 0), dtype=bool)
+
+    if sat is None:
+        sat = summed_area_table(usable_mask)
+    window_sum = (sat[panel_h_px:, panel_w_px:] - sat[:-panel_h_px, panel_w_px:]
+                  - sat[panel_h_px:, :-panel_w_px] + sat[:-panel_h_px, :-panel_w_px])
+    return window_sum == panel_h_px * panel_w_px
+
+# greedy_place_from_valid が 1 回にまとめて調べる行数
+_GREEDY_SCAN_ROWS = 64
+
+def greedy_place_from_valid(valid, panel_w_px, panel_h_px, origin=(0, 0)):
+    """
+    有効位置マップから貪欲法でパネルを配置する（左上から右下の順）
+    Greedy row-major placement over a precomputed valid-position map
+
+    calculate_panel_layout_fast と同じ順序・同じ結果になります。候補 (x, y) は
+    既に置いたパネルと列範囲 [x, x+Pw) で重なり、かつそのパネルが行 y まで
+    伸びている場合にのみ衝突するため、列ごとに「占有が終わる行」を保持すれば
+    占有マスクを切り出さずに判定できます。同じ行では配置後 Pw 列分を飛ばします。
+    占有状態は配置した行と占有が解ける行でしか変わらないため、その間の行は
+    「置ける窓」のマスクとまとめて論理積を取り、次に候補が現れる行へ直接進みます。
+
+    Produces exactly the same panels, in the same order, as
+    calculate_panel_layout_fast. A candidate (x, y) can only collide with a
+    placed panel covering columns [x, x+Pw) that extends down to row y, so a
+    per-column "occupied until row" array replaces the taken-mask slicing.
+    Within a row the scan jumps Pw columns after each placement. The set of
+    free windows only changes on rows where a panel is placed or released, so
+    the rows in between are tested in vectorized chunks and the scan jumps
+    straight to the next row that has a free candidate.
+
+    Args:
+        valid (numpy.ndarray): valid_placement_map の結果 / Output of valid_placement_map
+        panel_w_px (int): パネル幅（ピクセル） / Panel width in pixels
+        panel_h_px (int): パネル高さ（ピクセル） / Panel height in pixels
+        origin (tuple): grid_place_from_valid と引数を揃えるためのもの。貪欲法の結果は
+            平行移動に対して不変なので使用しない / Unused; greedy placement is translation invariant
+
+    Returns:
+        list: パネル位置のリスト [(x, y, width, height), ...] / List of panel positions
+    """
+    panels = []
+    if valid.size == 0:
+        return panels
+
+    n_rows, n_cols = valid.shape
+    # 各列が占有されている最後の行 + 1（パネル幅分の余白を右側に確保）
+    occupied_until = np.zeros(n_cols + panel_w_px, dtype=np.int64)
+    blocked_prefix = np.zeros(n_cols + panel_w_px + 1, dtype=np.int32)
+    free = np.ones(n_cols, dtype=bool)  # 窓 [x, x+Pw) に占有列がない
+    # 占有が解ける行（パネル高さが一定なので配置行の順に単調増加）
+    releases = deque()
+
+    y = 0
+    while y < n_rows:
+        # 占有状態が変わらない範囲で、空き候補のある最初の行を探す
+        stop = min(releases[0] if releases else n_rows, y + _GREEDY_SCAN_ROWS)
+        hits = np.flatnonzero((valid[y:stop] & free).any(axis=1))
+        if len(hits) == 0:
+            y = stop
+            if releases and y >= releases[0]:
+                releases.popleft()
+                np.cumsum(occupied_until > y, out=blocked_prefix[1:])
+                free = blocked_prefix[panel_w_px:panel_w_px + n_cols] == blocked_prefix[:n_cols]
+            continue
+
+        y += int(hits[0])
+        candidates = np.flatnonzero(valid[y] & free)
+        # 同じ行の中では配置するたびに Pw 列先の候補へジャンプ
+        i = 0
+        while i < len(candidates):
+            x = int(candidates[i])
+            panels.append((x, y, panel_w_px, panel_h_px))
+            occupied_until[x:x + panel_w_px] = y + panel_h_px
+            free[max(0, x - panel_w_px + 1):x + panel_w_px] = False
+            i = int(np.searchsorted(candidates, x + panel_w_px, side='left'))
+        releases.append(y + panel_h_px)
+        y += 1
+
+    return panels
+
+def calculate_panel_layout_sat(usable_mask, panel_w_px, panel_h_px):
+    """
+    積分画像を使用して高速にパネル配置を計算する
+    Fast panel layout calculation using a summed-area table
+
+    calculate_panel_layout_fast と同じ貪欲法の結果を返しますが、有効位置の判定に
+    畳み込みではなく積分画像を使用し（O(H×W)）、配置後は占有済みの行・列を
+    飛ばして走査します。
+
+    Returns the same greedy result as calculate_panel_layout_fast, but finds
+    valid positions with a summed-area table (O(H×W), independent of panel size)
+    and skips occupied rows and columns instead of testing every candidate.
+
+    Algorithm Overview:
+    1. 積分画像で全位置のウィンドウ内画素数を求める
+    2. 全画素が有効な位置を候補とする
+    3. 行ごとに占有列を除外し、左から貪欲にパネルを配置
+
+    Args:
+        usable_mask (numpy.ndarray): 有効エリアのマスク (255=有効) / Valid area mask (255=valid)
+            - Shape: (height, width)
+            - Type: uint8
+            - Values: 255 (valid), 0 (invalid)
+        panel_w_px (int): パネル幅（ピクセル） / Panel width in pixels
+        panel_h_px (int): パネル高さ（ピクセル） / Panel height in pixels
+
+    Returns:
+        tuple: (配置できたパネル数, パネル位置のリスト) / (Number of placed panels, List of panel positions)
+            - Each position: (x, y, width, height) in pixels
+
+    Example:
+        >>> mask = np.ones((400, 500), dtype=np.uint8) * 255
+        >>> count, positions = calculate_panel_layout_sat(mask, 50, 80)
+        >>> print(f"配置数: {count}, 最初の位置: {positions[0]}")
+        配置数: 50, 最初の位置: (0, 0, 50, 80)
+
+    Performance:
+        - 時間計算量: O(H×W + 配置数×W) / Time complexity: O(H×W + panels×W)
+        - 空間計算量: O(H×W) / Space complexity: O(H×W)
+
+    Note:
+        - 元のマスクは変更されません / The input mask is not modified
+        - ベンチマーク: scripts/bench_panel_layout.py
+    """
+    # 入力検証
+    if panel_w_px <= 0 or panel_h_px <= 0:
+        raise ValueError(f"Panel dimensions must be positive: {panel_w_px}x{panel_h_px}")
+
+    valid = valid_placement_map(usable_mask, panel_w_px, panel_h_px)
+    panels = greedy_place_from_valid(valid, panel_w_px, panel_h_px)
+    return len(panels), panels
+
+def calculate_panel_layout_grid(usable_mask, panel_w_px, panel_h_px):
+    """
+    パネルを格子状（行・列を揃えて）に配置する
+    Grid-aligned layout: panels on a regular lattice with the best phase offset
+
+    実際の施工と同様に、パネルを間隔 (Pw, Ph) の格子上に並べます。格子の
+    位相オフセット (x0, y0) ごとに格子点のうち有効な位置の数を数え、最も多い
+    オフセットを採用します。有効位置マップを (Ph, Pw) のブロックに折り畳んで
+    合計することで、全オフセットの配置数を O(H×W) で一括計算します。
+
+    Places panels on a lattice with pitch (Pw, Ph), as installers lay them out
+    in aligned rows. For every phase offset (x0, y0) the number of valid
+    lattice points is counted, and the offset with the most panels wins.
+    Folding the valid-position map into (Ph, Pw) blocks and summing them gives
+    the counts for all offsets at once in O(H×W).
+
+    Args:
+        usable_mask (numpy.ndarray): 有効エリアのマスク (255=有効) / Valid area mask (255=valid)
+        panel_w_px (int): パネル幅（ピクセル） / Panel width in pixels
+        panel_h_px (int): パネル高さ（ピクセル） / Panel height in pixels
+
+    Returns:
+        tuple: (配置できたパネル数, パネル位置のリスト) / (Number of placed panels, List of panel positions)
+            - Each position: (x, y, width, height) in pixels, row-major order
+
+    Example:
+        >>> mask = np.ones((400, 500), dtype=np.uint8) * 255
+        >>> count, positions = calculate_panel_layout_grid(mask, 50, 80)
+        >>> print(f"配置数: {count}, 最初の位置: {positions[0]}")
+        配置数: 50, 最初の位置: (0, 0, 50, 80)
+
+    Note:
+        - 同数のオフセットが複数ある場合は (y0, x0) が最小のものを採用
+        - 格子の制約により、貪欲法より枚数が少なくなる場合があります
+        - Ties are broken by the smallest (y0, x0)
+    """
+    # 入力検証
+    if panel_w_px <= 0 or panel_h_px <= 0:
+        raise ValueError(f"Panel dimensions must be positive: {panel_w_px}x{panel_h_px}")
+
+    valid = valid_placement_map(usable_mask, panel_w_px, panel_h_px)
+    panels = grid_place_from_valid(valid, panel_w_px, panel_h_px)
+    return len(panels), panels
+
+def lattice_phase_counts(valid, panel_w_px, panel_h_px):
+    """
+    格子の位相オフセットごとの配置数（有効位置マップを (Ph, Pw) のブロックに折り畳んで合計）
+    Panel count of the lattice for every phase offset, from a valid-position map
+
+    Returns:
+        numpy.ndarray: (Ph, Pw) の配列。phase_counts[y0, x0] = オフセット (x0, y0) の格子で置ける枚数
+            / phase_counts[y0, x0] is the number of valid lattice points for offset (x0, y0)
+    """
+    # (Ph, Pw) の倍数に 0 埋めし、行方向 → 列方向の順にブロックを折り畳む
+    rows, cols = valid.shape
+    padded_rows, padded_cols = -(-rows // panel_h_px) * panel_h_px, -(-cols // panel_w_px) * panel_w_px
+    padded = np.zeros((padded_rows, padded_cols), dtype=np.uint8)
+    padded[:rows, :cols] = valid
+    folded = padded.reshape(padded_rows // panel_h_px, panel_h_px, padded_cols).sum(axis=0, dtype=np.int32)
+    return folded.reshape(panel_h_px, padded_cols // panel_w_px, panel_w_px).sum(axis=1)
+
+def grid_place_from_valid(valid, panel_w_px, panel_h_px, origin=(0, 0)):
+    """
+    有効位置マップから最良の位相オフセットの格子でパネルを配置する
+    Lattice placement over a precomputed valid-position map (see calculate_panel_layout_grid)
+
+    Args:
+        origin (tuple): valid の左上の元画像座標 (x, y)。切り出したマスクでも、同数の位相の
+            選択を元画像の座標で行い、全体で計算した場合と同じ格子にする
+            / Image coordinates of valid[0, 0]; ties between phases are broken in image
+            coordinates so a cropped mask yields the same lattice as the full frame
+
+    Returns:
+        list: パネル位置のリスト [(x, y, width, height), ...] / List of panel positions
+    """
+    if valid.size == 0:
+        return []
+
+    # 元画像座標での位相の順に並べ替えてから最大を選ぶ（同数の場合の選択を切り出し位置に依存させない）
+    ox, oy = origin
+    phase_counts = np.roll(lattice_phase_counts(valid, panel_w_px, panel_h_px),
+                           (oy % panel_h_px, ox % panel_w_px), axis=(0, 1))
+    ay, ax = np.unravel_index(int(np.argmax(phase_counts)), phase_counts.shape)
+    y0, x0 = (ay - oy) % panel_h_px, (ax - ox) % panel_w_px
+
+    lattice_y, lattice_x = np.nonzero(valid[y0::panel_h_px, x0::panel_w_px])
+    return [(int(x0 + gx * panel_w_px), int(y0 + gy * panel_h_px), panel_w_px, panel_h_px)
+            for gy, gx in zip(lattice_y, lattice_x)]
+
+# 配置モード名 → 配置関数
+# Layout mode name → placement function (signature: usable_mask, panel_w_px, panel_h_px)
+LAYOUT_MODES = {
+    "greedy": calculate_panel_layout_sat,
+    "grid": calculate_panel_layout_grid,
+}
+
+# 配置モード名 → 有効位置マップからの配置関数（PlacementContext 用、引数 valid, w, h, origin）
+# Layout mode name → placer over a valid-position map (used by PlacementContext; args valid, w, h, origin)
+LAYOUT_PLACERS = {
+    "greedy": greedy_place_from_valid,
+    "grid": grid_place_from_valid,
+}
+
+def get_layout_function(layout_mode):
+    """
+    配置モード名から配置関数を取得する
+    Look up the placement function for a layout mode
+
+    Raises:
+        ValueError: 未知の配置モード / Unknown layout mode
+    """
+    if layout_mode not in LAYOUT_MODES:
+        raise ValueError(f"Unknown layout mode: {layout_mode}. Valid modes: {list(LAYOUT_MODES)}")
+    return LAYOUT_MODES[layout_mode]
+
+# これより小さい傾きは回転しない（軸平行のまま配置）
+# Roofs tilted less than this are placed axis-aligned
+MIN_ROTATION_DEG = 1.0
+
+# 配置を行う座標系: usable_mask 上で配置し、back_matrix で元画像座標へ戻す
+# Placement frame: panels are placed on usable_mask and mapped back with back_matrix
+LayoutFrame = namedtuple("LayoutFrame", ["usable_mask", "rotation_deg", "back_matrix"])
+
+def estimate_roof_angle(mask_bin):
+    """
+    屋根の主方向（最大輪郭の最小外接矩形の傾き）を推定する
+    Estimate the dominant roof edge orientation from the minimum-area rectangle
+    of the largest contour
+
+    Args:
+        mask_bin (numpy.ndarray): 二値化されたマスク (0/255) / Binary mask (0/255)
+
+    Returns:
+        float: 傾き（度, [-45, 45)）。この角度で回転すると屋根の辺が軸に揃う
+            / Angle in degrees in [-45, 45); rotating by it aligns the roof edges with the axes
+    """
+    contours, _ = cv2.findContours((mask_bin > 127).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return 0.0
+    _, _, angle = cv2.minAreaRect(max(contours, key=cv2.contourArea))
+    # OpenCV のバージョンにより角度の範囲が異なるため 90 度周期で正規化
+    return float((angle + 45.0) % 90.0 - 45.0)
+
+def rotate_mask(mask_bin, angle_deg):
+    """
+    マスクを中心回りに回転する（はみ出さないようにキャンバスを拡張）
+    Rotate a mask about its center onto an enlarged canvas
+
+    Args:
+        mask_bin (numpy.ndarray): 二値化されたマスク (0/255) / Binary mask (0/255)
+        angle_deg (float): 回転角（度、反時計回り） / Rotation angle in degrees (counter-clockwise)
+
+    Returns:
+        tuple: (回転後のマスク, 回転後→元画像の 2x3 アフィン行列)
+            / (rotated mask, 2x3 affine matrix mapping rotated coordinates back to the original)
+    """
+    h, w = mask_bin.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2.0, h / 2.0), angle_deg, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_w = int(math.ceil(h * sin + w * cos))
+    new_h = int(math.ceil(h * cos + w * sin))
+    matrix[0, 2] += new_w / 2.0 - w / 2.0
+    matrix[1, 2] += new_h / 2.0 - h / 2.0
+    rotated = cv2.warpAffine(mask_bin, matrix, (new_w, new_h), flags=cv2.INTER_NEAREST, borderValue=0)
+    return rotated, cv2.invertAffineTransform(matrix)
+
+def layout_frames(roof_mask_bin, usable_mask, offset_px, align_to_roof=False, setback_metric="square"):
+    """
+    配置を試す座標系のリストを作る（軸平行 + 必要に応じて屋根方向に揃えた座標系）
+    Build the placement frames: the axis-aligned frame, plus one aligned to the
+    dominant roof orientation when align_to_roof is set
+
+    回転と腐食は屋根ごとに 1 回だけ行い、全パネル種類・縦横の両方で共有します。
+    腐食は回転後に行うため、セットバックは屋根の辺に沿って適用されます。
+
+    The warp and erosion run once per roof and are shared by every panel option
+    and both orientations. Erosion happens after the warp, so the setback
+    follows the roof edges.
+
+    Args:
+        roof_mask_bin (numpy.ndarray): 屋根マスク (0/255) / Roof mask (0/255)
+        usable_mask (numpy.ndarray): 軸平行で腐食済みの有効エリア / Axis-aligned eroded usable mask
+        offset_px (int): セットバック（ピクセル） / Setback in pixels
+        align_to_roof (bool): 屋根方向に揃えた座標系も試すか / Also try the roof-aligned frame
+        setback_metric (str): セットバックの距離（SETBACK_METRICS） / Setback metric
+
+    Returns:
+        list: LayoutFrame のリスト / List of LayoutFrame
+    """
+    frames = [LayoutFrame(usable_mask, 0.0, None)]
+    if align_to_roof:
+        angle = estimate_roof_angle(roof_mask_bin)
+        if abs(angle) >= MIN_ROTATION_DEG:
+            rotated, back_matrix = rotate_mask(roof_mask_bin, angle)
+            frames.append(LayoutFrame(erode_with_margin(rotated, offset_px, setback_metric), angle, back_matrix))
+    return frames
+
+def best_layout_in_frames(layout_func, frames, panel_w_px, panel_l_px):
+    """
+    全座標系 × 縦置き/横置きで配置し、最も枚数の多いものを返す
+    Run the layout for every frame and both orientations and keep the best
+
+    同数の場合は軸平行・縦置きを優先します（回転なしの従来結果と一致）。
+    Ties prefer the axis-aligned frame and vertical orientation, which matches
+    the unrotated result.
+
+    Returns:
+        dict: count, panels, orientation, frame, count_v, count_h
+            - count_v / count_h: 採用した座標系での縦・横の枚数
+    """
+    best = None
+    for frame in frames:
+        count_v, panels_v = layout_func(frame.usable_mask, panel_w_px, panel_l_px)
+        count_h, panels_h = layout_func(frame.usable_mask, panel_l_px, panel_w_px)
+        if count_v >= count_h:
+            candidate = (count_v, panels_v, "vertical")
+        else:
+            candidate = (count_h, panels_h, "horizontal")
+        if best is None or candidate[0] > best["count"]:
+            best = {"count": candidate[0], "panels": candidate[1], "orientation": candidate[2],
+                    "frame": frame, "count_v": count_v, "count_h": count_h}
+    return best
+
+def panels_to_polygons(panels, back_matrix=None):
+    """
+    配置座標系のパネル矩形を元画像座標の四角形（4 頂点）に変換する
+    Map panel rectangles from the placement frame to 4-point polygons in the
+    original image coordinates
+
+    Args:
+        panels (list): [(x, y, width, height), ...]
+        back_matrix (numpy.ndarray): 2x3 アフィン行列（None の場合は恒等変換） / 2x3 affine matrix (identity if None)
+
+    Returns:
+        list: [[[x0, y0], [x1, y1], [x2, y2], [x3, y3]], ...]（時計回り、小数点以下 1 桁）
+    """
+    if not panels:
+        return []
+    rects = np.asarray(panels, dtype=np.float64)
+    x, y, w, h = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+    corners = np.stack([
+        np.stack([x, y], axis=1),
+        np.stack([x + w, y], axis=1),
+        np.stack([x + w, y + h], axis=1),
+        np.stack([x, y + h], axis=1),
+    ], axis=1)  # (N, 4, 2)
+    if back_matrix is not None:
+        corners = corners @ back_matrix[:, :2].T + back_matrix[:, 2]
+    return np.round(corners, 1).tolist()
+
+def mask_run_lengths(usable_mask):
+    """
+    有効画素（255）の行方向・列方向の連続長
+    Lengths of the runs of valid pixels (255) along every row and every column
+
+    Returns:
+        tuple: (行方向の連続長, 列方向の連続長) の int 配列 / (row run lengths, column run lengths)
+    """
+    def runs(valid):
+        padded = np.zeros((valid.shape[0], valid.shape[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = valid
+        edges = np.diff(padded, axis=1).ravel()
+        return np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+
+    valid = usable_mask == 255
+    return runs(valid), runs(valid.T)
+
+def placement_count_bound(run_lengths, panel_w_px, panel_h_px):
+    """
+    配置方法によらない配置数の上限（mask_run_lengths の結果から）
+    Upper bound on the panels of any placement, from mask_run_lengths
+
+    各パネルは Ph 行にわたり、各行では 1 つの連続区間の中の Pw 画素を占めるため、
+    行 y を通るパネルは高々 sum(floor(連続長 / Pw)) 枚です。全行で合計すると
+    配置数 × Ph 以下になります（列方向も同様）。面積による上限より厳しく、
+    寸法ごとに連続区間の数だけの計算で求まります。
+
+    Every panel spans Ph rows and covers Pw pixels of one run in each of them,
+    so the panels crossing a row are at most sum(floor(run / Pw)); summed over
+    all rows this is at least count x Ph (likewise for columns). Tighter than
+    the area bound, and costs one pass over the runs per panel size.
+    """
+    row_runs, col_runs = run_lengths
+    by_rows = int((row_runs // panel_w_px).sum()) // panel_h_px
+    by_cols = int((col_runs // panel_h_px).sum()) // panel_w_px
+    return min(by_rows, by_cols)
+
+def mask_bbox(mask, pad=0, threshold=127):
+    """
+    屋根画素（threshold より大きい画素、bool の場合は True）の外接矩形を pad 画素広げて画像内に収めたもの
+    Bounding box of the roof pixels (> threshold, or True for bool masks), grown by pad
+    and clipped to the image
+
+    uint8 のマスクは非ゼロ画素の外接矩形の中だけで二値化し、画像全体の一時配列を作りません
+    （それ以外の dtype は先に画像全体を二値化します）。
+    uint8 masks are thresholded only inside the bounding box of the non-zero
+    pixels, so no image-sized temporary is allocated (other dtypes are
+    thresholded as a whole first).
+
+    Returns:
+        tuple: (x, y, width, height)。空のマスクは (0, 0, 0, 0) / (0, 0, 0, 0) for an empty mask
+    """
+    if mask.dtype == bool:
+        x, y, w, h = cv2.boundingRect(mask.view(np.uint8))
+    elif mask.dtype != np.uint8:
+        # 二値化済み (0/1) のため、切り出しを再び threshold で二値化しない
+        x, y, w, h = cv2.boundingRect((mask > threshold).view(np.uint8))
+    else:
+        x, y, w, h = cv2.boundingRect(mask)
+        if w and h:
+            sx, sy, w, h = cv2.boundingRect((mask[y:y + h, x:x + w] > threshold).view(np.uint8))
+            x, y = x + sx, y + sy
+    if w == 0 or h == 0:
+        return 0, 0, 0, 0
+    img_h, img_w = mask.shape[:2]
+    x0, y0 = max(x - pad, 0), max(y - pad, 0)
+    return x0, y0, min(x + w + pad, img_w) - x0, min(y + h + pad, img_h) - y0
+
+class BasePlacementContext:
+    """
+    配置コンテキストの共通部分（ラスター版 PlacementContext / ポリゴン版 PolygonPlacementContext）
+    Interface shared by the raster and polygon placement contexts
+
+    サブクラスは frame_shape・origin・frames・_best を設定し、layout() を実装します。
+    Subclasses set frame_shape, origin, frames and _best and implement layout().
+    """
+
+    def full_frame(self, cropped):
+        """
+        切り出しのマスク（mask_bin / usable_mask）を元画像サイズに戻す（可視化用）
+        Paste a cropped mask back into an image-sized array (for visualization)
+        """
+        x, y = self.origin
+        h, w = cropped.shape[:2]
+        if (h, w) == tuple(self.frame_shape):
+            return cropped
+        full = np.zeros(self.frame_shape, dtype=cropped.dtype)
+        full[y:y + h, x:x + w] = cropped
+        return full
+
+    def layout(self, panel_w_px, panel_h_px, frame_index=0):
+        """指定座標系での配置 (count, panels) / Placement in one frame, see the subclasses"""
+        raise NotImplementedError
+
+    def best_layout(self, panel_w_px, panel_l_px):
+        """
+        全座標系 × 縦置き/横置きで最も枚数の多い配置（best_layout_in_frames と同じ規則）
+        Best placement over all frames and both orientations; same rules as best_layout_in_frames
+
+        Returns:
+            dict: count, panels, orientation, frame, count_v, count_h
+        """
+        key = (panel_w_px, panel_l_px)
+        if key not in self._best:
+            best = None
+            for i, frame in enumerate(self.frames):
+                count_v, panels_v = self.layout(panel_w_px, panel_l_px, i)
+                count_h, panels_h = self.layout(panel_l_px, panel_w_px, i)
+                if count_v >= count_h:
+                    candidate = (count_v, panels_v, "vertical")
+                else:
+                    candidate = (count_h, panels_h, "horizontal")
+                if best is None or candidate[0] > best["count"]:
+                    best = {"count": candidate[0], "panels": candidate[1], "orientation": candidate[2],
+                            "frame": frame, "count_v": count_v, "count_h": count_h}
+            self._best[key] = best
+        return self._best[key]
+
+class PlacementContext(BasePlacementContext):
+    """
+    屋根 1 つ分の配置計算の前処理を共有するコンテキスト
+    Per-roof placement context shared by every panel type and orientation
+
+    二値化・腐食・（align_to_roof の場合は回転）・積分画像を 1 回だけ計算し、
+    任意のパネルサイズ (w_px, h_px) の配置を積分画像から求めます。結果は
+    ピクセルサイズをキーにキャッシュされるため、ピクセル換算で同じ寸法になる
+    パネル種類は再計算されません。
+
+    Binarization, erosion, the optional roof-aligned warp and the summed-area
+    tables are computed once. Placement queries for any (w_px, h_px) are then
+    answered from the tables, and results are cached by pixel size, so panel
+    SKUs that round to the same pixel dimensions cost nothing extra.
+
+    前処理と配置は屋根の外接矩形をセットバック分広げた切り出しで行い、軸平行の
+    配置結果は元画像座標に平行移動して返します（セットバックの外側は腐食に影響しない
+    ため、軸平行の座標系の結果は画像全体で計算した場合と同じです）。回転した座標系
+    （align_to_roof）は切り出しの中心で回転するため、画像全体で計算した場合とは格子の
+    位相が変わり、パネル位置や枚数が一致するとは限りません。メモリと計算量は画像サイズ
+    ではなく屋根の大きさに比例します。
+
+    All work happens in the roof's bounding box padded by the setback, and
+    axis-aligned panels are translated back to image coordinates. Nothing
+    outside that padding affects the erosion, so axis-aligned results equal
+    the full-frame computation while memory and time scale with the roof.
+    Rotated frames (align_to_roof) are warped about the crop instead of the
+    whole image, which shifts their grid phase: their panels, and sometimes
+    their counts, differ from a full-frame run.
+
+    Args:
+        roof_mask (numpy.ndarray): 屋根マスク（127 より大きい画素が屋根） / Roof mask (> 127 is roof)
+        offset_px (int): セットバック（ピクセル） / Setback in pixels
+        layout_mode (str): 配置モード（LAYOUT_PLACERS のキー） / Layout mode (key of LAYOUT_PLACERS)
+        align_to_roof (bool): 屋根方向に回転した座標系も使うか / Also use the roof-aligned frame
+        crop (bool): 外接矩形で切り出すか（False は画像全体で計算、比較用） / Work in the bounding-box crop
+        setback_metric (str): セットバックの距離（"square" / "euclidean"） / Setback metric (SETBACK_METRICS)
+
+    Attributes:
+        mask_bin, usable_mask: 切り出した屋根・有効エリア (0/255)。元画像サイズは full_frame() で
+            / Cropped roof and usable masks (0/255); see full_frame() for image size
+        origin: 切り出しの左上の元画像座標 (x, y) / Image coordinates of the crop's top-left
+        frames: 配置座標系。回転した座標系の back_matrix は元画像座標へ戻す
+            / Placement frames; rotated frames' back_matrix maps to image coordinates
+
+    Example:
+        >>> ctx = PlacementContext(mask, offset_px=20)
+        >>> best = ctx.best_layout(21, 34)   # 縦・横の両方を試す
+        >>> best["count"], best["orientation"]
+    """
+
+    def __init__(self, roof_mask, offset_px, layout_mode="greedy", align_to_roof=False, crop=True,
+                 setback_metric="square"):
+        if layout_mode not in LAYOUT_PLACERS:
+            raise ValueError(f"Unknown layout mode: {layout_mode}. Valid modes: {list(LAYOUT_PLACERS)}")
+        self.layout_mode = layout_mode
+        self.setback_metric = setback_metric
+        self._placer = LAYOUT_PLACERS[layout_mode]
+
+        self.frame_shape = roof_mask.shape[:2]
+        x, y, w, h = mask_bbox(roof_mask, pad=max(offset_px, 0)) if crop else (0, 0, 0, 0)
+        if w == 0 or h == 0:
+            x, y, (h, w) = 0, 0, self.frame_shape  # 空のマスク・crop=False は画像全体
+        self.origin = (x, y)
+        self.mask_bin = (roof_mask[y:y + h, x:x + w] > 127).view(np.uint8) * 255
+        self.usable_mask = erode_with_margin(self.mask_bin, offset_px, setback_metric)
+        self.roof_pixels = int(np.count_nonzero(self.mask_bin))
+        self.effective_pixels = int(np.count_nonzero(self.usable_mask))
+
+        frames = layout_frames(self.mask_bin, self.usable_mask, offset_px, align_to_roof, setback_metric)
+        # 回転した座標系は切り出し → 元画像の平行移動を back_matrix に含める
+        self.frames = [frame if frame.back_matrix is None
+                       else frame._replace(back_matrix=frame.back_matrix + np.array([[0, 0, x], [0, 0, y]]))
+                       for frame in frames]
+        self._sats = [summed_area_table(frame.usable_mask) for frame in self.frames]
+        self._runs = None
+        self._layouts = {}
+        self._best = {}
+        self._lattice = {}
+
+    def layout(self, panel_w_px, panel_h_px, frame_index=0):
+        """
+        指定座標系での配置（ピクセルサイズ単位でキャッシュ）
+        Placement in one frame, cached by pixel size
+
+        Returns:
+            tuple: (配置数, パネル位置のリスト) / (count, [(x, y, width, height), ...])
+                - 軸平行の座標系（frame_index 0）は元画像座標、回転した座標系はその座標系の矩形
+                - Image coordinates for the axis-aligned frame 0, frame coordinates otherwise
+        """
+        if panel_w_px <= 0 or panel_h_px <= 0:
+            raise ValueError(f"Panel dimensions must be positive: {panel_w_px}x{panel_h_px}")
+        key = (frame_index, panel_w_px, panel_h_px)
+        if key not in self._layouts:
+            frame = self.frames[frame_index]
+            valid = valid_placement_map(frame.usable_mask, panel_w_px, panel_h_px, sat=self._sats[frame_index])
+            if frame.back_matrix is None:
+                ox, oy = self.origin
+                panels = [(px + ox, py + oy, pw, ph)
+                          for px, py, pw, ph in self._placer(valid, panel_w_px, panel_h_px, origin=self.origin)]
+            else:
+                panels = self._placer(valid, panel_w_px, panel_h_px)
+            self._layouts[key] = (len(panels), panels)
+        return self._layouts[key]
+
+    def count_bound(self, panel_w_px, panel_l_px):
+        """
+        best_layout の配置数の上限（全座標系・縦横、placement_count_bound）
+        Upper bound on best_layout(panel_w_px, panel_l_px)["count"], see placement_count_bound
+        """
+        if self._runs is None:
+            self._runs = [mask_run_lengths(frame.usable_mask) for frame in self.frames]
+        return max(max(placement_count_bound(runs, panel_w_px, panel_l_px),
+                       placement_count_bound(runs, panel_l_px, panel_w_px)) for runs in self._runs)
+
+    def lattice_layout(self, panel_w_px, panel_l_px):
+        """
+        格子配置の枚数だけを求める（パネル位置のリストは作らない。best_layout と同じ規則）
+        Counts-only lattice placement over all frames and both orientations
+
+        layout_mode が "grid" の場合は best_layout と同じ枚数になります。"greedy" では
+        格子配置による目安で、貪欲法の枚数より多い場合も少ない場合もあります。
+
+        Equals best_layout's count for layout_mode "grid"; for "greedy" it is an
+        estimate that can be above or below the greedy count.
+
+        Returns:
+            dict: count, orientation
+        """
+        key = (panel_w_px, panel_l_px)
+        if key not in self._lattice:
+            best = None
+            for frame, sat in zip(self.frames, self._sats):
+                counts = []
+                for w, h in ((panel_w_px, panel_l_px), (panel_l_px, panel_w_px)):
+                    valid = valid_placement_map(frame.usable_mask, w, h, sat=sat)
+                    counts.append(int(lattice_phase_counts(valid, w, h).max()) if valid.size else 0)
+                count_v, count_h = counts
+                candidate = (count_v, "vertical") if count_v >= count_h else (count_h, "horizontal")
+                if best is None or candidate[0] > best["count"]:
+                    best = {"count": candidate[0], "orientation": candidate[1]}
+            self._lattice[key] = best
+        return self._lattice[key]
+
+# 配置エンジン: raster（マスク上の積分画像, PlacementContext）/ polygon（輪郭ポリゴン, polygon_layout）
+# Placement engines: raster (summed-area tables on the mask) / polygon (roof contour polygon)
+PLACEMENT_ENGINES = ("raster", "polygon")
+
+def engine_pixels(value_m, gsd, engine="raster"):
+    """
+    配置エンジンに渡すピクセル寸法（raster は切り上げの整数、polygon は小数のまま）
+    Pixel size for a placement engine: ceiling integer for raster, exact float for polygon
+    """
+    if engine == "polygon":
+        if gsd <= 0:
+            raise ValueError(f"GSD must be positive, got: {gsd}")
+        return value_m / gsd
+    return pixels_from_meters(value_m, gsd)
+
+def placement_context(roof_mask, offset_px, layout_mode="greedy", align_to_roof=False, engine="raster",
+                      setback_metric="square"):
+    """
+    配置エンジンに応じた屋根 1 つ分の配置コンテキストを作る
+    Build the per-roof placement context for an engine (same interface for both)
+
+    polygon エンジン（shapely が必要）は使う場合にのみ読み込みます。
+    The polygon engine (requires shapely) is imported only when used.
+
+    Raises:
+        ValueError: 未知の配置エンジン・セットバックの距離 / Unknown engine or setback metric
+    """
+    if setback_metric not in SETBACK_METRICS:
+        raise ValueError(f"Unknown setback metric: {setback_metric}. Valid metrics: {list(SETBACK_METRICS)}")
+    if engine == "raster":
+        return PlacementContext(roof_mask, offset_px, layout_mode, align_to_roof, setback_metric=setback_metric)
+    if engine == "polygon":
+        from polygon_layout import PolygonPlacementContext
+        return PolygonPlacementContext(roof_mask, offset_px, layout_mode, align_to_roof, setback_metric=setback_metric)
+    raise ValueError(f"Unknown placement engine: {engine}. Valid engines: {list(PLACEMENT_ENGINES)}")
+
 def estimate_by_area(effective_area_sqm, panel_size_m):
     """
     面積ベースで設置可能枚数を計算する
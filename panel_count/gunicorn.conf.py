@@ -0,0 +1,56 @@
+"""
+太陽光パネル計算API の本番用 gunicorn 設定
+Production gunicorn settings for the panel service
+
+起動:
+    gunicorn -c gunicorn.conf.py api_integration:app
+
+設定（環境変数）:
+    PANEL_PORT              : 待ち受けポート (default 8001)
+    PANEL_WORKERS           : ワーカープロセス数 (default CPU コア数)
+    PANEL_THREADS           : ワーカーあたりのスレッド数 (default 1。2 以上で gthread)
+    PANEL_TIMEOUT_S         : 1 リクエストの処理時間上限 (default 120)
+    PANEL_GRACEFUL_TIMEOUT_S: SIGTERM 後に処理中のリクエストを待つ時間 (default 30)
+    PANEL_MAX_REQUESTS      : この件数を処理したワーカーを入れ替える (default 0 = 無効)
+    PANEL_MAX_REQUEST_MB    : リクエストボディの上限 (api_integration.py 側で 413 を返す)
+    PANEL_ACCESS_LOG        : アクセスログの出力先 (default "-" = stdout、空文字で無効)
+
+preload_app により api_integration / geometry / OpenCV は親プロセスで 1 回だけ
+読み込まれ、各ワーカーは fork で引き継ぐ（ワーカーごとの起動コストなし）。
+SIGTERM を受けると新規接続の受付を止め、処理中のリクエストが終わるまで
+（最大 PANEL_GRACEFUL_TIMEOUT_S 秒）待ってから終了する。
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PANEL_PORT', '8001')}"
+workers = int(os.environ.get('PANEL_WORKERS', '0')) or (os.cpu_count() or 1)
+threads = int(os.environ.get('PANEL_THREADS', '1'))
+worker_class = "gthread" if threads > 1 else "sync"
+
+preload_app = True
+timeout = int(os.environ.get('PANEL_TIMEOUT_S', '120'))
+graceful_timeout = int(os.environ.get('PANEL_GRACEFUL_TIMEOUT_S', '30'))
+keepalive = 5
+max_requests = int(os.environ.get('PANEL_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+# リクエストライン・ヘッダーの上限（ボディの上限は Flask の MAX_CONTENT_LENGTH）
+limit_request_line = 8190
+limit_request_fields = 100
+limit_request_field_size = 8190
+
+accesslog = os.environ.get('PANEL_ACCESS_LOG', '-') or None  # 空文字でアクセスログなし
+errorlog = "-"
+loglevel = os.environ.get('PANEL_LOG_LEVEL', 'info')
+
+# ワーカー自体がリクエスト単位で並列に動くため、批量処理のプロセスプールは
+# 既定で使わない（ワーカー数 × CPU 数のプロセスでコアを取り合わないように）
+os.environ.setdefault('PANEL_BATCH_WORKERS', '1')
+
+
+def on_starting(server):
+    server.log.info("panel service: workers=%d threads=%d preload=%s", workers, threads, preload_app)
+
+
+def worker_int(worker):
+    worker.log.info("worker %s interrupted", worker.pid)
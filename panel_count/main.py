@@ -1,6 +1,8 @@
 import logging
+import os
 import sys
 import traceback
+from batch import expand_inputs, run_batch
 from cli import parse_args, setup_logging, save_results_to_csv
 from planner import process_roof
 
@@ -23,6 +25,29 @@ def main():
         "Standard_B": (1.50, 0.80)
     }
     
+    visualization_dir = None if args.no_visualization else args.output_dir
+    if visualization_dir:
+        os.makedirs(visualization_dir, exist_ok=True)
+
+    # バッチモード: 屋根ごとに並列計算し、完了した順に CSV へ追記する
+    if args.input:
+        process_options = {
+            "gsd": args.gsd,
+            "panel_options": panel_options,
+            "offset_m": args.offset,
+            "panel_spacing_m": args.spacing,
+            "use_fast_algorithm": args.fast,
+            "layout_mode": args.layout_mode,
+            "align_to_roof": args.align_to_roof,
+            "engine": args.engine,
+            "setback_metric": args.setback_metric,
+            "visualization_dir": visualization_dir
+        }
+        summary = run_batch(expand_inputs(args.input), args.output_csv, process_options,
+                            workers=args.workers, resume=args.resume,
+                            parquet_dir=args.output_parquet, run_id=args.run_id)
+        return 1 if summary["failed"] else 0
+
     # 各屋根タイプに対して計算を実行
     results = []
     for roof_type in args.roof_types:
@@ -32,12 +57,25 @@ def main():
             panel_options, 
             args.offset, 
             args.spacing, 
-            use_fast_algorithm=args.fast
+            use_fast_algorithm=args.fast,
+            layout_mode=args.layout_mode,
+            align_to_roof=args.align_to_roof,
+            engine=args.engine,
+            setback_metric=args.setback_metric,
+            visualization_dir=visualization_dir
         )
         results.append(result)
     
     # 結果をCSVに保存
     save_results_to_csv(results, args.output_csv)
+
+    # パネル矩形を含む結果を Parquet に保存
+    if args.output_parquet:
+        from parquet_results import ParquetResultWriter
+        with ParquetResultWriter(args.output_parquet, args.run_id) as writer:
+            for result in results:
+                writer.write(result)
+        logging.info(f"結果を Parquet に保存しました: {writer.directory} ({len(writer.files)} ファイル)")
     
     return 0
 
@@ -0,0 +1,268 @@
+"""
+パネル配置結果の Parquet（Arrow）出力
+Columnar Parquet / Arrow output for panel layout results
+
+このモジュールは以下の機能を提供します：
+- 屋根 × パネル種類ごとの 1 行（屋根の統計 + パネル矩形の int32 / int16 のリスト列、
+  回転した座標系の配置は元画像座標の四角形も）
+- run_id / date による Hive 形式のパーティション（<root>/run_id=.../date=.../part-*.parquet）
+- 一定の行数ごとに完結した Parquet ファイルを書き出すストリーミングのライター
+- JSON の解析なしでの読み出しと、パネル 1 枚 1 行への展開
+
+This module provides the following functionality:
+- One row per roof × panel type: roof statistics plus the panel rectangles
+  as int32 / int16 list columns (and image-space corners for rotated frames)
+- Hive-style partitioning by run_id and date
+  (<root>/run_id=.../date=.../part-*.parquet)
+- A streaming writer that emits a complete Parquet file every N rows
+- Reading back without any JSON parsing, and exploding to one row per panel
+
+pyarrow が必要です（CLI の --output-parquet、API の PANEL_PARQUET_DIR を使う場合のみ読み込まれます）。
+Requires pyarrow; it is only imported when Parquet output is requested.
+
+Author: Panel Count Module Team
+"""
+
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# 1 行 = 屋根 × パネル種類。パネル矩形は x, y（int32）, w, h（int16）のリスト列。
+# 矩形は配置座標系の値で、rotation_deg が 0 のときは元画像座標。回転した座標系（align_to_roof）の
+# 配置は元画像座標の四角形を corners（パネルごとに x0, y0, ..., x3, y3）に持ち、それ以外は null
+# One row per roof × panel type. Rectangles are in the placement frame, which
+# is the image for rotation_deg 0; rotated layouts also store image-space
+# corners (null otherwise)
+LAYOUT_SCHEMA = pa.schema([
+    ("roof", pa.string()),
+    ("panel_name", pa.string()),
+    ("best", pa.bool_()),
+    ("count_sim", pa.int32()),
+    ("count_area", pa.int32()),
+    ("orientation", pa.string()),
+    ("rotation_deg", pa.float32()),
+    ("roof_area", pa.float64()),
+    ("effective_area", pa.float64()),
+    ("gsd", pa.float64()),
+    ("offset_m", pa.float64()),
+    ("panel_spacing_m", pa.float64()),
+    ("layout_mode", pa.string()),
+    ("engine", pa.string()),
+    ("setback_metric", pa.string()),
+    ("x", pa.list_(pa.int32())),
+    ("y", pa.list_(pa.int32())),
+    ("w", pa.list_(pa.int16())),
+    ("h", pa.list_(pa.int16())),
+    ("corners", pa.list_(pa.list_(pa.float32(), 8))),
+])
+
+RECT_COLUMNS = ("x", "y", "w", "h")
+
+# 四角形の頂点数 × 2（x, y） / Values per panel in the corners column
+CORNER_VALUES = 8
+
+# パーティションの列（ディレクトリ名、ファイルには含まない） / Partition columns (directory names only)
+PARTITIONING = ds.partitioning(pa.schema([("run_id", pa.string()), ("date", pa.string())]), flavor="hive")
+
+# この行数ごとに 1 ファイルを書き出す / Rows per written file
+FLUSH_ROWS = 10000
+
+def new_run_id():
+    """時刻 + 乱数の run_id（例: 20250702T093000-1a2b3c） / Timestamp plus random suffix"""
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+def result_rows(result):
+    """
+    1 屋根分の結果（planner.process_roof / calculate_single_roof）を列ごとの値に変換する
+    Convert one roof result (from planner.process_roof or calculate_single_roof) into rows
+
+    失敗した屋根は行なし。polygon エンジンの小数の座標は整数に丸めます。回転した座標系
+    （align_to_roof）の矩形は結果の "panels" と同じく配置座標系のままで、元画像座標の四角形は
+    結果の "panel_polygons" から corners に入れます。
+
+    Failed roofs yield no rows. Fractional polygon-engine coordinates are
+    rounded to whole pixels. Rectangles of a rotated frame stay in the
+    placement frame, as in the result's "panels"; their image-space corners
+    come from the result's "panel_polygons".
+
+    Returns:
+        list: LAYOUT_SCHEMA の列名をキーとする dict のリスト（矩形は numpy 配列）
+            / Dicts keyed by LAYOUT_SCHEMA columns, rectangles as numpy arrays
+    """
+    if not result.get("success", False):
+        return []
+    roof = result.get("roof_type", result.get("roof_id"))
+    rows = []
+    for panel_name, panel_data in result["panels"].items():
+        rects = np.rint(np.asarray(panel_data["panels"], dtype=np.float64).reshape(-1, 4))
+        rotated = float(panel_data.get("rotation_deg", 0.0)) != 0.0 and "panel_polygons" in panel_data
+        corners = (np.asarray(panel_data["panel_polygons"], dtype=np.float32).reshape(-1, CORNER_VALUES)
+                   if rotated else None)
+        rows.append({
+            "roof": str(roof),
+            "panel_name": panel_name,
+            "best": panel_name == result.get("best_panel"),
+            "count_sim": int(panel_data["count_sim"]),
+            "count_area": int(panel_data["count_area"]),
+            "orientation": panel_data["orientation"],
+            "rotation_deg": float(panel_data.get("rotation_deg", 0.0)),
+            "roof_area": float(result["roof_area"]),
+            "effective_area": float(result["effective_area"]),
+            "gsd": float(result["gsd"]),
+            "offset_m": float(result.get("offset_m", result.get("offset"))),
+            "panel_spacing_m": float(result.get("panel_spacing_m", result.get("panel_spacing"))),
+            "layout_mode": result.get("layout_mode"),
+            "engine": result.get("engine"),
+            "setback_metric": result.get("setback_metric"),
+            "x": rects[:, 0].astype(np.int32),
+            "y": rects[:, 1].astype(np.int32),
+            "w": rects[:, 2].astype(np.int32),
+            "h": rects[:, 3].astype(np.int32),
+            "corners": corners,
+        })
+    return rows
+
+def rows_to_table(rows):
+    """result_rows の行を LAYOUT_SCHEMA の Arrow テーブルにする / Build an Arrow table from result_rows rows"""
+    columns = {}
+    for field in LAYOUT_SCHEMA:
+        if field.name in RECT_COLUMNS:
+            lengths = np.array([len(row[field.name]) for row in rows], dtype=np.int32)
+            offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int32)]).astype(np.int32)
+            values = np.concatenate([row[field.name] for row in rows]) if rows else np.array([], np.int32)
+            # int16 の範囲外の値は pa.array が例外にする（黙って切り捨てない）
+            columns[field.name] = pa.ListArray.from_arrays(pa.array(offsets),
+                                                           pa.array(values, type=field.type.value_type))
+        elif field.name == "corners":
+            columns[field.name] = corners_array([row["corners"] for row in rows])
+        else:
+            columns[field.name] = pa.array([row[field.name] for row in rows], type=field.type)
+    return pa.Table.from_pydict(columns, schema=LAYOUT_SCHEMA)
+
+def corners_array(corners):
+    """
+    パネルごとの四角形（(N, 8) 配列または None）の list<fixed_size_list<float32, 8>> 列
+    Build the corners column from per-row (N, 8) arrays; None becomes a null row
+    """
+    present = [c for c in corners if c is not None]
+    lengths = np.array([0 if c is None else len(c) for c in corners], dtype=np.int32)
+    offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int32)]).astype(np.int32)
+    values = np.concatenate(present).reshape(-1) if present else np.array([], np.float32)
+    panels = pa.FixedSizeListArray.from_arrays(pa.array(values, type=pa.float32()), CORNER_VALUES)
+    mask = pa.array([c is None for c in corners], type=pa.bool_())
+    return pa.ListArray.from_arrays(pa.array(offsets), panels, mask=mask)
+
+class ParquetResultWriter:
+    """
+    屋根ごとの結果を run_id / date のパーティションに書き出すライター（CsvResultWriter と同じインターフェース）
+    Streams per-roof results into the run_id / date partition; same interface as batch.CsvResultWriter
+
+    flush_rows 行ごとに完結した Parquet ファイル（part-<token>-<n>.parquet）を書き出すため、
+    中断しても書き出し済みのファイルはそのまま読めます。ファイル名にはライターごとのトークンを
+    含むため、同じ run_id に複数のライター（再開・複数プロセス）が書き込めます。
+
+    A complete Parquet file (part-<token>-<n>.parquet) is written every
+    flush_rows rows, so an interrupted run leaves readable files. File names
+    carry a per-writer token, so several writers (resumed runs, separate
+    processes) can share one run_id.
+
+    Args:
+        root (str): データセットのルートディレクトリ / Dataset root directory
+        run_id (str): 実行の ID（None なら new_run_id()） / Run identifier
+        date (str): 日付のパーティション（None なら UTC の今日, YYYY-MM-DD） / Date partition
+        flush_rows (int): ファイルあたりの行数 / Rows per file
+
+    Example:
+        >>> with ParquetResultWriter("layouts") as writer:
+        ...     writer.write(process_roof("rikuyane", 0.05, panel_options, 0.3))
+        >>> read_layouts("layouts", filters=[("run_id", "=", writer.run_id)])
+    """
+
+    def __init__(self, root, run_id=None, date=None, flush_rows=FLUSH_ROWS):
+        self.run_id = run_id or new_run_id()
+        self.date = date or f"{datetime.now(timezone.utc):%Y-%m-%d}"
+        self.directory = os.path.join(root, f"run_id={self.run_id}", f"date={self.date}")
+        self.flush_rows = flush_rows
+        self.files = []
+        self._token = uuid.uuid4().hex[:8]
+        self._rows = []
+
+    def write(self, result):
+        """1 屋根分の結果を追加する（失敗した屋根は書かない） / Add one roof; failed roofs are skipped"""
+        self._rows.extend(result_rows(result))
+        if len(self._rows) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """バッファの行を 1 ファイルに書き出す / Write the buffered rows as one file"""
+        if not self._rows:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"part-{self._token}-{len(self.files):05d}.parquet")
+        pq.write_table(rows_to_table(self._rows), path, compression="zstd")
+        logging.debug(f"Parquet に {len(self._rows)} 行を書き出しました: {path}")
+        self.files.append(path)
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_layouts(root, filters=None, columns=None):
+    """
+    データセットを Arrow テーブルとして読み出す（run_id / date はパーティションの列）
+    Read the dataset as an Arrow table; run_id and date come from the partition directories
+
+    Args:
+        root (str): データセットのルートディレクトリ / Dataset root directory
+        filters: pyarrow の filters（例: [("run_id", "=", run_id)]） / pyarrow filters
+        columns (list): 読み出す列（None は全列） / Columns to read
+
+    Returns:
+        pyarrow.Table
+    """
+    return pq.read_table(root, partitioning=PARTITIONING, filters=filters, columns=columns)
+
+def explode_panels(table):
+    """
+    パネル 1 枚 1 行のテーブルに展開する（x, y, w, h はスカラー列になる）
+    Explode to one row per panel; x, y, w, h become scalar columns
+
+    corners はすべてのパネルについて元画像座標の四角形（x0, y0, ..., x3, y3）になります。
+    回転していない配置は矩形から求め、回転した配置は保存した四角形を使います。
+    corners holds every panel's image-space corners: derived from the
+    rectangle for unrotated layouts, the stored corners for rotated ones.
+    corners を読み出していない場合（columns の指定）は追加しません。
+    It is only added when the corners column was read.
+    """
+    table = table.combine_chunks()
+    parents = pc.list_parent_indices(table["x"])
+    flat = table.drop_columns([name for name in RECT_COLUMNS + ("corners",) if name in table.column_names])
+    flat = flat.take(parents)
+    rects = {}
+    for name in RECT_COLUMNS:
+        rects[name] = pc.list_flatten(table[name])
+        flat = flat.append_column(name, rects[name])
+    if "corners" not in table.column_names:
+        return flat
+
+    x, y, w, h = (rects[name].to_numpy(zero_copy_only=False).astype(np.float32) for name in RECT_COLUMNS)
+    corners = np.stack([x, y, x + w, y, x + w, y + h, x, y + h], axis=1)
+    stored = table["corners"].chunk(0) if table["corners"].num_chunks else pa.array([], table["corners"].type)
+    rotated = stored.is_valid().to_numpy(zero_copy_only=False)[parents.to_numpy()]
+    if rotated.any():
+        corners[rotated] = pc.list_flatten(stored).flatten().to_numpy().reshape(-1, CORNER_VALUES)
+    panels = pa.FixedSizeListArray.from_arrays(pa.array(corners.reshape(-1)), CORNER_VALUES)
+    return flat.append_column("corners", panels)
@@ -1,9 +1,11 @@
+import os
 import numpy as np
 import logging
 from roof_io import create_roof_mask, visualize_result
-from geometry import pixels_from_meters, erode_with_margin, calculate_panel_layout_fast, calculate_panel_layout_original, estimate_by_area
+from geometry import (erode_with_margin, calculate_panel_layout_original, estimate_by_area,
+                      layout_frames, best_layout_in_frames, panels_to_polygons, engine_pixels, placement_context)
 
-def process_roof(roof_shape_name, gsd, panel_options, offset_m, panel_spacing_m=0.02, dimensions=(400,500), use_fast_algorithm=True):
+def process_roof(roof_shape_name, gsd, panel_options, offset_m, panel_spacing_m=0.02, dimensions=(400,500), use_fast_algorithm=True, layout_mode="greedy", align_to_roof=False, engine="raster", setback_metric="square", visualization_dir="."):
     """
     屋根形状に対してパネル配置計算を行う
     
@@ -15,6 +17,11 @@ def process_roof(roof_shape_name, gsd, panel_options, offset_m, panel_spacing_m=
         panel_spacing_m: パネル間の間隔 (m)
         dimensions: マスク画像のサイズ (高さ, 幅)
         use_fast_algorithm: 高速アルゴリズムを使用するかどうか
+        layout_mode: 配置モード（"greedy" または "grid"、高速アルゴリズム時のみ有効）
+        align_to_roof: 屋根の主方向に回転した座標系でも配置を試すかどうか
+        engine: 配置エンジン（"raster" または "polygon"、高速アルゴリズム時のみ有効）
+        setback_metric: セットバックの距離（"square" または "euclidean"）
+        visualization_dir: 可視化画像（result_*.png）の保存先。None の場合は保存しない
         
     Returns:
         計算結果の辞書
@@ -32,12 +39,23 @@ def process_roof(roof_shape_name, gsd, panel_options, offset_m, panel_spacing_m=
         }
 
     # 有効エリアの計算（腐食処理）
-    offset_px = pixels_from_meters(offset_m, gsd)
-    usable_area_mask = erode_with_margin(roof_mask, offset_px)
+    if not use_fast_algorithm:
+        engine = "raster"  # 従来アルゴリズムはマスク上でのみ動作する
+    offset_px = engine_pixels(offset_m, gsd, engine)
+    if use_fast_algorithm:
+        # 腐食・積分画像（align_to_roof の場合は回転も）を 1 回だけ計算し、全パネル種類で共有する
+        # （polygon エンジンでは輪郭ポリゴンとセットバックのバッファ）
+        ctx = placement_context(roof_mask, offset_px, layout_mode, align_to_roof, engine, setback_metric)
+        effective_pixels = ctx.effective_pixels
+        best_layout = ctx.best_layout
+    else:
+        usable_area_mask = erode_with_margin(roof_mask, offset_px, setback_metric)
+        effective_pixels = np.sum(usable_area_mask) / 255
+        frames = layout_frames(roof_mask, usable_area_mask, offset_px, align_to_roof, setback_metric)
+        best_layout = lambda w_px, l_px: best_layout_in_frames(calculate_panel_layout_original, frames, w_px, l_px)
 
     # 有効面積(m^2)の計算
     pixel_area = gsd**2
-    effective_pixels = np.sum(usable_area_mask) / 255
     effective_area_sqm = effective_pixels * pixel_area
     
     roof_pixels = np.sum(roof_mask) / 255
@@ -53,6 +71,10 @@ def process_roof(roof_shape_name, gsd, panel_options, offset_m, panel_spacing_m=
         "gsd": gsd,
         "offset": offset_m,
         "panel_spacing": panel_spacing_m,
+        "layout_mode": layout_mode if use_fast_algorithm else "original",
+        "align_to_roof": align_to_roof,
+        "engine": engine,
+        "setback_metric": setback_metric,
         "panels": {},
         "success": True,
         "best_panel": None,
@@ -74,28 +96,19 @@ def process_roof(roof_shape_name, gsd, panel_options, offset_m, panel_spacing_m=
         panel_l_with_spacing = panel_length + panel_spacing_m
         panel_w_with_spacing = panel_width + panel_spacing_m
         
-        # ピクセルへの変換（切り上げ）
-        panel_l_px = pixels_from_meters(panel_l_with_spacing, gsd)
-        panel_w_px = pixels_from_meters(panel_w_with_spacing, gsd)
+        # ピクセルへの変換（raster は切り上げ、polygon は小数のまま）
+        panel_l_px = engine_pixels(panel_l_with_spacing, gsd, engine)
+        panel_w_px = engine_pixels(panel_w_with_spacing, gsd, engine)
 
-        # 配置アルゴリズムの選択
-        calc_func = calculate_panel_layout_fast if use_fast_algorithm else calculate_panel_layout_original
-        
-        # 縦置きと横置きの両方を試す
-        count_v, panels_v = calc_func(usable_area_mask.copy(), panel_w_px, panel_l_px)
-        count_h, panels_h = calc_func(usable_area_mask.copy(), panel_l_px, panel_w_px)
-        
-        # 最適な配置方向を選択
-        if count_v >= count_h:
-            count_placement = count_v
-            best_panels_for_panel_type = panels_v
-            orientation = "vertical"
-        else:
-            count_placement = count_h
-            best_panels_for_panel_type = panels_h
-            orientation = "horizontal"
+        # 縦置きと横置きの両方を試す（align_to_roof の場合は回転した座標系でも）
+        best = best_layout(panel_w_px, panel_l_px)
+        count_placement = best["count"]
+        best_panels_for_panel_type = best["panels"]
+        orientation = best["orientation"]
+        frame = best["frame"]
 
-        logging.info(f"    - 配置シミュレーション: {count_placement} 枚 (縦:{count_v}, 横:{count_h})")
+        logging.info(f"    - 配置シミュレーション: {count_placement} 枚 (縦:{best['count_v']}, 横:{best['count_h']}, "
+                     f"回転:{frame.rotation_deg:.1f}°)")
         
         # 結果を記録
         panel_result = {
@@ -104,8 +117,11 @@ def process_roof(roof_shape_name, gsd, panel_options, offset_m, panel_spacing_m=
             "count_area": count_area,
             "count_sim": count_placement,
             "orientation": orientation,
-            "panels": best_panels_for_panel_type
+            "panels": best_panels_for_panel_type,
+            "rotation_deg": frame.rotation_deg
         }
+        if align_to_roof:
+            panel_result["panel_polygons"] = panels_to_polygons(best_panels_for_panel_type, frame.back_matrix)
         
         results["panels"][panel_name] = panel_result
         
@@ -115,15 +131,19 @@ def process_roof(roof_shape_name, gsd, panel_options, offset_m, panel_spacing_m=
             # ファイル名に安全な文字列を生成
             safe_roof_name = roof_shape_name.replace('/', '_').replace('\\', '_').replace(':', '_').replace('{', '').replace('}', '').replace("'", '').replace(' ', '_')
             safe_panel_name = panel_name.replace(' ', '_')
-            best_panel_for_vis = (best_panels_for_panel_type, f"{safe_roof_name}_{safe_panel_name}")
+            best_panel_for_vis = (panel_result.get("panel_polygons", best_panels_for_panel_type),
+                                  f"{safe_roof_name}_{safe_panel_name}")
             results["best_panel"] = panel_name
             results["max_count"] = count_placement
 
     # 最適なパネル配置の可視化
-    if best_panel_for_vis:
+    if best_panel_for_vis and visualization_dir is not None:
         panels, name = best_panel_for_vis
-        output_filename = f"result_{name}.png"
-        visualize_result(roof_mask, panels, filename=output_filename)
+        output_filename = os.path.join(visualization_dir, f"result_{name}.png")
+        if align_to_roof:
+            visualize_result(roof_mask, [], filename=output_filename, polygons=panels)
+        else:
+            visualize_result(roof_mask, panels, filename=output_filename)
         results["visualization_file"] = output_filename
 
     logging.info(f"--- {roof_shape_name} の計算終了 ---")
@@ -0,0 +1,451 @@
+"""
+屋根の輪郭ポリゴン上での幾何学的なパネル配置
+Geometric (polygon-based) panel placement, independent of the pixel resolution
+
+ラスター版（geometry.PlacementContext）は腐食・積分画像・配置の走査がすべて画素数に
+比例するため、GSD を細かくすると（0.05 → 0.01 m/px で 25 倍の画素）計算量が増えます。
+このモジュールでは屋根マスクから輪郭を 1 回だけ抽出・簡略化してポリゴンにし、
+セットバックはポリゴンのバッファ（負の offset）、パネルの可否は行ごとの区間計算と
+shapely による厳密な包含判定で求めます。配置以降の計算量は画素数ではなく
+パネル数とポリゴンの頂点数で決まります。
+
+The roof contour is extracted and simplified once, the setback is a negative
+polygon buffer, and panels are placed row by row from the exact x-intervals
+where a row fits inside the polygon, then checked with shapely containment
+tests. After the contour extraction the cost depends on the panel count and
+the polygon complexity, not on the number of pixels.
+
+座標系 / Coordinates:
+    元画像の画素の角を整数とする連続座標（画素 (i, j) は [j, j+1) × [i, i+1)）。ラスター版の
+    パネル矩形 (x, y, w, h) と同じ意味で、パネル位置・寸法は小数になり得ます。
+    Continuous image coordinates with pixel corners on integers, so a rectangle
+    (x, y, w, h) means the same as in the raster engine; values may be fractional.
+
+Author: Panel Count Module Team
+"""
+
+import logging
+from collections import namedtuple
+
+import cv2
+import numpy as np
+import shapely
+from shapely import affinity
+
+from geometry import (LAYOUT_MODES, MIN_ROTATION_DEG, SETBACK_METRICS, BasePlacementContext, estimate_roof_angle,
+                      mask_bbox)
+
+logger = logging.getLogger(__name__)
+
+# 輪郭の簡略化（cv2.approxPolyDP）の許容誤差（ピクセル）
+# Contour simplification tolerance in pixels (cv2.approxPolyDP epsilon)
+SIMPLIFY_PX = 1.0
+
+# 行の位相（縦方向のずらし）の候補の上限。頂点の y 座標から作る候補がこれを超える場合は等間隔
+# Upper bound on row phase candidates; evenly spaced phases are used beyond it
+MAX_ROW_PHASES = 32
+
+# 区間・包含判定の浮動小数点の許容誤差（ピクセル）
+# Floating-point tolerance for interval arithmetic and containment checks (pixels)
+_EPS = 1e-6
+
+# 配置を行う座標系: usable（ポリゴン）上で配置し、back_matrix で元画像座標へ戻す
+# Placement frame: panels are placed in `usable` and mapped back with back_matrix
+PolygonFrame = namedtuple("PolygonFrame", ["usable", "rotation_deg", "back_matrix"])
+
+
+def _ring_geometry(points):
+    """輪郭の点列（画素中心）のポリゴン。線状・点状に潰れた部分も残す"""
+    if len(points) < 3:
+        return shapely.MultiPoint(points).convex_hull
+    return shapely.make_valid(shapely.Polygon(points))
+
+
+def _restore_corners(points, mask):
+    """
+    8 近傍の輪郭追跡が斜めに飛ばした角の屋根画素を補う
+    Re-insert the roof pixel that 8-connected tracing skips at each diagonal step
+
+    入隅や穴の角では輪郭が斜めに 1 画素進むため、そのまま簡略化すると長い辺がわずかに
+    傾きます。斜めの各ステップに、飛ばした 2 画素のうち屋根側の画素を挿入して、
+    軸に平行な辺と直角の角を保ちます。
+    """
+    nxt = np.roll(points, -1, axis=0)
+    diagonal = (np.abs(nxt - points) == 1).all(axis=1)
+    if len(points) < 3 or not diagonal.any():
+        return points
+    i = np.flatnonzero(diagonal)
+    first = np.column_stack([nxt[i, 0], points[i, 1]])
+    second = np.column_stack([points[i, 0], nxt[i, 1]])
+    first_roof = mask[first[:, 1], first[:, 0]] > 0
+    second_roof = mask[second[:, 1], second[:, 0]] > 0
+    keep = first_roof | second_roof  # どちらも屋根でない（角だけで接する）場合はそのまま
+    skipped = np.where(first_roof[:, None], first, second)
+    return np.insert(points, i[keep] + 1, skipped[keep], axis=0)
+
+
+def roof_polygon(mask_bin, origin=(0, 0), simplify_px=SIMPLIFY_PX):
+    """
+    二値マスクの屋根画素を覆うポリゴン（穴を含む）を元画像座標で返す
+    Polygon covering the roof pixels of a binary mask, holes included, in image coordinates
+
+    cv2.findContours の輪郭は境界画素の中心を通るため、入隅の角を補って
+    （_restore_corners）簡略化した外周は 0.5 画素外側へ、穴は 0.5 画素内側へ mitre バッファ
+    して画素の辺に合わせます。軸に平行な辺・直角の角は厳密に、斜めの辺の段差は
+    simplify_px 程度の誤差で直線になります。
+
+    Contours run through boundary pixel centres: after restoring the skipped
+    inner corners and simplifying, shells are buffered outwards and holes
+    inwards by half a pixel (mitre joins) to reach the pixel edges. Axis-
+    aligned edges and right angles come out exact; staircases of slanted edges
+    become straight lines within about simplify_px.
+
+    Args:
+        mask_bin (numpy.ndarray): 二値マスク (0/255) / Binary mask (0/255)
+        origin (tuple): mask_bin の左上の元画像座標 (x, y) / Image coordinates of mask_bin[0, 0]
+        simplify_px (float): 簡略化の許容誤差（0 で簡略化しない） / Simplification tolerance (0 disables it)
+
+    Returns:
+        shapely.Polygon | shapely.MultiPolygon: 屋根ポリゴン（空のマスクは空のポリゴン）
+    """
+    contours, hierarchy = cv2.findContours(mask_bin, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_NONE)
+    if not contours:
+        return shapely.Polygon()
+
+    shift = np.array([origin[0] + 0.5, origin[1] + 0.5])
+
+    def ring(i):
+        points = _restore_corners(contours[i].reshape(-1, 2), mask_bin)
+        if simplify_px > 0 and len(points) > 3:
+            points = cv2.approxPolyDP(points.reshape(-1, 1, 2), simplify_px, True).reshape(-1, 2)
+        return points + shift
+
+    parts = []
+    hierarchy = hierarchy[0]
+    for i in range(len(contours)):
+        if hierarchy[i][3] != -1:
+            continue  # 穴は外周と一緒に処理する
+        shell = _ring_geometry(ring(i)).buffer(0.5, cap_style="square", join_style="mitre")
+        child = hierarchy[i][2]
+        holes = []
+        while child != -1:
+            hole = _ring_geometry(ring(child)).buffer(-0.5, join_style="mitre")
+            if not hole.is_empty:
+                holes.append(hole)
+            child = hierarchy[child][0]
+        if holes:
+            shell = shell.difference(shapely.union_all(holes))
+        parts.append(shell)
+    return shapely.union_all(parts)
+
+
+def _polygon_edges(geom):
+    """ポリゴンの全ての輪（外周・穴）の辺 (x1, y1, x2, y2) の (E, 4) 配列"""
+    edges = []
+    for ring in shapely.get_rings(shapely.get_parts(geom)):
+        coords = shapely.get_coordinates(ring)
+        if len(coords) >= 2:
+            edges.append(np.hstack([coords[:-1], coords[1:]]))
+    return np.vstack(edges) if edges else np.zeros((0, 4))
+
+
+def _subtract_intervals(sections, blocked):
+    """区間 sections から閉区間 blocked（始点でソート済み）を除いた区間（端点は共有してよい）"""
+    free = []
+    for a, b in sections:
+        start = a
+        for c, d in blocked:
+            if c >= b:
+                break
+            if d <= start:
+                continue
+            if c > start:
+                free.append((start, c))
+            start = max(start, d)
+        if b - start > _EPS:
+            free.append((start, b))
+    return [(a, b) for a, b in free if b - a > _EPS]
+
+
+def row_intervals(edges, tops, height):
+    """
+    上端 tops・高さ height の各行について、行の全高にわたってポリゴン内に収まる x 区間を求める
+    For every row [top, top + height], the x-intervals where the full row height lies inside the polygon
+
+    縦の線分 {x} × [top, top+height] がポリゴン内にあるのは、行の中央の断面で x が内側にあり、
+    かつ行の内部（上下端を除く）を通る辺のどれにも x 方向で重ならない場合に限られます。
+    そのため全行の断面と辺の x 範囲を (行数 × 辺数) の配列で一括計算し、区間の差を取ります。
+
+    A vertical segment at x stays inside the polygon exactly when x is inside
+    the section at mid-height and no edge crossing the open row spans x, so
+    the sections and the edges' x-extents are computed for all rows at once
+    as (rows × edges) arrays and then subtracted per row.
+
+    Args:
+        edges (numpy.ndarray): _polygon_edges の結果 / Polygon edges (E, 4)
+        tops (numpy.ndarray): 各行の上端 / Row top coordinates (N,)
+        height (float): 行の高さ（パネル高さ） / Row height (panel height)
+
+    Returns:
+        list: 行ごとの [(x_start, x_end), ...] / Per-row lists of free x-intervals
+    """
+    tops = np.asarray(tops, dtype=np.float64)
+    if len(edges) == 0 or len(tops) == 0:
+        return [[] for _ in tops]
+
+    x1, y1, x2, y2 = edges.T
+    ylo, yhi = np.minimum(y1, y2), np.maximum(y1, y2)
+    dy = y2 - y1
+    horizontal = dy == 0
+    slope = np.divide(x2 - x1, dy, out=np.zeros_like(dy), where=~horizontal)
+
+    lo = tops[:, None]
+    hi = lo + height
+    mid = lo + height / 2.0
+
+    # 行の内部を通る辺の x 方向の範囲（行の上下端に載る水平な辺は含めない）
+    inside = (ylo < hi) & (yhi > lo)
+    xa = np.where(horizontal, x1, x1 + (np.maximum(ylo, lo) - y1) * slope)
+    xb = np.where(horizontal, x2, x1 + (np.minimum(yhi, hi) - y1) * slope)
+    blocked_lo, blocked_hi = np.minimum(xa, xb), np.maximum(xa, xb)
+
+    # 行の中央の断面（偶奇規則。半開区間で頂点の二重計上を避ける）
+    crossing = (ylo <= mid) & (mid < yhi)
+    x_mid = x1 + (mid - y1) * slope
+
+    intervals = []
+    for r in range(len(tops)):
+        xs = np.sort(x_mid[r][crossing[r]])
+        sections = xs[:len(xs) // 2 * 2].reshape(-1, 2)
+        hit = inside[r]
+        order = np.argsort(blocked_lo[r][hit], kind="stable")
+        blocked = np.column_stack([blocked_lo[r][hit][order], blocked_hi[r][hit][order]])
+        intervals.append(_subtract_intervals(sections.tolist(), blocked.tolist()))
+    return intervals
+
+
+def _fit(a, b, w):
+    """区間 [a, b] に左詰めで置けるパネル数"""
+    return int(np.floor((b - a) / w + _EPS))
+
+
+def _row_phases(geom, height):
+    """行の位相の候補: 頂点の y 座標に行の上端（= 下端）を合わせるずらし量と 0"""
+    ymin = geom.bounds[1]
+    ys = shapely.get_coordinates(geom)[:, 1]
+    phases = np.unique(np.round(np.concatenate([[0.0], (ys - ymin) % height]), 6))
+    phases = phases[phases < height - _EPS]
+    if len(phases) > MAX_ROW_PHASES:
+        phases = np.arange(MAX_ROW_PHASES) * (height / MAX_ROW_PHASES)
+    return phases
+
+
+def _greedy_rows(rows, w, h, x_min):
+    """各行の空き区間に左詰めで配置する"""
+    panels = []
+    for top, free in rows:
+        for a, b in free:
+            panels.extend((a + i * w, top, w, h) for i in range(_fit(a, b, w)))
+    return panels
+
+
+def _grid_rows(rows, w, h, x_min):
+    """
+    全行で共通の列位置 x_min + x0 + k*w に配置する（x0 は枚数が最大になるもの）
+    枚数は x0 が区間の始点に一致するときに最大になり得るため、候補は始点の位相だけで十分
+    """
+    starts = np.array([a for _, free in rows for a, _ in free])
+    ends = np.array([b for _, free in rows for _, b in free])
+    if len(starts) == 0:
+        return []
+    candidates = np.unique(np.round((starts - x_min) % w, 6))
+    candidates = candidates[candidates < w - _EPS]
+    if len(candidates) == 0:
+        candidates = np.zeros(1)
+    lattice = x_min + candidates[:, None]
+    k_min = np.ceil((starts - lattice) / w - _EPS)
+    k_max = np.floor((ends - lattice) / w - 1 + _EPS)
+    counts = np.maximum(k_max - k_min + 1, 0).sum(axis=1)
+    x0 = x_min + candidates[int(np.argmax(counts))]  # 同数の場合は最小の x0
+
+    panels = []
+    for top, free in rows:
+        for a, b in free:
+            k0 = int(np.ceil((a - x0) / w - _EPS))
+            k1 = int(np.floor((b - x0) / w - 1 + _EPS))
+            panels.extend((x0 + k * w, top, w, h) for k in range(k0, k1 + 1))
+    return panels
+
+
+# 配置モード名 → 行の空き区間からの配置関数（引数 rows, w, h, x_min）
+# Layout mode name → placer over per-row free intervals (args rows, w, h, x_min)
+POLYGON_PLACERS = {
+    "greedy": _greedy_rows,
+    "grid": _grid_rows,
+}
+
+
+def place_in_polygon(usable, panel_w, panel_h, layout_mode="greedy", prepared=False):
+    """
+    ポリゴン内にパネルを行ごとに配置する
+    Place panels row by row inside a polygon
+
+    行はパネル高さで隙間なく積み、行の位相（縦方向のずらし量）は頂点の y 座標に行の端を
+    合わせる候補から枚数が最大のものを選びます（同数なら小さいずらし量）。各行では
+    row_intervals の空き区間に、greedy は左詰めで、grid は全行共通の列位置で配置します。
+    最後に各パネルがポリゴンに含まれることを shapely で判定します。
+
+    Rows are stacked at the panel height; the row phase is chosen among
+    offsets that put a row edge on a vertex y-coordinate, keeping the one with
+    the most panels (smallest offset on ties). Each row is filled from its
+    free intervals: "greedy" packs from the left, "grid" uses one column
+    lattice for all rows. Every panel is finally checked for containment with
+    shapely.
+
+    Args:
+        usable (shapely.Polygon | shapely.MultiPolygon): 有効エリア / Usable area
+        panel_w (float): パネル幅（ピクセル、小数可） / Panel width in pixels (may be fractional)
+        panel_h (float): パネル高さ（ピクセル、小数可） / Panel height in pixels
+        layout_mode (str): "greedy" または "grid" / "greedy" or "grid"
+        prepared (bool): usable が shapely.prepare 済みか / Whether usable is already prepared
+
+    Returns:
+        list: パネル位置のリスト [(x, y, width, height), ...]（行優先） / Panel rectangles, row-major
+    """
+    if usable.is_empty:
+        return []
+    x_min, y_min, _, y_max = usable.bounds
+    if y_max - y_min < panel_h - _EPS:
+        return []
+
+    edges = _polygon_edges(usable)
+    phases = _row_phases(usable, panel_h)
+    tops, owner = [], []
+    for p, phase in enumerate(phases):
+        n_rows = int(np.floor((y_max - y_min - phase) / panel_h + _EPS))
+        tops.extend(y_min + phase + np.arange(n_rows) * panel_h)
+        owner.extend([p] * n_rows)
+    intervals = row_intervals(edges, np.array(tops), panel_h)
+
+    place = POLYGON_PLACERS[layout_mode]
+    best = []
+    for p in range(len(phases)):
+        rows = [(top, free) for top, free, o in zip(tops, intervals, owner) if o == p]
+        panels = place(rows, panel_w, panel_h, x_min)
+        if len(panels) > len(best):
+            best = panels
+    if not best:
+        return best
+
+    # 厳密な包含判定（境界上の辺は許容するため、わずかに縮めた矩形で判定する）
+    if not prepared:
+        shapely.prepare(usable)
+    rects = np.asarray(best, dtype=np.float64)
+    boxes = shapely.box(rects[:, 0] + _EPS, rects[:, 1] + _EPS,
+                        rects[:, 0] + rects[:, 2] - _EPS, rects[:, 1] + rects[:, 3] - _EPS)
+    inside = shapely.contains(usable, boxes)
+    if not inside.all():
+        logger.debug("包含判定で除外したパネル: %d 枚", int((~inside).sum()))
+        best = [panel for panel, ok in zip(best, inside) if ok]
+    return [tuple(float(v) for v in panel) for panel in best]
+
+
+class PolygonPlacementContext(BasePlacementContext):
+    """
+    屋根 1 つ分の配置計算をポリゴンで行うコンテキスト（PlacementContext と同じインターフェース）
+    Polygon-based per-roof placement context with the PlacementContext interface
+
+    輪郭の抽出・簡略化・セットバックのバッファ（align_to_roof の場合は回転も）を 1 回だけ
+    行い、パネルサイズごとの配置を place_in_polygon で求めてキャッシュします。パネル寸法と
+    セットバックは小数のピクセル値（メートル / GSD）をそのまま使えます。best_layout と
+    full_frame は BasePlacementContext のものを使います（count_bound / lattice_layout は
+    ラスター版のみ）。
+
+    The contour, its simplification and the setback buffer (and the roof-
+    aligned rotation) are computed once; each panel size is placed with
+    place_in_polygon and cached. Panel sizes and the setback may be fractional
+    pixel values (metres / GSD). best_layout and full_frame are inherited from
+    BasePlacementContext; count_bound / lattice_layout are raster-only.
+
+    セットバックは mitre 結合の負のバッファで、軸に平行な辺・入隅では正方形カーネルの腐食
+    （erode_with_margin）と同じ、斜めの辺では辺からの垂直距離になります。setback_metric が
+    "euclidean" の場合は round 結合（入隅からも円弧で離す、ユークリッド距離の腐食に相当）です。
+    ラスター版と異なり画像の端に接する屋根にもセットバックを適用します。
+
+    The setback is a negative mitre buffer: identical to the square-kernel
+    erosion along axis-aligned edges and inner corners, the perpendicular
+    distance along slanted edges. With setback_metric "euclidean" it uses a
+    round join, matching the Euclidean erosion. Unlike the raster engine it
+    also applies along the image border.
+
+    Args:
+        roof_mask (numpy.ndarray): 屋根マスク（127 より大きい画素が屋根） / Roof mask (> 127 is roof)
+        offset_px (float): セットバック（ピクセル、小数可） / Setback in pixels (may be fractional)
+        layout_mode (str): 配置モード（"greedy" / "grid"） / Layout mode
+        align_to_roof (bool): 屋根方向に回転した座標系も使うか / Also use the roof-aligned frame
+        setback_metric (str): セットバックの距離（"square" / "euclidean"） / Setback metric
+        simplify_px (float): 輪郭の簡略化の許容誤差 / Contour simplification tolerance
+
+    Attributes:
+        roof, usable: 屋根・有効エリアのポリゴン（元画像座標） / Roof and usable polygons (image coordinates)
+        mask_bin: 切り出した屋根マスク (0/255)。元画像サイズは full_frame() で / Cropped roof mask
+        roof_pixels: 屋根の画素数 / Roof pixel count
+        effective_pixels: 有効エリアの面積（ピクセル², 小数） / Usable area in square pixels (float)
+        frames: PolygonFrame のリスト / Placement frames
+    """
+
+    def __init__(self, roof_mask, offset_px, layout_mode="greedy", align_to_roof=False, setback_metric="square",
+                 simplify_px=SIMPLIFY_PX):
+        if layout_mode not in LAYOUT_MODES:
+            raise ValueError(f"Unknown layout mode: {layout_mode}. Valid modes: {list(LAYOUT_MODES)}")
+        if setback_metric not in SETBACK_METRICS:
+            raise ValueError(f"Unknown setback metric: {setback_metric}. Valid metrics: {list(SETBACK_METRICS)}")
+        self.layout_mode = layout_mode
+        self.setback_metric = setback_metric
+
+        self.frame_shape = roof_mask.shape[:2]
+        x, y, w, h = mask_bbox(roof_mask)
+        if w == 0 or h == 0:
+            x, y, (h, w) = 0, 0, self.frame_shape
+        self.origin = (x, y)
+        self.mask_bin = (roof_mask[y:y + h, x:x + w] > 127).view(np.uint8) * 255
+        self.roof_pixels = int(np.count_nonzero(self.mask_bin))
+
+        self.roof = roof_polygon(self.mask_bin, self.origin, simplify_px)
+        join_style = "mitre" if setback_metric == "square" else "round"
+        self.usable = self.roof.buffer(-offset_px, join_style=join_style) if offset_px > 0 else self.roof
+        self.effective_pixels = float(self.usable.area)
+
+        self.frames = [PolygonFrame(self.usable, 0.0, None)]
+        if align_to_roof and not self.usable.is_empty:
+            angle = estimate_roof_angle(self.mask_bin)
+            if abs(angle) >= MIN_ROTATION_DEG:
+                # rotate_mask と同じ向きに回転（回転・バッファは可換なので有効エリアを回転する）
+                cx, cy = self.roof.centroid.x, self.roof.centroid.y
+                matrix = cv2.getRotationMatrix2D((cx, cy), angle, 1.0)
+                rotated = affinity.affine_transform(self.usable, [matrix[0, 0], matrix[0, 1], matrix[1, 0],
+                                                                  matrix[1, 1], matrix[0, 2], matrix[1, 2]])
+                self.frames.append(PolygonFrame(rotated, angle, cv2.invertAffineTransform(matrix)))
+        for frame in self.frames:
+            shapely.prepare(frame.usable)
+        self._layouts = {}
+        self._best = {}
+
+    def layout(self, panel_w_px, panel_h_px, frame_index=0):
+        """
+        指定座標系での配置（パネルサイズ単位でキャッシュ）
+        Placement in one frame, cached by panel size
+
+        Returns:
+            tuple: (配置数, パネル位置のリスト) / (count, [(x, y, width, height), ...])
+                - 軸平行の座標系（frame_index 0）は元画像座標、回転した座標系はその座標系の矩形
+                - Image coordinates for the axis-aligned frame 0, frame coordinates otherwise
+        """
+        if panel_w_px <= 0 or panel_h_px <= 0:
+            raise ValueError(f"Panel dimensions must be positive: {panel_w_px}x{panel_h_px}")
+        key = (frame_index, panel_w_px, panel_h_px)
+        if key not in self._layouts:
+            panels = place_in_polygon(self.frames[frame_index].usable, panel_w_px, panel_h_px,
+                                      self.layout_mode, prepared=True)
+            self._layouts[key] = (len(panels), panels)
+        return self._layouts[key]
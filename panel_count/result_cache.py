@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+パネル計算結果のキャッシュ
+Content-addressed cache for panel calculation results
+
+キーはデコード済みマスク（二値化後）のハッシュと正規化したパラメータから作るため、
+同じ屋根を PNG / RLE など別の形式で送っても同じエントリに当たります。
+メモリ上は件数上限付きの LRU、各エントリには TTL があります。ディレクトリを
+指定すると JSON ファイルにも書き出し、再起動後も再利用できます。
+
+Keys are built from a hash of the binarized decoded mask plus normalized
+parameters, so the same roof sent as PNG or RLE maps to the same entry.
+Entries live in a size-bounded in-memory LRU with a TTL and can optionally be
+persisted as JSON files so they survive restarts.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 配置アルゴリズムや結果の形式を変えたら上げる（古いディスクキャッシュを無効化）
+CACHE_VERSION = 2
+
+# キャッシュする結果（屋根・パネル種類ごと）のキー。キャッシュキーに含めるため、結果にキーを
+# 追加・削除するとここを更新するだけで古いエントリには当たらなくなる。可視化形式ごとにしか出ない
+# キーも含める（tests/test_result_cache.py で全オプションの結果と照合）
+# Keys of a cached result; they are part of the cache key, so changing the
+# result shape (and this set, which a test keeps in sync) invalidates old entries
+RESULT_FIELDS = {
+    "roof": ("align_to_roof", "best_panel", "effective_area", "engine", "gsd", "layout_mode", "max_count",
+             "offset_m", "panel_spacing_m", "panels", "roof_area", "roof_id", "setback_metric", "success",
+             "total_capacity_kw", "visualization_b64", "visualization_geojson"),
+    "panel": ("count_area", "count_sim", "orientation", "panel_name", "panel_polygons", "panel_size", "panels",
+              "rotation_deg"),
+}
+SCHEMA_DIGEST = hashlib.sha256(json.dumps(RESULT_FIELDS, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def mask_digest(mask):
+    """
+    マスクの内容ハッシュ（127 より大きい画素を屋根とみなした二値マスク）
+    Content hash of a mask, binarized the same way as the placement code (> 127)
+    """
+    mask = np.asarray(mask)
+    h = hashlib.sha256()
+    h.update(repr(mask.shape[:2]).encode())
+    h.update(np.packbits(mask > 127).tobytes())
+    return h.hexdigest()
+
+
+def make_cache_key(kind, mask, params):
+    """
+    結果の種類・マスク・パラメータからキャッシュキーを作る
+    Build a cache key from the result kind, the mask and JSON-serializable params
+    """
+    normalized = json.dumps(params, sort_keys=True, separators=(',', ':'), default=float)
+    h = hashlib.sha256()
+    h.update(f"v{CACHE_VERSION}:{SCHEMA_DIGEST}:{kind}:{mask_digest(mask)}:".encode())
+    h.update(normalized.encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU + TTL の結果キャッシュ（スレッドセーフ）
+    Thread-safe LRU + TTL result cache with an optional on-disk store
+
+    値は JSON として保持するため、get のたびに独立したコピーが返ります。
+
+    Values are stored as JSON text, so every get returns an independent copy.
+
+    Args:
+        max_entries (int): メモリ上の最大件数（0 で無効） / Max in-memory entries (0 disables the cache)
+        ttl_s (float): 有効期間（秒） / Time to live in seconds
+        disk_dir (str): 永続化ディレクトリ（None ならメモリのみ） / Directory for persisted entries
+    """
+
+    def __init__(self, max_entries=256, ttl_s=3600.0, disk_dir=None):
+        self.max_entries = int(max_entries)
+        self.ttl_s = float(ttl_s)
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key, now):
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                expires_at, text = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"キャッシュファイルの読み込みエラー: {path}: {e}")
+            return None
+        if expires_at <= now:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        return expires_at, text
+
+    def _write_disk(self, key, expires_at, text):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 途中まで書かれたファイルを読まないよう、一時ファイルから置き換える
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump([expires_at, text], f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"キャッシュファイルの書き込みエラー: {path}: {e}")
+
+    def _remember(self, key, expires_at, text):
+        self._entries[key] = (expires_at, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """
+        キャッシュされた結果を返す（なければ None）
+        Return the cached value for key, or None
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None and self.disk_dir:
+                entry = self._read_disk(key, now)
+                if entry is not None:
+                    self.disk_hits += 1
+                    self._remember(key, *entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            text = entry[1]
+        return json.loads(text)
+
+    def put(self, key, value):
+        """
+        結果を保存する（JSON に変換できる値のみ）
+        Store a JSON-serializable value
+        """
+        if not self.enabled:
+            return
+        text = json.dumps(value, ensure_ascii=False)
+        expires_at = time.time() + self.ttl_s
+        with self._lock:
+            self._remember(key, expires_at, text)
+        if self.disk_dir:
+            self._write_disk(key, expires_at, text)
+
+    def clear(self):
+        """メモリ上のエントリと統計を消去（ディスクは残す） / Drop in-memory entries and counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.disk_hits = 0
+
+    def stats(self):
+        """/health 用の統計 / Counters for /health"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "disk_dir": self.disk_dir,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -7,10 +7,8 @@ Client for roof detection segmentation system
 import requests
 import json
 import base64
-import cv2
-import numpy as np
 import os
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Union
 
 class RoofDetectionClient:
     """屋根検出分割システムのクライアント"""
@@ -26,10 +24,11 @@ class RoofDetectionClient:
         self.panel_api_url = panel_api_url.rstrip('/')
 
     # 新API: 直接マスクを取得
-    def detect_roof_masks(self, image_path: str) -> Optional[Dict]:
+    def detect_roof_masks(self, image_path: str, mask_format: str = "png") -> Optional[Dict]:
         """
-        屋根検出システムから二値マスク(0/255のPNG Base64)を取得
-        Returns keys: {"masks": [data:image/png;base64,...], "centers": [{x,y}, ...]}
+        屋根検出システムから二値マスクを取得
+        - mask_format: "png"（0/255のPNG Base64）/ "rle" / "packbits" / "polygon"
+        Returns keys: {"format": ..., "masks": [...], "centers": [{x,y}, ...]}
         """
         try:
             with open(image_path, 'rb') as f:
@@ -37,6 +36,7 @@ class RoofDetectionClient:
                 response = requests.post(
                     f"{self.roof_api_url}/segment_masks",
                     files=files,
+                    params={'format': mask_format},
                     timeout=60
                 )
             if response.status_code == 200:
@@ -52,6 +52,29 @@ class RoofDetectionClient:
             print(f"❌ 屋根検出システム呼び出しエラー: {e}")
             return None
 
+    def iter_roof_masks(self, image_path: str, mask_format: str = "png") -> Iterator[Dict]:
+        """
+        /segment_masks?stream=true の NDJSON を 1 マスクずつ返す
+        Yields: {"type": "mask", "index": i, "format": ..., "mask": ..., "center": {x, y}}
+        """
+        with open(image_path, 'rb') as f:
+            files = {'image': (os.path.basename(image_path), f, 'image/jpeg')}
+            response = requests.post(
+                f"{self.roof_api_url}/segment_masks",
+                files=files,
+                params={'format': mask_format, 'stream': 'true'},
+                stream=True,
+                timeout=60
+            )
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                item = json.loads(line)
+                if item.get("type") == "mask":
+                    yield item
+
     # 旧互換API: 必要なら呼び出し
     def detect_roof_segments(self, image_path: str, x: int, y: int) -> Optional[Dict]:
         try:
@@ -78,13 +101,13 @@ class RoofDetectionClient:
             print(f"❌ 屋根検出システム呼び出しエラー: {e}")
             return None
 
-    def calculate_solar_panels_from_masks(self, roof_masks_b64: List[str],
+    def calculate_solar_panels_from_masks(self, roof_masks_b64: List[Union[str, Dict]],
                              map_scale: float = 0.05,
                              spacing_interval: float = 0.3,
                              panel_options: Optional[Dict[str, List[float]]] = None) -> Optional[Dict]:
         """
         太陽光パネル配置を計算（複数マスクに対応）
-        - roof_masks_b64: data:image/png;base64,... の配列
+        - roof_masks_b64: data:image/png;base64,... または /segment_masks のコンパクト形式の配列
         - panel_options: {name: [length_m, width_m]} を指定しなければサーバーデフォルト
         """
         try:
@@ -92,6 +115,8 @@ class RoofDetectionClient:
                 "roof_masks": roof_masks_b64,
                 "gsd": map_scale,
                 "offset_m": spacing_interval,
+                # 批量では可視化は既定で省略されるため、保存用に明示的に要求する
+                "include_visualization": True,
             }
             if panel_options:
                 request_data["panel_options"] = panel_options
@@ -117,12 +142,72 @@ class RoofDetectionClient:
             print(f"❌ パネル計算システム呼び出しエラー: {e}")
             return None
 
+    def iter_solar_panels_from_masks(self, roof_masks_b64: List[Union[str, Dict]],
+                                     map_scale: float = 0.05,
+                                     spacing_interval: float = 0.3,
+                                     panel_options: Optional[Dict[str, List[float]]] = None) -> Iterator[Dict]:
+        """
+        /calculate_panels のストリーミングモード（NDJSON）を 1 行ずつ返す
+        Yields {"type": "roof", "roof_id": i, ...} per roof, then {"type": "summary", ...}
+        """
+        request_data = {
+            "roof_masks": roof_masks_b64,
+            "gsd": map_scale,
+            "offset_m": spacing_interval,
+            "stream": True,
+            "include_visualization": True,
+        }
+        if panel_options:
+            request_data["panel_options"] = panel_options
+        with requests.post(
+            f"{self.panel_api_url}/calculate_panels",
+            json=request_data,
+            stream=True,
+            timeout=120
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def calculate_solar_panels_streaming(self, roof_masks_b64: List[Union[str, Dict]],
+                                         map_scale: float = 0.05,
+                                         spacing_interval: float = 0.3,
+                                         panel_options: Optional[Dict[str, List[float]]] = None) -> Optional[Dict]:
+        """
+        ストリーミングで受信しながら屋根ごとに進捗を表示し、
+        calculate_solar_panels_from_masks と同じ形の結果にまとめる
+        """
+        result = {"success": True, "total_roofs": len(roof_masks_b64), "roofs": []}
+        try:
+            for item in self.iter_solar_panels_from_masks(roof_masks_b64, map_scale,
+                                                          spacing_interval, panel_options):
+                kind = item.pop("type", None)
+                if kind == "roof":
+                    status = f"{item.get('max_count', 0)} 枚" if item.get("success") else item.get("error")
+                    print(f"  屋根 {item.get('roof_id', 0) + 1}/{len(roof_masks_b64)}: {status}")
+                    result["roofs"].append(item)
+                elif kind == "summary":
+                    result["summary"] = item.get("summary", {})
+                elif kind == "error":
+                    print(f"❌ パネル計算エラー: {item.get('message')}")
+                    return None
+        except Exception as e:
+            print(f"❌ パネル計算システム呼び出しエラー: {e}")
+            return None
+        print(f"✅ パネル計算成功: 合計 {result.get('summary', {}).get('total_panels', 0)} 枚")
+        return result
+
     def process_complete_workflow(self, image_path: str, x: int, y: int,
                                 center_latitude: float = 35.6895,
                                 map_scale: float = 0.05,
-                                spacing_interval: float = 0.3) -> Optional[Dict]:
+                                spacing_interval: float = 0.3,
+                                mask_format: str = "rle",
+                                stream: bool = False) -> Optional[Dict]:
         """
         完全なワークフローを実行（強化版 preroof を利用）
+        マスクはコンパクトな mask_format（既定 RLE）でそのままパネル計算へ渡す
+        stream=True の場合、パネル計算結果を屋根ごとに逐次受信する
         """
         print("=" * 60)
         print("完全ワークフロー実行開始")
@@ -130,7 +215,7 @@ class RoofDetectionClient:
 
         # Step 1: 屋根検出（マスク取得）
         print("\n🔍 Step 1: 屋根検出分割")
-        roof_result = self.detect_roof_masks(image_path)
+        roof_result = self.detect_roof_masks(image_path, mask_format=mask_format)
         if not roof_result:
             print("❌ 屋根検出に失敗しました")
             return None
@@ -138,9 +223,14 @@ class RoofDetectionClient:
 
         # Step 2: 太陽光パネル計算（バッチ対応）
         print("\n☀️ Step 2: 太陽光パネル配置計算")
-        panel_result = self.calculate_solar_panels_from_masks(
-            masks, map_scale, spacing_interval
-        )
+        if stream:
+            panel_result = self.calculate_solar_panels_streaming(
+                masks, map_scale, spacing_interval
+            )
+        else:
+            panel_result = self.calculate_solar_panels_from_masks(
+                masks, map_scale, spacing_interval
+            )
         if not panel_result:
             print("❌ パネル計算に失敗しました")
             return None
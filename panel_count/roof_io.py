@@ -1,3 +1,4 @@
+import base64
 import cv2
 import numpy as np
 import logging
@@ -39,7 +40,7 @@ def load_roof_mask_from_image(image_path, target_dimensions=None):
 def create_roof_mask(shape_name, dimensions=(400, 500)):
     """Generate binary mask for specified roof shape or load from image file"""
     # 检查是否是图片文件路径
-    if shape_name.endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff')):
+    if shape_name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff')):
         return load_roof_mask_from_image(shape_name, dimensions)
 
     # 原有的几何形状生成逻辑
@@ -68,10 +69,103 @@ def create_roof_mask(shape_name, dimensions=(400, 500)):
     mask_bin = (mask > 127).astype(np.uint8) * 255
     return mask_bin
 
-def visualize_result(original_mask, panels, filename="result_with_panels.png"):
-    """Draw panels on roof mask and save image"""
+# 可視化画像の出力形式: 形式名 → (拡張子, MIME タイプ, 品質パラメータ)
+VISUALIZATION_FORMATS = {
+    "png": (".png", "image/png", cv2.IMWRITE_PNG_COMPRESSION),
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+def render_result(original_mask, panels, polygons=None):
+    """Draw panels (axis-aligned rects, or rotated 4-point polygons) on roof mask and return the BGR image"""
     result_img = cv2.cvtColor(original_mask, cv2.COLOR_GRAY2BGR)
     for (x, y, w, h) in panels:
-        cv2.rectangle(result_img, (x, y), (x + w, y + h), (255, 0, 0), 2)
-    cv2.imwrite(filename, result_img)
+        # polygon エンジンの矩形は小数座標のため丸めて描画する
+        cv2.rectangle(result_img, (round(x), round(y)), (round(x + w), round(y + h)), (255, 0, 0), 2)
+    if polygons:
+        pts = [np.round(np.asarray(p)).astype(np.int32) for p in polygons]
+        cv2.polylines(result_img, pts, True, (255, 0, 0), 2)
+    return result_img
+
+def visualize_result(original_mask, panels, filename="result_with_panels.png", polygons=None):
+    """Draw panels (axis-aligned rects, or rotated 4-point polygons) on roof mask and save image"""
+    cv2.imwrite(filename, render_result(original_mask, panels, polygons))
     logging.info(f"Saved result image to '{filename}'")
+
+def encode_image(image, fmt="png", quality=None):
+    """
+    Encode an image in memory (no temporary file) and return the bytes
+
+    quality is 0-100 for jpeg/webp; for png it is mapped to the zlib
+    compression level (100 = fastest, 0 = smallest). None keeps OpenCV defaults.
+    """
+    if fmt not in VISUALIZATION_FORMATS:
+        raise ValueError(f"Unknown image format: {fmt}. Valid formats: {list(VISUALIZATION_FORMATS)}")
+    ext, _, quality_flag = VISUALIZATION_FORMATS[fmt]
+    params = []
+    if quality is not None:
+        quality = int(min(max(quality, 0), 100))
+        if fmt == "png":
+            quality = round((100 - quality) * 9 / 100)
+        params = [quality_flag, quality]
+    ok, buffer = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError(f"Failed to encode image as {fmt}")
+    return buffer.tobytes()
+
+def image_data_uri(image, fmt="png", quality=None):
+    """Encode an image in memory and return it as a data URI"""
+    mime = VISUALIZATION_FORMATS.get(fmt, (None, None))[1]
+    encoded = encode_image(image, fmt, quality)
+    return f"data:{mime};base64,{base64.b64encode(encoded).decode('utf-8')}"
+
+# クライアント側で描画するためのベクター出力: 形式名 → MIME タイプ
+VECTOR_FORMATS = {
+    "svg": "image/svg+xml",
+    "geojson": "application/geo+json",
+}
+
+def panel_outlines(panels, polygons=None):
+    """Corner points [[x, y] x 4] of every panel; polygons (align_to_roof) take precedence over rects"""
+    if polygons:
+        return [[[float(px), float(py)] for px, py in p] for p in polygons]
+    return [[[x, y], [x + w, y], [x + w, y + h], [x, y + h]] for x, y, w, h in panels]
+
+def roof_outlines(original_mask):
+    """Outer contours of the roof mask as point lists (pixel coordinates)"""
+    contours, _ = cv2.findContours((original_mask > 127).astype(np.uint8), cv2.RETR_EXTERNAL,
+                                   cv2.CHAIN_APPROX_SIMPLE)
+    return [c.reshape(-1, 2).tolist() for c in contours if len(c) >= 3]
+
+def panels_to_svg(original_mask, panels, polygons=None):
+    """Roof outline and panels as an SVG document in pixel coordinates"""
+    h, w = original_mask.shape[:2]
+
+    def points(pts):
+        return " ".join(f"{x:g},{y:g}" for x, y in pts)
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" viewBox="0 0 {w} {h}">',
+             '<g class="roof" fill="#ffffff" stroke="#808080" stroke-width="1">']
+    parts += [f'<polygon points="{points(c)}"/>' for c in roof_outlines(original_mask)]
+    parts.append('</g><g class="panels" fill="#00ff00" fill-opacity="0.3" stroke="#0000ff" stroke-width="2">')
+    parts += [f'<polygon points="{points(p)}"/>' for p in panel_outlines(panels, polygons)]
+    parts.append('</g></svg>')
+    return "".join(parts)
+
+def panels_to_geojson(original_mask, panels, polygons=None):
+    """
+    Roof outline and panels as a GeoJSON FeatureCollection
+
+    Coordinates are image pixels (x right, y down); there is no CRS. Each
+    feature carries "kind" ("roof" / "panel") and panels an "index".
+    """
+    features = []
+    for c in roof_outlines(original_mask):
+        features.append({"type": "Feature", "properties": {"kind": "roof"},
+                         "geometry": {"type": "Polygon", "coordinates": [c + [c[0]]]}})
+    for i, p in enumerate(panel_outlines(panels, polygons)):
+        features.append({"type": "Feature", "properties": {"kind": "panel", "index": i},
+                         "geometry": {"type": "Polygon", "coordinates": [p + [p[0]]]}})
+    h, w = original_mask.shape[:2]
+    return {"type": "FeatureCollection", "properties": {"coordinate_space": "pixel", "width": w, "height": h},
+            "features": features}
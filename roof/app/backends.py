@@ -0,0 +1,172 @@
+# backends.py
+"""
+推論バックエンドの選択
+CPU inference backends for the roof segmentation model (PyTorch / ONNX Runtime / OpenVINO)
+
+ROOF_MODEL_PATH の .pt（preroof の学習成果）を起動時に ONNX / OpenVINO 形式へ書き出し、
+ultralytics の YOLO 経由で読み込む。前処理・NMS・マスク生成は ultralytics の同じ
+実装を通るため、process_image の出力（マスク・重心）は PyTorch と一致する
+（tests/test_roof_backends.py で確認）。書き出し結果は重みの SHA-256 ごとに
+ROOF_EXPORT_DIR に保存し、再起動時や他のワーカーでは再利用する。
+ROOF_MODEL_PATH に .onnx や *_openvino_model/ を直接指定することもできる。
+
+設定（環境変数）:
+    ROOF_INFER_BACKEND : torch | onnx | openvino (default torch)
+    ROOF_INFER_THREADS : 推論 1 回あたりのスレッド数（torch の intra-op、ONNX Runtime の
+                         intra_op_num_threads、OpenVINO の INFERENCE_NUM_THREADS）。0 = 各ランタイムの既定
+    ROOF_OV_PRECISION  : OpenVINO の推論精度 f32 | bf16 | f16 (default f32)。bf16 は AMX/AVX512-BF16 の
+                         CPU で速いが、マスクが PyTorch と完全には一致しない
+    ROOF_ONNX_INT8     : 1 で ONNX を動的量子化（INT8 重み）して使う。精度は
+                         scripts/bench_roof_backends.py で確認すること
+    ROOF_EXPORT_DIR    : 書き出した ONNX / OpenVINO の保存先 (default ~/.cache/roof_export)
+"""
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx", "openvino")
+INFER_BACKEND = os.getenv("ROOF_INFER_BACKEND", "torch").lower()
+INFER_THREADS = int(os.getenv("ROOF_INFER_THREADS", "0"))
+OV_PRECISION = os.getenv("ROOF_OV_PRECISION", "f32").lower()
+ONNX_INT8 = os.getenv("ROOF_ONNX_INT8", "0") == "1"
+EXPORT_DIR = Path(os.getenv("ROOF_EXPORT_DIR", str(Path.home() / ".cache" / "roof_export")))
+
+# 書き出し時の入力サイズ（推論時の letterbox と同じ）
+EXPORT_IMGSZ = 640
+
+
+def backend_for(weights: Path, backend: str = INFER_BACKEND) -> str:
+    """重みの形式からバックエンドを決める（.onnx / *_openvino_model は形式を優先）"""
+    if weights.suffix == ".onnx":
+        return "onnx"
+    if weights.is_dir() and weights.name.endswith("_openvino_model"):
+        return "openvino"
+    if backend not in BACKENDS:
+        raise ValueError(f"ROOF_INFER_BACKEND must be one of {', '.join(BACKENDS)}, got: {backend}")
+    return backend
+
+
+def backend_tag(weights: Optional[Path], backend: str = INFER_BACKEND) -> str:
+    """推論キャッシュのキーに含めるバックエンド名（精度の違いで結果が変わるため）"""
+    if weights is None:
+        return "torch"
+    try:
+        backend = backend_for(weights, backend)
+    except ValueError:
+        return backend  # 設定誤りは読込時に ModelLoadError として報告する
+    if backend == "onnx" and ONNX_INT8:
+        return "onnx-int8"
+    if backend == "openvino" and OV_PRECISION != "f32":
+        return f"openvino-{OV_PRECISION}"
+    return backend
+
+
+def _export(weights: Path, backend: str, target: Path) -> None:
+    """weights を一時ディレクトリで書き出し、target へ原子的に移動する（並行するワーカー対策）"""
+    from ultralytics import YOLO
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    work = Path(tempfile.mkdtemp(dir=target.parent, prefix=".export-"))
+    try:
+        # ultralytics は .pt と同じ場所に書き出すため、コピーしてから書き出す
+        src = work / weights.name
+        shutil.copyfile(weights, src)
+        fmt = "onnx" if backend == "onnx" else "openvino"
+        kwargs = {"simplify": True} if fmt == "onnx" else {}
+        exported = Path(YOLO(str(src)).export(format=fmt, dynamic=True, imgsz=EXPORT_IMGSZ, verbose=False,
+                                              **kwargs))
+        if backend == "onnx" and ONNX_INT8:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantized = exported.with_suffix(".int8.onnx")
+            quantize_dynamic(str(exported), str(quantized), weight_type=QuantType.QUInt8)
+            exported = quantized
+        try:
+            os.replace(exported, target)
+        except OSError:
+            if not target.exists():
+                raise
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def resolve_weights(weights: Path, digest: str, backend: str = INFER_BACKEND) -> Path:
+    """
+    バックエンド用の重みのパスを返す（必要なら .pt から書き出す）
+    Args:
+        weights : ROOF_MODEL_PATH
+        digest  : weights の SHA-256（書き出し結果の保存先に使う）
+        backend : torch | onnx | openvino
+    """
+    backend = backend_for(weights, backend)
+    if backend == "torch" or weights.suffix != ".pt":
+        return weights
+    name = weights.stem + (".int8.onnx" if ONNX_INT8 else ".onnx") if backend == "onnx" \
+        else f"{weights.stem}_openvino_model"
+    target = EXPORT_DIR / digest[:16] / name
+    if not target.exists():
+        logger.info("exporting %s to %s", weights, target)
+        _export(weights, backend, target)
+    return target
+
+
+def _runtime_owner(yolo, attr: str):
+    """ultralytics の AutoBackend（版によっては内側の backend）から attr を持つオブジェクトを探す"""
+    autobackend = getattr(getattr(yolo, "predictor", None), "model", None)
+    for obj in (getattr(autobackend, "__dict__", {}).get("backend"), autobackend):
+        if obj is not None and attr in getattr(obj, "__dict__", {}):
+            return obj
+    return None
+
+
+def configure_runtime(yolo, weights: Path, threads: int = INFER_THREADS) -> None:
+    """
+    読み込んだモデルのランタイムをスレッド数・精度の設定で作り直す
+    （ultralytics の既定はセッション設定を受け付けないため、初回推論で生成された
+    セッション / コンパイル済みモデルを置き換える）
+    """
+    backend = backend_for(weights, "torch")
+    if backend == "torch":
+        if threads > 0:
+            import torch
+            torch.set_num_threads(threads)
+        return
+
+    import numpy as np
+    yolo.predict(np.zeros((32, 32, 3), dtype=np.uint8), verbose=False)  # predictor と AutoBackend を生成
+
+    if backend == "onnx":
+        import onnxruntime
+        owner = _runtime_owner(yolo, "session")
+        if owner is None:
+            logger.warning("ONNX Runtime session not found; using ultralytics defaults")
+            return
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        path = weights if weights.suffix == ".onnx" else next(weights.glob("*.onnx"))
+        owner.session = onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        return
+
+    import openvino as ov
+    owner = _runtime_owner(yolo, "ov_compiled_model")
+    if owner is None:
+        logger.warning("OpenVINO compiled model not found; using ultralytics defaults")
+        return
+    config = {"PERFORMANCE_HINT": "LATENCY",
+              "INFERENCE_PRECISION_HINT": {"f32": ov.Type.f32, "bf16": ov.Type.bf16, "f16": ov.Type.f16}[OV_PRECISION]}
+    if threads > 0:
+        config["INFERENCE_NUM_THREADS"] = threads
+    core = ov.Core()
+    xml = next(weights.glob("*.xml"))
+    compile_model = lambda model: core.compile_model(model, device_name="CPU", config=config)
+    owner.ov_compiled_model = compile_model(core.read_model(model=str(xml), weights=str(xml.with_suffix(".bin"))))
+    if "compile_model" in owner.__dict__:
+        owner.compile_model = compile_model
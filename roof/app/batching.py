@@ -0,0 +1,229 @@
+# batching.py
+"""
+推論リクエストのマイクロバッチング
+Dynamic micro-batching scheduler for roof segmentation inference
+
+各リクエストはキューに積まれ、最大 N 枚 または T ミリ秒のどちらか早い方で
+1 バッチにまとめて model.predict に渡される。結果は待機中の各コルーチンへ返す。
+
+設定（環境変数）:
+    ROOF_BATCH_MAX_SIZE   : 1 バッチの最大画像数 (default 8)
+    ROOF_BATCH_WAIT_MS    : 先頭リクエストからバッチを締め切るまでの待ち時間 (default 10ms)
+    ROOF_BATCH_QUEUE_DEPTH: 待機キューの上限。超過時は QueueFullError (default 64)
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_SIZE = int(os.getenv("ROOF_BATCH_MAX_SIZE", "8"))
+BATCH_WAIT_MS = float(os.getenv("ROOF_BATCH_WAIT_MS", "10"))
+BATCH_QUEUE_DEPTH = int(os.getenv("ROOF_BATCH_QUEUE_DEPTH", "64"))
+
+
+class QueueFullError(RuntimeError):
+    """待機キュー / 受け付け上限に達している（retry_after 秒後の再試行を推奨）"""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BatchStats:
+    """直近バッチのサイズとレイテンシを保持し、チューニング用の集計を返す"""
+
+    def __init__(self, window: int = 1000):
+        self._batches: Deque[Tuple[int, float]] = deque(maxlen=window)
+        self.total_batches = 0
+        self.total_images = 0
+
+    def record(self, size: int, latency_ms: float) -> None:
+        self._batches.append((size, latency_ms))
+        self.total_batches += 1
+        self.total_images += size
+
+    def summary(self) -> Dict[str, float]:
+        if not self._batches:
+            return {"total_batches": 0, "total_images": 0}
+        sizes = [s for s, _ in self._batches]
+        latencies = sorted(l for _, l in self._batches)
+
+        def pct(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "total_batches": self.total_batches,
+            "total_images": self.total_images,
+            "window": len(self._batches),
+            "avg_batch_size": sum(sizes) / len(sizes),
+            "latency_ms_p50": pct(0.50),
+            "latency_ms_p90": pct(0.90),
+            "latency_ms_p99": pct(0.99),
+            "latency_ms_max": latencies[-1],
+        }
+
+
+class InferenceBatcher:
+    """
+    リクエストを集約してバッチ推論を行うスケジューラ
+
+    Args:
+        infer_fn        : (List[bytes], conf) -> 画像ごとの結果 or Exception のリスト
+        max_batch_size  : 1 バッチの最大画像数
+        max_wait_ms     : バッチ締め切りまでの最大待ち時間
+        max_queue_depth : 待機キューの上限
+        executor        : 推論を実行するプールを返す関数（None の場合は asyncio 既定のプール）
+        max_concurrent_batches : 同時に実行するバッチ数（通常はワーカー数）
+        max_inflight    : キュー待ち + 推論中のリクエスト数上限（0 = キュー上限 + 同時実行分）
+    """
+
+    def __init__(self, infer_fn: Callable, max_batch_size: int = BATCH_MAX_SIZE,
+                 max_wait_ms: float = BATCH_WAIT_MS, max_queue_depth: int = BATCH_QUEUE_DEPTH,
+                 executor: Optional[Callable[[], Executor]] = None,
+                 max_concurrent_batches: int = 1, max_inflight: int = 0):
+        self.infer_fn = infer_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self.max_queue_depth = max(1, max_queue_depth)
+        self.executor = executor
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.max_inflight = max_inflight or (self.max_queue_depth + self.max_concurrent_batches * self.max_batch_size)
+        self.inflight = 0
+        self.stats = BatchStats()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        # 実行中のバッチ。asyncio はタスクを弱参照でしか保持しないため、完了まで参照を持つ
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_started(self) -> None:
+        # TestClient などはリクエストごとにイベントループが変わるため、
+        # 現在のループにキューとワーカーを張り直す
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._worker is not None and not self._worker.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue_depth)
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._tasks = set()
+        self._worker = loop.create_task(self._run())
+
+    def retry_after(self) -> int:
+        """現在のキュー長と直近のバッチレイテンシから再試行までの秒数を見積もる"""
+        p50_ms = self.stats.summary().get("latency_ms_p50", 1000.0)
+        pending_batches = math.ceil(self.queue_depth / self.max_batch_size) / self.max_concurrent_batches
+        return max(1, math.ceil((pending_batches + 1) * p50_ms / 1000.0))
+
+    async def submit(self, image_bytes: bytes, conf: float):
+        """画像 1 枚を投入し、バッチ推論の結果を待つ（アドミッション制御付き）"""
+        self._ensure_started()
+        if self.inflight >= self.max_inflight:
+            raise QueueFullError(f"inference pool is saturated ({self.inflight} in flight)",
+                                 retry_after=self.retry_after())
+        future = self._loop.create_future()
+        try:
+            self._queue.put_nowait((image_bytes, conf, future))
+        except asyncio.QueueFull:
+            raise QueueFullError(f"inference queue is full ({self.max_queue_depth})",
+                                 retry_after=self.retry_after())
+        self.inflight += 1
+        try:
+            result = await future
+        finally:
+            self.inflight -= 1
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def shutdown(self) -> None:
+        """バッチの締め切りを止め、実行中のバッチの完了を待つ。キューに残ったリクエストはエラーで返す"""
+        if self._worker is None or self._loop is not asyncio.get_running_loop():
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        while not self._queue.empty():
+            _fail(self._queue.get_nowait())
+
+    async def _collect(self, batch: List[tuple]) -> List[tuple]:
+        """先頭 1 件を待ち、その後 max_wait_ms 以内に届いた分を max_batch_size まで集める"""
+        batch.append(await self._queue.get())
+        deadline = self._loop.time() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            # 空きワーカーができるまで締め切らない（その間に次のバッチが溜まる）
+            await self._slots.acquire()
+            batch: List[tuple] = []
+            try:
+                await self._collect(batch)
+            except BaseException:
+                # 締め切り前に停止した場合、取り出し済みのリクエストを待たせたままにしない
+                self._slots.release()
+                for item in batch:
+                    _fail(item)
+                raise
+            task = self._loop.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[tuple]) -> None:
+        try:
+            # conf が異なるリクエストは別々に推論する
+            groups: Dict[float, List[tuple]] = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for conf, items in groups.items():
+                await self._run_group(conf, items)
+        finally:
+            self._slots.release()
+
+    async def _run_group(self, conf: float, items: List[tuple]) -> None:
+        images = [image_bytes for image_bytes, _, _ in items]
+        executor = self.executor() if self.executor is not None else None
+        start = time.perf_counter()
+        try:
+            # CPU バウンドな推論はイベントループ外のワーカーで実行
+            outputs = await self._loop.run_in_executor(executor, self.infer_fn, images, conf)
+        except Exception as e:
+            outputs = [e] * len(items)
+        latency_ms = (time.perf_counter() - start) * 1000.0
+        self.stats.record(len(items), latency_ms)
+        logger.info("inference batch: size=%d conf=%.2f latency=%.1fms queue=%d",
+                    len(items), conf, latency_ms, self.queue_depth)
+
+        for (_, _, future), output in zip(items, outputs):
+            if not future.done():
+                future.set_result(output)
+
+
+def _fail(item: tuple) -> None:
+    """キューから取り出したリクエストを停止エラーで返す"""
+    future = item[2]
+    if not future.done():
+        future.set_result(RuntimeError("inference batcher is shutting down"))
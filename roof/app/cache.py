@@ -0,0 +1,159 @@
+# cache.py
+"""
+推論結果のキャッシュ
+Content-addressed cache of roof segmentation results
+
+同じ航空写真タイルに対する /segment・/segment_masks の再送信（クリックごと・
+リトライ）で YOLO を再実行しないよう、画像バイト列・信頼度閾値・モデル重みの
+ハッシュをキーにマスク配列と重心を保持する。マスクはインスタンスごとの
+外接矩形の切り出しを np.packbits で 1/8 に圧縮して保存し、メモリ上限（バイト数）と件数上限を超えると LRU で追い出す。
+キーのハッシュはワーカーが実際に読み込んだモデルのもの（起動時に記録）。重みファイルを
+置き換えても再起動までは旧モデルの結果として扱い、再起動後は新しいハッシュで
+古いエントリには当たらず、invalidate_model で一括破棄される。
+
+設定（環境変数）:
+    ROOF_CACHE_MAX_MB      : 保持するマスクの合計サイズ上限 (default 256, 0 = 無効)
+    ROOF_CACHE_MAX_ENTRIES : 保持する画像数の上限 (default 256)
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.masks import RoofMask
+
+CACHE_MAX_MB = float(os.getenv("ROOF_CACHE_MAX_MB", "256"))
+CACHE_MAX_ENTRIES = int(os.getenv("ROOF_CACHE_MAX_ENTRIES", "256"))
+
+
+@dataclass
+class CachedSegmentation:
+    """
+    1 画像分の推論結果
+
+    Attributes:
+        packed      : np.packbits した各マスクの切り出し
+        boxes       : 各切り出しの (x, y, w, h)
+        frame_shape : 元画像の (H, W)
+        centers     : 各マスクの重心 (x, y)
+    """
+    packed: List[np.ndarray]
+    boxes: List[Tuple[int, int, int, int]]
+    frame_shape: Tuple[int, int]
+    centers: List[Tuple[Optional[int], Optional[int]]]
+
+    @classmethod
+    def from_roof_masks(cls, roof_masks: Sequence[RoofMask]) -> "CachedSegmentation":
+        if not roof_masks:
+            return cls(packed=[], boxes=[], frame_shape=(0, 0), centers=[])
+        return cls(packed=[np.packbits(m.mask.astype(bool, copy=False)) for m in roof_masks],
+                   boxes=[m.bbox for m in roof_masks],
+                   frame_shape=tuple(roof_masks[0].shape),
+                   centers=[m.center for m in roof_masks])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(int(p.nbytes) for p in self.packed)
+
+    def roof_masks(self, image_bgr: Optional[np.ndarray] = None) -> List[RoofMask]:
+        """RoofMask のリストに戻す（エンコード結果はリクエストごとに新しく持つ）"""
+        roof_masks = []
+        for packed, (x, y, w, h), center in zip(self.packed, self.boxes, self.centers):
+            crop = np.unpackbits(packed, count=w * h).view(bool).reshape(h, w)
+            roof_masks.append(RoofMask(mask=crop, center=center, image_bgr=image_bgr,
+                                       offset=(x, y), frame_shape=self.frame_shape))
+        return roof_masks
+
+
+def cache_key(image_bytes: bytes, conf: float, model_hash: str) -> str:
+    """画像バイト列・信頼度閾値・モデル重みハッシュからキーを作る"""
+    h = hashlib.sha256()
+    h.update(f"{model_hash}:{float(conf)!r}:".encode())
+    h.update(image_bytes)
+    return h.hexdigest()
+
+
+class InferenceCache:
+    """
+    メモリ上限付き LRU の推論キャッシュ（スレッドセーフ）
+
+    Args:
+        max_bytes   : 保持するパック済みマスクの合計バイト数上限（0 で無効）
+        max_entries : 保持する画像数の上限
+    """
+
+    def __init__(self, max_bytes: int = int(CACHE_MAX_MB * 2**20), max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_entries = max(0, int(max_entries))
+        self.model_hash: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, CachedSegmentation]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    def invalidate_model(self, model_hash: str) -> None:
+        """モデル重みが変わった場合は全エントリを破棄する"""
+        with self._lock:
+            if self.model_hash is not None and self.model_hash != model_hash:
+                self._entries.clear()
+                self._bytes = 0
+            self.model_hash = model_hash
+
+    def get(self, key: str) -> Optional[CachedSegmentation]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: CachedSegmentation) -> None:
+        # 1 件で上限を超える結果は保存しない
+        if not self.enabled or entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "model_hash": self.model_hash,
+            }
@@ -1,11 +1,138 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import json
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List,Dict
-import base64
-from app.segmentation import process_image   # (List[bytes], List[(x,y)]) を返す
+from typing import Any, List, Dict, Optional, Union
+from app.segmentation import (process_images, loaded_model_hash, _decode_image,  # 画像ごとに List[RoofMask] を返す
+                              ModelNotReadyError)
+from app.batching import InferenceBatcher, QueueFullError
+from app.workers import InferencePool, MAX_INFLIGHT, OVERLOAD_STATUS
+from app.mask_codec import MASK_FORMATS
+from app.cache import CachedSegmentation, InferenceCache, cache_key
+
+logger = logging.getLogger(__name__)
+
+# コールドスタートの回帰を追うため、このモジュールの import 時間を /ready・/live で報告する
+# （torch / ultralytics はモデル読込時に import されるため含まない）
+IMPORT_TIME_S = round(time.perf_counter() - _IMPORT_STARTED, 4)
+
+# 推論はマイクロバッチングキュー → ワーカープールで実行
+# （設定は app/batching.py / app/workers.py の環境変数）
+pool = InferencePool()
+batcher = InferenceBatcher(process_images, executor=lambda: pool.executor,
+                           max_concurrent_batches=pool.workers, max_inflight=MAX_INFLIGHT)
+
+# 同じ画像・閾値・モデル重みの推論結果を再利用（設定は app/cache.py の環境変数）
+inference_cache = InferenceCache()
+
+def _loaded_model_hash() -> Optional[str]:
+    """
+    推論キャッシュのキーに使う、ワーカーが実際に読み込んだモデルの識別子
+    起動時（lifespan）に各ワーカーが報告した model_hash。lifespan を経由しない場合
+    （TestClient 等）はこのプロセスの読込状態。未読込・ワーカー間で異なる場合は None（キャッシュしない）
+    """
+    workers = _lifecycle["workers"]
+    hashes = {w.get("model_hash") for w in workers} if workers else {loaded_model_hash()}
+    return hashes.pop() if len(hashes) == 1 else None
+
+async def _segment(data: bytes, conf: float, with_image: bool = False):
+    """
+    キャッシュを参照してから推論する。with_image は RGBA 出力用に元画像も付ける
+    （推論時の RoofMask は元画像を持っているため、キャッシュヒット時のみデコードする）
+    """
+    model_hash = _loaded_model_hash()
+    if model_hash is None:
+        return await batcher.submit(data, conf=conf)
+    inference_cache.invalidate_model(model_hash)
+    key = cache_key(data, conf, model_hash)
+    cached = inference_cache.get(key)
+    if cached is not None:
+        image_bgr = await run_in_threadpool(_decode_image, data) if with_image else None
+        return await run_in_threadpool(cached.roof_masks, image_bgr)
+
+    roof_masks = await batcher.submit(data, conf=conf)
+    if inference_cache.enabled:
+        entry = await run_in_threadpool(CachedSegmentation.from_roof_masks, roof_masks)
+        inference_cache.put(key, entry)
+    return roof_masks
+
+# 起動状態（/ready・/live 用）
+_lifecycle = {"status": "starting", "started_at": time.time(), "startup_time_s": None, "workers": []}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 起動時に各ワーカーへ ROOF_MODEL_PATH のモデルを読み込みウォームアップ
+    # 読込に失敗した場合もプロセスは止めず、/ready が 503 と理由を返す
+    start = time.perf_counter()
+    workers = await pool.prewarm()
+    ready = all(w["status"] == "ready" for w in workers)
+    _lifecycle.update(status="ready" if ready else "failed", workers=workers,
+                      startup_time_s=round(time.perf_counter() - start, 4))
+    logger.info("roof service %s: import=%.3fs startup=%.3fs", _lifecycle["status"],
+                IMPORT_TIME_S, _lifecycle["startup_time_s"])
+    yield
+    # 停止時は処理中のバッチを完了させてから終了
+    _lifecycle["status"] = "stopping"
+    await batcher.shutdown()
+    pool.shutdown()
+
+app = FastAPI(title="Roof Segmentation API", lifespan=lifespan)
+
+def _overloaded(e: QueueFullError) -> HTTPException:
+    print(f"[WARN] {e}")
+    return HTTPException(status_code=OVERLOAD_STATUS, detail="推論ワーカーが混雑しています",
+                         headers={"Retry-After": str(e.retry_after)})
 
-app = FastAPI(title="Roof Segmentation API")
+def _not_ready(e: ModelNotReadyError) -> HTTPException:
+    print(f"[ERROR] {e}")
+    return HTTPException(status_code=503, detail=str(e))
+
+def _encode_response(roof_masks, key: str, kind: str) -> dict:
+    # PNG エンコードは CPU 処理のためスレッドプールから呼ぶ
+    return {
+        key: [m.data_uri(kind) for m in roof_masks],
+        "centers": [m.center_dict() for m in roof_masks],
+    }
+
+def _encode_masks(roof_masks, fmt: str) -> dict:
+    return {
+        "format": fmt,
+        "masks": [m.encode(fmt) for m in roof_masks],
+        "centers": [m.center_dict() for m in roof_masks],
+    }
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+async def _stream_masks(roof_masks, fmt: str):
+    """1 マスク 1 行の NDJSON。各マスクはエンコードでき次第送出する"""
+    for i, m in enumerate(roof_masks):
+        encoded = await run_in_threadpool(m.encode, fmt)
+        line = {"type": "mask", "index": i, "format": fmt, "mask": encoded, "center": m.center_dict()}
+        yield json.dumps(line) + "\n"
+    yield json.dumps({"type": "done", "count": len(roof_masks)}) + "\n"
+
+# Accept: application/vnd.roof-mask.rle+json のようにマスク形式を指定できる
+_MASK_MEDIA_PREFIX = "application/vnd.roof-mask."
+
+def _select_mask_format(fmt: Optional[str], accept: Optional[str]) -> str:
+    """format クエリ > Accept ヘッダ > png の順で転送形式を決める"""
+    if fmt is None and accept:
+        for media in accept.split(","):
+            media = media.split(";")[0].strip()
+            if media.startswith(_MASK_MEDIA_PREFIX):
+                fmt = media[len(_MASK_MEDIA_PREFIX):].split("+")[0]
+                break
+    fmt = (fmt or "png").lower()
+    if fmt not in MASK_FORMATS:
+        raise HTTPException(status_code=400,
+                            detail=f"未対応のマスク形式: {fmt}（{', '.join(MASK_FORMATS)}）")
+    return fmt
 
 class SegResponse(BaseModel):
     images: List[str]             # data:image/png;base64,... の文字列リスト
@@ -16,8 +143,11 @@ async def segment_endpoint(image: UploadFile = File(...)):
     # 入力画像バイト列を読み込み
     data = await image.read()
     try:
-        # process_image は now List[bytes] を返すように実装を変更
-        png_bytes_list, centers = process_image(data, conf=0.8)
+        roof_masks = await _segment(data, conf=0.8, with_image=True)
+    except QueueFullError as e:
+        raise _overloaded(e)
+    except ModelNotReadyError as e:
+        raise _not_ready(e)
     except ValueError as e:
         # 画像読込失敗など
         print(f"[ERROR] {e}")
@@ -27,32 +157,31 @@ async def segment_endpoint(image: UploadFile = File(...)):
         print(f"[ERROR] {e}")
         raise HTTPException(status_code=500, detail="内部エラー")
 
-    # 各バイト列を Base64 エンコード
-    base64_images = []
-    center_list: List[Dict[str,int]] = []
-    for b, center in zip(png_bytes_list, centers):
-        cx, cy = center
-        b64 = base64.b64encode(b).decode("utf-8")
-        base64_images.append(f"data:image/png;base64,{b64}")
-        center_list.append({"x": cx, "y": cy})
-    return JSONResponse(content={
-        "images": base64_images,
-        "centers": center_list
-    })
-
-# 新しいエンドポイント: 二値マスク画像（PNG, 0/255）をBase64で返す
+    # 元画像に重ねた RGBA-PNG として 1 回だけエンコード
+    content = await run_in_threadpool(_encode_response, roof_masks, "images", "rgba")
+    return JSONResponse(content=content)
+
+# 新しいエンドポイント: 二値マスクを返す
+# 既定は PNG(0/255) の Base64。format=rle|packbits|polygon でコンパクトな形式を選べる
 class MaskResponse(BaseModel):
-    masks: List[str]
+    format: str = "png"
+    masks: List[Union[str, Dict[str, Any]]]
     centers: List[Dict[str, int]]
 
 @app.post("/segment_masks", response_model=MaskResponse)
-async def segment_masks_endpoint(image: UploadFile = File(...)):
-    import numpy as np
-    import cv2
-
+async def segment_masks_endpoint(image: UploadFile = File(...),
+                                 format: Optional[str] = Query(None, description="png | rle | packbits | polygon"),
+                                 stream: bool = Query(False, description="NDJSON で 1 マスクずつ返す"),
+                                 accept: Optional[str] = Header(None)):
+    fmt = _select_mask_format(format, accept)
+    stream = stream or (accept is not None and NDJSON_MEDIA_TYPE in accept)
     data = await image.read()
     try:
-        png_bytes_list, centers = process_image(data, conf=0.8)
+        roof_masks = await _segment(data, conf=0.8)
+    except QueueFullError as e:
+        raise _overloaded(e)
+    except ModelNotReadyError as e:
+        raise _not_ready(e)
     except ValueError as e:
         print(f"[ERROR] {e}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -60,30 +189,60 @@ async def segment_masks_endpoint(image: UploadFile = File(...)):
         print(f"[ERROR] {e}")
         raise HTTPException(status_code=500, detail="内部エラー")
 
-    # RGBA の α から 0/255 のグレースケールPNGへ統一変換
-    base64_masks = []
-    center_list: List[Dict[str,int]] = []
-    for b, center in zip(png_bytes_list, centers):
-        arr = np.frombuffer(b, np.uint8)
-        img = cv2.imdecode(arr, cv2.IMREAD_UNCHANGED)  # 1ch or 3ch or 4ch
-        if img is None:
-            continue
-        if img.ndim == 2:
-            mask = (img > 0).astype(np.uint8) * 255
-        elif img.shape[2] == 4:
-            alpha = img[:, :, 3]
-            mask = (alpha > 0).astype(np.uint8) * 255
-        else:
-            # フォールバック: グレースケール化して閾値
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            _, mask = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
-        _, mask_png = cv2.imencode('.png', mask)
-        b64 = base64.b64encode(mask_png.tobytes()).decode("utf-8")
-        base64_masks.append(f"data:image/png;base64,{b64}")
-        cx, cy = center
-        center_list.append({"x": cx, "y": cy})
-
-    return JSONResponse(content={
-        "masks": base64_masks,
-        "centers": center_list
-    })
+    if stream:
+        # 推論は画像単位のため完了後に開始し、エンコードはマスクごとに逐次送出
+        return StreamingResponse(_stream_masks(roof_masks, fmt), media_type=NDJSON_MEDIA_TYPE)
+
+    # マスク配列から指定形式へ直接エンコード（RGBA 経由の往復なし）
+    content = await run_in_threadpool(_encode_masks, roof_masks, fmt)
+    return JSONResponse(content=content)
+
+@app.get("/live")
+async def live_endpoint():
+    """プロセスが応答できるか（モデルの状態は問わない）"""
+    return {
+        "status": "alive",
+        "uptime_s": round(time.time() - _lifecycle["started_at"], 3),
+        "import_time_s": IMPORT_TIME_S,
+    }
+
+@app.get("/ready")
+async def ready_endpoint():
+    """
+    推論を受け付けられるか。全ワーカーでモデルの読込とウォームアップが完了していれば 200、
+    起動中・読込失敗・停止中は 503（モデルのハッシュ・読込時間・失敗理由を含む）
+    """
+    workers = _lifecycle["workers"]
+    first = workers[0] if workers else {}
+    content = {
+        "status": _lifecycle["status"],
+        "mode": first.get("mode"),
+        "model_path": first.get("model_path"),
+        "model_hash": first.get("model_hash"),
+        "load_time_s": max((w["load_time_s"] for w in workers if w["load_time_s"] is not None), default=None),
+        "warmup_time_s": max((w["warmup_time_s"] for w in workers if w["warmup_time_s"] is not None), default=None),
+        "import_time_s": IMPORT_TIME_S,
+        "startup_time_s": _lifecycle["startup_time_s"],
+        "workers": len(workers),
+        "workers_ready": sum(w["status"] == "ready" for w in workers),
+    }
+    errors = sorted({w["error"] for w in workers if w.get("error")})
+    if errors:
+        content["error"] = "; ".join(errors)
+    return JSONResponse(content=content, status_code=200 if _lifecycle["status"] == "ready" else 503)
+
+@app.get("/batch_stats")
+async def batch_stats_endpoint():
+    """マイクロバッチの設定と直近バッチのレイテンシ集計（スループット/p99 のチューニング用）"""
+    return {
+        "max_batch_size": batcher.max_batch_size,
+        "max_wait_ms": batcher.max_wait_ms,
+        "max_queue_depth": batcher.max_queue_depth,
+        "queue_depth": batcher.queue_depth,
+        "inflight": batcher.inflight,
+        "max_inflight": batcher.max_inflight,
+        "executor": pool.kind,
+        "workers": pool.workers,
+        **batcher.stats.summary(),
+        "inference_cache": inference_cache.stats(),
+    }
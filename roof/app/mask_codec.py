@@ -0,0 +1,206 @@
+# mask_codec.py
+"""
+屋根マスクのコンパクトな転送形式
+Compact wire formats for binary roof masks (roof service ⇄ panel service)
+
+roof サービスと panel サービスで共有するモジュール（panel_count/mask_codec.py は同一内容のコピー。
+変更時は両方を更新すること。tests/test_mask_codec.py で一致を検証する）。
+
+形式 / Formats:
+    png      : "data:image/png;base64,..." 文字列（従来形式）
+    rle      : COCO 形式の非圧縮 RLE
+               {"format": "rle", "size": [h, w], "counts": [0 の連続数, 1 の連続数, ...]}
+               ※列優先 (Fortran) 順、先頭は 0 の連続数
+    packbits : np.packbits によるビットパック
+               {"format": "packbits", "shape": [h, w], "data": "<base64>"}
+    polygon  : 輪郭ポリゴン（COCO 形式のフラットな座標列）
+               {"format": "polygon", "size": [h, w], "polygons": [[x0, y0, x1, y1, ...], ...],
+                "levels": [0, 1, ...]}
+               ※levels は輪郭の入れ子の深さ（奇数 = 穴）。輪郭から再構成するため、
+                 1 画素幅の構造などで僅かに誤差が出る場合がある
+
+環境変数 / Environment:
+    MASK_MAX_PIXELS : デコードするマスクの画素数 (h * w) の上限 (default 2**28)。数バイトの RLE /
+                      polygon でも巨大な配列を確保できてしまうため、デコード前にヘッダーを検証する
+"""
+import base64
+import os
+from numbers import Integral
+from typing import Any, Dict, Tuple, Union
+
+import cv2
+import numpy as np
+
+MASK_FORMATS = ("png", "rle", "packbits", "polygon")
+
+# デコードするマスクの画素数の上限 / Largest mask (h * w) decode_mask will allocate
+MAX_MASK_PIXELS = int(os.getenv("MASK_MAX_PIXELS", str(1 << 28)))
+
+
+def _as_bool(mask: np.ndarray) -> np.ndarray:
+    return mask if mask.dtype == bool else mask > 127 if mask.dtype == np.uint8 else mask > 0
+
+
+def encode_png(mask: np.ndarray) -> str:
+    png = cv2.imencode('.png', _as_bool(mask).astype(np.uint8) * 255)[1].tobytes()
+    return "data:image/png;base64," + base64.b64encode(png).decode("utf-8")
+
+
+def encode_rle(mask: np.ndarray) -> Dict[str, Any]:
+    mask = _as_bool(mask)
+    h, w = mask.shape
+    flat = mask.ravel(order='F')
+    if flat.size == 0:
+        return {"format": "rle", "size": [h, w], "counts": []}
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], change, [flat.size]))
+    counts = np.diff(bounds).tolist()
+    if flat[0]:
+        counts.insert(0, 0)
+    return {"format": "rle", "size": [h, w], "counts": counts}
+
+
+def encode_packbits(mask: np.ndarray) -> Dict[str, Any]:
+    mask = _as_bool(mask)
+    h, w = mask.shape
+    data = base64.b64encode(np.packbits(mask.ravel()).tobytes()).decode("ascii")
+    return {"format": "packbits", "shape": [h, w], "data": data}
+
+
+def encode_polygon(mask: np.ndarray) -> Dict[str, Any]:
+    mask_u8 = _as_bool(mask).astype(np.uint8)
+    h, w = mask_u8.shape
+    contours, hierarchy = cv2.findContours(mask_u8, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    levels = []
+    for i in range(len(contours)):
+        # 親をたどって入れ子の深さを求める
+        depth, parent = 0, hierarchy[0][i][3]
+        while parent >= 0:
+            depth += 1
+            parent = hierarchy[0][parent][3]
+        levels.append(depth)
+    order = sorted(range(len(contours)), key=lambda i: levels[i])
+    return {
+        "format": "polygon",
+        "size": [h, w],
+        "polygons": [contours[i].reshape(-1).tolist() for i in order],
+        "levels": [levels[i] for i in order],
+    }
+
+
+_ENCODERS = {
+    "png": encode_png,
+    "rle": encode_rle,
+    "packbits": encode_packbits,
+    "polygon": encode_polygon,
+}
+
+
+def encode_mask(mask: np.ndarray, fmt: str = "png") -> Union[str, Dict[str, Any]]:
+    """マスク配列（bool または 0/255）を指定形式にエンコード"""
+    if fmt not in _ENCODERS:
+        raise ValueError(f"unsupported mask format: {fmt} (supported: {MASK_FORMATS})")
+    return _ENCODERS[fmt](mask)
+
+
+def _mask_size(value: Any) -> Tuple[int, int]:
+    """size / shape ヘッダーを検証して (h, w) を返す（非負の整数 2 つ、画素数は MAX_MASK_PIXELS まで）"""
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError(f"mask size must be [h, w]: {value!r}")
+    if not all(isinstance(v, Integral) and not isinstance(v, bool) and v >= 0 for v in value):
+        raise ValueError(f"mask size must be non-negative integers: {value!r}")
+    h, w = int(value[0]), int(value[1])
+    if h * w > MAX_MASK_PIXELS:
+        raise ValueError(f"mask size {h}x{w} exceeds MAX_MASK_PIXELS ({MAX_MASK_PIXELS})")
+    return h, w
+
+
+def _rle_counts(value: Any, total: int) -> np.ndarray:
+    """RLE の counts を検証して int64 配列にする（非負の整数、合計 = 画素数）"""
+    if not isinstance(value, (list, tuple)):
+        raise ValueError("RLE counts must be a list")
+    if not all(isinstance(v, Integral) and not isinstance(v, bool) and 0 <= v <= total for v in value):
+        raise ValueError("RLE counts must be non-negative integers")
+    counts = np.asarray(value, dtype=np.int64)
+    if int(counts.sum()) != total:
+        raise ValueError("RLE counts do not match mask size")
+    return counts
+
+
+def _polygon_list(value: Any, limit: int) -> list:
+    """polygons を検証する（各ポリゴンは偶数長の整数列、座標は 0..max(h, w)）"""
+    if not isinstance(value, (list, tuple)):
+        raise ValueError("polygons must be a list")
+    for flat in value:
+        if not isinstance(flat, (list, tuple)) or len(flat) % 2:
+            raise ValueError("each polygon must be a flat [x0, y0, x1, y1, ...] list")
+        # numpy の int32 変換は範囲外の値を黙って丸めるため、変換前に値を確認する
+        if not all(isinstance(v, Integral) and not isinstance(v, bool) and 0 <= v <= limit for v in flat):
+            raise ValueError(f"polygon coordinates must be integers in 0..{limit}")
+    return list(value)
+
+
+def _polygon_levels(value: Any, count: int) -> list:
+    """levels を検証する（polygons と同じ長さの非負の整数列）"""
+    if not isinstance(value, (list, tuple)) or len(value) != count:
+        raise ValueError(f"polygon levels must be a list of {count} integers")
+    if not all(isinstance(v, Integral) and not isinstance(v, bool) and v >= 0 for v in value):
+        raise ValueError("polygon levels must be non-negative integers")
+    return [int(v) for v in value]
+
+
+def decode_mask(obj: Union[str, Dict[str, Any]]) -> np.ndarray:
+    """
+    任意の転送形式 → 0/255 の uint8 マスク
+
+    RLE / packbits / polygon はヘッダーの画素数を MAX_MASK_PIXELS で制限してから配列を確保する。
+
+    Raises:
+        ValueError: 形式が不正な場合、または MAX_MASK_PIXELS を超える場合
+    """
+    if isinstance(obj, str):
+        img_bytes = base64.b64decode(obj.split(",")[-1])
+        img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError("PNG mask decode failed")
+        return img
+
+    if not isinstance(obj, dict):
+        raise ValueError(f"unsupported mask payload type: {type(obj).__name__}")
+
+    fmt = obj.get("format")
+    if fmt == "rle":
+        h, w = _mask_size(obj.get("size"))
+        counts = _rle_counts(obj.get("counts"), h * w)
+        values = np.zeros(len(counts), dtype=np.uint8)
+        values[1::2] = 255
+        return np.repeat(values, counts).reshape((h, w), order='F')
+
+    if fmt == "packbits":
+        h, w = _mask_size(obj.get("shape"))
+        packed = np.frombuffer(base64.b64decode(obj.get("data", "")), dtype=np.uint8)
+        bits = np.unpackbits(packed, count=h * w)
+        if bits.size != h * w:
+            raise ValueError("packbits data does not match mask shape")
+        return bits.reshape(h, w) * np.uint8(255)
+
+    if fmt == "polygon":
+        h, w = _mask_size(obj.get("size"))
+        polygons = _polygon_list(obj.get("polygons", []), max(h, w))
+        levels = obj.get("levels")
+        levels = [0] * len(polygons) if levels is None else _polygon_levels(levels, len(polygons))
+        mask = np.zeros((h, w), dtype=np.uint8)
+        # 外側から順に描画: 偶数レベルは塗りつぶし、奇数レベル（穴）は抜く
+        for level, flat in sorted(zip(levels, polygons), key=lambda item: item[0]):
+            if not flat:
+                continue
+            pts = [np.asarray(flat, dtype=np.int32).reshape(-1, 1, 2)]
+            if level % 2 == 0:
+                cv2.fillPoly(mask, pts, 255)
+            else:
+                # 穴の輪郭は前景画素上にあるため、抜いた後に輪郭線を戻す
+                cv2.fillPoly(mask, pts, 0)
+                cv2.polylines(mask, pts, True, 255, 1)
+        return mask
+
+    raise ValueError(f"unsupported mask format: {fmt}")
@@ -0,0 +1,113 @@
+# masks.py
+"""
+セグメンテーション結果のマスク表現
+Raw roof mask arrays with lazy, cached encoders
+
+推論ワーカーはエンコードせずにマスク配列を返し、各エンドポイントが
+必要な形式で 1 回だけエンコードする。マスクはインスタンスの外接矩形で
+切り出して保持し（大きな航空写真で N × H × W の配列を持たないため）、
+元画像サイズの配列はエンコード時に一時的にだけ作る。
+"""
+import base64
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from app.mask_codec import encode_mask
+
+
+@dataclass
+class RoofMask:
+    """
+    1 インスタンス分の屋根マスク
+
+    Attributes:
+        mask        : 外接矩形で切り出した (h, w) bool 配列。frame_shape が None の場合は
+                      元画像サイズ (H, W) の配列そのもの
+        center      : 重心 (x, y)（元画像座標系）。空マスクの場合 (None, None)
+        image_bgr   : 元画像（RGBA 出力用。同じ画像の全マスクで共有）
+        offset      : 切り出し位置の左上 (x, y)
+        frame_shape : 元画像の (H, W)
+    """
+    mask: np.ndarray
+    center: Tuple[Optional[int], Optional[int]]
+    image_bgr: Optional[np.ndarray] = None
+    offset: Tuple[int, int] = (0, 0)
+    frame_shape: Optional[Tuple[int, int]] = None
+    _encoded: Dict[str, bytes] = field(default_factory=dict, repr=False, compare=False)
+
+    @classmethod
+    def from_full(cls, mask: np.ndarray, center: Tuple[Optional[int], Optional[int]],
+                  image_bgr: Optional[np.ndarray] = None) -> "RoofMask":
+        """元画像サイズのマスクを外接矩形で切り出して作る"""
+        mask = mask.astype(bool, copy=False)
+        ys = np.flatnonzero(mask.any(axis=1))
+        xs = np.flatnonzero(mask.any(axis=0))
+        if len(ys) == 0:
+            return cls(mask=np.zeros((0, 0), dtype=bool), center=center, image_bgr=image_bgr,
+                       frame_shape=mask.shape)
+        crop = mask[ys[0]:ys[-1] + 1, xs[0]:xs[-1] + 1]
+        return cls(mask=crop, center=center, image_bgr=image_bgr,
+                   offset=(int(xs[0]), int(ys[0])), frame_shape=mask.shape)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """元画像の (H, W)"""
+        return tuple(self.frame_shape) if self.frame_shape is not None else self.mask.shape
+
+    @property
+    def bbox(self) -> Tuple[int, int, int, int]:
+        """切り出し範囲 (x, y, w, h)（元画像座標系）"""
+        h, w = self.mask.shape
+        return self.offset[0], self.offset[1], w, h
+
+    @property
+    def area(self) -> int:
+        return int(np.count_nonzero(self.mask))
+
+    def full_mask(self) -> np.ndarray:
+        """元画像サイズの (H, W) bool 配列（切り出しの場合は新しく確保する）"""
+        if self.frame_shape is None or self.mask.shape == tuple(self.frame_shape):
+            return self.mask
+        full = np.zeros(self.frame_shape, dtype=bool)
+        x, y, w, h = self.bbox
+        full[y:y + h, x:x + w] = self.mask
+        return full
+
+    def to_uint8(self) -> np.ndarray:
+        """元画像サイズの 0/255 の uint8 配列"""
+        return self.full_mask().view(np.uint8) * 255
+
+    def binary_png(self) -> bytes:
+        """0/255 のグレースケール PNG（/segment_masks 用）"""
+        if "binary" not in self._encoded:
+            self._encoded["binary"] = cv2.imencode('.png', self.to_uint8())[1].tobytes()
+        return self._encoded["binary"]
+
+    def rgba_png(self) -> bytes:
+        """元画像 + α チャンネルにマスクを入れた RGBA PNG（/segment 用）"""
+        if "rgba" not in self._encoded:
+            if self.image_bgr is None:
+                raise ValueError("RGBA encoding requires the source image")
+            # BGRA で組み立てて OpenCV でエンコード（PNG 上は RGBA として保存される）
+            canvas = cv2.cvtColor(self.image_bgr, cv2.COLOR_BGR2BGRA)
+            canvas[..., 3] = self.to_uint8()
+            self._encoded["rgba"] = cv2.imencode('.png', canvas)[1].tobytes()
+        return self._encoded["rgba"]
+
+    def data_uri(self, kind: str = "binary") -> str:
+        """data:image/png;base64,... 形式の文字列"""
+        png = self.rgba_png() if kind == "rgba" else self.binary_png()
+        return "data:image/png;base64," + base64.b64encode(png).decode("utf-8")
+
+    def encode(self, fmt: str = "png") -> Union[str, Dict[str, Any]]:
+        """転送形式でエンコード（png はデータ URI、それ以外は mask_codec の辞書）"""
+        if fmt == "png":
+            return self.data_uri("binary")
+        return encode_mask(self.full_mask(), fmt)
+
+    def center_dict(self) -> Dict[str, Optional[int]]:
+        cx, cy = self.center
+        return {"x": cx, "y": cy}
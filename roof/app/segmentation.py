@@ -1,266 +1,541 @@
 # segmentation.py
-import io
+"""
+屋根セグメンテーション推論
+Roof segmentation inference (YOLO) with an explicit model lifecycle
+
+torch / ultralytics の import とモデル読込はモジュール読込時には行わず、
+load_model()（FastAPI の lifespan または推論ワーカーの初期化）で 1 回だけ実行する。
+読込に失敗した場合はモックに切り替えず ModelLoadError とし、状態は
+model_status() で /ready に報告する。
+
+モデルの選択:
+    USE_MOCK_MODEL=true、または CI 環境で ROOF_MODEL_PATH 未指定 → モック
+    ROOF_MODEL_PATH → 指定の重み（読込失敗はエラー）
+    未指定 → preroof の学習成果（開発時のみ）、なければモック
+推論バックエンド（PyTorch / ONNX Runtime / OpenVINO）は app/backends.py の環境変数で選ぶ。
+大きな画像のタイル分割推論の設定は app/tiling.py を参照。
+"""
+import hashlib
+import logging
 import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
 import cv2
 import numpy as np
-from PIL import Image
-from typing import List, Tuple
 
-from ultralytics import YOLO
-from dotenv import load_dotenv
-from app.util import letterbox, make_full_mask_png
-from typing import List,Tuple
+from app import backends, tiling
+from app.masks import RoofMask
 
-from app.util import make_full_mask_png  
-
-# ─── モデル読込 ─────────────────────────────────
-import os
-from pathlib import Path
+logger = logging.getLogger(__name__)
 
+# ─── モデル設定 ─────────────────────────────────
 # 開発環境とDocker環境の両方に対応 + preroof 強化版の自動検出
 current_dir = Path(__file__).parent.parent  # /app/roof
 repo_root = current_dir.parent             # プロジェクトルート
 
 # 優先順位: 環境変数 > preroof 強化版（開発時のみ）。
-# CI/開発でモデル未提供の場合はモックで動作させてAPIを落とさない。
 env_model_path = os.getenv("ROOF_MODEL_PATH")
 if env_model_path:
-    model_path = Path(env_model_path)
+    model_path: Optional[Path] = Path(env_model_path)
 else:
     # 開発時の便宜: preroof の学習成果を自動検出（本番では ROOF_MODEL_PATH を指定）
     preroof_candidate = repo_root / "preroof/runs/segment/continue_training_optimized/weights/best.pt"
     model_path = preroof_candidate if preroof_candidate.exists() else None
-    if model_path is None:
-        print("⚠️ No model path provided; running in mock mode. Set ROOF_MODEL_PATH to use real model.")
 
-# PyTorch version compatibility fix
-import torch
+# 默认禁用模拟模型，但若未提供模型路径则自动开启以便CI通过
+USE_MOCK_MODEL = (os.getenv('USE_MOCK_MODEL', 'false').lower() == 'true'
+                  or (env_model_path is None and 'CI' in os.environ)
+                  or model_path is None)
+
+# ウォームアップ推論に使うダミー画像の一辺
+WARMUP_SIZE = int(os.getenv("ROOF_WARMUP_SIZE", "640"))
+
+
+class ModelLoadError(RuntimeError):
+    """指定されたモデルを読み込めない（モックには切り替えない）"""
+
+
+class ModelNotReadyError(RuntimeError):
+    """モデルの読込に失敗しているため推論できない"""
+
+
+model = None  # 読込済みの YOLO（モックモードでは None）
+_load_lock = threading.Lock()
+_status: Dict[str, Any] = {
+    "status": "not_loaded",          # not_loaded | ready | failed
+    "mode": "mock" if USE_MOCK_MODEL else "yolo",
+    "backend": None if USE_MOCK_MODEL else backends.backend_tag(model_path),
+    "model_path": None if USE_MOCK_MODEL else str(model_path),
+    "model_hash": None,
+    "load_time_s": None,
+    "warmup_time_s": None,
+    "error": None,
+}
 
-# Only use add_safe_globals if available (PyTorch 2.1+)
-if hasattr(torch.serialization, 'add_safe_globals'):
+
+def _register_safe_globals() -> None:
+    """PyTorch 2.6+ の weights_only 読込で ultralytics のクラスを許可する"""
+    import torch
+
+    # Only use add_safe_globals if available (PyTorch 2.1+)
+    if not hasattr(torch.serialization, 'add_safe_globals'):
+        return
     try:
-        # Import ultralytics classes
         from ultralytics.nn.tasks import SegmentationModel
         from ultralytics.nn.modules.conv import Conv
         from ultralytics.nn.modules.block import C2f
         from ultralytics.nn.modules.head import Segment
-
-        # Import standard PyTorch classes that are commonly needed
         from torch.nn.modules.container import Sequential
         from torch.nn.modules.linear import Linear
         from torch.nn.modules.conv import Conv2d
         from torch.nn.modules.batchnorm import BatchNorm2d
         from torch.nn.modules.activation import ReLU, SiLU
-
-        torch.serialization.add_safe_globals([
-            # Ultralytics classes
-            SegmentationModel,
-            Conv,
-            C2f,
-            Segment,
-            # Standard PyTorch classes
-            Sequential,
-            Linear,
-            Conv2d,
-            BatchNorm2d,
-            ReLU,
-            SiLU
-        ])
     except ImportError:
         # If modules can't be imported, skip safe globals
-        pass
+        return
+    torch.serialization.add_safe_globals([
+        SegmentationModel, Conv, C2f, Segment,
+        Sequential, Linear, Conv2d, BatchNorm2d, ReLU, SiLU,
+    ])
 
-# 默认禁用模拟模型，但若未提供模型路径则自动开启以便CI通过
-USE_MOCK_MODEL = os.getenv('USE_MOCK_MODEL', 'false').lower() == 'true' or (env_model_path is None and 'CI' in os.environ)
 
-if USE_MOCK_MODEL or (env_model_path is None and model_path is None):
-    print("⚠️  Using mock model (no model provided or CI environment)")
-    model = None
-else:
-    # Load YOLO model with PyTorch 2.6+ compatibility
-    if model_path is None:
-        # safety: should not happen because handled above
-        print("⚠️ No model path; using mock")
-        USE_MOCK_MODEL = True
-        model = None
-    else:
-        print(f"🔄 Loading YOLO model from: {model_path}")
-        print(f"📁 Model file exists: {model_path.exists()}")
-        if model_path.exists():
-            print(f"📊 Model file size: {model_path.stat().st_size} bytes")
+def _load_yolo(path: Path, backend: str = backends.INFER_BACKEND, threads: int = backends.INFER_THREADS):
+    """
+    YOLO モデルを読み込む。backend（ROOF_INFER_BACKEND）が onnx / openvino の場合は
+    書き出した重みを読み込み、スレッド数などのランタイム設定を適用する。失敗時は ModelLoadError
+    """
+    if not path.exists():
+        raise ModelLoadError(f"モデルファイルが見つかりません: {path}")
+    try:
+        digest = weights_digest() if path == model_path else _digest_files(path)
+        weights = backends.resolve_weights(path, digest, backend)
+    except Exception as e:
+        raise ModelLoadError(f"モデルの書き出しに失敗しました: {path}: {e}") from e
+    loaded = _load_weights(weights)
+    try:
+        backends.configure_runtime(loaded, weights, threads)
+    except Exception as e:
+        raise ModelLoadError(f"推論ランタイムの設定に失敗しました: {weights}: {e}") from e
+    return loaded
+
+
+def _load_weights(model_path: Path):
+    """YOLO で重みを読み込む（PyTorch 2.6+ 互換）"""
+    import torch
+    from ultralytics import YOLO
 
+    if model_path.suffix != ".pt":
+        logger.info("loading YOLO model: %s", model_path)
         try:
-            model = YOLO(str(model_path))
-            print(f"✅ YOLO model loaded successfully")
-            print(f"🏷️  Model task: {getattr(model, 'task', 'unknown')}")
-            print(f"🔧 Model type: {type(model)}")
+            return YOLO(str(model_path), task="segment")
         except Exception as e:
-            print(f"❌ Error loading YOLO model: {e}")
-            print(f"🔍 Error type: {type(e)}")
-
-            if "weights_only" in str(e):
-                print("🔧 Attempting to load with weights_only=False...")
-                # For PyTorch 2.6+, temporarily disable weights_only for trusted model
-                import torch
-                original_load = torch.load
-                torch.load = lambda *args, **kwargs: original_load(*args, **{**kwargs, 'weights_only': False})
-                try:
-                    try:
-                        model = YOLO(str(model_path))
-                        print("✅ YOLO model loaded successfully with weights_only=False")
-                    except Exception as e2:
-                        print(f"❌ Fallback load with weights_only=False failed: {e2}")
-                        print("🔄 Falling back to mock mode")
-                        USE_MOCK_MODEL = True
-                        model = None
-                finally:
-                    torch.load = original_load
-            else:
-                print(f"💥 Model file incompatible, falling back to mock mode")
-                print(f"🔄 Setting USE_MOCK_MODEL=True due to model compatibility issue")
-                USE_MOCK_MODEL = True
-                model = None
+            raise ModelLoadError(f"モデルの読込に失敗しました: {model_path}: {e}") from e
+    _register_safe_globals()
+    logger.info("loading YOLO model: %s (%d bytes)", model_path, model_path.stat().st_size)
+    try:
+        return YOLO(str(model_path))
+    except Exception as e:
+        if "weights_only" not in str(e):
+            raise ModelLoadError(f"モデルの読込に失敗しました: {model_path}: {e}") from e
+        # For PyTorch 2.6+, temporarily disable weights_only for trusted model
+        logger.info("retrying model load with weights_only=False")
+        original_load = torch.load
+        torch.load = lambda *args, **kwargs: original_load(*args, **{**kwargs, 'weights_only': False})
+        try:
+            return YOLO(str(model_path))
+        except Exception as e2:
+            raise ModelLoadError(f"モデルの読込に失敗しました: {model_path}: {e2}") from e2
+        finally:
+            torch.load = original_load
 
-# ─── 推論メイン関数 ─────────────────────────────
-def process_image(image_bytes: bytes, conf: float = 0.8) -> Tuple[List[bytes], List[Tuple[int, int]]]:
+
+def load_model() -> Dict[str, Any]:
     """
-    Args:
-        image_bytes : アップロード画像（バイト列）
-        conf        : 信頼度閾値
+    モデルを読み込みウォームアップする（プロセス内で 1 回だけ。2 回目以降は状態を返すのみ）
     Returns:
-        png_bytes_list : 個々のマスクを重ねた RGBA-PNG バイト列のリスト
-        centers        : 各マスク重心座標 [(x, y), ...]  ※元画像座標系
+        model_status() と同じ辞書
+    Raises:
+        ModelLoadError : ROOF_MODEL_PATH の重みを読み込めない場合
+    """
+    global model
+    with _load_lock:
+        if _status["status"] == "ready":
+            return model_status()
+        if _status["status"] == "failed":
+            raise ModelLoadError(_status["error"])
+        if USE_MOCK_MODEL:
+            logger.warning("using mock model (USE_MOCK_MODEL / CI, or no ROOF_MODEL_PATH)")
+        start = time.perf_counter()
+        try:
+            # 読み込む重みの識別子（読込後にファイルが置き換えられても、推論キャッシュは読み込んだモデルで引く）
+            fingerprint = model_fingerprint()
+            if not USE_MOCK_MODEL:
+                model = _load_yolo(model_path)
+            _status["load_time_s"] = round(time.perf_counter() - start, 4)
+            start = time.perf_counter()
+            warm_up()
+            _status["warmup_time_s"] = round(time.perf_counter() - start, 4)
+        except Exception as e:
+            model = None
+            _status.update(status="failed", error=str(e))
+            logger.error("model load failed: %s", e)
+            if isinstance(e, ModelLoadError):
+                raise
+            raise ModelLoadError(str(e)) from e
+        _status.update(status="ready", model_hash=fingerprint)
+        logger.info("model ready: mode=%s load=%.3fs warm-up=%.3fs",
+                    _status["mode"], _status["load_time_s"], _status["warmup_time_s"])
+        return model_status()
+
+
+def loaded_model_hash() -> Optional[str]:
+    """このプロセスで読み込んだモデルの識別子（未読込・失敗時は None）"""
+    return _status["model_hash"] if _status["status"] == "ready" else None
+
+
+def model_status() -> Dict[str, Any]:
+    """
+    /ready 用のモデル状態（プロセスごと）
+    ワーカー専用モデルの読込に失敗したワーカーがあれば status は failed（worker_errors に詳細）
+    """
+    status = dict(_status, pid=os.getpid())
+    if _worker_errors and status["status"] == "ready":
+        errors = dict(_worker_errors)
+        status.update(status="failed", error="; ".join(f"{name}: {e}" for name, e in errors.items()),
+                      worker_errors=errors)
+    return status
+
+
+# ─── モデル重みのハッシュ ─────────────────────────
+# load_model() が読み込んだ重みのハッシュを model_status() の model_hash に記録し、推論キャッシュの
+# キーに使う（リクエストごとにファイルを読み直さない。重みを置き換えた場合は再起動で反映）
+_fingerprint_lock = threading.Lock()
+_fingerprint: Tuple[Optional[tuple], str] = (None, "")
+
+
+def _weight_files(path: Path) -> List[Path]:
+    # OpenVINO はディレクトリ（.xml + .bin）
+    return sorted(p for p in path.iterdir() if p.is_file()) if path.is_dir() else [path]
+
+
+def _digest_files(path: Path) -> str:
+    h = hashlib.sha256()
+    for p in _weight_files(path):
+        with open(p, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def weights_digest() -> str:
     """
-    # ① バイト列 → OpenCV BGR
+    ROOF_MODEL_PATH の重みファイルの SHA-256
+    ファイルの更新日時・サイズが変わった場合のみ再計算する
+    """
+    global _fingerprint
+    try:
+        stamp = tuple((str(p), p.stat().st_mtime_ns, p.stat().st_size) for p in _weight_files(model_path))
+    except OSError:
+        stamp = ((str(model_path), None, None),)
+    with _fingerprint_lock:
+        if _fingerprint[0] != stamp:
+            try:
+                digest = _digest_files(model_path)
+            except OSError:
+                digest = "missing:" + str(model_path)
+            _fingerprint = (stamp, digest)
+        return _fingerprint[1]
+
+
+def model_fingerprint() -> str:
+    """
+    推論結果を決めるモデルの識別子（モックモードでは "mock"）
+    重みの SHA-256 に、PyTorch 以外ではバックエンド名（精度）を付ける
+    """
+    if USE_MOCK_MODEL or model_path is None:
+        return "mock"
+    tag = backends.backend_tag(model_path)
+    digest = weights_digest()
+    return digest if tag == "torch" else f"{digest}:{tag}"
+
+# ─── 推論ワーカー ───────────────────────────────
+# Ultralytics の predictor はスレッドセーフではないため、
+# スレッドプールの各ワーカーは専用のモデルインスタンスを持つ
+_worker_state = threading.local()
+_owner_lock = threading.Lock()
+_process_model_owner: Optional[threading.Thread] = None  # プロセスのモデルを専用に使うワーカー
+_worker_errors: Dict[str, str] = {}  # ワーカー専用モデルの読込エラー（スレッド名 → エラー）
+
+
+def _claim_process_model() -> bool:
+    """プロセスのモデルをまだどのワーカーも使っていなければ、呼び出したワーカーの専用にする"""
+    global _process_model_owner
+    with _owner_lock:
+        if _process_model_owner is None or not _process_model_owner.is_alive():
+            _process_model_owner = threading.current_thread()
+            return True
+        return False
+
+
+def init_worker(per_thread_model: bool = False) -> Dict[str, Any]:
+    """
+    推論ワーカーの初期化（プール生成時に各ワーカーで 1 回実行）
+    Args:
+        per_thread_model : True の場合ワーカーごとに専用のモデルを使う（スレッドプール用。
+                           プロセスプールではプロセスのモデルを使う）。最初に初期化された
+                           ワーカーはプロセスのモデルをそのまま使い、2 つ目以降のワーカーだけが
+                           ROOF_MODEL_PATH から読み込む（ワーカー数 N でモデルは N 個）
+    読込の失敗はここでは送出せず（プールを壊さないため）、状態に記録して推論時に
+    ModelNotReadyError とする。ワーカー専用モデルの失敗は model_status() が failed を返し、
+    そのワーカーはプロセスのモデルを共有しない。
+    """
+    try:
+        load_model()
+    except ModelLoadError:
+        return model_status()
+    if per_thread_model and model is not None:
+        _worker_state.per_thread = True
+        if _claim_process_model():
+            _worker_state.model = model
+        else:
+            try:
+                if model_fingerprint() != _status["model_hash"]:
+                    raise ModelLoadError("起動中にモデルの重みが置き換えられました（ワーカー間でモデルが異なる）")
+                _worker_state.model = _load_yolo(model_path)
+                warm_up()
+            except Exception as e:
+                _worker_state.model = None
+                _worker_errors[threading.current_thread().name] = str(e)
+                logger.error("worker model load failed (%s): %s", threading.current_thread().name, e)
+    return model_status()
+
+
+def _current_model():
+    """ワーカーのモデル。専用モデルを使うワーカーで読込に失敗していれば ModelNotReadyError"""
+    if getattr(_worker_state, 'per_thread', False):
+        worker_model = getattr(_worker_state, 'model', None)
+        if worker_model is None:
+            error = _worker_errors.get(threading.current_thread().name)
+            raise ModelNotReadyError(f"このワーカーのモデルが読み込まれていません: {error}")
+        return worker_model
+    return model
+
+
+def warm_up() -> None:
+    """ダミー画像で 1 回推論し、初回リクエストのレイテンシ（遅延初期化）を前倒しする"""
+    if USE_MOCK_MODEL or _current_model() is None:
+        return
+    dummy = np.zeros((WARMUP_SIZE, WARMUP_SIZE, 3), dtype=np.uint8)
+    _current_model().predict(dummy, conf=0.99, verbose=False)
+
+
+def _ensure_model() -> None:
+    """lifespan を経由しない呼び出し（TestClient 等）でも初回推論時に読み込む"""
+    if _status["status"] != "ready":
+        try:
+            load_model()
+        except ModelLoadError as e:
+            raise ModelNotReadyError(f"モデルが読み込まれていません: {e}") from None
+
+
+# ─── 推論メイン関数 ─────────────────────────────
+SegResult = List[RoofMask]
+
+
+def _decode_image(image_bytes: bytes) -> np.ndarray:
+    """バイト列 → OpenCV BGR（失敗時は ValueError）"""
     arr = np.frombuffer(image_bytes, np.uint8)
     img_bgr = cv2.imdecode(arr, cv2.IMREAD_COLOR)
     if img_bgr is None:
         raise ValueError("画像のデコードに失敗しました")
+    return img_bgr
 
-    H_orig, W_orig = img_bgr.shape[:2]
-
-    # ② 推論
-    if USE_MOCK_MODEL or model is None:
-        # 模拟模式：返回测试数据
-        print("🔧 Mock mode: generating test roof segments")
 
-        # 创建模拟的屋顶区域
-        h, w = H_orig, W_orig
-        mock_mask = np.zeros((h, w), dtype=np.uint8)
+Crop = Tuple[np.ndarray, int, int]  # (切り出したマスク, x, y)
 
-        # 创建一个矩形屋顶区域
-        x1, y1 = w//4, h//4
-        x2, y2 = 3*w//4, 3*h//4
-        mock_mask[y1:y2, x1:x2] = 255
 
-        # 转换为PNG字节
-        _, buffer = cv2.imencode('.png', mock_mask)
-        png_bytes = buffer.tobytes()
+def _mock_masks(img_bgr: np.ndarray) -> List[Crop]:
+    """モデル無し時のダミーマスク（画像中央の矩形 1 つ）"""
+    h, w = img_bgr.shape[:2]
 
-        # 计算中心点
-        center_x = (x1 + x2) // 2
-        center_y = (y1 + y2) // 2
+    # 创建一个矩形屋顶区域
+    x1, y1 = w//4, h//4
+    x2, y2 = 3*w//4, 3*h//4
+    return [(np.ones((y2 - y1, x2 - x1), dtype=bool), x1, y1)]
 
-        return [png_bytes], [(center_x, center_y)]
 
-    else:
-        # 真实模型推论
+def _predict_batch(images_bgr: List[np.ndarray], conf: float, worker_model=None) -> list:
+    """複数画像を 1 回の model.predict で推論し、画像ごとの Results を返す"""
+    worker_model = worker_model or _current_model()
+    try:
+        return worker_model.predict(images_bgr, conf=conf, verbose=False)
+    except AttributeError as attr_e:
+        print(f"❌ AttributeError during prediction: {attr_e}")
         try:
-            print(f"🔍 Running model prediction with conf={conf}")
-            print(f"🖼️  Input image shape: {img_bgr.shape}")
-            print(f"🤖 Model object: {model}")
-            print(f"🔧 Model attributes: {dir(model)}")
+            print("🔄 Trying alternative prediction method...")
+            return worker_model(images_bgr, conf=conf, verbose=False)
+        except Exception as alt_e:
+            print(f"❌ Alternative method also failed: {alt_e}")
+            raise attr_e
 
-            # Try different prediction approaches
-            try:
-                results = model.predict(img_bgr, conf=conf, verbose=False)[0]
-                print(f"✅ Model prediction completed")
-                print(f"📊 Results type: {type(results)}")
-                print(f"🔧 Results attributes: {dir(results)}")
-
-                # Check if results has masks attribute
-                if hasattr(results, 'masks'):
-                    print(f"✅ Results has masks attribute")
-                    if results.masks is None:
-                        print("⚠️  No masks detected in results")
-                        return [], []
-                else:
-                    print("❌ Results object has no masks attribute")
-                    print(f"📋 Available attributes: {[attr for attr in dir(results) if not attr.startswith('_')]}")
-                    return [], []
-
-            except AttributeError as attr_e:
-                print(f"❌ AttributeError during prediction: {attr_e}")
-                # Try alternative prediction method
-                try:
-                    print("🔄 Trying alternative prediction method...")
-                    results = model(img_bgr, conf=conf, verbose=False)[0]
-                    print(f"✅ Alternative prediction completed")
-                    print(f"📊 Results type: {type(results)}")
-                except Exception as alt_e:
-                    print(f"❌ Alternative method also failed: {alt_e}")
-                    raise attr_e
 
-        except Exception as e:
-            print(f"❌ Error during model prediction: {e}")
-            print(f"🔍 Error type: {type(e)}")
-
-            # If model prediction fails due to compatibility issues, fall back to mock mode
-            if "'Segment' object has no attribute 'detect'" in str(e):
-                print("🔄 Model compatibility issue detected, falling back to mock mode for this request")
-                # Generate mock result similar to mock mode
-                h, w = H_orig, W_orig
-                mock_mask = np.zeros((h, w), dtype=np.uint8)
-                x1, y1 = w//4, h//4
-                x2, y2 = 3*w//4, 3*h//4
-                mock_mask[y1:y2, x1:x2] = 255
-
-                _, buffer = cv2.imencode('.png', mock_mask)
-                png_bytes = buffer.tobytes()
-                center_x = (x1 + x2) // 2
-                center_y = (y1 + y2) // 2
-
-                print("⚠️  Returned mock result due to model compatibility issue")
-                return [png_bytes], [(center_x, center_y)]
-            else:
-                raise e
-
-    masks_net = results.masks.data.cpu().numpy()  # (N, H_net, W_net)
-    if masks_net.size == 0:
-        return [], []
-
-    png_bytes_list: List[bytes] = []
-    centers: List[Tuple[int, int]] = []
-
-    for mask_net in masks_net:
-        # ─── (1) ネットワーク出力サイズ → 元画像サイズへリサイズ ───
-        mask_resized = cv2.resize(
-            mask_net,                     # float32 (0.0–1.0)
-            (W_orig, H_orig),
-            interpolation=cv2.INTER_NEAREST,
-        )
-        # (2) 2値化
-        mask = (mask_resized > 0.5).astype(np.uint8)   # 0 or 1
-
-        # ─── ここから変更 ───
-        # ——— マスクだけの白黒画像 (Lモード) を作成 ———
-        mask_img = (mask * 255).astype(np.uint8)    # 0→0, 1→255
-        canvas = np.zeros((H_orig, W_orig, 4), dtype=np.uint8)
-        canvas[..., :3] = img_bgr
-        canvas[..., 3] = mask_img               # α チャンネルにマスク
-
-        pil_rgba = Image.fromarray(cv2.cvtColor(canvas, cv2.COLOR_BGRA2RGBA))  # PIL用に変換
-        buf = io.BytesIO()
-        pil_rgba.save(buf, format="PNG")
-        png_bytes_list.append(buf.getvalue())
-
-        # 重心だけはそのまま計算
-        ys, xs = np.where(mask > 0)
-        if len(xs) > 0 and len(ys) > 0:
-            center_x = int(xs.mean())
-            center_y = int(ys.mean())
+def _nearest_index(out_size: int, in_size: int) -> np.ndarray:
+    """出力画素ごとの参照元の添字（torch.nn.functional.interpolate(mode='nearest') と同じ計算）"""
+    if out_size == in_size:
+        return np.arange(out_size)
+    scale = np.float32(in_size) / np.float32(out_size)
+    idx = np.floor(np.arange(out_size, dtype=np.float32) * scale).astype(np.int64)
+    return np.minimum(idx, in_size - 1)
+
+
+def _instance_crops(results, H_orig: int, W_orig: int) -> List[Crop]:
+    """
+    ネットワーク出力のマスク (N, H_net, W_net) を元画像サイズへ最近傍補間し、
+    インスタンスごとの外接矩形で切り出す（元画像サイズの N × H × W 配列は作らない）
+    """
+    if getattr(results, 'masks', None) is None or results.masks.data.numel() == 0:
+        return []
+    data = results.masks.data
+    # ultralytics 8.3 以降は 0/1 の uint8。float と比較すると全画素が float に昇格するため避ける
+    masks_net = (data.bool() if not data.is_floating_point() else data > 0.5).cpu().numpy()
+    _, h_net, w_net = masks_net.shape
+    rows = _nearest_index(H_orig, h_net)
+    cols = _nearest_index(W_orig, w_net)
+    empty = (np.zeros((0, 0), dtype=bool), 0, 0)
+    crops: List[Crop] = []
+    for m in masks_net:
+        ys = np.flatnonzero(m.any(axis=1))
+        xs = np.flatnonzero(m.any(axis=0))
+        if len(ys) == 0:
+            crops.append(empty)
+            continue
+        # 参照元が外接矩形に入る出力画素の範囲（rows / cols は単調なので連続する）
+        y_out = np.flatnonzero((rows >= ys[0]) & (rows <= ys[-1]))
+        x_out = np.flatnonzero((cols >= xs[0]) & (cols <= xs[-1]))
+        if len(y_out) == 0 or len(x_out) == 0:
+            crops.append(empty)
+            continue
+        if H_orig == h_net and W_orig == w_net:
+            crop = m[y_out[0]:y_out[-1] + 1, x_out[0]:x_out[-1] + 1]  # タイル = 入力サイズの場合は補間なし
         else:
-            center_x = center_y = None
-        centers.append((center_x, center_y))
+            crop = m.take(rows[y_out[0]:y_out[-1] + 1], axis=0).take(cols[x_out[0]:x_out[-1] + 1], axis=1)
+        # 縮小時は端の行・列が間引かれることがあるため詰め直す
+        cy = np.flatnonzero(crop.any(axis=1))
+        cx = np.flatnonzero(crop.any(axis=0))
+        if len(cy) == 0:
+            crops.append(empty)
+            continue
+        crops.append((crop[cy[0]:cy[-1] + 1, cx[0]:cx[-1] + 1],
+                      int(x_out[0] + cx[0]), int(y_out[0] + cy[0])))
+    return crops
+
+
+def _crop_center(crop: np.ndarray, x: int, y: int) -> Tuple[Optional[int], Optional[int]]:
+    """画像モーメント (m10/m00, m01/m00) から重心を計算（元画像座標系）"""
+    area = int(np.count_nonzero(crop))
+    if area == 0:
+        return (None, None)
+    h, w = crop.shape
+    m10 = int(crop.sum(axis=0, dtype=np.int64) @ np.arange(x, x + w, dtype=np.int64))
+    m01 = int(crop.sum(axis=1, dtype=np.int64) @ np.arange(y, y + h, dtype=np.int64))
+    return (int(m10 / area), int(m01 / area))
+
+
+def _build_result(img_bgr: np.ndarray, crops: List[Crop]) -> SegResult:
+    """エンコードはせず、遅延エンコーダ付きの RoofMask（外接矩形の切り出し）として返す"""
+    frame_shape = img_bgr.shape[:2]
+    return [RoofMask(mask=crop, center=_crop_center(crop, x, y), image_bgr=img_bgr,
+                     offset=(x, y), frame_shape=frame_shape)
+            for crop, x, y in crops]
+
+
+def process_images(images: List[bytes], conf: float = 0.8) -> List[Union[SegResult, Exception]]:
+    """
+    複数画像をまとめて推論する（マイクロバッチ用）
+    Args:
+        images : アップロード画像（バイト列）のリスト
+        conf   : 信頼度閾値（バッチ内で共通）
+    Returns:
+        画像ごとの RoofMask のリスト。デコードに失敗した画像は
+        その位置に ValueError を返し、他の画像の推論は継続する。
+    """
+    outputs: List[Union[SegResult, Exception]] = [None] * len(images)
+    decoded: List[Tuple[int, np.ndarray]] = []
+    for i, image_bytes in enumerate(images):
+        try:
+            decoded.append((i, _decode_image(image_bytes)))
+        except ValueError as e:
+            outputs[i] = e
+
+    if not decoded:
+        return outputs
+
+    _ensure_model()
+    if USE_MOCK_MODEL:
+        # 模拟模式：返回测试数据
+        print(f"🔧 Mock mode: generating test roof segments (batch={len(decoded)})")
+        for i, img_bgr in decoded:
+            outputs[i] = _build_result(img_bgr, _mock_masks(img_bgr))
+        return outputs
 
-    return png_bytes_list, centers
\ No newline at end of file
+    # 真实模型推论（バッチ全体で 1 回）
+    segmented = segment_decoded([img for _, img in decoded], conf)
+    for (i, _), result in zip(decoded, segmented):
+        outputs[i] = result
+    return outputs
+
+
+def segment_decoded(images_bgr: List[np.ndarray], conf: float, worker_model=None) -> List[SegResult]:
+    """
+    デコード済み画像をまとめて推論し、画像ごとの RoofMask のリストを返す
+    Args:
+        worker_model : 使用する YOLO（省略時はワーカーのモデル。バックエンドの比較用）
+    """
+    segmented: List[Optional[SegResult]] = [None] * len(images_bgr)
+    # 通常サイズの画像は 1 回の predict でまとめて推論する
+    whole = [i for i, img in enumerate(images_bgr) if not tiling.needs_tiling(img.shape, tiling.TILE_MIN_SIDE, tiling.TILE_SIZE)]
+    if whole:
+        batch_results = _predict_batch([images_bgr[i] for i in whole], conf, worker_model)
+        for i, results in zip(whole, batch_results):
+            H_orig, W_orig = images_bgr[i].shape[:2]
+            segmented[i] = _build_result(images_bgr[i], _instance_crops(results, H_orig, W_orig))
+    for i, img_bgr in enumerate(images_bgr):
+        if segmented[i] is None:
+            segmented[i] = _segment_tiled(img_bgr, conf, worker_model)
+    return segmented
+
+
+def _segment_tiled(img_bgr: np.ndarray, conf: float, worker_model=None) -> SegResult:
+    """大きな画像を重なり付きのタイルに分けて ROOF_TILE_BATCH 枚ずつ推論し、継ぎ目をまたぐ屋根を統合する"""
+    H_orig, W_orig = img_bgr.shape[:2]
+    windows = tiling.tile_grid(H_orig, W_orig, tiling.TILE_SIZE, tiling.TILE_OVERLAP)
+    batch = max(1, tiling.TILE_BATCH)
+    instances: List[tiling.TileInstance] = []
+    for start in range(0, len(windows), batch):
+        chunk = windows[start:start + batch]
+        tiles = [np.ascontiguousarray(img_bgr[y:y + h, x:x + w]) for x, y, w, h in chunk]
+        for k, ((x, y, w, h), results) in enumerate(zip(chunk, _predict_batch(tiles, conf, worker_model))):
+            instances.extend(tiling.TileInstance(crop=crop, x=x + cx, y=y + cy, tile=start + k)
+                             for crop, cx, cy in _instance_crops(results, h, w) if crop.size)
+    merged = tiling.merge_instances(instances, tiling.MERGE_THRESHOLD)
+    logger.debug("tiled inference: %dx%d, %d tiles, %d -> %d instances",
+                 W_orig, H_orig, len(windows), len(instances), len(merged))
+    return _build_result(img_bgr, [(m.crop, m.x, m.y) for m in merged])
+
+
+def process_image(image_bytes: bytes, conf: float = 0.8) -> SegResult:
+    """
+    Args:
+        image_bytes : アップロード画像（バイト列）
+        conf        : 信頼度閾値
+    Returns:
+        RoofMask のリスト。各要素は外接矩形で切り出した bool のマスク配列と重心 (x, y)（元画像座標系）を持ち、
+        binary_png() / rgba_png() で必要な形式に 1 回だけエンコードできる
+    """
+    output = process_images([image_bytes], conf=conf)[0]
+    if isinstance(output, Exception):
+        raise output
+    return output
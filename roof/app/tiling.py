@@ -0,0 +1,141 @@
+# tiling.py
+"""
+大きな航空写真のタイル分割推論
+Overlapping tiles for very large aerial images and seam merging of instance masks
+
+YOLO は入力を 640px に縮小するため、数千 px 四方のオルソ画像をそのまま推論すると
+小さな屋根が潰れる。長辺が ROOF_TILE_MIN_SIDE を超える画像は重なり付きのタイルに
+分割してまとめて推論し、タイルの継ぎ目をまたぐ屋根は重なり領域でのマスクの一致から
+同一インスタンスと判定して和集合で統合する。マスクは各インスタンスの外接矩形の
+切り出し（と位置）で扱い、元画像サイズの配列は作らない。
+
+設定（環境変数）:
+    ROOF_TILE_SIZE     : タイルの一辺 px (default 640 = YOLO の入力サイズ)
+    ROOF_TILE_OVERLAP  : 隣接タイルの重なり px (default 128)。屋根 1 棟より広くしておくと統合が安定する
+    ROOF_TILE_MIN_SIDE : 長辺がこれを超える画像だけ分割する (default 1280, 0 = 分割しない)
+    ROOF_TILE_BATCH    : 1 回の predict に渡すタイル数 (default 8)
+    ROOF_TILE_MERGE    : 重なり領域で小さい方のマスクに対する共通部分の割合がこれ以上なら統合 (default 0.5)
+"""
+import os
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+TILE_SIZE = int(os.getenv("ROOF_TILE_SIZE", "640"))
+TILE_OVERLAP = int(os.getenv("ROOF_TILE_OVERLAP", "128"))
+TILE_MIN_SIDE = int(os.getenv("ROOF_TILE_MIN_SIDE", "1280"))
+TILE_BATCH = int(os.getenv("ROOF_TILE_BATCH", "8"))
+MERGE_THRESHOLD = float(os.getenv("ROOF_TILE_MERGE", "0.5"))
+
+Window = Tuple[int, int, int, int]  # (x, y, w, h)
+
+
+@dataclass
+class TileInstance:
+    """
+    タイル 1 枚から得たインスタンス
+
+    Attributes:
+        crop : 外接矩形で切り出した (h, w) bool マスク
+        x, y : 切り出しの左上（元画像座標系）
+        tile : 検出したタイルの番号（同じタイル内の検出は NMS 済みのため統合しない）
+    """
+    crop: np.ndarray
+    x: int
+    y: int
+    tile: int = 0
+
+    @property
+    def x1(self) -> int:
+        return self.x + self.crop.shape[1]
+
+    @property
+    def y1(self) -> int:
+        return self.y + self.crop.shape[0]
+
+
+def needs_tiling(shape: Sequence[int], min_side: int = TILE_MIN_SIDE, size: int = TILE_SIZE) -> bool:
+    """長辺が min_side を超え、タイルより大きい画像だけを分割する"""
+    return min_side > 0 and size > 0 and max(shape[:2]) > max(min_side, size)
+
+
+def _starts(length: int, size: int, step: int) -> List[int]:
+    if length <= size:
+        return [0]
+    starts = list(range(0, length - size, step))
+    return starts + [length - size]  # 最後のタイルは画像の端に揃える（タイルの大きさを揃える）
+
+
+def tile_grid(height: int, width: int, size: int = TILE_SIZE, overlap: int = TILE_OVERLAP) -> List[Window]:
+    """
+    画像全体を覆う重なり付きのタイル (x, y, w, h) を行優先で返す
+    隣接タイルは少なくとも overlap px 重なる
+    """
+    if not 0 <= overlap < size:
+        raise ValueError(f"ROOF_TILE_OVERLAP must be in [0, ROOF_TILE_SIZE), got {overlap} (size {size})")
+    step = size - overlap
+    return [(x, y, min(size, width), min(size, height))
+            for y in _starts(height, size, step) for x in _starts(width, size, step)]
+
+
+def _same_instance(a: TileInstance, b: TileInstance, threshold: float) -> bool:
+    """外接矩形の共通範囲で、小さい方のマスクの threshold 以上が重なれば同じ屋根とみなす"""
+    x0, y0 = max(a.x, b.x), max(a.y, b.y)
+    x1, y1 = min(a.x1, b.x1), min(a.y1, b.y1)
+    if x0 >= x1 or y0 >= y1:
+        return False
+    pa = a.crop[y0 - a.y:y1 - a.y, x0 - a.x:x1 - a.x]
+    pb = b.crop[y0 - b.y:y1 - b.y, x0 - b.x:x1 - b.x]
+    inter = np.count_nonzero(pa & pb)
+    if inter == 0:
+        return False
+    return inter >= threshold * min(np.count_nonzero(pa), np.count_nonzero(pb))
+
+
+def merge_instances(instances: List[TileInstance], threshold: float = MERGE_THRESHOLD) -> List[TileInstance]:
+    """
+    タイルの継ぎ目をまたぐ同一の屋根を統合する
+    異なるタイルで検出され重なり領域のマスクが一致するインスタンスを連結し（推移的）、
+    各グループのマスクの和集合を返す。順序は各グループの最初の検出順
+    """
+    n = len(instances)
+    if n < 2:
+        return list(instances)
+    parent = list(range(n))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    boxes = np.array([(m.x, m.y, m.x1, m.y1) for m in instances])
+    tiles = np.array([m.tile for m in instances])
+    for i in range(n - 1):
+        # 外接矩形が重なる、別タイルの検出だけをマスクで比較する
+        rest = np.arange(i + 1, n)
+        hit = ((boxes[rest, 0] < boxes[i, 2]) & (boxes[rest, 2] > boxes[i, 0])
+               & (boxes[rest, 1] < boxes[i, 3]) & (boxes[rest, 3] > boxes[i, 1])
+               & (tiles[rest] != tiles[i]))
+        for j in rest[hit]:
+            ri, rj = find(i), find(int(j))
+            if ri != rj and _same_instance(instances[i], instances[j], threshold):
+                parent[max(ri, rj)] = min(ri, rj)
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(instances[i])
+    merged = []
+    for root in sorted(groups):
+        members = groups[root]
+        if len(members) == 1:
+            merged.append(members[0])
+            continue
+        x0, y0 = min(m.x for m in members), min(m.y for m in members)
+        x1, y1 = max(m.x1 for m in members), max(m.y1 for m in members)
+        crop = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        for m in members:
+            crop[m.y - y0:m.y1 - y0, m.x - x0:m.x1 - x0] |= m.crop
+        merged.append(TileInstance(crop=crop, x=x0, y=y0, tile=members[0].tile))
+    return merged
@@ -0,0 +1,92 @@
+# workers.py
+"""
+推論ワーカープール
+Bounded worker pool that runs YOLO inference off the FastAPI event loop
+
+設定（環境変数）:
+    ROOF_INFER_EXECUTOR : "thread" または "process" (default thread)
+    ROOF_INFER_WORKERS  : ワーカー数 (default 1)
+    ROOF_MAX_INFLIGHT   : 受け付け中（キュー待ち + 推論中）リクエスト数の上限。
+                          超過時は Retry-After 付きで拒否する (default: キュー上限 + ワーカー数 × バッチ上限)
+    ROOF_OVERLOAD_STATUS: 過負荷時に返す HTTP ステータス 429 / 503 (default 503)
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INFER_EXECUTOR = os.getenv("ROOF_INFER_EXECUTOR", "thread").lower()
+INFER_WORKERS = int(os.getenv("ROOF_INFER_WORKERS", "1"))
+MAX_INFLIGHT = int(os.getenv("ROOF_MAX_INFLIGHT", "0"))  # 0 = 自動
+OVERLOAD_STATUS = int(os.getenv("ROOF_OVERLOAD_STATUS", "503"))
+
+
+def _init_worker(per_thread_model: bool) -> None:
+    # 各ワーカーでモデルを読み込み、ウォームアップ推論を行う
+    from app import segmentation
+    segmentation.init_worker(per_thread_model=per_thread_model)
+
+
+def _worker_status() -> Dict[str, Any]:
+    from app import segmentation
+    return segmentation.model_status()
+
+
+class InferencePool:
+    """
+    スレッド / プロセスプールのラッパー
+
+    Args:
+        kind    : "thread" または "process"
+        workers : ワーカー数
+    """
+
+    def __init__(self, kind: str = INFER_EXECUTOR, workers: int = INFER_WORKERS):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"ROOF_INFER_EXECUTOR must be 'thread' or 'process', got: {kind}")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        """初回アクセス時にプールを生成（lifespan を経由しない TestClient 等でも動作させる）"""
+        if self._executor is None:
+            if self.kind == "process":
+                # torch のスレッド状態を fork で引き継がないよう spawn を使用
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(False,),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="roof-infer",
+                    initializer=_init_worker,
+                    initargs=(self.workers > 1,),
+                )
+        return self._executor
+
+    async def prewarm(self) -> List[Dict[str, Any]]:
+        """
+        全ワーカーを起動し、モデル読込とウォームアップ推論を完了させる
+        Returns:
+            各ワーカーのモデル状態（segmentation.model_status()）
+        """
+        loop = asyncio.get_running_loop()
+        statuses = await asyncio.gather(*[loop.run_in_executor(self.executor, _worker_status)
+                                          for _ in range(self.workers)])
+        logger.info("inference pool started: executor=%s workers=%d", self.kind, self.workers)
+        return list(statuses)
+
+    def shutdown(self) -> None:
+        """処理中のバッチを完了させてからプールを停止する"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
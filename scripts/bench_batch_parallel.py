@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+批量パネル計算の並列化ベンチマーク
+Benchmark: wall-clock time of the /calculate_panels batch path vs worker count
+
+create_roof_mask の各形状を RLE で渡し、iter_roof_results をワーカー数ごとに実行する。
+プールの起動時間を除くため、計測前に 1 回ウォームアップする。
+
+Usage:
+  python scripts/bench_batch_parallel.py [--roofs 30] [--size 600 800] [--workers 1 2 4]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / 'panel_count'))
+
+from api_integration import iter_roof_results, shutdown_batch_pool
+from mask_codec import encode_mask
+from roof_io import create_roof_mask
+
+SHAPES = ["original_sample", "kiritsuma_side", "yosemune_main", "katanagare", "rikuyane"]
+PANEL_OPTIONS = {"Standard_A": (1.65, 1.0), "Standard_B": (1.0, 1.0), "Large": (2.0, 1.0)}
+
+
+def run(roof_masks, workers, gsd):
+    start = time.perf_counter()
+    results = list(iter_roof_results(roof_masks, gsd, 1.0, 0.02, PANEL_OPTIONS, workers=workers))
+    elapsed = time.perf_counter() - start
+    return elapsed, [r.get("max_count") for r in results]
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--roofs', type=int, default=30)
+    p.add_argument('--size', type=int, nargs=2, default=[600, 800], metavar=('H', 'W'))
+    p.add_argument('--gsd', type=float, default=0.05)
+    p.add_argument('--workers', type=int, nargs='+', default=None)
+    args = p.parse_args()
+
+    # ワーカープロセス側のログはそのまま出力される
+    logging.disable(logging.INFO)
+    cores = os.cpu_count() or 1
+    worker_counts = args.workers or sorted({1, 2, 4, cores})
+
+    roof_masks = [encode_mask(create_roof_mask(SHAPES[i % len(SHAPES)], tuple(args.size)), "rle")
+                  for i in range(args.roofs)]
+
+    print(f"{args.roofs} roofs of {args.size[0]}x{args.size[1]} px, gsd={args.gsd}, cpu cores={cores}")
+    print(f"{'workers':>7} {'wall s':>8} {'roofs/s':>8} {'speedup':>8}")
+    baseline = expected = None
+    for workers in worker_counts:
+        run(roof_masks[:workers], workers, args.gsd)  # プール起動のウォームアップ
+        elapsed, counts = run(roof_masks, workers, args.gsd)
+        if baseline is None:
+            baseline, expected = elapsed, counts
+        assert counts == expected, "parallel results differ from serial"
+        print(f"{workers:>7} {elapsed:>8.2f} {args.roofs / elapsed:>8.1f} {baseline / elapsed:>7.2f}x")
+
+    shutdown_batch_pool()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+/segment_masks のマスクエンコード方式ベンチマーク
+Benchmark: per-mask latency of the legacy RGBA round-trip vs direct binary PNG
+
+legacy : RGBA キャンバス → PIL PNG エンコード → cv2.imdecode → α 抽出 → グレースケール PNG 再エンコード
+direct : RoofMask.binary_png()（マスク配列から 1 回だけエンコード）
+
+Usage:
+  python scripts/bench_mask_encoding.py [--repeat 50]
+"""
+
+import argparse
+import glob
+import io
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / 'roof'))
+
+from app.masks import RoofMask
+
+
+def load_samples():
+    """panel_count/sample の画像から (名前, BGR 画像, bool マスク) を作る"""
+    samples = []
+    for path in sorted(glob.glob(str(REPO_ROOT / 'panel_count' / 'sample' / '*.png'))):
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            continue
+        if img.ndim == 3 and img.shape[2] == 4:
+            # セグメント画像: α チャンネルがマスク
+            mask = img[..., 3] > 0
+            bgr = img[..., :3].copy()
+        else:
+            # 全体画像: 中央の矩形をマスクとする（モックモードと同じ形）
+            bgr = img if img.ndim == 3 else cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+            h, w = bgr.shape[:2]
+            mask = np.zeros((h, w), dtype=bool)
+            mask[h // 4:3 * h // 4, w // 4:3 * w // 4] = True
+        samples.append((Path(path).name, bgr, mask))
+    return samples
+
+
+def legacy_roundtrip(bgr, mask):
+    """変更前の process_image + /segment_masks と同じ処理"""
+    H, W = mask.shape
+    canvas = np.zeros((H, W, 4), dtype=np.uint8)
+    canvas[..., :3] = bgr
+    canvas[..., 3] = mask.astype(np.uint8) * 255
+    buf = io.BytesIO()
+    Image.fromarray(cv2.cvtColor(canvas, cv2.COLOR_BGRA2RGBA)).save(buf, format="PNG")
+    img = cv2.imdecode(np.frombuffer(buf.getvalue(), np.uint8), cv2.IMREAD_UNCHANGED)
+    alpha = (img[:, :, 3] > 0).astype(np.uint8) * 255
+    return cv2.imencode('.png', alpha)[1].tobytes()
+
+
+def direct_binary(bgr, mask):
+    return RoofMask(mask=mask, center=(None, None), image_bgr=bgr).binary_png()
+
+
+def time_per_call(fn, bgr, mask, repeat):
+    fn(bgr, mask)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(bgr, mask)
+    return (time.perf_counter() - start) / repeat * 1000.0
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--repeat', type=int, default=50)
+    args = p.parse_args()
+
+    samples = load_samples()
+    if not samples:
+        print("No sample images found under panel_count/sample")
+        return 1
+
+    print(f"{'sample':<55} {'size':>9} {'legacy ms':>10} {'direct ms':>10} {'saved ms':>9}")
+    total_legacy = total_direct = 0.0
+    for name, bgr, mask in samples:
+        # 出力が同一であることを確認
+        legacy_mask = cv2.imdecode(np.frombuffer(legacy_roundtrip(bgr, mask), np.uint8), cv2.IMREAD_UNCHANGED)
+        direct_mask = cv2.imdecode(np.frombuffer(direct_binary(bgr, mask), np.uint8), cv2.IMREAD_UNCHANGED)
+        assert np.array_equal(legacy_mask, direct_mask), name
+
+        t_legacy = time_per_call(legacy_roundtrip, bgr, mask, args.repeat)
+        t_direct = time_per_call(direct_binary, bgr, mask, args.repeat)
+        total_legacy += t_legacy
+        total_direct += t_direct
+        size = f"{mask.shape[1]}x{mask.shape[0]}"
+        print(f"{name[:55]:<55} {size:>9} {t_legacy:>10.3f} {t_direct:>10.3f} {t_legacy - t_direct:>9.3f}")
+
+    n = len(samples)
+    print(f"\nmean per mask: legacy {total_legacy / n:.3f} ms, direct {total_direct / n:.3f} ms, "
+          f"saved {(total_legacy - total_direct) / n:.3f} ms ({total_legacy / max(total_direct, 1e-9):.1f}x)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+屋根マスク転送形式のベンチマーク
+Benchmark: JSON payload size and encode/decode latency per mask transport format
+
+png      : 0/255 グレースケール PNG の data URI（従来形式）
+rle      : COCO 形式の非圧縮 RLE
+packbits : np.packbits + Base64
+polygon  : 輪郭ポリゴン
+
+Usage:
+  python scripts/bench_mask_transport.py [--repeat 50]
+"""
+
+import argparse
+import glob
+import json
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / 'panel_count'))
+
+from mask_codec import MASK_FORMATS, decode_mask, encode_mask
+
+
+def load_masks():
+    """panel_count のサンプルから (名前, bool マスク) を作る"""
+    masks = []
+    for path in sorted(glob.glob(str(REPO_ROOT / 'panel_count' / 'sample' / '*.png'))):
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if img is None or img.ndim != 3 or img.shape[2] != 4:
+            continue
+        # セグメント画像: α チャンネルがマスク
+        masks.append((Path(path).name, img[..., 3] > 0))
+    roof = cv2.imread(str(REPO_ROOT / 'panel_count' / 'sample_roof.png'), cv2.IMREAD_GRAYSCALE)
+    if roof is not None:
+        masks.append(('sample_roof.png', roof > 127))
+    return masks
+
+
+def time_ms(fn, arg, repeat):
+    fn(arg)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    return (time.perf_counter() - start) / repeat * 1000.0
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--repeat', type=int, default=50)
+    args = p.parse_args()
+
+    masks = load_masks()
+    if not masks:
+        print("No sample masks found under panel_count/")
+        return 1
+
+    totals = {fmt: [0, 0.0, 0.0] for fmt in MASK_FORMATS}
+    print(f"{'sample':<40} {'format':<9} {'bytes':>9} {'ratio':>6} {'enc ms':>8} {'dec ms':>8} {'exact':>6}")
+    for name, mask in masks:
+        png_size = None
+        for fmt in MASK_FORMATS:
+            payload = encode_mask(mask, fmt)
+            size = len(json.dumps(payload, separators=(',', ':')))
+            png_size = png_size or size
+            exact = np.array_equal(decode_mask(payload) > 0, mask)
+            t_enc = time_ms(lambda m: encode_mask(m, fmt), mask, args.repeat)
+            t_dec = time_ms(decode_mask, payload, args.repeat)
+            totals[fmt][0] += size
+            totals[fmt][1] += t_enc
+            totals[fmt][2] += t_dec
+            print(f"{name[:40]:<40} {fmt:<9} {size:>9} {size / png_size:>6.2f} "
+                  f"{t_enc:>8.3f} {t_dec:>8.3f} {str(exact):>6}")
+
+    n = len(masks)
+    png_total = totals['png'][0]
+    print(f"\nmean per mask over {n} samples:")
+    for fmt, (size, t_enc, t_dec) in totals.items():
+        print(f"  {fmt:<9} {size / n:>10.0f} bytes ({size / png_total:.2f}x png)  "
+              f"encode {t_enc / n:.3f} ms  decode {t_dec / n:.3f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+パネルカタログ評価のベンチマーク
+Benchmark: /rank_panels catalog sweep, N SKUs on one roof mask
+
+2 種類のカタログを測る:
+  catalog : 市販モジュールの代表的な寸法（60/72 セル、ハーフカット等）にメーカー間の寸法差
+            （既定 ±20 mm、--spread-mm）と出力違いを加えて N 件生成（ピクセル寸法は 20 種類前後に重なる）
+  random  : 寸法を一様乱数で生成し、出力を面積に比例させる。ピクセル寸法がほとんど重ならず、
+            全 SKU の効率がほぼ同じになる最悪ケース
+
+それぞれ既定の評価（上位 top_k 件のみ配置、残りは格子配置の目安）と exact_counts=True（全 SKU を配置）の
+時間、異なるピクセル寸法の数と実際に配置した寸法の数、上位 top_k 件が一致するかを表示する。
+
+Usage:
+  python scripts/bench_panel_catalog.py [--skus 500] [--size 1000 1000] [--gsd 0.05] [--spread-mm 20]
+                                        [--dims catalog|random|both]
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / 'panel_count'))
+
+from api_integration import app, rank_panel_catalog
+from mask_codec import encode_mask
+from roof_io import create_roof_mask
+
+# (長さ m, 幅 m, 出力 W の範囲)
+MODULE_FORMATS = [
+    (1.65, 0.99, (270, 340)),   # 60 セル
+    (1.96, 0.99, (330, 410)),   # 72 セル
+    (1.72, 1.13, (390, 430)),   # 108 ハーフカット
+    (1.76, 1.05, (360, 400)),   # 120 ハーフカット
+    (2.09, 1.04, (440, 480)),   # 144 ハーフカット
+    (2.28, 1.13, (530, 570)),   # 182 mm セル
+    (2.38, 1.30, (580, 670)),   # 210 mm セル
+]
+
+
+def make_catalog(n, random_dims, spread_mm=20, seed=0):
+    rng = np.random.default_rng(seed)
+    catalog = []
+    for i in range(n):
+        if random_dims:
+            length, width = rng.uniform(1.6, 2.4), rng.uniform(0.99, 1.3)
+            power = 200 * length * width
+        else:
+            length, width, (lo, hi) = MODULE_FORMATS[i % len(MODULE_FORMATS)]
+            length += rng.integers(-spread_mm, spread_mm + 1) / 1000.0
+            width += rng.integers(-spread_mm, spread_mm + 1) / 1000.0
+            power = rng.integers(lo, hi + 1)
+        catalog.append({"name": f"SKU{i:04d}", "length": round(float(length), 3),
+                        "width": round(float(width), 3), "power_w": float(power)})
+    return catalog
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--skus', type=int, default=500)
+    p.add_argument('--size', type=int, nargs=2, default=[1000, 1000], metavar=('H', 'W'))
+    p.add_argument('--gsd', type=float, default=0.05)
+    p.add_argument('--shape', default='original_sample')
+    p.add_argument('--top-k', type=int, default=5)
+    p.add_argument('--spread-mm', type=int, default=20, help='代表寸法からのメーカー間の寸法差 (mm)')
+    p.add_argument('--dims', choices=('catalog', 'random', 'both'), default='both',
+                   help='catalog: 代表寸法 ± spread / random: 一様乱数の寸法（最悪ケース）')
+    p.add_argument('--repeat', type=int, default=3)
+    args = p.parse_args()
+
+    logging.disable(logging.INFO)
+    mask = create_roof_mask(args.shape, tuple(args.size))
+    client = app.test_client()
+    print(f"{args.skus} SKUs, mask {args.size[0]}x{args.size[1]} ({args.shape}), gsd={args.gsd}, top_k={args.top_k}")
+
+    for dims in (('catalog', 'random') if args.dims == 'both' else (args.dims,)):
+        catalog = make_catalog(args.skus, dims == 'random', args.spread_mm)
+        timings = {}
+        for exact_counts in (False, True):
+            best = float('inf')
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = rank_panel_catalog(mask, args.gsd, catalog, top_k=args.top_k, exact_counts=exact_counts)
+                best = min(best, time.perf_counter() - start)
+            timings[exact_counts] = (best, result)
+        (fast_s, result), (exact_s, exact) = timings[False], timings[True]
+
+        # HTTP 経由（RLE マスクのデコードと JSON 化を含む）
+        payload = {"roof_mask": encode_mask(mask, "rle"), "gsd": args.gsd, "catalog": catalog, "top_k": args.top_k}
+        start = time.perf_counter()
+        response = client.post('/rank_panels', json=payload)
+        http_s = time.perf_counter() - start
+        assert response.status_code == 200 and response.get_json()["ranking"] == result["ranking"]
+
+        top = [entry["panel_name"] for entry in result["ranking"][:args.top_k]]
+        same = top == [entry["panel_name"] for entry in exact["ranking"][:args.top_k]]
+        label = "random" if dims == 'random' else f"catalog ±{args.spread_mm} mm"
+        print(f"\n[{label} dims] {result['unique_panel_sizes']} distinct pixel sizes, "
+              f"{result['placed_panel_sizes']} placed")
+        print(f"rank_panel_catalog: {fast_s * 1000:.0f} ms, exact_counts=True: {exact_s * 1000:.0f} ms "
+              f"(best of {args.repeat}), POST /rank_panels: {http_s * 1000:.0f} ms, "
+              f"response {len(response.get_data())} bytes")
+        print(f"top_k_exact={result['top_k_exact']}, top {args.top_k} same as exact_counts: {same}")
+        print(f"{'rank':>4} {'sku':<8} {'size m':>11} {'W':>5} {'count':>6} {'kW':>8} {'area ratio':>10}")
+        for entry in result["ranking"][:args.top_k]:
+            size = f"{entry['panel_size'][0]:.3f}x{entry['panel_size'][1]:.3f}"
+            print(f"{entry['rank']:>4} {entry['panel_name']:<8} {size:>11} {entry['power_w']:>5.0f} "
+                  f"{entry['count']:>6} {entry['kw']:>8.2f} {entry['effective_area_ratio']:>10.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+屋根マスクの切り出しによる配置計算の比較
+Benchmark: full-frame vs bounding-box-cropped PlacementContext per roof segment
+
+panel_count/sample の "* Segment *.png"（1 枚の画像から得た屋根ごとの RGBA。α がマスク）を、
+元の解像度のままファイル名の中心座標の位置で推論画像と同じ大きさのフレームに置き、画像全体で
+計算する場合（crop=False）と外接矩形の切り出しで計算する場合（既定）について、
+二値化・腐食・配置（/calculate_panels の既定パネル 3 種 × 縦横）の時間と NumPy の
+ピークメモリ（tracemalloc）を比較する。パネル位置が一致することも確認する。
+
+Usage:
+  python scripts/bench_panel_crop.py [--frame 640 2560] [--scale 1] [--gsd 0.2] [--offset 1.0] [--repeat 5]
+"""
+
+import argparse
+import glob
+import logging
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / 'panel_count'))
+
+from geometry import PlacementContext, pixels_from_meters
+
+PANEL_OPTIONS = {
+    "Sharp_NQ-256AF": (1.318, 0.990),
+    "Standard_A": (1.65, 0.99),
+    "Standard_B": (1.50, 0.80),
+}
+PANEL_SPACING_M = 0.02
+
+
+def load_segments(frame, scale):
+    """各セグメントを frame × frame の画像の中心座標の位置に置いたマスク"""
+    segments = []
+    for path in sorted(glob.glob(str(REPO_ROOT / 'panel_count' / 'sample' / '*Segment*.png'))):
+        name = Path(path).name.split(' center')[0]
+        cx, cy = (int(v) * scale for v in re.search(r"'x' (\d+), 'y' (\d+)", Path(path).name).groups())
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        roof = ((image[..., 3] if image.ndim == 3 and image.shape[2] == 4 else image) > 127).astype(np.uint8) * 255
+        roof = cv2.resize(roof, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+        h, w = roof.shape
+        x0, y0 = min(max(cx - w // 2, 0), frame - w), min(max(cy - h // 2, 0), frame - h)
+        mask = np.zeros((frame, frame), dtype=np.uint8)
+        mask[y0:y0 + h, x0:x0 + w] = roof
+        segments.append((name, mask))
+    return segments
+
+
+def place(mask, offset_px, gsd, crop):
+    ctx = PlacementContext(mask, offset_px, crop=crop)
+    layouts = []
+    for length, width in PANEL_OPTIONS.values():
+        w_px = pixels_from_meters(width + PANEL_SPACING_M, gsd)
+        l_px = pixels_from_meters(length + PANEL_SPACING_M, gsd)
+        best = ctx.best_layout(w_px, l_px)
+        layouts.append((best["count"], best["panels"]))
+    return layouts
+
+
+def measure(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best * 1000.0, peak / 2**20, result
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--frame', type=int, nargs='+', default=[640, 2560], help="inference image sizes (px)")
+    p.add_argument('--scale', type=int, default=1, help="upscale the sample segments (higher resolution imagery)")
+    p.add_argument('--gsd', type=float, default=0.2)
+    p.add_argument('--offset', type=float, default=1.0)
+    p.add_argument('--repeat', type=int, default=5)
+    args = p.parse_args()
+
+    logging.disable(logging.INFO)
+    offset_px = pixels_from_meters(args.offset, args.gsd)
+    print(f"gsd {args.gsd} m/px, setback {offset_px}px, panels: {', '.join(PANEL_OPTIONS)}")
+    print(f"{'segment':<12} {'frame':>6} {'roof px':>8} {'full ms':>8} {'crop ms':>8} {'speedup':>8} "
+          f"{'full MB':>8} {'crop MB':>8} {'same':>5}")
+    for frame in args.frame:
+        totals = [0.0, 0.0]
+        for name, mask in load_segments(frame, args.scale):
+            full_ms, full_mb, full = measure(lambda: place(mask, offset_px, args.gsd, False), args.repeat)
+            crop_ms, crop_mb, cropped = measure(lambda: place(mask, offset_px, args.gsd, True), args.repeat)
+            totals[0] += full_ms
+            totals[1] += crop_ms
+            print(f"{name:<12} {frame:>6} {int(np.count_nonzero(mask)):>8} {full_ms:>8.2f} {crop_ms:>8.2f} "
+                  f"{full_ms / crop_ms:>7.1f}x {full_mb:>8.2f} {crop_mb:>8.3f} {str(full == cropped):>5}")
+        print(f"{'total':<12} {frame:>6} {'':>8} {totals[0]:>8.2f} {totals[1]:>8.2f} {totals[0] / totals[1]:>7.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+ラスター版とポリゴン版の配置エンジンの比較
+Benchmark: raster (summed-area table) vs polygon (roof contour) placement engines
+
+create_roof_mask の各形状を同じ実寸（--size の画素数 × --base-gsd m/px）のまま GSD を
+変えて描き（0.05 → 0.01 m/px で画素数は 25 倍）、/calculate_panels と同じ前処理と配置
+（既定パネル 3 種 × 縦横）の時間と枚数を比較する。ポリゴン版はパネル寸法・セットバックを
+小数のピクセル値のまま使う（engine_pixels）。
+
+Usage:
+  python scripts/bench_panel_engines.py [--gsd 0.05 0.02 0.01] [--mode greedy] [--align] [--repeat 3]
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import cv2
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / 'panel_count'))
+
+from geometry import PLACEMENT_ENGINES, engine_pixels, placement_context
+from roof_io import create_roof_mask
+
+SHAPES = ["original_sample", "kiritsuma_side", "yosemune_main", "katanagare", "rikuyane"]
+PANEL_OPTIONS = {
+    "Sharp_NQ-256AF": (1.318, 0.990),
+    "Standard_A": (1.65, 0.99),
+    "Standard_B": (1.50, 0.80),
+}
+PANEL_SPACING_M = 0.02
+
+
+def place(mask, gsd, offset_m, mode, align, engine):
+    ctx = placement_context(mask, engine_pixels(offset_m, gsd, engine), mode, align, engine)
+    counts = []
+    for length, width in PANEL_OPTIONS.values():
+        best = ctx.best_layout(engine_pixels(width + PANEL_SPACING_M, gsd, engine),
+                               engine_pixels(length + PANEL_SPACING_M, gsd, engine))
+        counts.append(best["count"])
+    return counts
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000.0, result
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--gsd', type=float, nargs='+', default=[0.05, 0.02, 0.01])
+    p.add_argument('--base-gsd', type=float, default=0.05, help="GSD at which --size pixels are drawn")
+    p.add_argument('--size', type=int, nargs=2, default=[400, 500], help="mask size (h w) at --base-gsd")
+    p.add_argument('--offset', type=float, default=0.3)
+    p.add_argument('--mode', choices=['greedy', 'grid'], default='greedy')
+    p.add_argument('--align', action='store_true', help="also try the roof-aligned frame")
+    p.add_argument('--repeat', type=int, default=3)
+    args = p.parse_args()
+
+    logging.disable(logging.INFO)
+    base = {shape: create_roof_mask(shape, tuple(args.size)) for shape in SHAPES}
+    print(f"roofs: {args.size[1] * args.base_gsd:.0f}m x {args.size[0] * args.base_gsd:.0f}m, "
+          f"setback {args.offset}m, mode {args.mode}, align_to_roof {args.align}, panels: {', '.join(PANEL_OPTIONS)}")
+    print(f"{'shape':<16} {'gsd':>6} {'pixels':>10} {'raster ms':>10} {'polygon ms':>11} {'speedup':>8} "
+          f"{'raster counts':>15} {'polygon counts':>15}")
+    for gsd in args.gsd:
+        scale = args.base_gsd / gsd
+        totals = dict.fromkeys(PLACEMENT_ENGINES, 0.0)
+        for shape in SHAPES:
+            mask = cv2.resize(base[shape], None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+            results = {}
+            for engine in PLACEMENT_ENGINES:
+                ms, counts = timed(lambda: place(mask, gsd, args.offset, args.mode, args.align, engine), args.repeat)
+                totals[engine] += ms
+                results[engine] = (ms, counts)
+            (r_ms, r_counts), (p_ms, p_counts) = results["raster"], results["polygon"]
+            print(f"{shape:<16} {gsd:>6.3f} {mask.size:>10} {r_ms:>10.1f} {p_ms:>11.1f} {r_ms / p_ms:>7.1f}x "
+                  f"{'/'.join(map(str, r_counts)):>15} {'/'.join(map(str, p_counts)):>15}")
+        print(f"{'total':<16} {gsd:>6.3f} {'':>10} {totals['raster']:>10.1f} {totals['polygon']:>11.1f} "
+              f"{totals['raster'] / totals['polygon']:>7.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
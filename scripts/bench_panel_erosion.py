@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+セットバックの腐食のベンチマーク
+Benchmark: square-kernel cv2.erode vs distance-transform erosion (square / Euclidean)
+
+create_roof_mask の形状を --scale 倍に拡大したマスクで、マージンごとに
+(a) (2m+1)² の正方形カーネルの cv2.erode、(b) チェビシェフ距離の距離変換（結果が
+(a) と同一であることを確認）、(c) ユークリッド距離の距離変換の時間を比較する。
+カーネルの時間はマージンに比例し、距離変換はマージンに依存しない。erode_with_margin は
+geometry.DISTANCE_EROSION_MIN_PX 以上のマージンで (b) に切り替える。
+
+Usage:
+  python scripts/bench_panel_erosion.py [--shape rikuyane] [--scale 2 8] [--margin 10 40 100 200 400]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / 'panel_count'))
+
+from geometry import DISTANCE_EROSION_MIN_PX, erode_by_distance
+from roof_io import create_roof_mask
+
+
+def best_time(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000.0, result
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--shape', default='rikuyane')
+    p.add_argument('--scale', type=int, nargs='+', default=[2, 8], help="upscale the 400x500 roof mask")
+    p.add_argument('--margin', type=int, nargs='+', default=[10, 40, 100, 200, 400])
+    p.add_argument('--repeat', type=int, default=3)
+    args = p.parse_args()
+
+    base = create_roof_mask(args.shape, (400, 500))
+    print(f"roof: {args.shape}, DISTANCE_EROSION_MIN_PX = {DISTANCE_EROSION_MIN_PX}")
+    print(f"{'size':>10} {'margin':>7} {'kernel ms':>10} {'dist ms':>8} {'same':>5} {'euclid ms':>10}")
+    for scale in args.scale:
+        mask = cv2.resize(base, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+        size = f"{mask.shape[1]}x{mask.shape[0]}"
+        for margin in args.margin:
+            kernel = np.ones((2 * margin + 1, 2 * margin + 1), np.uint8)
+            t_kernel, eroded = best_time(lambda: cv2.erode(mask, kernel), args.repeat)
+            t_dist, by_distance = best_time(lambda: erode_by_distance(mask, margin, "square"), args.repeat)
+            t_euclid, _ = best_time(lambda: erode_by_distance(mask, margin, "euclidean"), args.repeat)
+            same = bool(np.array_equal(eroded, by_distance))
+            print(f"{size:>10} {margin:>7} {t_kernel:>10.1f} {t_dist:>8.1f} {str(same):>5} {t_euclid:>10.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
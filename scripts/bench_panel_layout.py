@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+パネル配置エンジンのベンチマーク
+Benchmark: greedy panel placement, convolve2d (fast) vs summed-area table (sat),
+plus the grid-aligned lattice mode (grid)
+
+create_roof_mask の各形状と panel_count/sample の実マスクについて、複数の GSD で
+縦置き・横置きの配置を計算し、fast と sat の結果が同一であることを確認しながら
+時間を比較する。grid は配置が異なるため枚数と時間のみ示す。
+
+Usage:
+  python scripts/bench_panel_layout.py [--gsd 0.02 0.05 0.1] [--size 1000 1250] [--repeat 3]
+"""
+
+import argparse
+import glob
+import logging
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / 'panel_count'))
+
+from geometry import (calculate_panel_layout_fast, calculate_panel_layout_grid, calculate_panel_layout_sat,
+                      erode_with_margin, pixels_from_meters)
+from roof_io import create_roof_mask
+
+SHAPES = ["original_sample", "kiritsuma_side", "yosemune_main", "katanagare", "rikuyane"]
+PANEL_SIZE = (1.65, 1.0)
+PANEL_SPACING_M = 0.02
+OFFSET_M = 1.0
+
+
+def load_masks(size):
+    masks = [(name, create_roof_mask(name, tuple(size))) for name in SHAPES]
+    for path in sorted(glob.glob(str(REPO_ROOT / 'panel_count' / 'sample' / '*Segment*.png'))):
+        masks.append((Path(path).name.split(' center')[0], create_roof_mask(path)))
+    return [(name, m) for name, m in masks if m is not None]
+
+
+def best_time(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000.0, result
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--gsd', type=float, nargs='+', default=[0.02, 0.05, 0.1])
+    p.add_argument('--size', type=int, nargs=2, default=[1000, 1250], metavar=('H', 'W'))
+    p.add_argument('--repeat', type=int, default=3)
+    args = p.parse_args()
+
+    logging.disable(logging.INFO)
+    masks = load_masks(args.size)
+
+    print(f"{'mask':<20} {'size':>10} {'gsd':>5} {'panel px':>9} {'count':>6} "
+          f"{'fast ms':>9} {'sat ms':>8} {'speedup':>8} {'grid':>6} {'grid ms':>8}")
+    total_fast = total_sat = total_grid = 0.0
+    for gsd in args.gsd:
+        panel_l_px = pixels_from_meters(PANEL_SIZE[0] + PANEL_SPACING_M, gsd)
+        panel_w_px = pixels_from_meters(PANEL_SIZE[1] + PANEL_SPACING_M, gsd)
+        for name, mask in masks:
+            usable = erode_with_margin(mask, pixels_from_meters(OFFSET_M, gsd))
+            for pw, ph in ((panel_w_px, panel_l_px), (panel_l_px, panel_w_px)):
+                t_fast, (n_fast, p_fast) = best_time(lambda: calculate_panel_layout_fast(usable, pw, ph), args.repeat)
+                t_sat, (n_sat, p_sat) = best_time(lambda: calculate_panel_layout_sat(usable, pw, ph), args.repeat)
+                assert n_fast == n_sat and [tuple(map(int, q)) for q in p_fast] == p_sat, (name, gsd, pw, ph)
+                t_grid, (n_grid, _) = best_time(lambda: calculate_panel_layout_grid(usable, pw, ph), args.repeat)
+                total_fast += t_fast
+                total_sat += t_sat
+                total_grid += t_grid
+                size = f"{mask.shape[1]}x{mask.shape[0]}"
+                print(f"{name[:20]:<20} {size:>10} {gsd:>5} {f'{pw}x{ph}':>9} {n_sat:>6} "
+                      f"{t_fast:>9.2f} {t_sat:>8.2f} {t_fast / max(t_sat, 1e-9):>7.1f}x {n_grid:>6} {t_grid:>8.2f}")
+
+    print(f"\ntotal: fast {total_fast:.1f} ms, sat {total_sat:.1f} ms "
+          f"({total_fast / max(total_sat, 1e-9):.1f}x), identical layouts; grid {total_grid:.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
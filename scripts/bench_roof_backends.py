@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+屋根セグメンテーションの推論バックエンド比較
+Benchmark: PyTorch (ultralytics) vs ONNX Runtime vs OpenVINO on CPU
+
+同じ重みを各バックエンドで読み込み（ONNX / OpenVINO は app/backends.py と同じ手順で
+書き出し）、segment_decoded（process_image と同じ後処理）のレイテンシを測る。
+PyTorch との一致は、ネットワーク出力の最大誤差と、検出されたマスクの IoU・重心のずれで示す。
+
+重みは --weights または ROOF_MODEL_PATH。未指定なら乱数初期化の yolov8n-seg で
+速度のみ比較する（検出がないためマスクの一致は示さない）。
+
+Usage:
+  python scripts/bench_roof_backends.py [--weights best.pt] [--images 'dir/*.jpg']
+                                        [--backends torch onnx onnx-int8 openvino openvino-bf16]
+                                        [--threads 0] [--repeat 10] [--batch 4] [--conf 0.5]
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / 'roof'))
+sys.path.insert(0, str(REPO_ROOT / 'tests'))
+
+os.environ.setdefault('USE_MOCK_MODEL', 'true')  # app.segmentation の既定モデルは読み込まない
+
+import cv2
+
+from app import backends, segmentation
+from test_roof_backends import _images, _match, _network_outputs, _synthetic_weights
+
+
+def load_images(pattern):
+    if not pattern:
+        return _images()
+    images = [cv2.imread(p, cv2.IMREAD_COLOR) for p in sorted(glob.glob(pattern))]
+    return [im for im in images if im is not None]
+
+
+def load_backend(weights, name, threads):
+    """'onnx-int8' / 'openvino-bf16' のような名前を backends の設定に変換して読み込む"""
+    backend, _, variant = name.partition('-')
+    backends.ONNX_INT8 = variant == 'int8'
+    backends.OV_PRECISION = variant or 'f32'
+    start = time.perf_counter()
+    model = segmentation._load_yolo(weights, backend=backend, threads=threads)
+    return model, time.perf_counter() - start
+
+
+def timed(fn, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000.0, result
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--weights', default=os.environ.get('ROOF_MODEL_PATH'))
+    p.add_argument('--images', help="glob of aerial images (default: synthetic 640x480)")
+    p.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'onnx-int8', 'openvino', 'openvino-bf16'])
+    p.add_argument('--threads', type=int, default=0, help="intra-op threads (0 = runtime default)")
+    p.add_argument('--repeat', type=int, default=10)
+    p.add_argument('--batch', type=int, default=4)
+    p.add_argument('--conf', type=float, default=0.5)
+    args = p.parse_args()
+
+    logging.disable(logging.WARNING)
+    tmp = tempfile.TemporaryDirectory()
+    backends.EXPORT_DIR = Path(tmp.name) / 'export'
+    weights = Path(args.weights) if args.weights else Path(tmp.name) / 'yolov8n_seg_random.pt'
+    if not args.weights:
+        _synthetic_weights(weights)
+    images = load_images(args.images)
+    batch = (images * args.batch)[:args.batch]
+
+    print(f"weights: {args.weights or 'random yolov8n-seg (speed only)'}, images: {len(images)} "
+          f"{images[0].shape[1]}x{images[0].shape[0]}, threads: {args.threads or 'default'}, cores: {os.cpu_count()}")
+    print(f"{'backend':<14} {'load s':>7} {'1 img ms':>9} {f'batch{args.batch} ms':>10} {'img/s':>7} {'speedup':>8} "
+          f"{'max |dy|':>9} {'masks':>7} {'min IoU':>8} {'max shift':>9}")
+    reference = None
+    for name in args.backends:
+        try:
+            model, load_s = load_backend(weights, name, args.threads)
+        except Exception as e:
+            print(f"{name:<14} skipped: {e}")
+            continue
+        segmentation.segment_decoded(images[:1], args.conf, model)  # 初回の遅延初期化を除く
+        single_ms, _ = timed(lambda: [segmentation.segment_decoded([im], args.conf, model) for im in images],
+                             args.repeat)
+        single_ms /= len(images)
+        batch_ms, _ = timed(lambda: segmentation.segment_decoded(batch, args.conf, model), args.repeat)
+        outputs = [_network_outputs(model, im) for im in images]
+        segmented = segmentation.segment_decoded(images, args.conf, model)
+        if reference is None:
+            reference = (name, single_ms, outputs, segmented)
+        dy = max(float(np.abs(o - r).max()) for out, ref in zip(outputs, reference[2]) for o, r in zip(out, ref))
+        masks = sum(len(s) for s in segmented)
+        matches = [_match(r, s) for r, s in zip(reference[3], segmented) if r and s]
+        min_iou = min((m[0] for m in matches), default=float('nan'))
+        shift = max((m[1] for m in matches), default=float('nan'))
+        print(f"{name:<14} {load_s:>7.2f} {single_ms:>9.1f} {batch_ms:>10.1f} {args.batch * 1000 / batch_ms:>7.1f} "
+              f"{reference[1] / single_ms:>7.2f}x {dy:>9.2e} {masks:>7} {min_iou:>8.3f} {shift:>9}")
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+屋根検出サービスのコールドスタート計測
+Benchmark: cold-start cost of the roof service (import time and time to /ready)
+
+毎回新しいインタプリタで次を計測する:
+  - import app.segmentation / import app.main の時間
+  - lifespan（モデル読込 + ウォームアップ）を含めて /ready が 200 を返すまでの時間
+  - python -X importtime で累積時間の大きいモジュール上位
+
+ROOF_MODEL_PATH を指定すると実モデル、未指定なら CI=1 のモックモードで計測する。
+コールドスタートの回帰を追うため、結果は 1 行ずつ出力する。
+
+Usage:
+  python scripts/bench_roof_startup.py [--repeat 3] [--top 10]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+ROOF_DIR = REPO_ROOT / 'roof'
+
+_TIME_IMPORT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+_TIME_READY = """
+import json, time
+start = time.perf_counter()
+from fastapi.testclient import TestClient
+from app.main import app
+with TestClient(app) as client:
+    ready = client.get('/ready')
+    print(json.dumps({"wall_s": time.perf_counter() - start, "status": ready.status_code, **ready.json()}))
+"""
+
+
+def _env():
+    env = dict(os.environ, PYTHONPATH=str(ROOF_DIR))
+    if not env.get('ROOF_MODEL_PATH'):
+        env['CI'] = '1'
+    return env
+
+
+def _run(code):
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOF_DIR, env=_env(), capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr else f"exit {out.returncode}")
+    return out.stdout.strip().splitlines()[-1]
+
+
+def import_profile(module, top):
+    """-X importtime の出力から累積時間の大きい順に (秒, モジュール) を返す"""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOF_DIR,
+                         env=_env(), capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        rows.append((int(cumulative) / 1e6, name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--top', type=int, default=10)
+    args = p.parse_args()
+
+    mode = os.environ.get('ROOF_MODEL_PATH') or 'mock (CI=1)'
+    print(f"model: {mode}, repeat: {args.repeat} (best of)")
+    for module in ('app.segmentation', 'app.main'):
+        best = min(float(_run(_TIME_IMPORT.format(module=module))) for _ in range(args.repeat))
+        print(f"import {module:<18} {best * 1000:>9.1f} ms")
+
+    runs = [json.loads(_run(_TIME_READY)) for _ in range(args.repeat)]
+    best = min(runs, key=lambda r: r['wall_s'])
+    print(f"start -> /ready {best['status']}   {best['wall_s'] * 1000:>9.1f} ms  "
+          f"(import {best.get('import_time_s', 0) * 1000:.1f} ms, load {best.get('load_time_s', 0) * 1000:.1f} ms, "
+          f"warm-up {best.get('warmup_time_s', 0) * 1000:.1f} ms)")
+
+    print("\nslowest imports under app.main (cumulative):")
+    for seconds, name in import_profile('app.main', args.top):
+        print(f"  {seconds * 1000:>9.1f} ms  {name}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+大きな航空写真のタイル分割推論の比較
+Benchmark: whole-image vs tiled roof inference on a large image
+
+同じ画像を (a) 1 回の predict（YOLO が 640px に縮小）と (b) 重なり付きタイル
+（app/tiling.py）で推論し、レイテンシ・検出数・マスクの保持サイズ（外接矩形の切り出し
+と、従来の N × H × W 配列の比較）・NumPy のピークメモリ（tracemalloc）を表示する。
+
+重みは --weights または ROOF_MODEL_PATH。未指定なら乱数初期化の yolov8n-seg で
+速度のみ比較する。画像は --image（未指定なら合成の 4000x3000）。
+
+Usage:
+  python scripts/bench_roof_tiling.py [--weights best.pt] [--image ortho.jpg]
+                                      [--tile 640] [--overlap 128] [--tile-batch 8] [--conf 0.5]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / 'roof'))
+sys.path.insert(0, str(REPO_ROOT / 'tests'))
+
+os.environ.setdefault('USE_MOCK_MODEL', 'true')  # app.segmentation の既定モデルは読み込まない
+
+import cv2
+
+from app import segmentation, tiling
+from test_roof_backends import _synthetic_weights
+
+
+def synthetic_ortho(h=3000, w=4000, seed=0):
+    """様々な大きさ・色の矩形（屋根）を散らした大きな画像"""
+    rng = np.random.default_rng(seed)
+    image = np.full((h, w, 3), 90, np.uint8)
+    for _ in range(400):
+        x, y = int(rng.integers(0, w - 120)), int(rng.integers(0, h - 120))
+        rw, rh = int(rng.integers(30, 120)), int(rng.integers(30, 120))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(image, (x, y), (x + rw, y + rh), color, -1)
+    return image
+
+
+def run(image, model, conf, tiled):
+    min_side = 1 if tiled else 0
+    with mock.patch.object(tiling, 'TILE_MIN_SIDE', min_side):
+        segmentation.segment_decoded([image], conf, model)  # 初回の遅延初期化を除く
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = segmentation.segment_decoded([image], conf, model)[0]
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--weights', default=os.environ.get('ROOF_MODEL_PATH'))
+    p.add_argument('--image', help="large aerial image (default: synthetic 4000x3000)")
+    p.add_argument('--tile', type=int, default=tiling.TILE_SIZE)
+    p.add_argument('--overlap', type=int, default=tiling.TILE_OVERLAP)
+    p.add_argument('--tile-batch', type=int, default=tiling.TILE_BATCH)
+    p.add_argument('--conf', type=float, default=0.5)
+    args = p.parse_args()
+
+    logging.disable(logging.WARNING)
+    tiling.TILE_SIZE, tiling.TILE_OVERLAP, tiling.TILE_BATCH = args.tile, args.overlap, args.tile_batch
+    tmp = tempfile.TemporaryDirectory()
+    weights = Path(args.weights) if args.weights else Path(tmp.name) / 'yolov8n_seg_random.pt'
+    if not args.weights:
+        _synthetic_weights(weights)
+    model = segmentation._load_yolo(weights, backend='torch')
+    image = cv2.imread(args.image, cv2.IMREAD_COLOR) if args.image else synthetic_ortho()
+    H, W = image.shape[:2]
+    windows = tiling.tile_grid(H, W, args.tile, args.overlap)
+
+    print(f"weights: {args.weights or 'random yolov8n-seg (speed only)'}, image: {W}x{H}, "
+          f"tiles: {len(windows)} x {args.tile}px (overlap {args.overlap}, batch {args.tile_batch}), "
+          f"cores: {os.cpu_count()}")
+    print(f"{'mode':<7} {'time s':>7} {'masks':>6} {'median px':>10} {'crop MB':>8} {'N*H*W MB':>9} {'peak MB':>8}")
+    for name, tiled in (('whole', False), ('tiled', True)):
+        result, elapsed, peak = run(image, model, args.conf, tiled)
+        crop_mb = sum(m.mask.nbytes for m in result) / 2**20
+        full_mb = len(result) * H * W / 2**20
+        median = int(np.median([m.area for m in result])) if result else 0
+        print(f"{name:<7} {elapsed:>7.2f} {len(result):>6} {median:>10} {crop_mb:>8.2f} {full_mb:>9.1f} "
+              f"{peak / 2**20:>8.1f}")
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
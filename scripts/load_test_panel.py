@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+パネル計算API の負荷テスト
+Load test: /calculate_panels throughput under gunicorn with 1..N workers
+
+ワーカー数ごとに gunicorn（panel_count/gunicorn.conf.py）を起動し、/health が
+応答するまで待ってから、複数スレッドで /calculate_panels に一定時間 POST し続けて
+req/s とレイテンシ (p50 / p99) を測る。結果キャッシュは無効にする
+（同じマスクの繰り返しでキャッシュに当たると計算を測れないため）。
+最後に SIGTERM を送り、処理中のリクエストを待って停止することを確認する。
+
+Usage:
+  python scripts/load_test_panel.py [--workers 1 2 4] [--concurrency 8] [--duration 10]
+                                    [--size 1000 1250] [--gsd 0.05] [--port 18001]
+"""
+
+import argparse
+import base64
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import requests
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+PANEL_DIR = REPO_ROOT / 'panel_count'
+sys.path.insert(0, str(PANEL_DIR))
+
+from roof_io import create_roof_mask
+
+SHAPES = ["original_sample", "kiritsuma_side", "yosemune_main", "katanagare", "rikuyane"]
+
+
+def build_payloads(size, gsd):
+    payloads = []
+    for name in SHAPES:
+        ok, buf = cv2.imencode('.png', create_roof_mask(name, tuple(size)))
+        payloads.append({
+            "roof_mask": base64.b64encode(buf.tobytes()).decode(),
+            "gsd": gsd,
+            "include_visualization": False
+        })
+    return payloads
+
+
+def start_server(workers, port):
+    env = dict(os.environ, PANEL_WORKERS=str(workers), PANEL_PORT=str(port), PANEL_CACHE_SIZE='0',
+               PANEL_LOG_LEVEL='warning', PANEL_ACCESS_LOG='')
+    # アプリのログはリクエストごとに出るため、負荷テスト中は捨てる
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'api_integration:app'],
+                            cwd=PANEL_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {proc.returncode}")
+        try:
+            if requests.get(f"{url}/health", timeout=1).ok:
+                return proc, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("gunicorn did not become healthy")
+
+
+def run_load(url, payloads, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(i):
+        session = requests.Session()
+        k = i
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                ok = session.post(f"{url}/calculate_panels", json=payloads[k % len(payloads)], timeout=120).ok
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+            k += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    latencies.sort()
+    pct = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000.0 if latencies else float('nan')
+    return len(latencies) / wall, pct(0.5), pct(0.99), len(latencies), errors[0]
+
+
+def stop_server(proc, url, payload):
+    # 処理中のリクエストがある状態で SIGTERM を送り、正常に完了することを確認する
+    result = {}
+    inflight = threading.Thread(target=lambda: result.update(
+        status=requests.post(f"{url}/calculate_panels", json=payload, timeout=120).status_code))
+    inflight.start()
+    time.sleep(0.05)
+    proc.send_signal(signal.SIGTERM)
+    inflight.join()
+    proc.wait(timeout=60)
+    return result.get('status'), proc.returncode
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    p.add_argument('--concurrency', type=int, default=8)
+    p.add_argument('--duration', type=float, default=10.0)
+    p.add_argument('--size', type=int, nargs=2, default=[1000, 1250], metavar=('H', 'W'))
+    p.add_argument('--gsd', type=float, default=0.05)
+    p.add_argument('--port', type=int, default=18001)
+    args = p.parse_args()
+
+    payloads = build_payloads(args.size, args.gsd)
+    print(f"cpu cores: {os.cpu_count()}, concurrency: {args.concurrency}, duration: {args.duration:g}s")
+    print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'ok':>6} {'errors':>6} {'drain':>12}")
+    base = None
+    for workers in args.workers:
+        proc, url = start_server(workers, args.port)
+        try:
+            rps, p50, p99, ok, errors = run_load(url, payloads, args.concurrency, args.duration)
+        finally:
+            status, code = stop_server(proc, url, payloads[0])
+        base = base or rps
+        print(f"{workers:>7} {rps:>8.2f} {p50:>8.1f} {p99:>8.1f} {ok:>6} {errors:>6} "
+              f"{f'{status}/exit {code}':>12}   ({rps / base:.2f}x)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
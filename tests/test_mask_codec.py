@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Roof mask transport format tests
+屋根マスク転送形式のテスト
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / 'panel_count'))
+
+import mask_codec
+from mask_codec import MASK_FORMATS, MAX_MASK_PIXELS, decode_mask, encode_mask
+
+
+def _sample_masks():
+    empty = np.zeros((5, 7), dtype=bool)
+    full = np.ones((5, 7), dtype=bool)
+    # 穴とその中の島を持つ円形マスク
+    ring = np.zeros((120, 160), dtype=np.uint8)
+    cv2.circle(ring, (80, 60), 50, 1, -1)
+    ring[40:80, 60:100] = 0
+    ring[55:65, 75:85] = 1
+    return [empty, full, ring.astype(bool)]
+
+
+class TestMaskCodec(unittest.TestCase):
+    """各形式のエンコード → デコードで元のマスクに戻ること"""
+
+    def test_roundtrip_all_formats(self):
+        for fmt in MASK_FORMATS:
+            for mask in _sample_masks():
+                with self.subTest(fmt=fmt, shape=mask.shape, area=int(mask.sum())):
+                    decoded = decode_mask(encode_mask(mask, fmt))
+                    self.assertEqual(decoded.dtype, np.uint8)
+                    np.testing.assert_array_equal(decoded > 0, mask)
+
+    def test_rle_matches_coco_layout(self):
+        mask = np.array([[1, 0], [1, 1]], dtype=bool)
+        rle = encode_mask(mask, "rle")
+        # 列優先で 1,1,0,1 → 先頭の 0 の連続数は 0
+        self.assertEqual(rle["size"], [2, 2])
+        self.assertEqual(rle["counts"], [0, 2, 1, 1])
+
+    def test_uint8_input_is_thresholded(self):
+        mask = np.zeros((4, 4), dtype=np.uint8)
+        mask[1:3, 1:3] = 255
+        np.testing.assert_array_equal(decode_mask(encode_mask(mask, "packbits")), mask)
+
+    def test_invalid_payloads_raise_value_error(self):
+        with self.assertRaises(ValueError):
+            encode_mask(np.zeros((2, 2), dtype=bool), "jpeg")
+        with self.assertRaises(ValueError):
+            decode_mask({"format": "rle", "size": [2, 2], "counts": [1, 1]})
+        with self.assertRaises(ValueError):
+            decode_mask({"format": "unknown"})
+
+    def test_headers_are_validated_before_allocating(self):
+        huge = MAX_MASK_PIXELS + 1
+        payloads = [
+            # 数バイトで巨大な配列を要求するヘッダー
+            {"format": "rle", "size": [huge, 1], "counts": [huge]},
+            {"format": "rle", "size": [100000, 100000], "counts": [10000000000]},
+            {"format": "packbits", "shape": [huge, 1], "data": ""},
+            {"format": "polygon", "size": [huge, 1], "polygons": []},
+            # 負・整数以外の値
+            {"format": "rle", "size": [-2, -2], "counts": [4]},
+            {"format": "rle", "size": [2.0, 2], "counts": [4]},
+            {"format": "rle", "size": [2, 2], "counts": [5, -1]},
+            {"format": "rle", "size": [2, 2], "counts": [1.5, 2.5]},
+            {"format": "rle", "size": [2], "counts": [2]},
+            {"format": "polygon", "size": [4, 4], "polygons": [[0, 0, 2**40, 0, 3, 3]]},
+            {"format": "polygon", "size": [4, 4], "polygons": [[0, 0, -1, 0, 3, 3]]},
+            {"format": "polygon", "size": [4, 4], "polygons": [[0, 0, 2.5, 0, 3, 3]]},
+            # levels の長さ・型の不一致
+            {"format": "polygon", "size": [4, 4], "polygons": [[0, 0, 3, 0, 3, 3], [1, 1, 2, 1, 2, 2]],
+             "levels": [0]},
+            {"format": "polygon", "size": [4, 4], "polygons": [[0, 0, 3, 0, 3, 3]], "levels": ["a"]},
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload), self.assertRaises(ValueError):
+                decode_mask(payload)
+
+    def test_panel_copy_matches_roof_module(self):
+        # panel_count のコピーは roof/app/mask_codec.py と同一であること
+        roof_codec = REPO_ROOT / 'roof' / 'app' / 'mask_codec.py'
+        panel_codec = Path(mask_codec.__file__)
+        self.assertFalse(panel_codec.is_symlink())
+        self.assertEqual(panel_codec.read_bytes(), roof_codec.read_bytes())
+
+    def test_oversized_mask_is_rejected_by_panel_api(self):
+        from api_integration import app
+        payload = {"roof_mask": {"format": "rle", "size": [100000, 100000], "counts": [10000000000]}}
+        response = app.test_client().post('/calculate_panels', json=payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["error"], "decode_error")
+
+
+if __name__ == "__main__":
+    unittest.main()
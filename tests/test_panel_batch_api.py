@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Batch /calculate_panels API tests
+/calculate_panels 批量处理接口测试
+"""
+
+import json
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'panel_count'))
+
+from api_integration import RESULT_CACHE, app, iter_roof_results, shutdown_batch_pool, visualize_panels_on_mask
+from mask_codec import encode_mask
+
+
+def _roof_masks():
+    mask = np.zeros((200, 200), dtype=bool)
+    mask[20:180, 20:180] = True
+    return [encode_mask(mask, "rle"), "not-a-mask", encode_mask(mask, "png")]
+
+
+def _strip(roof):
+    # NDJSON の行には "type" が付く
+    return {k: v for k, v in roof.items() if k != "type"}
+
+
+class TestBatchCalculatePanels(unittest.TestCase):
+    """roof_masks の批量処理（一括 JSON / NDJSON ストリーミング）"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.payload = {"roof_masks": _roof_masks(), "gsd": 0.05, "offset_m": 1.0}
+
+    def test_errors_are_isolated_per_roof(self):
+        result = self.client.post('/calculate_panels', json=self.payload).get_json()
+        self.assertEqual([r["roof_id"] for r in result["roofs"]], [0, 1, 2])
+        self.assertEqual([r["success"] for r in result["roofs"]], [True, False, True])
+        self.assertEqual(result["roofs"][1]["error"], "decode_error")
+        self.assertEqual(result["summary"]["total_panels"],
+                         result["roofs"][0]["max_count"] + result["roofs"][2]["max_count"])
+
+    def test_stream_matches_batch_response(self):
+        batch = self.client.post('/calculate_panels', json=self.payload).get_json()
+        response = self.client.post('/calculate_panels', json=dict(self.payload, stream=True))
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+        self.assertEqual([line["type"] for line in lines], ["roof", "roof", "roof", "summary"])
+        self.assertEqual([_strip(r) for r in lines[:-1]], [_strip(r) for r in batch["roofs"]])
+        self.assertEqual(lines[-1]["summary"], batch["summary"])
+        self.assertEqual(lines[-1]["total_roofs"], 3)
+
+    def test_process_pool_keeps_roof_order(self):
+        options = {"Standard_B": (1.65, 1.0)}
+        serial = list(iter_roof_results(_roof_masks(), 0.05, 1.0, 0.02, options, workers=1))
+        RESULT_CACHE.clear()  # プール側で計算させる
+        try:
+            parallel = list(iter_roof_results(_roof_masks(), 0.05, 1.0, 0.02, options, workers=2))
+        finally:
+            shutdown_batch_pool()
+        self.assertEqual([r["roof_id"] for r in parallel], [0, 1, 2])
+        self.assertEqual([_strip(r) for r in parallel], [_strip(r) for r in serial])
+
+
+class TestVisualizationOptions(unittest.TestCase):
+    """可視化はメモリ上でエンコードし、批量では要求された場合のみ返す"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.mask = _roof_masks()[0]
+
+    def test_batch_visualization_is_opt_in(self):
+        payload = {"roof_masks": [self.mask], "gsd": 0.05}
+        roof = self.client.post('/calculate_panels', json=payload).get_json()["roofs"][0]
+        self.assertNotIn("visualization_b64", roof)
+
+        payload.update(include_visualization=True, visualization_format="jpeg", visualization_quality=60)
+        roof = self.client.post('/calculate_panels', json=payload).get_json()["roofs"][0]
+        self.assertTrue(roof["visualization_b64"].startswith("data:image/jpeg;base64,"))
+
+    def test_single_roof_formats(self):
+        for fmt, mime in (("png", "image/png"), ("webp", "image/webp")):
+            with self.subTest(fmt=fmt):
+                result = self.client.post('/calculate_panels', json={
+                    "roof_mask": self.mask, "gsd": 0.05, "visualization_format": fmt}).get_json()
+                self.assertTrue(result["visualization_b64"].startswith(f"data:{mime};base64,"))
+                self.assertNotIn("visualization_file", result)
+
+        result = self.client.post('/calculate_panels', json={
+            "roof_mask": self.mask, "gsd": 0.05, "include_visualization": False}).get_json()
+        self.assertNotIn("visualization_b64", result)
+
+        response = self.client.post('/calculate_panels', json={
+            "roof_mask": self.mask, "gsd": 0.05, "visualization_format": "gif"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["error"], "invalid_visualization_options")
+
+
+    def test_vector_formats(self):
+        result = self.client.post('/calculate_panels', json={
+            "roof_mask": self.mask, "gsd": 0.05, "visualization_format": "svg"}).get_json()
+        self.assertTrue(result["visualization_b64"].startswith("data:image/svg+xml;base64,"))
+
+        payload = {"roof_masks": [self.mask], "gsd": 0.05, "include_visualization": True,
+                   "visualization_format": "geojson"}
+        roof = self.client.post('/calculate_panels', json=payload).get_json()["roofs"][0]
+        kinds = [f["properties"]["kind"] for f in roof["visualization_geojson"]["features"]]
+        self.assertEqual(kinds, ["roof"] + ["panel"] * roof["max_count"])
+        self.assertNotIn("visualization_b64", roof)
+
+    def test_overlay_is_blended_once_per_image(self):
+        mask = np.zeros((60, 80), dtype=np.uint8)
+        mask[5:55, 5:75] = 255
+        panels = [(10, 10, 20, 15), (30, 10, 20, 15), (10, 30, 20, 15)]
+        vis = visualize_panels_on_mask(mask, panels)
+        # 塗りの内側は 0.3 × 緑 + 0.7 × 白 で、隣接パネルの重なりによる二重合成がない
+        np.testing.assert_array_equal(vis[20, 20], [178, 255, 178])
+        np.testing.assert_array_equal(vis[20, 40], [178, 255, 178])
+        np.testing.assert_array_equal(vis[50, 60], [255, 255, 255])
+
+
+class TestRequestLimits(unittest.TestCase):
+    """リクエストボディの上限（PANEL_MAX_REQUEST_MB）"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.limit = app.config['MAX_CONTENT_LENGTH']
+        app.config['MAX_CONTENT_LENGTH'] = 1024
+
+    def tearDown(self):
+        app.config['MAX_CONTENT_LENGTH'] = self.limit
+
+    def test_oversized_body_is_rejected_as_json(self):
+        response = self.client.post('/calculate_panels', json={"roof_mask": "A" * 4096, "gsd": 0.05})
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.get_json()["error"], "request_too_large")
+
+        response = self.client.post('/calculate_panels', json={"roof_shape_name": "rikuyane", "gsd": 0.05,
+                                                                "include_visualization": False})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
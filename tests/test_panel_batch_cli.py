@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Batch CLI runner tests (input expansion, process pool, streaming CSV, resume)
+バッチ計算（入力の展開・プロセスプール・CSV への逐次追記・再開）のテスト
+"""
+
+import csv
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'panel_count'))
+
+from batch import completed_inputs, expand_inputs, iter_batch_results, run_batch
+from cli import CSV_FIELDNAMES
+
+PANEL_OPTIONS = {"Standard_A": (1.65, 0.99), "Standard_B": (1.50, 0.80)}
+
+
+def _write_mask(path, size):
+    mask = np.zeros((400, 500), dtype=np.uint8)
+    mask[50:50 + size, 60:60 + size] = 255
+    cv2.imwrite(str(path), mask)
+
+
+def _rows(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+class TestBatchRunner(unittest.TestCase):
+    """ディレクトリ・glob の入力を並列に計算し、完了した屋根から CSV に書き込む"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        (self.root / 'masks' / 'sub').mkdir(parents=True)
+        for i, size in enumerate((150, 200, 250)):
+            _write_mask(self.root / 'masks' / f'roof_{i}.png', size)
+        _write_mask(self.root / 'masks' / 'sub' / 'roof_3.PNG', 300)
+        (self.root / 'masks' / 'notes.txt').write_text('not a mask')
+        self.csv = str(self.root / 'out.csv')
+        self.options = {"gsd": 0.05, "panel_options": PANEL_OPTIONS, "offset_m": 0.3,
+                        "visualization_dir": None}
+        logging.disable(logging.INFO)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        self.tmp.cleanup()
+
+    def test_expand_inputs(self):
+        masks = str(self.root / 'masks')
+        by_dir = expand_inputs([masks])
+        self.assertEqual([Path(p).name for p in by_dir], ['roof_0.png', 'roof_1.png', 'roof_2.png'])
+        by_glob = expand_inputs([os.path.join(masks, '**', '*.*'), masks, 'rikuyane'])
+        self.assertEqual([Path(p).name for p in by_glob],
+                         ['roof_0.png', 'roof_1.png', 'roof_2.png', 'roof_3.PNG', 'rikuyane'])
+        self.assertEqual(expand_inputs([os.path.join(masks, '*.jpg')]), [])
+
+    def test_parallel_matches_serial(self):
+        inputs = expand_inputs([str(self.root / 'masks' / '**' / '*.*')]) + ['rikuyane']
+        serial = {r["roof_type"]: r["max_count"] for r in iter_batch_results(inputs, self.options, workers=1)}
+        parallel = {r["roof_type"]: r["max_count"] for r in iter_batch_results(inputs, self.options, workers=2)}
+        self.assertEqual(parallel, serial)
+        self.assertEqual(len(serial), 5)
+        self.assertTrue(all(count > 0 for count in serial.values()))
+
+    def test_streaming_csv_and_resume(self):
+        inputs = expand_inputs([str(self.root / 'masks')])
+        summary = run_batch(inputs, self.csv, self.options, workers=2)
+        self.assertEqual((summary["processed"], summary["succeeded"], summary["failed"]), (3, 3, 0))
+        rows = _rows(self.csv)
+        self.assertEqual(list(rows[0]), CSV_FIELDNAMES)
+        self.assertEqual(len(rows), 3 * len(PANEL_OPTIONS))
+        self.assertEqual(completed_inputs(self.csv), set(inputs))
+        self.assertEqual(summary["total_panels"],
+                         sum(max(int(r["count_sim"]) for r in rows if r["roof_type"] == roof) for roof in inputs))
+
+        # 壊れた画像は失敗として数え、CSV には書かない（再開時に再計算される）
+        broken = self.root / 'masks' / 'roof_9.png'
+        broken.write_bytes(b'not a png')
+        inputs = expand_inputs([str(self.root / 'masks'), 'rikuyane'])
+        summary = run_batch(inputs, self.csv, self.options, workers=2, resume=True)
+        self.assertEqual((summary["skipped"], summary["processed"], summary["failed"]), (3, 2, 1))
+        rows = _rows(self.csv)
+        self.assertEqual(len(rows), 4 * len(PANEL_OPTIONS))
+        self.assertNotIn(str(broken), completed_inputs(self.csv))
+
+        _write_mask(broken, 100)
+        summary = run_batch(inputs, self.csv, self.options, workers=1, resume=True)
+        self.assertEqual((summary["skipped"], summary["processed"], summary["failed"]), (4, 1, 0))
+        self.assertEqual(completed_inputs(self.csv), set(inputs))
+
+    def test_visualization_dir(self):
+        out = self.root / 'vis'
+        out.mkdir()
+        summary = run_batch(['rikuyane'], self.csv, {**self.options, "visualization_dir": str(out)})
+        self.assertEqual(summary["succeeded"], 1)
+        self.assertEqual([p.name for p in out.iterdir()], ['result_rikuyane_Standard_B.png'])
+
+
+if __name__ == "__main__":
+    unittest.main()
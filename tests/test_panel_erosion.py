@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Setback erosion tests (distance transform, square / Euclidean metric)
+セットバックの腐食（距離変換、正方形 / ユークリッド距離）のテスト
+"""
+
+import importlib.util
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'panel_count'))
+
+import geometry
+from api_integration import RESULT_CACHE, app
+from geometry import SETBACK_METRICS, erode_by_distance, erode_with_margin, placement_context
+from roof_io import create_roof_mask
+
+HAS_SHAPELY = importlib.util.find_spec('shapely') is not None
+
+
+def _disk_kernel(radius):
+    """半径 radius の円（中心からの距離が radius 以下の画素）のカーネル"""
+    yy, xx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    return (xx ** 2 + yy ** 2 <= radius ** 2).astype(np.uint8)
+
+
+def _masks():
+    """屋根形状と、画像の端に接する屋根・穴のあるランダムなマスク"""
+    masks = [create_roof_mask(shape, (300, 400)) for shape in ["original_sample", "yosemune_main", "katanagare"]]
+    rng = np.random.default_rng(0)
+    noisy = (rng.random((120, 150)) > 0.1).astype(np.uint8) * 255
+    noisy[:, :20] = 255
+    masks.append(cv2.medianBlur(noisy, 3))
+    return masks
+
+
+class TestDistanceErosion(unittest.TestCase):
+    """距離変換による腐食がカーネルの腐食と一致すること"""
+
+    def test_square_matches_kernel_erosion(self):
+        for i, mask in enumerate(_masks()):
+            for margin in (1, 2, 5, 20, 37):
+                with self.subTest(mask=i, margin=margin):
+                    expected = cv2.erode(mask, np.ones((2 * margin + 1,) * 2, np.uint8))
+                    np.testing.assert_array_equal(erode_by_distance(mask, margin, "square"), expected)
+
+    def test_large_margins_use_distance_transform(self):
+        mask = create_roof_mask("rikuyane", (400, 500))
+        kernel = erode_with_margin(mask, 30)
+        with mock.patch.object(geometry, 'DISTANCE_EROSION_MIN_PX', 10), \
+                mock.patch.object(geometry, 'erode_by_distance', wraps=erode_by_distance) as by_distance:
+            np.testing.assert_array_equal(erode_with_margin(mask, 30), kernel)
+            erode_with_margin(mask, 5)
+        self.assertEqual(by_distance.call_count, 1)
+
+    def test_euclidean_matches_disk_kernel(self):
+        for i, mask in enumerate(_masks()):
+            for margin in (1, 3, 8, 20):
+                with self.subTest(mask=i, margin=margin):
+                    expected = cv2.erode(mask, _disk_kernel(margin))
+                    actual = erode_with_margin(mask, margin, "euclidean")
+                    np.testing.assert_array_equal(actual, expected)
+                    # 円は正方形に含まれるため、ユークリッド距離の有効エリアの方が広い
+                    self.assertTrue(np.all(actual >= erode_with_margin(mask, margin)))
+
+    def test_edge_cases(self):
+        mask = create_roof_mask("rikuyane", (100, 120))
+        for metric in SETBACK_METRICS:
+            np.testing.assert_array_equal(erode_with_margin(mask, 0, metric), mask)
+            self.assertEqual(int(np.count_nonzero(erode_with_margin(mask, 500, metric))), 0)
+        with self.assertRaises(ValueError):
+            erode_with_margin(mask, 5, "manhattan")
+        with self.assertRaises(ValueError):
+            placement_context(mask, 5, setback_metric="manhattan")
+
+
+class TestEuclideanSetback(unittest.TestCase):
+    """ユークリッド距離のセットバック（入隅で円弧になる）"""
+
+    def setUp(self):
+        # L 字の屋根: 入隅の周りだけ正方形と円で有効エリアが異なる
+        self.mask = np.zeros((300, 400), dtype=np.uint8)
+        self.mask[40:260, 50:200] = 255
+        self.mask[40:140, 200:350] = 255
+
+    def test_raster_context(self):
+        square = placement_context(self.mask, 20)
+        euclidean = placement_context(self.mask, 20, setback_metric="euclidean")
+        self.assertEqual(euclidean.setback_metric, "euclidean")
+        self.assertGreater(euclidean.effective_pixels, square.effective_pixels)
+        # 差は入隅の周りの 20x20 の角だけ
+        self.assertLess(euclidean.effective_pixels - square.effective_pixels, 20 * 20)
+        distance = cv2.distanceTransform(self.mask, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+        best = euclidean.best_layout(13, 21)
+        self.assertGreaterEqual(best["count"], square.best_layout(13, 21)["count"])
+        for x, y, w, h in best["panels"]:
+            self.assertGreater(float(distance[y:y + h, x:x + w].min()), 20)
+
+    @unittest.skipUnless(HAS_SHAPELY, "shapely not installed")
+    def test_polygon_context(self):
+        raster = placement_context(self.mask, 20, setback_metric="euclidean")
+        polygon = placement_context(self.mask, 20, engine="polygon", setback_metric="euclidean")
+        mitre = placement_context(self.mask, 20, engine="polygon")
+        self.assertGreater(polygon.effective_pixels, mitre.effective_pixels)
+        self.assertAlmostEqual(polygon.effective_pixels, raster.effective_pixels, delta=raster.effective_pixels * 0.01)
+        # 共通部分だけを継承し、ラスター版の積分画像に依存するメソッドは持たない
+        self.assertIsInstance(polygon, geometry.BasePlacementContext)
+        self.assertNotIsInstance(polygon, geometry.PlacementContext)
+        self.assertEqual(polygon.best_layout(13, 21)["count"], len(polygon.best_layout(13, 21)["panels"]))
+        self.assertFalse(hasattr(polygon, "count_bound"))
+
+
+class TestSetbackMetricApi(unittest.TestCase):
+    """/calculate_panels の setback_metric パラメータ"""
+
+    def setUp(self):
+        RESULT_CACHE.clear()
+        self.client = app.test_client()
+
+    def test_setback_metric_parameter(self):
+        payload = {"roof_shape_name": "original_sample", "gsd": 0.05, "offset_m": 1.0,
+                   "include_visualization": False}
+        square = self.client.post('/calculate_panels', json=payload).get_json()
+        euclidean = self.client.post('/calculate_panels', json={**payload, "setback_metric": "euclidean"}).get_json()
+        self.assertEqual((square["setback_metric"], euclidean["setback_metric"]), ("square", "euclidean"))
+        self.assertGreater(euclidean["effective_area"], square["effective_area"])
+
+        response = self.client.post('/calculate_panels', json={**payload, "setback_metric": "round"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["error"], "invalid_setback_metric")
+
+
+if __name__ == "__main__":
+    unittest.main()
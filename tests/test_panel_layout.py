@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Panel placement engine tests
+パネル配置エンジンのテスト
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'panel_count'))
+
+from geometry import (best_layout_in_frames, calculate_panel_layout_fast, calculate_panel_layout_grid,
+                      calculate_panel_layout_sat, erode_with_margin, estimate_roof_angle, get_layout_function,
+                      layout_frames, mask_bbox, panels_to_polygons, PlacementContext, valid_placement_map)
+from roof_io import create_roof_mask
+
+
+def _as_int_tuples(panels):
+    return [tuple(int(v) for v in p) for p in panels]
+
+
+class TestSatLayout(unittest.TestCase):
+    """積分画像版の配置が畳み込み版と同一であること"""
+
+    def assertSameLayout(self, mask, panel_w_px, panel_h_px):
+        expected = calculate_panel_layout_fast(mask, panel_w_px, panel_h_px)
+        actual = calculate_panel_layout_sat(mask, panel_w_px, panel_h_px)
+        self.assertEqual(actual[0], expected[0])
+        self.assertEqual(_as_int_tuples(actual[1]), _as_int_tuples(expected[1]))
+
+    def test_matches_fast_on_roof_shapes(self):
+        for shape in ["original_sample", "kiritsuma_side", "yosemune_main", "rikuyane"]:
+            mask = create_roof_mask(shape, (200, 250))
+            for size in [(7, 11), (11, 7), (1, 1), (40, 3)]:
+                with self.subTest(shape=shape, size=size):
+                    self.assertSameLayout(mask, *size)
+
+    def test_matches_fast_on_random_masks(self):
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            h, w = rng.integers(5, 60, 2)
+            mask = (rng.random((h, w)) < 0.9).astype(np.uint8) * 255
+            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+            self.assertSameLayout(mask, *rng.integers(1, 10, 2))
+
+    def test_panel_larger_than_mask(self):
+        mask = np.full((10, 10), 255, dtype=np.uint8)
+        self.assertEqual(calculate_panel_layout_sat(mask, 11, 5), (0, []))
+        with self.assertRaises(ValueError):
+            calculate_panel_layout_sat(mask, 0, 5)
+
+
+class TestGridLayout(unittest.TestCase):
+    """格子配置: 最良の位相オフセットを選び、重なりなくマスク内に収まること"""
+
+    def test_best_phase_and_no_overlap(self):
+        mask = create_roof_mask("yosemune_main", (300, 400))
+        panel_w, panel_h = 13, 21
+        count, panels = calculate_panel_layout_grid(mask, panel_w, panel_h)
+
+        valid = valid_placement_map(mask, panel_w, panel_h)
+        best = max(int(valid[y0::panel_h, x0::panel_w].sum())
+                   for y0 in range(panel_h) for x0 in range(panel_w))
+        self.assertEqual(count, best)
+
+        occupied = np.zeros(mask.shape, dtype=np.int32)
+        for x, y, w, h in panels:
+            occupied[y:y + h, x:x + w] += 1
+        self.assertLessEqual(occupied.max(), 1)
+        self.assertFalse(np.any(occupied[mask == 0]))
+
+        # 全パネルが同じ格子上にある
+        self.assertEqual(len({x % panel_w for x, _, _, _ in panels}), 1)
+        self.assertEqual(len({y % panel_h for _, y, _, _ in panels}), 1)
+
+    def test_layout_mode_lookup(self):
+        self.assertIs(get_layout_function("grid"), calculate_panel_layout_grid)
+        with self.assertRaises(ValueError):
+            get_layout_function("unknown")
+
+
+class TestRotatedLayout(unittest.TestCase):
+    """屋根方向に揃えた配置: 傾いた屋根で枚数が増え、四角形が屋根内に収まること"""
+
+    def setUp(self):
+        self.mask = np.zeros((400, 500), dtype=np.uint8)
+        corners = cv2.boxPoints(((250, 200), (300, 150), 25)).astype(np.int32)
+        cv2.fillPoly(self.mask, [corners], 255)
+        self.usable = erode_with_margin(self.mask, 5)
+
+    def test_estimate_roof_angle(self):
+        self.assertAlmostEqual(estimate_roof_angle(self.mask), 25.0, delta=1.0)
+        self.assertEqual(estimate_roof_angle(create_roof_mask("rikuyane", (100, 120))), 0.0)
+
+    def test_aligned_frame_places_more_panels_inside_roof(self):
+        axis_only = best_layout_in_frames(calculate_panel_layout_sat,
+                                          layout_frames(self.mask, self.usable, 5), 11, 17)
+        aligned = best_layout_in_frames(calculate_panel_layout_sat,
+                                        layout_frames(self.mask, self.usable, 5, align_to_roof=True), 11, 17)
+        self.assertGreater(aligned["count"], axis_only["count"])
+        self.assertNotEqual(aligned["frame"].rotation_deg, 0.0)
+
+        polygons = panels_to_polygons(aligned["panels"], aligned["frame"].back_matrix)
+        self.assertEqual(len(polygons), aligned["count"])
+        drawn = np.zeros_like(self.mask)
+        cv2.fillPoly(drawn, [np.round(np.asarray(p)).astype(np.int32) for p in polygons], 255)
+        self.assertEqual(int(np.count_nonzero(drawn[self.mask == 0])), 0)
+
+    def test_axis_aligned_roof_is_unchanged(self):
+        mask = create_roof_mask("kiritsuma_side", (200, 250))
+        usable = erode_with_margin(mask, 5)
+        frames = layout_frames(mask, usable, 5, align_to_roof=True)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(panels_to_polygons([(1, 2, 3, 4)]), [[[1, 2], [4, 2], [4, 6], [1, 6]]])
+
+
+class TestPlacementContext(unittest.TestCase):
+    """屋根ごとの前処理共有: 単独の配置関数と同じ結果を返し、ピクセルサイズでキャッシュすること"""
+
+    def test_matches_standalone_layouts(self):
+        mask = create_roof_mask("original_sample", (300, 400))
+        usable = erode_with_margin(mask, 6)
+        for mode, func in [("greedy", calculate_panel_layout_sat), ("grid", calculate_panel_layout_grid)]:
+            ctx = PlacementContext(mask, 6, layout_mode=mode)
+            np.testing.assert_array_equal(ctx.full_frame(ctx.usable_mask), usable)
+            with self.subTest(mode=mode):
+                self.assertEqual(ctx.layout(13, 21), func(usable, 13, 21))
+                expected = best_layout_in_frames(func, layout_frames(mask, usable, 6), 13, 21)
+                actual = ctx.best_layout(13, 21)
+                self.assertEqual((actual["count"], actual["orientation"], actual["panels"]),
+                                 (expected["count"], expected["orientation"], expected["panels"]))
+
+    def test_results_are_cached_by_pixel_size(self):
+        ctx = PlacementContext(create_roof_mask("rikuyane", (200, 250)), 4)
+        first = ctx.best_layout(13, 21)
+        self.assertIs(ctx.best_layout(13, 21), first)
+        # 向きを入れ替えた問い合わせは同じ 2 つの配置を再利用する
+        ctx.best_layout(21, 13)
+        self.assertEqual(len(ctx._layouts), 2)
+
+    def _small_roofs(self):
+        """大きな画像の一部だけを占める屋根（画像の端に接するものを含む）"""
+        roof = create_roof_mask("original_sample", (150, 200))
+        for y, x in [(300, 420), (0, 0), (650, 800)]:
+            mask = np.zeros((800, 1000), dtype=np.uint8)
+            mask[y:y + 150, x:x + 200] = roof[:800 - y, :1000 - x]
+            yield mask
+
+    def test_cropped_context_matches_full_frame(self):
+        for mask in self._small_roofs():
+            for mode in ("greedy", "grid"):
+                with self.subTest(mode=mode):
+                    full = PlacementContext(mask, 6, layout_mode=mode, crop=False)
+                    cropped = PlacementContext(mask, 6, layout_mode=mode)
+                    self.assertLess(cropped.mask_bin.size, mask.size // 4)
+                    self.assertEqual((cropped.roof_pixels, cropped.effective_pixels),
+                                     (full.roof_pixels, full.effective_pixels))
+                    np.testing.assert_array_equal(cropped.full_frame(cropped.usable_mask), full.usable_mask)
+                    for size in [(13, 21), (21, 13), (9, 9)]:
+                        self.assertEqual(cropped.layout(*size), full.layout(*size))
+
+    def test_cropped_roof_aligned_frame_maps_to_image(self):
+        mask = np.zeros((600, 800), dtype=np.uint8)
+        box = cv2.boxPoints(((500, 300), (180, 110), 20)).astype(np.int32)
+        cv2.fillPoly(mask, [box], 255)
+        ctx = PlacementContext(mask, 3, align_to_roof=True)
+        self.assertEqual(len(ctx.frames), 2)
+        best = ctx.best_layout(9, 15)
+        self.assertNotEqual(best["frame"].rotation_deg, 0.0)
+        polygons = panels_to_polygons(best["panels"], best["frame"].back_matrix)
+        drawn = np.zeros_like(mask)
+        cv2.fillPoly(drawn, [np.round(np.asarray(p)).astype(np.int32) for p in polygons], 255)
+        self.assertEqual(int(np.count_nonzero(drawn[mask == 0])), 0)
+
+    def test_cropped_roof_aligned_context_parity(self):
+        # 軸平行の座標系は切り出しでも画像全体と同一。回転した座標系は回転の中心が変わるため、
+        # 角度と枚数の近さだけを確認する（パネル位置の一致は保証しない）
+        mask = np.zeros((600, 800), dtype=np.uint8)
+        box = cv2.boxPoints(((500, 300), (180, 110), 20)).astype(np.int32)
+        cv2.fillPoly(mask, [box], 255)
+        for mode in ("greedy", "grid"):
+            with self.subTest(mode=mode):
+                cropped = PlacementContext(mask, 3, layout_mode=mode, align_to_roof=True)
+                full = PlacementContext(mask, 3, layout_mode=mode, align_to_roof=True, crop=False)
+                self.assertEqual(cropped.layout(9, 15, 0), full.layout(9, 15, 0))
+                self.assertAlmostEqual(cropped.frames[1].rotation_deg, full.frames[1].rotation_deg, places=3)
+                rotated = [panels_to_polygons(ctx.layout(9, 15, 1)[1], ctx.frames[1].back_matrix)
+                           for ctx in (cropped, full)]
+                self.assertLessEqual(abs(len(rotated[0]) - len(rotated[1])), max(2, len(rotated[1]) // 20))
+
+    def test_mask_bbox_for_every_dtype(self):
+        # uint8 以外（int32 / float64）のマスクも同じ外接矩形で切り出す
+        mask = np.zeros((60, 80), dtype=np.uint8)
+        mask[10:20, 5:30] = 255
+        for dtype in (np.uint8, bool, np.int32, np.float64):
+            typed = mask > 0 if dtype is bool else mask.astype(dtype)
+            with self.subTest(dtype=np.dtype(dtype).name):
+                self.assertEqual(mask_bbox(typed), (5, 10, 25, 10))
+                self.assertEqual(mask_bbox(typed, pad=3), (2, 7, 31, 16))
+                ctx = PlacementContext(typed, 2)
+                self.assertEqual((ctx.origin, ctx.mask_bin.shape), ((3, 8), (14, 29)))
+        self.assertEqual(mask_bbox(np.zeros((5, 5), dtype=np.float64)), (0, 0, 0, 0))
+
+    def test_count_bound_and_lattice_counts(self):
+        # 上限は全配置の枚数以上、格子配置の枚数は grid の配置と一致（目安のため greedy とは一致しない）
+        for shape in ["original_sample", "yosemune_main", "rikuyane"]:
+            mask = create_roof_mask(shape, (300, 400))
+            for align_to_roof in (False, True):
+                greedy = PlacementContext(mask, 6, align_to_roof=align_to_roof)
+                grid = PlacementContext(mask, 6, layout_mode="grid", align_to_roof=align_to_roof)
+                for size in [(13, 21), (9, 9), (40, 7)]:
+                    with self.subTest(shape=shape, align_to_roof=align_to_roof, size=size):
+                        bound = greedy.count_bound(*size)
+                        self.assertLessEqual(greedy.best_layout(*size)["count"], bound)
+                        self.assertLessEqual(grid.best_layout(*size)["count"], bound)
+                        if not align_to_roof:
+                            # 面積による上限以下（回転した座標系は有効画素数が変わる）
+                            self.assertLessEqual(bound, greedy.effective_pixels // (size[0] * size[1]))
+                        expected = grid.best_layout(*size)
+                        lattice = greedy.lattice_layout(*size)
+                        self.assertEqual((lattice["count"], lattice["orientation"]),
+                                         (expected["count"], expected["orientation"]))
+
+    def test_unknown_layout_mode(self):
+        with self.assertRaises(ValueError):
+            PlacementContext(np.zeros((10, 10), dtype=np.uint8), 1, layout_mode="unknown")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Parquet layout output tests (schema, partitioning, CLI batch and Flask batch paths)
+パネル配置結果の Parquet 出力（スキーマ・パーティション・CLI / API の批量処理）のテスト
+"""
+
+import importlib.util
+import json
+import logging
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'panel_count'))
+
+import api_integration
+from api_integration import RESULT_CACHE, app
+from batch import run_batch
+from mask_codec import encode_mask
+from planner import process_roof
+
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+PANEL_OPTIONS = {"Standard_A": (1.65, 0.99), "Standard_B": (1.50, 0.80)}
+
+
+@unittest.skipUnless(HAS_PYARROW, "pyarrow not installed")
+class TestParquetWriter(unittest.TestCase):
+    """屋根の統計とパネル矩形を書き出し、JSON の解析なしで読み戻せること"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        logging.disable(logging.INFO)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        self.tmp.cleanup()
+
+    def test_roundtrip_and_partitioning(self):
+        import pyarrow as pa
+        from parquet_results import LAYOUT_SCHEMA, ParquetResultWriter, explode_panels, read_layouts
+
+        results = [process_roof(shape, 0.05, PANEL_OPTIONS, 0.3, visualization_dir=None)
+                   for shape in ("rikuyane", "original_sample", "katanagare")]
+        with ParquetResultWriter(self.root, run_id="nightly", date="2025-07-02", flush_rows=4) as writer:
+            for result in results + [{"roof_type": "broken.png", "success": False}]:
+                writer.write(result)
+        # 4 行ごとに 1 ファイル（3 屋根 × 2 パネル = 6 行）
+        self.assertEqual(len(writer.files), 2)
+        self.assertTrue(all("run_id=nightly/date=2025-07-02/part-" in f for f in writer.files))
+
+        table = read_layouts(self.root)
+        self.assertEqual(table.num_rows, 6)
+        for name in ("x", "y"):
+            self.assertEqual(table.schema.field(name).type, pa.list_(pa.int32()))
+        for name in ("w", "h"):
+            self.assertEqual(table.schema.field(name).type, pa.list_(pa.int16()))
+        self.assertEqual(set(table.column("run_id").to_pylist()), {"nightly"})
+        self.assertEqual(table.schema.names[:len(LAYOUT_SCHEMA)], LAYOUT_SCHEMA.names)
+
+        rows = {(r["roof"], r["panel_name"]): r for r in table.to_pylist()}
+        for result in results:
+            for panel_name, panel_data in result["panels"].items():
+                row = rows[(result["roof_type"], panel_name)]
+                self.assertEqual(row["count_sim"], panel_data["count_sim"])
+                self.assertEqual(row["best"], panel_name == result["best_panel"])
+                self.assertEqual(list(zip(row["x"], row["y"], row["w"], row["h"])),
+                                 [tuple(int(v) for v in p) for p in panel_data["panels"]])
+
+        panels = explode_panels(table)
+        self.assertEqual(panels.num_rows, sum(table.column("count_sim").to_pylist()))
+        best = read_layouts(self.root, filters=[("run_id", "=", "nightly"), ("best", "=", True)],
+                            columns=["roof", "count_sim"])
+        self.assertEqual(sorted(best.column("roof").to_pylist()), sorted(r["roof_type"] for r in results))
+
+    def test_polygon_engine_coordinates_are_rounded(self):
+        from parquet_results import ParquetResultWriter, read_layouts
+
+        result = process_roof("yosemune_main", 0.05, PANEL_OPTIONS, 0.3, engine="polygon", visualization_dir=None)
+        with ParquetResultWriter(self.root) as writer:
+            writer.write(result)
+        row = [r for r in read_layouts(self.root).to_pylist() if r["panel_name"] == result["best_panel"]][0]
+        expected = np.rint(np.asarray(result["panels"][result["best_panel"]]["panels"]))
+        np.testing.assert_array_equal(np.stack([row["x"], row["y"], row["w"], row["h"]], axis=1), expected)
+        self.assertEqual(row["engine"], "polygon")
+
+    def test_rotated_layouts_store_image_corners(self):
+        import cv2
+        from geometry import panels_to_polygons
+        from parquet_results import ParquetResultWriter, explode_panels, read_layouts
+
+        mask = np.zeros((400, 500), dtype=np.uint8)
+        cv2.fillPoly(mask, [cv2.boxPoints(((250, 200), (300, 150), 25)).astype(np.int32)], 255)
+        path = str(Path(self.root) / "tilted.png")
+        cv2.imwrite(path, mask)
+        result = process_roof(path, 0.05, PANEL_OPTIONS, 0.3, align_to_roof=True, visualization_dir=None)
+        self.assertNotEqual(result["panels"][result["best_panel"]]["rotation_deg"], 0.0)
+        axis_aligned = process_roof("rikuyane", 0.05, PANEL_OPTIONS, 0.3, visualization_dir=None)
+        layouts = str(Path(self.root) / "layouts")
+        with ParquetResultWriter(layouts) as writer:
+            writer.write(result)
+            writer.write(axis_aligned)
+
+        table = read_layouts(layouts)
+        rows = {(r["roof"], r["panel_name"]): r for r in table.to_pylist()}
+        for panel_name, panel_data in axis_aligned["panels"].items():
+            self.assertIsNone(rows[("rikuyane", panel_name)]["corners"])
+
+        panels = explode_panels(table)
+        self.assertEqual(panels.num_rows, sum(table.column("count_sim").to_pylist()))
+        for roof, source in ((path, result), ("rikuyane", axis_aligned)):
+            for panel_name, panel_data in source["panels"].items():
+                selected = panels.filter((np.asarray(panels.column("roof").to_pylist()) == roof)
+                                         & (np.asarray(panels.column("panel_name").to_pylist()) == panel_name))
+                corners = np.asarray(selected.column("corners").to_pylist(), dtype=np.float64)
+                expected = panel_data.get("panel_polygons") or panels_to_polygons(panel_data["panels"])
+                with self.subTest(roof=roof, panel_name=panel_name):
+                    # 回転した配置は元画像座標の四角形（配置座標系の矩形ではない）
+                    np.testing.assert_allclose(corners.reshape(-1, 4, 2), np.asarray(expected), atol=1e-3)
+
+    def test_rect_overflow_is_an_error(self):
+        import pyarrow as pa
+        from parquet_results import result_rows, rows_to_table
+
+        result = process_roof("rikuyane", 0.05, PANEL_OPTIONS, 0.3, visualization_dir=None)
+        result["panels"]["Standard_A"]["panels"] = [(0, 0, 40000, 10)]
+        with self.assertRaises(pa.ArrowInvalid):
+            rows_to_table(result_rows(result))
+
+    def test_cli_batch_writes_parquet(self):
+        from parquet_results import read_layouts
+
+        summary = run_batch(["rikuyane", "katanagare"], str(Path(self.root) / "out.csv"),
+                            {"gsd": 0.05, "panel_options": PANEL_OPTIONS, "offset_m": 0.3, "visualization_dir": None},
+                            parquet_dir=str(Path(self.root) / "layouts"), run_id="cli")
+        self.assertEqual(summary["run_id"], "cli")
+        table = read_layouts(str(Path(self.root) / "layouts"), filters=[("run_id", "=", "cli")])
+        self.assertEqual(sorted(set(table.column("roof").to_pylist())), ["katanagare", "rikuyane"])
+
+
+@unittest.skipUnless(HAS_PYARROW, "pyarrow not installed")
+class TestParquetApi(unittest.TestCase):
+    """PANEL_PARQUET_DIR を設定すると roof_masks の批量結果を Parquet にも書き出す"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        RESULT_CACHE.clear()
+        self.client = app.test_client()
+        mask = np.zeros((200, 200), dtype=bool)
+        mask[20:180, 20:180] = True
+        self.payload = {"roof_masks": [encode_mask(mask, "rle"), "not-a-mask", encode_mask(mask, "png")],
+                        "gsd": 0.05, "offset_m": 0.3, "panel_options": {"Standard_B": [1.65, 1.0]}}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_batch_and_stream(self):
+        from parquet_results import read_layouts
+
+        with mock.patch.object(api_integration, 'PARQUET_DIR', self.tmp.name):
+            batch = self.client.post('/calculate_panels', json=self.payload).get_json()
+            response = self.client.post('/calculate_panels', json=dict(self.payload, stream=True))
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        stream_run = lines[-1]["run_id"]
+        self.assertNotEqual(batch["run_id"], stream_run)
+
+        for run_id in (batch["run_id"], stream_run):
+            table = read_layouts(self.tmp.name, filters=[("run_id", "=", run_id)])
+            # デコードに失敗した屋根（roof_id 1）は書かない
+            self.assertEqual(sorted(table.column("roof").to_pylist()), ["0", "2"])
+            self.assertEqual(table.column("count_sim").to_pylist(), [batch["roofs"][0]["max_count"]] * 2)
+
+    def test_disabled_by_default(self):
+        batch = self.client.post('/calculate_panels', json=self.payload).get_json()
+        self.assertNotIn("run_id", batch)
+
+
+if __name__ == "__main__":
+    unittest.main()
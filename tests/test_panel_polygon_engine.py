@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Polygon-based placement engine tests (cross-checked against the raster engine)
+輪郭ポリゴンによる配置エンジンのテスト（ラスター版との照合）
+"""
+
+import importlib.util
+import sys
+import unittest
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'panel_count'))
+
+from api_integration import RESULT_CACHE, app
+from geometry import PLACEMENT_ENGINES, engine_pixels, erode_with_margin, panels_to_polygons, placement_context
+from roof_io import create_roof_mask
+
+HAS_SHAPELY = importlib.util.find_spec('shapely') is not None
+
+
+def _rectilinear_roof():
+    """L 字の屋根に煙突（穴）があるマスク"""
+    mask = np.zeros((300, 400), dtype=np.uint8)
+    mask[40:260, 50:200] = 255
+    mask[40:140, 200:350] = 255
+    mask[100:130, 100:125] = 0
+    return mask
+
+
+def _pixel_cover(panels, shape):
+    """各パネルが完全に覆う画素の被覆回数"""
+    cover = np.zeros(shape, dtype=np.int32)
+    for x, y, w, h in panels:
+        y0, y1 = int(np.ceil(y - 1e-6)), int(np.floor(y + h + 1e-6))
+        x0, x1 = int(np.ceil(x - 1e-6)), int(np.floor(x + w + 1e-6))
+        cover[y0:y1, x0:x1] += 1
+    return cover
+
+
+@unittest.skipUnless(HAS_SHAPELY, "shapely not installed")
+class TestPolygonEngine(unittest.TestCase):
+    """ポリゴン版: 有効エリア内に重ならずに配置し、ラスター版と同程度の枚数になること"""
+
+    def test_rectangle_count_is_exact(self):
+        mask = np.zeros((400, 500), dtype=np.uint8)
+        mask[50:350, 60:460] = 255
+        for mode in ("greedy", "grid"):
+            ctx = placement_context(mask, 20, mode, engine="polygon")
+            self.assertEqual(ctx.effective_pixels, 360.0 * 260.0)
+            count, panels = ctx.layout(20, 33)
+            self.assertEqual(count, (360 // 20) * (260 // 33))
+            self.assertEqual(panels[0], (80.0, 70.0, 20.0, 33.0))
+            # 小数の寸法でも隙間なく並べる
+            self.assertEqual(ctx.layout(17.5, 26.0)[0], int(360 // 17.5) * 10)
+
+    def test_rectilinear_roof_stays_inside_eroded_mask(self):
+        mask = _rectilinear_roof()
+        usable = erode_with_margin(mask, 6) > 0
+        for mode in ("greedy", "grid"):
+            with self.subTest(mode=mode):
+                polygon = placement_context(mask, 6, mode, engine="polygon")
+                raster = placement_context(mask, 6, mode, engine="raster")
+                self.assertAlmostEqual(polygon.effective_pixels, raster.effective_pixels, delta=1.0)
+                count, panels = polygon.layout(13, 21)
+                cover = _pixel_cover(panels, mask.shape)
+                self.assertLessEqual(cover.max(), 1)
+                self.assertEqual(int(cover[~usable].sum()), 0)
+                self.assertEqual(int(cover.sum()), count * 13 * 21)
+                self.assertGreaterEqual(count, raster.layout(13, 21)[0] * 0.9)
+
+    def test_matches_raster_engine_on_roof_shapes(self):
+        for shape in ["original_sample", "kiritsuma_side", "yosemune_main", "katanagare", "rikuyane"]:
+            mask = create_roof_mask(shape, (400, 500))
+            distance = cv2.distanceTransform((mask > 127).astype(np.uint8), cv2.DIST_L2, 5)
+            for mode in ("greedy", "grid"):
+                with self.subTest(shape=shape, mode=mode):
+                    raster = placement_context(mask, 20, mode, engine="raster").best_layout(21, 34)
+                    polygon = placement_context(mask, 20, mode, engine="polygon").best_layout(21, 34)
+                    # 斜めの辺では正方形カーネルの腐食の方がセットバックが大きい
+                    self.assertGreaterEqual(polygon["count"], raster["count"] * 0.95)
+                    self.assertLessEqual(polygon["count"], raster["count"] * 1.2)
+                    cover = _pixel_cover(polygon["panels"], mask.shape)
+                    self.assertLessEqual(cover.max(), 1)
+                    # セットバック（ポリゴン化の誤差 1 画素まで）を守る
+                    self.assertGreaterEqual(float(distance[cover > 0].min()), 20 - 1)
+
+    def test_count_is_independent_of_resolution(self):
+        # 同じ 15m x 9m の屋根を GSD を変えて描いても、メートル単位の寸法で同じ枚数になる
+        for angle, align_to_roof in ((30, False), (12, True)):
+            counts = []
+            for gsd in (0.05, 0.025, 0.0125):
+                scale = 0.05 / gsd
+                mask = np.zeros((int(300 * scale), int(400 * scale)), dtype=np.uint8)
+                corners = cv2.boxPoints(((200 * scale, 150 * scale), (300 * scale, 180 * scale), angle))
+                cv2.fillPoly(mask, [corners.astype(np.int32)], 255)
+                ctx = placement_context(mask, engine_pixels(1.0, gsd, "polygon"), align_to_roof=align_to_roof,
+                                        engine="polygon")
+                best = ctx.best_layout(engine_pixels(1.02, gsd, "polygon"), engine_pixels(1.67, gsd, "polygon"))
+                counts.append(best["count"])
+            with self.subTest(angle=angle, align_to_roof=align_to_roof):
+                self.assertLessEqual(max(counts) - min(counts), 1, counts)
+
+    def test_roof_aligned_frame(self):
+        mask = np.zeros((400, 500), dtype=np.uint8)
+        corners = cv2.boxPoints(((250, 200), (300, 150), 25)).astype(np.int32)
+        cv2.fillPoly(mask, [corners], 255)
+        axis_only = placement_context(mask, 5, engine="polygon").best_layout(11, 17)
+        ctx = placement_context(mask, 5, align_to_roof=True, engine="polygon")
+        aligned = ctx.best_layout(11, 17)
+        self.assertGreater(aligned["count"], axis_only["count"])
+        self.assertAlmostEqual(aligned["frame"].rotation_deg, 25.0, delta=1.0)
+
+        polygons = panels_to_polygons(aligned["panels"], aligned["frame"].back_matrix)
+        drawn = np.zeros_like(mask)
+        cv2.fillPoly(drawn, [np.round(np.asarray(p)).astype(np.int32) for p in polygons], 255)
+        self.assertEqual(int(np.count_nonzero(drawn[mask == 0])), 0)
+
+    def test_empty_mask_and_unknown_engine(self):
+        ctx = placement_context(np.zeros((50, 60), dtype=np.uint8), 3, engine="polygon")
+        self.assertEqual(ctx.best_layout(5, 8)["count"], 0)
+        self.assertEqual(ctx.full_frame(ctx.mask_bin).shape, (50, 60))
+        self.assertEqual(PLACEMENT_ENGINES, ("raster", "polygon"))
+        with self.assertRaises(ValueError):
+            placement_context(_rectilinear_roof(), 3, engine="vector")
+
+
+@unittest.skipUnless(HAS_SHAPELY, "shapely not installed")
+class TestPolygonEngineApi(unittest.TestCase):
+    """/calculate_panels の engine パラメータ"""
+
+    def setUp(self):
+        RESULT_CACHE.clear()
+        self.client = app.test_client()
+
+    def test_engine_parameter(self):
+        payload = {"roof_shape_name": "rikuyane", "gsd": 0.05, "offset_m": 0.5, "include_visualization": True}
+        raster = self.client.post('/calculate_panels', json=payload).get_json()
+        polygon = self.client.post('/calculate_panels', json={**payload, "engine": "polygon"}).get_json()
+        self.assertTrue(polygon["success"])
+        self.assertEqual((raster["engine"], polygon["engine"]), ("raster", "polygon"))
+        self.assertIn("visualization_b64", polygon)
+        self.assertGreaterEqual(polygon["max_count"], raster["max_count"])
+
+        response = self.client.post('/calculate_panels', json={**payload, "engine": "vector"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["error"], "invalid_engine")
+
+
+if __name__ == "__main__":
+    unittest.main()
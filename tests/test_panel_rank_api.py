@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Panel catalog ranking API tests
+/rank_panels パネルカタログ評価のテスト
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'panel_count'))
+
+from api_integration import app, calculate_single_roof, parse_panel_catalog
+from mask_codec import encode_mask
+
+CATALOG = {
+    "M60": [1.65, 0.99, 330],
+    "M60_dup": [1.651, 0.991, 300],   # ピクセル寸法は M60 と同じ
+    "M72": [1.96, 0.99, 400],
+    "Large": [2.28, 1.13],            # 出力省略時は 400 W
+}
+
+
+def _roof_mask():
+    mask = np.zeros((300, 400), dtype=bool)
+    mask[20:280, 30:370] = True
+    return mask
+
+
+def _round_roof_mask():
+    # 角のセットバックが距離の種類で変わる屋根
+    mask = np.zeros((300, 400), dtype=np.uint8)
+    cv2.circle(mask, (200, 150), 130, 255, -1)
+    return mask
+
+
+def _large_catalog(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{"name": f"SKU{i:03d}", "length": round(float(rng.uniform(1.6, 2.4)), 3),
+             "width": round(float(rng.uniform(0.99, 1.3)), 3), "power_w": float(rng.integers(300, 600))}
+            for i in range(n)]
+
+
+class TestRankPanels(unittest.TestCase):
+    """カタログ全体の順位付け"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.payload = {"roof_mask": encode_mask(_roof_mask(), "rle"), "gsd": 0.05, "catalog": CATALOG, "top_k": 2}
+
+    def test_counts_match_calculate_panels(self):
+        result = self.client.post('/rank_panels', json=dict(self.payload, exact_counts=True)).get_json()
+        options = {name: tuple(values[:2]) for name, values in CATALOG.items()}
+        single = calculate_single_roof(_roof_mask().astype(np.uint8) * 255, 0.05, options)
+
+        self.assertEqual(result["catalog_size"], 4)
+        self.assertEqual(result["unique_panel_sizes"], 3)
+        for entry in result["ranking"]:
+            expected = single["panels"][entry["panel_name"]]
+            self.assertEqual(entry["count"], expected["count_sim"])
+            self.assertEqual(entry["count_method"], "placement")
+            self.assertAlmostEqual(entry["kw"], entry["count"] * entry["power_w"] / 1000.0)
+
+    def test_top_k_is_placed_and_rest_is_estimated(self):
+        payload = dict(self.payload, roof_mask=encode_mask(_round_roof_mask(), "rle"), catalog=_large_catalog(),
+                       top_k=3)
+        result = self.client.post('/rank_panels', json=payload).get_json()
+        exact = self.client.post('/rank_panels', json=dict(payload, exact_counts=True)).get_json()
+        exact_counts = {entry["panel_name"]: entry["count"] for entry in exact["ranking"]}
+
+        self.assertLess(result["placed_panel_sizes"], result["unique_panel_sizes"])
+        self.assertEqual(exact["placed_panel_sizes"], exact["unique_panel_sizes"])
+        # 上位 top_k 件は配置結果で、パネル矩形の数と一致する
+        for entry in result["ranking"][:3]:
+            self.assertEqual(entry["count_method"], "placement")
+            self.assertEqual(entry["count"], exact_counts[entry["panel_name"]])
+            self.assertEqual(len(entry["panels"]), entry["count"])
+        for entry in result["ranking"]:
+            if entry["count_method"] == "placement":
+                self.assertEqual(entry["count"], exact_counts[entry["panel_name"]])
+        self.assertIn("lattice", {entry["count_method"] for entry in result["ranking"]})
+        kws = [entry["kw"] for entry in result["ranking"]]
+        self.assertEqual(kws, sorted(kws, reverse=True))
+        if result["top_k_exact"]:
+            self.assertEqual([entry["panel_name"] for entry in result["ranking"][:3]],
+                             [entry["panel_name"] for entry in exact["ranking"][:3]])
+
+        # grid では格子配置の枚数がそのまま配置結果
+        grid = self.client.post('/rank_panels', json=dict(payload, layout_mode="grid")).get_json()
+        self.assertEqual({entry["count_method"] for entry in grid["ranking"]}, {"placement"})
+        self.assertTrue(grid["top_k_exact"])
+
+    def test_engine_and_setback_metric_match_calculate_panels(self):
+        options = {name: tuple(values[:2]) for name, values in CATALOG.items()}
+        areas = {}
+        for engine, setback_metric in [("raster", "euclidean"), ("polygon", "square")]:
+            with self.subTest(engine=engine, setback_metric=setback_metric):
+                payload = dict(self.payload, roof_mask=encode_mask(_round_roof_mask(), "rle"), engine=engine,
+                               setback_metric=setback_metric, exact_counts=True)
+                result = self.client.post('/rank_panels', json=payload).get_json()
+                single = calculate_single_roof(_round_roof_mask(), 0.05, options, offset_m=1.0, engine=engine,
+                                               setback_metric=setback_metric)
+                self.assertEqual((result["engine"], result["setback_metric"]), (engine, setback_metric))
+                self.assertEqual(result["effective_area"], single["effective_area"])
+                areas[engine] = result["effective_area"]
+                for entry in result["ranking"]:
+                    self.assertEqual(entry["count"], single["panels"][entry["panel_name"]]["count_sim"])
+        # 円形の屋根では euclidean のセットバックが既定（square）と異なる
+        square = calculate_single_roof(_round_roof_mask(), 0.05, options, offset_m=1.0)
+        self.assertNotEqual(areas["raster"], square["effective_area"])
+
+        for field, error in [("engine", "invalid_engine"), ("setback_metric", "invalid_setback_metric")]:
+            response = self.client.post('/rank_panels', json=dict(self.payload, **{field: "unknown"}))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()["error"], error)
+
+    def test_polygon_engine_setback_matches_calculate_panels(self):
+        # offset_m がピクセルの整数倍でない場合も、セットバックは /calculate_panels と同じ（切り上げない）
+        roof = {"roof_shape_name": "rikuyane", "dimensions": [400, 500], "gsd": 0.05, "offset_m": 0.33,
+                "engine": "polygon"}
+        ranked = self.client.post('/rank_panels', json=dict(roof, catalog=CATALOG, top_k=1)).get_json()
+        top = ranked["ranking"][0]
+        single = self.client.post('/calculate_panels', json=dict(
+            roof, panel_options={top["panel_name"]: top["panel_size"]})).get_json()
+        self.assertEqual(ranked["effective_area"], single["effective_area"])
+        self.assertEqual(top["count"], single["panels"][top["panel_name"]]["count_sim"])
+
+    def test_ranking_order_and_top_k_panels(self):
+        result = self.client.post('/rank_panels', json=self.payload).get_json()
+        ranking = result["ranking"]
+        self.assertEqual([r["rank"] for r in ranking], [1, 2, 3, 4])
+        self.assertEqual([r["kw"] for r in ranking], sorted((r["kw"] for r in ranking), reverse=True))
+        self.assertEqual(result["best_panel"], ranking[0]["panel_name"])
+        self.assertEqual([len(r["panels"]) for r in ranking[:2]], [r["count"] for r in ranking[:2]])
+        self.assertTrue(all("panels" not in r for r in ranking[2:]))
+
+        by_count = self.client.post('/rank_panels', json=dict(self.payload, rank_by="count")).get_json()
+        counts = [r["count"] for r in by_count["ranking"]]
+        self.assertEqual(counts, sorted(counts, reverse=True))
+
+    def test_list_catalog_and_errors(self):
+        skus = parse_panel_catalog([{"name": "A", "length": 1.65, "width": 1.0}])
+        self.assertEqual(skus, [("A", 1.65, 1.0, 400.0)])
+        for bad in ({}, [{"name": "A"}], {"A": [1.65]}, {"A": [0, 1.0]}):
+            with self.subTest(catalog=bad):
+                with self.assertRaises(ValueError):
+                    parse_panel_catalog(bad)
+
+        response = self.client.post('/rank_panels', json=dict(self.payload, catalog={"A": ["x", 1]}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["error"], "invalid_parameters")
+        response = self.client.post('/rank_panels', json=dict(self.payload, rank_by="price"))
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
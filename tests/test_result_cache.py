@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Panel result cache tests
+パネル計算結果キャッシュのテスト
+"""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'panel_count'))
+
+from api_integration import RESULT_CACHE, app
+from mask_codec import decode_mask, encode_mask
+from result_cache import RESULT_FIELDS, ResultCache, make_cache_key
+
+
+def _roof_mask():
+    mask = np.zeros((200, 240), dtype=np.uint8)
+    mask[20:180, 20:220] = 255
+    return mask
+
+
+class TestResultCache(unittest.TestCase):
+    """LRU・TTL・ディスク保存"""
+
+    def test_lru_eviction_and_copies(self):
+        cache = ResultCache(max_entries=2)
+        cache.put("a", {"n": [1]})
+        cache.put("b", {"n": [2]})
+        cache.get("a")["n"].append(99)   # 返り値を変更してもキャッシュは変わらない
+        cache.put("c", {"n": [3]})       # 最も古く使われた b を追い出す
+        self.assertEqual(cache.get("a"), {"n": [1]})
+        self.assertIsNone(cache.get("b"))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (2, 1, 2))
+
+    def test_ttl_expiry(self):
+        cache = ResultCache(ttl_s=10)
+        with mock.patch("result_cache.time.time", return_value=1000.0):
+            cache.put("a", 1)
+        with mock.patch("result_cache.time.time", return_value=1009.0):
+            self.assertEqual(cache.get("a"), 1)
+        with mock.patch("result_cache.time.time", return_value=1011.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_disk_store_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ResultCache(disk_dir=tmp).put("ab12", {"max_count": 7})
+            restarted = ResultCache(disk_dir=tmp)
+            self.assertEqual(restarted.get("ab12"), {"max_count": 7})
+            self.assertEqual(restarted.stats()["disk_hits"], 1)
+
+    def test_key_ignores_transport_format(self):
+        mask = _roof_mask()
+        params = {"gsd": 0.05}
+        for fmt in ("rle", "polygon"):
+            decoded = decode_mask(encode_mask(mask, fmt))
+            self.assertEqual(make_cache_key("single", decoded, params), make_cache_key("single", mask, params))
+        self.assertNotEqual(make_cache_key("single", mask, params), make_cache_key("single", mask, {"gsd": 0.1}))
+        self.assertNotEqual(make_cache_key("single", mask, params), make_cache_key("batch", mask, params))
+
+
+class TestCalculatePanelsCache(unittest.TestCase):
+    """/calculate_panels の再送信がキャッシュから返ること"""
+
+    def setUp(self):
+        RESULT_CACHE.clear()
+        self.client = app.test_client()
+
+    def test_resubmission_hits_cache_across_formats(self):
+        mask = _roof_mask()
+        first = self.client.post('/calculate_panels', json={"roof_mask": encode_mask(mask, "rle"), "gsd": 0.05})
+        second = self.client.post('/calculate_panels', json={"roof_mask": encode_mask(mask, "png"), "gsd": 0.05})
+        self.assertEqual(first.get_json(), second.get_json())
+
+        stats = self.client.get('/health').get_json()["result_cache"]
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+        self.client.post('/calculate_panels', json={"roof_mask": encode_mask(mask, "rle"), "gsd": 0.05,
+                                                    "offset_m": 0.5})
+        self.assertEqual(self.client.get('/health').get_json()["result_cache"]["misses"], 2)
+
+    def test_batch_roofs_are_cached(self):
+        payload = {"roof_masks": [encode_mask(_roof_mask(), "rle")] * 2, "gsd": 0.05}
+        result = self.client.post('/calculate_panels', json=payload).get_json()
+        self.assertEqual([r["roof_id"] for r in result["roofs"]], [0, 1])
+        self.assertEqual(result["roofs"][0]["max_count"], result["roofs"][1]["max_count"])
+        self.assertEqual(RESULT_CACHE.stats()["hits"], 1)
+
+    def test_result_fields_match_cache_schema(self):
+        # 結果の形式を変えたら RESULT_FIELDS を更新する（キャッシュキーが変わり古いエントリを使わない）
+        # 結果に現れうるキー（可視化形式ごとのキーを含む）をすべて集める
+        roof_fields, panel_fields = set(), set()
+        for align_to_roof in (False, True):
+            payload = {"gsd": 0.05, "align_to_roof": align_to_roof}
+            results = [self.client.post('/calculate_panels', json=dict(payload, roof_mask=encode_mask(
+                _roof_mask(), "rle"))).get_json()]
+            for fmt in ("png", "svg", "geojson"):
+                batch = self.client.post('/calculate_panels', json=dict(payload, roof_masks=[encode_mask(
+                    _roof_mask(), "rle")], include_visualization=True, visualization_format=fmt)).get_json()
+                results.append(batch["roofs"][0])
+            for result in results:
+                roof_fields.update(result)
+                for panel in result["panels"].values():
+                    panel_fields.update(panel)
+        self.assertEqual(roof_fields, set(RESULT_FIELDS["roof"]))
+        self.assertEqual(panel_fields, set(RESULT_FIELDS["panel"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
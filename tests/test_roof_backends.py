@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Roof inference backend parity tests (PyTorch vs ONNX Runtime / OpenVINO)
+推論バックエンド間でマスク・重心が一致することのテスト
+"""
+
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'roof'))
+
+os.environ.setdefault('USE_MOCK_MODEL', 'true')
+
+HAS_ULTRALYTICS = importlib.util.find_spec('ultralytics') is not None and importlib.util.find_spec('cv2') is not None
+HAS_ONNX = importlib.util.find_spec('onnx') is not None and importlib.util.find_spec('onnxruntime') is not None
+HAS_OPENVINO = importlib.util.find_spec('openvino') is not None
+
+if HAS_ULTRALYTICS:
+    import cv2
+    from app import backends, segmentation
+
+
+# 学習済みの重み（あればマスク・重心の一致も確認する）
+PARITY_MODEL = os.environ.get('ROOF_PARITY_MODEL')
+
+
+def _synthetic_weights(path):
+    """学習済みの重みがなくてもネットワーク出力を比較できるよう、乱数初期化の yolov8n-seg を保存する"""
+    import torch
+    from ultralytics import YOLO
+    torch.manual_seed(0)
+    YOLO('yolov8n-seg.yaml').save(str(path))
+
+
+def _network_outputs(model, image):
+    """前処理済みテンソルに対するネットワーク出力（予測 (1, 4+nc+32, N) とプロトタイプマスク）"""
+    import torch
+    model.predict(image, verbose=False)
+    predictor = model.predictor
+    with torch.no_grad():
+        outputs = predictor.model(predictor.preprocess([image]))
+
+    def flatten(item):
+        if isinstance(item, (list, tuple)):
+            return [t for sub in item for t in flatten(sub)]
+        if isinstance(item, dict):
+            return [t for sub in item.values() for t in flatten(sub)]
+        return [item.cpu().numpy() if isinstance(item, torch.Tensor) else np.asarray(item)]
+
+    return flatten(outputs)[:2]
+
+
+def _images():
+    rng = np.random.default_rng(1)
+    images = []
+    for _ in range(3):
+        image = np.full((480, 640, 3), 90, np.uint8)
+        for _ in range(4):
+            x, y = int(rng.integers(0, 500)), int(rng.integers(0, 380))
+            color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            cv2.rectangle(image, (x, y), (x + 120, y + 80), color, -1)
+        images.append(image)
+    return images
+
+
+def _match(reference, other):
+    """マスクを IoU で対応付け、(最小 IoU, 重心の最大ずれ px) を返す（NMS の同点順の違いを許容）"""
+    ref = np.stack([m.full_mask() for m in reference]).reshape(len(reference), -1)
+    oth = np.stack([m.full_mask() for m in other]).reshape(len(other), -1).astype(np.float32)
+    inter = ref.astype(np.float32) @ oth.T
+    union = ref.sum(1)[:, None] + oth.sum(1)[None, :] - inter
+    iou = inter / np.maximum(union, 1)
+    best = iou.argmax(1)
+    shift = max(abs(a - b) for r, j in zip(reference, best) for a, b in zip(r.center, other[j].center))
+    return float(iou.max(1).min()), shift
+
+
+class _ExportDirMixin:
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.export_dir = mock.patch.object(backends, 'EXPORT_DIR', Path(cls.tmp.name) / 'export')
+        cls.export_dir.start()
+        cls.images = _images()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.export_dir.stop()
+        cls.tmp.cleanup()
+
+
+@unittest.skipUnless(HAS_ULTRALYTICS, "ultralytics not installed")
+class TestBackendParity(_ExportDirMixin, unittest.TestCase):
+    """書き出したモデルのネットワーク出力が PyTorch と一致する（同じ前処理・後処理を通る）"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.weights = Path(cls.tmp.name) / 'roof_synthetic.pt'
+        _synthetic_weights(cls.weights)
+        reference_model = segmentation._load_yolo(cls.weights, backend='torch')
+        cls.reference = [_network_outputs(reference_model, image) for image in cls.images]
+
+    def _assert_parity(self, backend):
+        model = segmentation._load_yolo(self.weights, backend=backend, threads=1)
+        for image, reference in zip(self.images, self.reference):
+            outputs = _network_outputs(model, image)
+            self.assertEqual([o.shape for o in outputs], [r.shape for r in reference])
+            for output, expected in zip(outputs, reference):
+                np.testing.assert_allclose(output, expected, rtol=1e-4, atol=1e-3)
+
+    @unittest.skipUnless(HAS_ONNX, "onnx / onnxruntime not installed")
+    def test_onnx_runtime_matches_torch(self):
+        self._assert_parity('onnx')
+        self.assertTrue((backends.EXPORT_DIR / segmentation._digest_files(self.weights)[:16]
+                         / 'roof_synthetic.onnx').exists())
+
+    @unittest.skipUnless(HAS_OPENVINO, "openvino not installed")
+    def test_openvino_matches_torch(self):
+        self._assert_parity('openvino')
+
+    def test_backend_is_part_of_the_cache_key(self):
+        self.assertEqual(backends.backend_tag(self.weights, 'torch'), 'torch')
+        self.assertEqual(backends.backend_tag(self.weights.with_suffix('.onnx'), 'torch'), 'onnx')
+        with self.assertRaises(ValueError):
+            backends.backend_for(self.weights, 'tensorrt')
+
+
+@unittest.skipUnless(HAS_ULTRALYTICS and PARITY_MODEL, "ROOF_PARITY_MODEL (trained weights) not set")
+class TestTrainedModelParity(_ExportDirMixin, unittest.TestCase):
+    """学習済みの重みで、マスクと重心が process_image（PyTorch）と一致する"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.weights = Path(PARITY_MODEL)
+        reference_model = segmentation._load_yolo(cls.weights, backend='torch')
+        cls.reference = segmentation.segment_decoded(cls.images, 0.5, reference_model)
+
+    def _assert_parity(self, backend):
+        model = segmentation._load_yolo(self.weights, backend=backend, threads=1)
+        segmented = segmentation.segment_decoded(self.images, 0.5, model)
+        for reference, other in zip(self.reference, segmented):
+            self.assertEqual(len(other), len(reference))
+            if reference:
+                min_iou, shift = _match(reference, other)
+                self.assertGreaterEqual(min_iou, 0.98)
+                self.assertLessEqual(shift, 1)
+
+    @unittest.skipUnless(HAS_ONNX, "onnx / onnxruntime not installed")
+    def test_onnx_runtime_masks(self):
+        self._assert_parity('onnx')
+
+    @unittest.skipUnless(HAS_OPENVINO, "openvino not installed")
+    def test_openvino_masks(self):
+        self._assert_parity('openvino')
+
+
+if __name__ == "__main__":
+    unittest.main()
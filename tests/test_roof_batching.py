@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Roof inference micro-batching tests
+屋根推論マイクロバッチングのテスト
+"""
+
+import asyncio
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'roof'))
+
+from app.batching import InferenceBatcher, QueueFullError
+
+
+class TestInferenceBatcher(unittest.TestCase):
+    """InferenceBatcher の集約・エラー分離・キュー上限"""
+
+    def test_requests_are_grouped_into_batches(self):
+        calls = []
+
+        def infer(images, conf):
+            calls.append(len(images))
+            return [(img.upper(), conf) for img in images]
+
+        batcher = InferenceBatcher(infer, max_batch_size=4, max_wait_ms=50, max_queue_depth=16)
+
+        async def run():
+            return await asyncio.gather(*[batcher.submit(b"img%d" % i, 0.8) for i in range(8)])
+
+        results = asyncio.run(run())
+        self.assertEqual(results, [(b"IMG%d" % i, 0.8) for i in range(8)])
+        self.assertEqual(calls, [4, 4])
+        self.assertEqual(batcher.stats.summary()["total_images"], 8)
+
+    def test_per_item_errors_are_isolated(self):
+        def infer(images, conf):
+            return [ValueError("bad") if img == b"bad" else img for img in images]
+
+        batcher = InferenceBatcher(infer, max_batch_size=8, max_wait_ms=20)
+
+        async def run():
+            return await asyncio.gather(batcher.submit(b"ok", 0.8), batcher.submit(b"bad", 0.8),
+                                        return_exceptions=True)
+
+        ok, bad = asyncio.run(run())
+        self.assertEqual(ok, b"ok")
+        self.assertIsInstance(bad, ValueError)
+
+    def test_full_queue_is_rejected(self):
+        def infer(images, conf):
+            return images
+
+        batcher = InferenceBatcher(infer, max_batch_size=1, max_wait_ms=0, max_queue_depth=1)
+
+        async def run():
+            return await asyncio.gather(*[batcher.submit(b"x", 0.8) for _ in range(4)],
+                                        return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(any(isinstance(r, QueueFullError) for r in results))
+        self.assertIn(b"x", results)
+
+    def test_inflight_limit_sets_retry_after(self):
+        pool = ThreadPoolExecutor(max_workers=2)
+
+        def infer(images, conf):
+            time.sleep(0.05)
+            return images
+
+        batcher = InferenceBatcher(infer, max_batch_size=1, max_wait_ms=0, max_queue_depth=16,
+                                   executor=lambda: pool, max_concurrent_batches=2, max_inflight=3)
+
+        async def run():
+            return await asyncio.gather(*[batcher.submit(b"x", 0.8) for _ in range(6)],
+                                        return_exceptions=True)
+
+        results = asyncio.run(run())
+        pool.shutdown()
+        rejected = [r for r in results if isinstance(r, QueueFullError)]
+        self.assertEqual(len(rejected), 3)
+        self.assertGreaterEqual(rejected[0].retry_after, 1)
+        self.assertEqual(batcher.inflight, 0)
+
+    def test_shutdown_waits_for_running_batches(self):
+        pool = ThreadPoolExecutor(max_workers=1)
+
+        def infer(images, conf):
+            time.sleep(0.05)
+            return images
+
+        batcher = InferenceBatcher(infer, max_batch_size=2, max_wait_ms=0,
+                                   executor=lambda: pool, max_concurrent_batches=1)
+
+        async def run():
+            pending = asyncio.ensure_future(batcher.submit(b"x", 0.8))
+            while not batcher._tasks:
+                await asyncio.sleep(0.001)
+            # 実行中のバッチは参照が保持され、停止時に完了まで待たれる
+            tasks = set(batcher._tasks)
+            await batcher.shutdown()
+            self.assertTrue(all(t.done() for t in tasks))
+            self.assertEqual(batcher._tasks, set())
+            return await pending
+
+        self.assertEqual(asyncio.run(run()), b"x")
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Roof inference cache tests
+屋根推論キャッシュのテスト
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'roof'))
+
+from app.cache import CachedSegmentation, InferenceCache, cache_key
+from app.masks import RoofMask
+
+
+def _roof_masks(h=40, w=64):
+    a = np.zeros((h, w), dtype=bool)
+    a[5:20, 10:30] = True
+    b = np.zeros((h, w), dtype=bool)
+    b[25:35, 40:60] = True
+    return [RoofMask(mask=a, center=(19, 12)), RoofMask(mask=b, center=(49, 29))]
+
+
+class TestInferenceCache(unittest.TestCase):
+    """パック済みマスクの往復・LRU・モデル変更時の破棄"""
+
+    def test_roundtrip_restores_masks_and_centers(self):
+        entry = CachedSegmentation.from_roof_masks(_roof_masks())
+        self.assertEqual(entry.nbytes, 2 * 40 * 64 // 8)
+        restored = entry.roof_masks()
+        for original, copy in zip(_roof_masks(), restored):
+            np.testing.assert_array_equal(copy.mask, original.mask)
+            self.assertEqual(copy.center, original.center)
+            self.assertEqual(copy.binary_png(), original.binary_png())
+        self.assertEqual(CachedSegmentation.from_roof_masks([]).roof_masks(), [])
+
+    def test_key_depends_on_image_conf_and_model(self):
+        key = cache_key(b"tile", 0.8, "w1")
+        self.assertEqual(key, cache_key(b"tile", 0.8, "w1"))
+        self.assertNotEqual(key, cache_key(b"tile2", 0.8, "w1"))
+        self.assertNotEqual(key, cache_key(b"tile", 0.5, "w1"))
+        self.assertNotEqual(key, cache_key(b"tile", 0.8, "w2"))
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        entry = CachedSegmentation.from_roof_masks(_roof_masks())
+        cache = InferenceCache(max_bytes=2 * entry.nbytes, max_entries=10)
+        cache.put("a", entry)
+        cache.put("b", entry)
+        self.assertIs(cache.get("a"), entry)   # a を最近使用にする
+        cache.put("c", entry)                  # b が追い出される
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"], stats["evictions"]), (2, 2 * entry.nbytes, 1))
+
+    def test_model_change_drops_entries(self):
+        cache = InferenceCache()
+        cache.invalidate_model("w1")
+        cache.put(cache_key(b"tile", 0.8, "w1"), CachedSegmentation.from_roof_masks(_roof_masks()))
+        cache.invalidate_model("w1")
+        self.assertEqual(cache.stats()["entries"], 1)
+        cache.invalidate_model("w2")
+        self.assertEqual(cache.stats()["entries"], 0)
+        self.assertEqual(cache.stats()["model_hash"], "w2")
+
+    def test_disabled_cache_stores_nothing(self):
+        cache = InferenceCache(max_bytes=0)
+        cache.put("a", CachedSegmentation.from_roof_masks(_roof_masks()))
+        self.assertIsNone(cache.get("a"))
+        self.assertFalse(cache.stats()["enabled"])
+
+
+if __name__ == "__main__":
+    unittest.main()
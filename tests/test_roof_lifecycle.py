@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Roof service startup lifecycle tests
+屋根検出サービスの起動（遅延 import・/ready・/live）のテスト
+"""
+
+import importlib.util
+import os
+import subprocess
+import sys
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+ROOF_DIR = Path(__file__).resolve().parents[1] / 'roof'
+sys.path.insert(0, str(ROOF_DIR))
+
+HAS_FASTAPI = importlib.util.find_spec('fastapi') is not None and importlib.util.find_spec('httpx') is not None
+
+if HAS_FASTAPI:
+    # モデルを使わないモックモードで起動する
+    os.environ.setdefault('USE_MOCK_MODEL', 'true')
+    from fastapi.testclient import TestClient
+    from app import main, segmentation
+
+
+class TestLazyImport(unittest.TestCase):
+    """app.main の import で torch / ultralytics を読み込まない"""
+
+    def test_heavy_modules_are_not_imported(self):
+        code = "import sys, app.main; print(sorted(m for m in ('torch', 'ultralytics') if m in sys.modules))"
+        env = dict(os.environ, PYTHONPATH=str(ROOF_DIR), USE_MOCK_MODEL='true')
+        out = subprocess.run([sys.executable, '-c', code], cwd=ROOF_DIR, env=env, capture_output=True, text=True)
+        if out.returncode != 0 and 'ModuleNotFoundError' in out.stderr:
+            self.skipTest(out.stderr.strip().splitlines()[-1])
+        self.assertEqual(out.returncode, 0, out.stderr)
+        self.assertEqual(out.stdout.strip().splitlines()[-1], "[]")
+
+
+@unittest.skipUnless(HAS_FASTAPI, "fastapi not installed")
+class TestReadiness(unittest.TestCase):
+    """lifespan でモデルを読み込み、/ready が状態を報告する"""
+
+    def test_ready_after_lifespan(self):
+        client = TestClient(main.app)
+        self.assertEqual(client.get('/live').status_code, 200)
+        self.assertEqual(client.get('/ready').status_code, 503)
+
+        with TestClient(main.app) as client:
+            response = client.get('/ready')
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertEqual(body["status"], "ready")
+            self.assertEqual(body["mode"], "mock")
+            self.assertEqual(body["model_hash"], "mock")
+            self.assertEqual(body["workers_ready"], body["workers"])
+            self.assertGreater(body["import_time_s"], 0)
+
+            live = client.get('/live').json()
+            self.assertEqual(live["status"], "alive")
+
+    def test_missing_weights_are_an_error_not_mock(self):
+        if importlib.util.find_spec('ultralytics') is None:
+            self.skipTest("ultralytics not installed")
+        with self.assertRaises(segmentation.ModelLoadError):
+            segmentation._load_yolo(Path('/nonexistent/roof_best.pt'))
+
+
+
+@unittest.skipUnless(HAS_FASTAPI, "fastapi not installed")
+class TestInferenceCacheKey(unittest.TestCase):
+    """推論キャッシュのキーは読み込んだモデルの識別子（リクエストごとに重みファイルを読まない）"""
+
+    def test_requests_use_the_loaded_model_hash(self):
+        import cv2
+        import numpy as np
+
+        image = cv2.imencode('.png', np.zeros((64, 64, 3), dtype=np.uint8))[1].tobytes()
+        main.inference_cache.clear()
+        with TestClient(main.app) as client:
+            # 起動後に重みファイルが置き換えられても、リクエストではハッシュを計算し直さない
+            with mock.patch.object(segmentation, 'model_fingerprint', side_effect=AssertionError("rehashed")):
+                for _ in range(2):
+                    response = client.post('/segment_masks', files={"image": ("roof.png", image, "image/png")})
+                    self.assertEqual(response.status_code, 200)
+        self.assertEqual(main.inference_cache.model_hash, "mock")
+        self.assertEqual(main.inference_cache.stats()["hits"], 1)
+
+    def test_no_cache_when_workers_disagree(self):
+        workers = [{"model_hash": "old"}, {"model_hash": "new"}]
+        with mock.patch.dict(main._lifecycle, workers=workers):
+            self.assertIsNone(main._loaded_model_hash())
+        with mock.patch.dict(main._lifecycle, workers=workers[:1]):
+            self.assertEqual(main._loaded_model_hash(), "old")
+
+
+@unittest.skipUnless(HAS_FASTAPI, "fastapi not installed")
+class TestWorkerModels(unittest.TestCase):
+    """スレッドプールのワーカー専用モデル: N ワーカーで N 個、読込の失敗は /ready に出す"""
+
+    def _start_workers(self, workers, load_yolo):
+        # 推論モデルを読み込んだ状態を模擬する（_load_yolo・warm_up は差し替え）
+        process_model = object()
+        patches = [
+            mock.patch.object(segmentation, 'model', process_model),
+            mock.patch.dict(segmentation._status, status="ready", error=None),
+            mock.patch.object(segmentation, '_load_yolo', side_effect=load_yolo),
+            mock.patch.object(segmentation, 'warm_up'),
+            mock.patch.object(segmentation, '_process_model_owner', None),
+            mock.patch.object(segmentation, '_worker_errors', {}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        barrier = threading.Barrier(workers)
+
+        def current_model():
+            barrier.wait(timeout=5)  # 全ワーカーのスレッドを起動させる
+            try:
+                return segmentation._current_model()
+            except segmentation.ModelNotReadyError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=workers, initializer=segmentation.init_worker,
+                                initargs=(True,)) as executor:
+            models = list(executor.map(lambda _: current_model(), range(workers)))
+        return process_model, models
+
+    def test_first_worker_reuses_the_process_model(self):
+        process_model, models = self._start_workers(3, lambda path: object())
+        self.assertEqual(segmentation._load_yolo.call_count, 2)
+        self.assertEqual(len({id(m) for m in models}), 3)
+        self.assertIn(process_model, models)
+        self.assertEqual(segmentation.model_status()["status"], "ready")
+
+    def test_worker_load_failure_is_reported(self):
+        def load_yolo(path):
+            raise segmentation.ModelLoadError("out of memory")
+
+        process_model, models = self._start_workers(3, load_yolo)
+        # 失敗したワーカーはプロセスのモデルを共有せず、推論時に ModelNotReadyError
+        self.assertEqual(models.count(process_model), 1)
+        self.assertEqual(sum(isinstance(m, segmentation.ModelNotReadyError) for m in models), 2)
+        status = segmentation.model_status()
+        self.assertEqual(status["status"], "failed")
+        self.assertEqual(len(status["worker_errors"]), 2)
+        self.assertIn("out of memory", status["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
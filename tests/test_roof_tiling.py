@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Tiled roof inference tests (tile grid, seam merging, cropped masks)
+大きな画像のタイル分割推論・継ぎ目の統合・切り出しマスクのテスト
+"""
+
+import importlib.util
+import os
+import sys
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'roof'))
+
+os.environ.setdefault('USE_MOCK_MODEL', 'true')
+
+import cv2
+
+from app import segmentation, tiling
+from app.cache import CachedSegmentation
+from app.masks import RoofMask
+from app.tiling import TileInstance, merge_instances, tile_grid
+
+HAS_TORCH = importlib.util.find_spec('torch') is not None
+
+
+class _ComponentModel:
+    """明るい領域の連結成分を 1 インスタンスとして返す YOLO の代わり（入力解像度のマスク）"""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, images, conf=0.5, verbose=False):
+        import torch
+        self.batches.append([im.shape[:2] for im in images])
+        results = []
+        for image in images:
+            n, labels = cv2.connectedComponents((image[..., 0] > 200).astype(np.uint8))
+            masks = torch.from_numpy(np.stack([labels == k for k in range(1, n)])) if n > 1 else None
+            results.append(SimpleNamespace(masks=SimpleNamespace(data=masks.float()) if masks is not None else None))
+        return results
+
+
+def _large_image(h=1500, w=2100):
+    """タイルの継ぎ目をまたぐ矩形・タイルに収まる矩形・複数タイルにわたる L 字を描いた画像"""
+    image = np.full((h, w, 3), 60, np.uint8)
+    cv2.rectangle(image, (560, 100), (700, 220), (255, 255, 255), -1)    # x 方向の継ぎ目
+    cv2.rectangle(image, (100, 1000), (250, 1100), (255, 255, 255), -1)  # タイル内
+    cv2.rectangle(image, (1000, 450), (1100, 620), (255, 255, 255), -1)  # 4 タイルの角
+    cv2.rectangle(image, (1300, 800), (1900, 860), (255, 255, 255), -1)  # 3 タイルにわたる
+    cv2.rectangle(image, (1300, 800), (1360, 1400), (255, 255, 255), -1)
+    return image
+
+
+def _full_masks(result):
+    return sorted((m.full_mask() for m in result), key=lambda m: tuple(np.argwhere(m)[0]))
+
+
+class TestTileGrid(unittest.TestCase):
+    """タイルが画像全体を重なり付きで覆う"""
+
+    def test_tiles_cover_image_with_overlap(self):
+        windows = tile_grid(1500, 2100, size=640, overlap=128)
+        covered = np.zeros((1500, 2100), dtype=int)
+        for x, y, w, h in windows:
+            self.assertEqual((w, h), (640, 640))
+            covered[y:y + h, x:x + w] += 1
+        self.assertTrue((covered > 0).all())
+        xs = sorted({x for x, _, _, _ in windows})
+        self.assertEqual(xs[-1] + 640, 2100)
+        self.assertTrue(all(b - a <= 640 - 128 for a, b in zip(xs, xs[1:])))
+
+    def test_small_images_are_not_tiled(self):
+        self.assertEqual(tile_grid(300, 500, size=640, overlap=128), [(0, 0, 500, 300)])
+        self.assertFalse(tiling.needs_tiling((1280, 1000), min_side=1280, size=640))
+        self.assertTrue(tiling.needs_tiling((1281, 1000), min_side=1280, size=640))
+        self.assertFalse(tiling.needs_tiling((5000, 5000), min_side=0))
+        with self.assertRaises(ValueError):
+            tile_grid(1000, 1000, size=640, overlap=640)
+
+
+class TestSeamMerge(unittest.TestCase):
+    """継ぎ目をまたぐ同じ屋根は統合し、重なり領域の別の屋根は統合しない"""
+
+    def test_split_roof_is_merged(self):
+        full = np.zeros((200, 300), dtype=bool)
+        full[50:120, 80:220] = True
+        left = TileInstance(crop=full[50:120, 80:160], x=80, y=50, tile=0)
+        right = TileInstance(crop=full[50:120, 130:220], x=130, y=50, tile=1)
+        merged = merge_instances([left, right])
+        self.assertEqual(len(merged), 1)
+        self.assertEqual((merged[0].x, merged[0].y), (80, 50))
+        np.testing.assert_array_equal(merged[0].crop, full[50:120, 80:220])
+
+    def test_neighbouring_roofs_stay_separate(self):
+        a = TileInstance(crop=np.ones((40, 30), dtype=bool), x=100, y=10, tile=0)
+        b = TileInstance(crop=np.ones((40, 30), dtype=bool), x=131, y=10, tile=1)
+        same_tile = TileInstance(crop=np.ones((40, 30), dtype=bool), x=75, y=10, tile=0)
+        self.assertEqual(len(merge_instances([a, b, same_tile])), 3)
+
+
+class TestCroppedMasks(unittest.TestCase):
+    """外接矩形の切り出しから元画像サイズのマスク・エンコード・キャッシュを復元できる"""
+
+    def setUp(self):
+        full = np.zeros((120, 160), dtype=bool)
+        full[30:70, 50:90] = True
+        full[60:80, 85:100] = True
+        self.full = full
+
+    def test_crop_roundtrip(self):
+        cropped = RoofMask.from_full(self.full, center=(70, 50))
+        self.assertEqual(cropped.bbox, (50, 30, 50, 50))
+        self.assertEqual(cropped.shape, (120, 160))
+        np.testing.assert_array_equal(cropped.full_mask(), self.full)
+        whole = RoofMask(mask=self.full, center=(70, 50))
+        self.assertEqual(cropped.binary_png(), whole.binary_png())
+        self.assertEqual(cropped.encode("rle"), whole.encode("rle"))
+
+    def test_cache_stores_crops(self):
+        cropped = RoofMask.from_full(self.full, center=(70, 50))
+        entry = CachedSegmentation.from_roof_masks([cropped])
+        self.assertEqual(entry.nbytes, (50 * 50 + 7) // 8)
+        restored = entry.roof_masks()[0]
+        np.testing.assert_array_equal(restored.full_mask(), self.full)
+        self.assertEqual(restored.center, (70, 50))
+
+    def test_centers_match_full_frame_moments(self):
+        crops = [(self.full[30:80, 50:100], 50, 30)]
+        result = segmentation._build_result(np.zeros((120, 160, 3), np.uint8), crops)
+        ys, xs = np.nonzero(self.full)
+        self.assertEqual(result[0].center, (int(xs.sum() / len(xs)), int(ys.sum() / len(ys))))
+
+
+@unittest.skipUnless(HAS_TORCH, "torch not installed")
+class TestTiledSegmentation(unittest.TestCase):
+    """タイル分割推論が画像全体の推論と同じマスクを返す"""
+
+    def test_instance_crops_match_torch_interpolation(self):
+        import torch
+        rng = np.random.default_rng(0)
+        net = np.zeros((3, 160, 160), dtype=np.float32)
+        net[0, 20:90, 30:70] = 1
+        net[1] = rng.random((160, 160)) > 0.97
+        results = SimpleNamespace(masks=SimpleNamespace(data=torch.from_numpy(net)))
+        for H, W in [(480, 640), (100, 90), (160, 160), (333, 517)]:
+            expected = torch.nn.functional.interpolate((torch.from_numpy(net) > 0.5).to(torch.uint8)[None],
+                                                       size=(H, W), mode='nearest')[0].bool().numpy()
+            result = segmentation._build_result(np.zeros((H, W, 3), np.uint8),
+                                                 segmentation._instance_crops(results, H, W))
+            self.assertEqual(len(result), 3)
+            for roof, mask in zip(result, expected):
+                np.testing.assert_array_equal(roof.full_mask(), mask)
+                if mask.any():
+                    (y0, x0), (y1, x1) = np.argwhere(mask).min(0), np.argwhere(mask).max(0)
+                    self.assertEqual(roof.bbox, (x0, y0, x1 - x0 + 1, y1 - y0 + 1))
+
+    def test_tiled_matches_whole_image(self):
+        image = _large_image()
+        model = _ComponentModel()
+        with mock.patch.object(tiling, 'TILE_MIN_SIDE', 0):
+            whole = segmentation.segment_decoded([image], 0.5, model)[0]
+        self.assertEqual(model.batches, [[image.shape[:2]]])
+
+        model = _ComponentModel()
+        with mock.patch.object(tiling, 'TILE_MIN_SIDE', 1280), mock.patch.object(tiling, 'TILE_BATCH', 4):
+            small = np.full((480, 640, 3), 60, np.uint8)
+            tiled, untouched = segmentation.segment_decoded([image, small], 0.5, model)
+        self.assertEqual(len(tiled), 4)
+        self.assertEqual(untouched, [])
+        # 通常サイズの画像は 1 回、大きな画像は 4 枚ずつのタイルで推論する
+        self.assertEqual(model.batches[0], [(480, 640)])
+        self.assertTrue(all(len(b) <= 4 and set(b) == {(640, 640)} for b in model.batches[1:]))
+        self.assertEqual(sum(len(b) for b in model.batches[1:]), len(tile_grid(*image.shape[:2])))
+
+        for a, b in zip(_full_masks(whole), _full_masks(tiled)):
+            np.testing.assert_array_equal(a, b)
+        self.assertEqual(sorted(m.center for m in whole), sorted(m.center for m in tiled))
+        self.assertTrue(all(m.mask.shape != image.shape[:2] for m in tiled))
+
+
+if __name__ == "__main__":
+    unittest.main()